@@ -6,5 +6,6 @@ from .work import router as work_router
 from .shop import router as shop_router
 from .city import router as city_router
 from .memory import router as memory_router
+from .llm import router as llm_router
 
-__all__ = ["agents_router", "chat_router", "dev_router", "bounties_router", "work_router", "shop_router", "city_router", "memory_router"]
+__all__ = ["agents_router", "chat_router", "dev_router", "bounties_router", "work_router", "shop_router", "city_router", "memory_router", "llm_router"]
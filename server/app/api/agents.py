@@ -5,6 +5,8 @@ import logging
 import secrets
 from ..core import get_db
 from ..models import Agent
+from ..services.agent_directory import agent_directory
+from ..services.broadcast_bus import broadcast_bus
 from .schemas import AgentCreate, AgentUpdate, AgentOut, SoulPersonality
 
 logger = logging.getLogger(__name__)
@@ -31,6 +33,15 @@ def _validate_personality_json(raw: dict | None) -> dict | None:
         return None
 
 
+def _directory_changed():
+    """agent 增删 / 改名后让本 worker 和其他 worker 的名字缓存失效"""
+    agent_directory.invalidate()
+    broadcast_bus.notify_peers("agent_directory")
+
+
+broadcast_bus.subscribe("agent_directory", lambda _payload: agent_directory.invalidate())
+
+
 @router.get("/", response_model=list[AgentOut])
 async def list_agents(db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(Agent).where(Agent.id != 0))
@@ -49,6 +60,7 @@ async def create_agent(data: AgentCreate, db: AsyncSession = Depends(get_db)):
                   bot_token=generate_bot_token(), personality_json=validated_pj)
     db.add(agent)
     await db.commit()
+    _directory_changed()
     await db.refresh(agent)
     return agent
 
@@ -85,6 +97,8 @@ async def update_agent(agent_id: int, data: AgentUpdate, db: AsyncSession = Depe
         setattr(agent, field, value)
 
     await db.commit()
+    if "name" in update_data:
+        _directory_changed()
     await db.refresh(agent)
     return agent
 
@@ -98,6 +112,7 @@ async def delete_agent(agent_id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(404, "Agent not found")
     await db.delete(agent)
     await db.commit()
+    _directory_changed()
 
 
 @router.post("/{agent_id}/regenerate-token", response_model=AgentOut)
@@ -126,13 +141,15 @@ async def get_agent_strategies(agent_id: int, db: AsyncSession = Depends(get_db)
 
 @router.post("/{agent_id}/strategies")
 async def set_agent_strategies(agent_id: int, strategies: list[dict], db: AsyncSession = Depends(get_db)):
-    """设置 Agent 策略（全量替换）。"""
+    """设置 Agent 策略（全量替换，持久化）；立即按当前挂单 / 持仓检查一次。"""
     agent = await db.get(Agent, agent_id)
     if not agent:
         raise HTTPException(404, "Agent not found")
-    from ..services.strategy_engine import Strategy, update_strategies
+    from ..services.strategy_engine import Strategy, save_strategies
+    from ..services.strategy_runtime import strategy_runtime
     parsed = [Strategy(**s) for s in strategies]
-    update_strategies(agent_id, parsed)
+    await save_strategies(agent_id, parsed, db)
+    strategy_runtime.publish([("holdings", agent_id)])
     return {"ok": True, "count": len(parsed)}
 
 
@@ -142,8 +159,8 @@ async def clear_agent_strategies(agent_id: int, db: AsyncSession = Depends(get_d
     agent = await db.get(Agent, agent_id)
     if not agent:
         raise HTTPException(404, "Agent not found")
-    from ..services.strategy_engine import clear_strategies
-    clear_strategies(agent_id)
+    from ..services.strategy_engine import delete_strategies
+    await delete_strategies(agent_id, db)
     return {"ok": True}
 
 
@@ -7,6 +7,7 @@ from typing import Optional
 
 from ..core import get_db
 from ..models import Bounty, Agent
+from ..services.world_state import BOUNTIES, world_state
 from .schemas import BountyCreate, BountyOut
 
 
@@ -93,6 +94,8 @@ async def complete_bounty(bounty_id: int, agent_id: int = Query(...), db: AsyncS
         .where(Agent.id == agent_id)
         .values(credits=Agent.credits + bounty.reward)
     )
+    world_state.touch_agents(agent_id, db=db)
+    world_state.touch_sections(BOUNTIES, db=db)
 
     await db.commit()
     await db.refresh(bounty)
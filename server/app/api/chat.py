@@ -1,21 +1,27 @@
-import re
 import json
 import asyncio
 import logging
+import time
+import uuid
 from datetime import datetime
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import joinedload
 from ..core import get_db, async_session
+from ..core.config import settings
+from ..core.llm_clients import llm_client
+from ..core.llm_router import llm_router
 from ..models import Message, Agent, MemoryReference
 from ..services.wakeup_service import WakeupService
 from ..services.agent_runner import runner_manager
 from ..services.economy_service import economy_service
 from ..services.memory_service import memory_service
+from ..services.broadcast_hub import broadcast_hub
+from ..services.broadcast_bus import broadcast_bus
+from ..services.agent_directory import agent_directory
 from ..models import MemoryType
 from .schemas import MessageOut
-from openai import AsyncOpenAI
 
 logger = logging.getLogger(__name__)
 router = APIRouter(tags=["chat"])
@@ -30,6 +36,9 @@ bot_connections: dict[int, WebSocket] = {}  # {agent_id: ws}
 # 心跳间隔（秒）
 HEARTBEAT_INTERVAL = 30
 
+# 流式回复增量只推给连接时带 ?stream=1 的客户端
+STREAM_CHANNEL = "message_delta"
+
 # 唤醒服务单例
 wakeup_service = WakeupService()
 
@@ -60,29 +69,28 @@ def _truncation_fallback(conversation: str) -> str:
     return f"对话摘要: {conversation[:200]}"
 
 
-async def _call_llm_provider(provider, prompt: str) -> str:
-    """调用单个 LLM provider，返回文本结果"""
-    async with AsyncOpenAI(
-        api_key=provider.get_auth_token(),
-        base_url=provider.get_base_url(),
-    ) as client:
-        response = await client.chat.completions.create(
-            model=provider.model_id,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=200,  # 100 字 ≈ 150~200 token
-        )
-        if not response.choices:
-            return ""
-        content = response.choices[0].message.content or ""
-        return content.strip()
+async def _call_llm_provider(target, messages: list[dict]):
+    """调用单个 LLM 供应商（客户端来自共享连接池，不关闭）"""
+    client = llm_client(base_url=target.base_url, api_key=target.api_key)
+    return await client.chat.completions.create(
+        model=target.model_id,
+        messages=messages,
+        max_tokens=200,  # 100 字 ≈ 150~200 token
+    )
+
+
+def _summary_text(response) -> str:
+    if not response.choices:
+        return ""
+    content = response.choices[0].message.content or ""
+    return content.strip()
 
 
 async def _llm_summarize(conversation: str) -> str | None:
     """
     调用 LLM 生成对话摘要，带 fallback 链：
-    1. memory-summary-model 主供应商
-    2. memory-summary-model 备用供应商
-    3. 截断拼接兜底
+    1. memory-summary-model 的供应商，按健康分排序逐个尝试（超时 / 报错 / 少于 5 字都换下一个）
+    2. 截断拼接兜底
     返回 None 表示"无有效记忆"，调用方跳过保存。
     """
     from ..core.config import MODEL_REGISTRY
@@ -94,41 +102,30 @@ async def _llm_summarize(conversation: str) -> str | None:
         logger.warning("memory-summary-model not in MODEL_REGISTRY, using truncation fallback")
         return _truncation_fallback(conversation)
 
-    for i, provider in enumerate(entry.providers):
-        if not provider.is_available():
-            continue
-        try:
-            summary = await asyncio.wait_for(
-                _call_llm_provider(provider, prompt),
-                timeout=MEMORY_SUMMARY_TIMEOUT,
-            )
-            if summary and len(summary.strip()) >= 5:
-                cleaned = summary.strip()
-                if "无有效记忆" in cleaned:
-                    logger.info("LLM determined no useful memory in conversation")
-                    return None
-                return cleaned[:100]
-            else:
-                logger.warning(
-                    "Memory summary validation failed (provider=%s, attempt=%d, len=%d), trying next",
-                    provider.name, i + 1, len(summary.strip()) if summary else 0,
-                )
-                continue
-        except asyncio.TimeoutError:
-            logger.warning(
-                "Memory summary timeout (provider=%s, attempt=%d, limit=%ds), trying next",
-                provider.name, i + 1, MEMORY_SUMMARY_TIMEOUT,
-            )
-            continue
-        except Exception as e:
-            logger.warning(
-                "Memory summary failed (provider=%s, attempt=%d): %s, trying next",
-                provider.name, i + 1, e,
-            )
-            continue
+    targets = llm_router.targets("memory-summary-model")
+    if not targets:
+        logger.warning("No memory summary provider available, using truncation fallback")
+        return _truncation_fallback(conversation)
+
+    messages = [{"role": "user", "content": prompt}]
+    try:
+        routed = await llm_router.complete(
+            targets,
+            lambda target: _call_llm_provider(target, messages),
+            messages=messages,
+            max_tokens=200,
+            validate=lambda response: len(_summary_text(response)) >= 5,
+            attempt_timeout=MEMORY_SUMMARY_TIMEOUT,
+        )
+    except Exception as e:
+        logger.warning("All memory summary providers failed (%s), using truncation fallback", e)
+        return _truncation_fallback(conversation)
 
-    logger.warning("All memory summary providers failed, using truncation fallback")
-    return _truncation_fallback(conversation)
+    cleaned = _summary_text(routed.value)
+    if "无有效记忆" in cleaned:
+        logger.info("LLM determined no useful memory in conversation")
+        return None
+    return cleaned[:100]
 
 
 async def _extract_memory(agent_id: int, recent_messages: list[dict]):
@@ -154,85 +151,173 @@ async def _extract_memory(agent_id: int, recent_messages: list[dict]):
         logger.warning("Memory extraction failed for agent %d: %s", agent_id, e)
 
 
-async def delayed_send(agent_info: dict, reply: str, usage_info: dict | None, delay: float, used_memory_ids: list[int] | None = None):
+async def _persist_reply(agent_info: dict, reply: str, usage_info: dict | None,
+                         used_memory_ids: list[int] | None = None, stream_id: str | None = None):
+    """保存并广播一条 Agent 回复：消息 + 扣额度 + LLM 用量 + 记忆引用一次提交，然后异步提取记忆"""
+    history = list(agent_info["history"])  # 防御性拷贝
+    async with async_session() as db:
+        msg = await send_agent_message(
+            agent_info["agent_id"], agent_info["agent_name"], reply, db, stream_id=stream_id,
+        )
+        await economy_service.deduct_quota(agent_info["agent_id"], db)
+        if usage_info:
+            from ..models.tables import LLMUsage
+            record = LLMUsage(
+                model=usage_info["model"],
+                agent_id=usage_info["agent_id"],
+                prompt_tokens=usage_info["prompt_tokens"],
+                completion_tokens=usage_info["completion_tokens"],
+                total_tokens=usage_info["total_tokens"],
+                latency_ms=usage_info["latency_ms"],
+                queue_wait_ms=usage_info.get("queue_wait_ms", 0),
+            )
+            db.add(record)
+        # 写入记忆引用
+        if used_memory_ids and msg:
+            for mid in used_memory_ids:
+                db.add(MemoryReference(message_id=msg.id, memory_id=mid))
+        await db.commit()
+
+    # M2-4: 记忆提取（fire-and-forget，不阻塞消息发送）
+    # 将 Agent 回复追加到 history，确保摘要包含完整对话
+    history.append({"name": agent_info["agent_name"], "content": reply})
+    task = asyncio.create_task(
+        _extract_memory(agent_info["agent_id"], history)
+    )
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def delayed_send(agent_info: dict, reply: str, usage_info: dict | None, delay: float,
+                       used_memory_ids: list[int] | None = None, stream_id: str | None = None):
     """延迟发送 Agent 回复（batch 模式下错开广播时间）"""
     await asyncio.sleep(delay)
-    history = list(agent_info["history"])  # 防御性拷贝
     try:
-        async with async_session() as db:
-            msg = await send_agent_message(agent_info["agent_id"], agent_info["agent_name"], reply, db)
-            await economy_service.deduct_quota(agent_info["agent_id"], db)
-            if usage_info:
-                from ..models.tables import LLMUsage
-                record = LLMUsage(
-                    model=usage_info["model"],
-                    agent_id=usage_info["agent_id"],
-                    prompt_tokens=usage_info["prompt_tokens"],
-                    completion_tokens=usage_info["completion_tokens"],
-                    total_tokens=usage_info["total_tokens"],
-                    latency_ms=usage_info["latency_ms"],
-                )
-                db.add(record)
-            # 写入记忆引用
-            if used_memory_ids and msg:
-                for mid in used_memory_ids:
-                    db.add(MemoryReference(message_id=msg.id, memory_id=mid))
-            await db.commit()
-
-        # 记忆提取（fire-and-forget，不阻塞消息发送）
-        history.append({"name": agent_info["agent_name"], "content": reply})
-        task = asyncio.create_task(
-            _extract_memory(agent_info["agent_id"], history)
-        )
-        _background_tasks.add(task)
-        task.add_done_callback(_background_tasks.discard)
+        await _persist_reply(agent_info, reply, usage_info, used_memory_ids, stream_id)
         logger.info("Delayed send completed for agent %s (delay=%.1fs)", agent_info["agent_name"], delay)
     except Exception as e:
         logger.error("Delayed send failed for agent %s: %s", agent_info["agent_name"], e, exc_info=True)
 
 
 def parse_mentions(content: str, agent_names: dict[str, int]) -> list[int]:
-    """解析 @提及，返回被提及的 agent_id 列表"""
-    pattern = r'@([\w\u4e00-\u9fff]+)'
-    matches = re.findall(pattern, content)
-    return [agent_names[name] for name in matches if name in agent_names]
+    """解析 @提及，返回被提及的 agent_id 列表（agent_names 是目录缓存时复用预编译的匹配器）"""
+    return agent_directory.matcher_for(agent_names).find(content)
 
 
 async def get_agent_name_map(db: AsyncSession) -> dict[str, int]:
-    """获取 {agent_name: agent_id} 映射"""
-    result = await db.execute(select(Agent.name, Agent.id))
-    return {name: aid for name, aid in result.all()}
+    """获取 {agent_name: agent_id} 映射（进程内缓存，agent 增删改时失效）"""
+    return await agent_directory.name_map(db)
 
 
-def _all_connections() -> list[tuple[int, WebSocket]]:
-    """获取所有活跃连接（human + bot）的扁平列表"""
-    conns = []
-    for aid, ws_list in human_connections.items():
-        for ws in ws_list:
-            conns.append((aid, ws))
-    for aid, ws in bot_connections.items():
-        conns.append((aid, ws))
-    return conns
+def _local_presence() -> tuple[set[int], set[int]]:
+    """本 worker 的在线连接：(人类 agent_id, bot agent_id)"""
+    return set(human_connections), set(bot_connections)
 
 
-async def broadcast(data: dict):
-    """广播消息给所有在线连接（human + bot）"""
-    text = json.dumps(data, ensure_ascii=False)
-    for aid, ws in _all_connections():
+def _drop_replaced_bot(payload: dict):
+    """同一 bot 在其他 worker 上重连了：关掉本 worker 上的旧连接"""
+    aid = payload.get("agent_id")
+    ws = bot_connections.pop(aid, None)
+    if ws is None:
+        return
+    broadcast_hub.unregister(ws)
+    broadcast_bus.presence_changed()
+
+    async def close():
         try:
-            await ws.send_text(text)
-        except Exception as e:
-            logger.warning("broadcast send failed for agent_id=%s: %s", aid, e)
-            # 清理失败的连接
-            if aid in human_connections:
-                try:
-                    human_connections[aid].remove(ws)
-                except ValueError:
-                    pass
-                if not human_connections[aid]:
-                    human_connections.pop(aid, None)
-            elif aid in bot_connections and bot_connections[aid] is ws:
-                bot_connections.pop(aid, None)
+            await ws.close(code=4001, reason="Replaced by new connection")
+        except Exception:
+            pass
+    task = asyncio.create_task(close())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+broadcast_bus.set_presence_source(_local_presence)
+broadcast_bus.subscribe("bot_connected", _drop_replaced_bot)
+
+
+def _forget_connection(aid: int, ws: WebSocket):
+    """广播中心放弃某个连接（发送失败 / 超时 / 慢客户端被踢）时，从连接池移除"""
+    if aid in human_connections:
+        try:
+            human_connections[aid].remove(ws)
+        except ValueError:
+            pass
+        if not human_connections[aid]:
+            human_connections.pop(aid, None)
+    elif bot_connections.get(aid) is ws:
+        bot_connections.pop(aid, None)
+    broadcast_bus.presence_changed()
+
+
+async def broadcast(data: dict, coalesce_key=None, channel: str | None = None):
+    """广播消息给所有在线连接（human + bot）
+
+    只序列化一次，然后放进每个连接的发送队列立即返回，不等待任何客户端；
+    coalesce_key 相同且仍在排队的旧消息会被新消息就地替换（如同一 agent 的状态变化）。
+    channel 不为空时只发给订阅了该频道的连接（如 message_delta）。
+    多 worker 部署时经广播总线转发，其他 worker 投递给各自的连接。
+    """
+    text = json.dumps(data, ensure_ascii=False)
+    broadcast_bus.publish(text, coalesce_key, channel)
+
+
+class ReplyStream:
+    """一条流式生成中的回复：把 token 增量合并后以 message_delta 推给订阅的连接
+
+    客户端按 stream_id 拼出临时消息；结束时 new_message 带同一个 stream_id 替换它，
+    生成失败 / 没有回复时推一条 aborted 让客户端移除。
+    """
+
+    def __init__(self, agent_id: int, agent_name: str):
+        self.id = f"s-{uuid.uuid4().hex[:12]}"
+        self.agent_id = agent_id
+        self.agent_name = agent_name
+        self.seq = 0
+        self._buffer: list[str] = []
+        self._reset = False
+        self._last_flush = 0.0
+
+    async def push(self, text: str, reset: bool = False):
+        if reset:
+            self._buffer.clear()
+            self._reset = True
+        if text:
+            self._buffer.append(text)
+        if time.monotonic() - self._last_flush >= settings.chat_stream_flush_ms / 1000:
+            await self.flush()
+
+    async def flush(self):
+        if not self._buffer and not self._reset:
+            return
+        data = {
+            "stream_id": self.id,
+            "agent_id": self.agent_id,
+            "agent_name": self.agent_name,
+            "seq": self.seq,
+            "delta": "".join(self._buffer),
+        }
+        if self._reset:
+            data["reset"] = True
+        self._buffer.clear()
+        self._reset = False
+        self.seq += 1
+        self._last_flush = time.monotonic()
+        await broadcast({"type": "message_delta", "data": data}, channel=STREAM_CHANNEL)
+
+    async def abort(self):
+        if self.seq:
+            await broadcast({
+                "type": "message_delta",
+                "data": {"stream_id": self.id, "agent_id": self.agent_id, "seq": self.seq, "aborted": True},
+            }, channel=STREAM_CHANNEL)
+
+
+@router.get("/ws/stats")
+async def ws_stats():
+    """广播队列指标：连接数、排队深度、丢弃 / 合并数、因过慢被断开的连接数（本 worker）+ 总线状态"""
+    return {**broadcast_hub.stats(), "bus": broadcast_bus.stats()}
 
 
 async def broadcast_system_event(event: str, agent_id: int, agent_name: str):
@@ -248,10 +333,10 @@ async def broadcast_system_event(event: str, agent_id: int, agent_name: str):
     })
 
 
-async def send_agent_message(agent_id: int, agent_name: str, content: str, db: AsyncSession):
-    """Agent 发送消息（持久化 + 广播），调用方负责 commit"""
-    name_map = await get_agent_name_map(db)
-    mentions = parse_mentions(content, name_map)
+async def send_agent_message(agent_id: int, agent_name: str, content: str, db: AsyncSession,
+                             stream_id: str | None = None):
+    """Agent 发送消息（持久化 + 广播），调用方负责 commit；stream_id：替换该流式回复的临时消息"""
+    mentions = await agent_directory.parse_mentions(content, db)
     msg = Message(
         agent_id=agent_id,
         sender_type="agent",
@@ -263,31 +348,106 @@ async def send_agent_message(agent_id: int, agent_name: str, content: str, db: A
     await db.flush()
     await db.refresh(msg)
 
-    await broadcast({
-        "type": "new_message",
-        "data": {
-            "id": msg.id,
-            "agent_id": agent_id,
-            "agent_name": agent_name,
-            "sender_type": "agent",
-            "message_type": "chat",
-            "content": content,
-            "mentions": mentions,
-            "created_at": str(msg.created_at),
-        }
-    })
+    data = {
+        "id": msg.id,
+        "agent_id": agent_id,
+        "agent_name": agent_name,
+        "sender_type": "agent",
+        "message_type": "chat",
+        "content": content,
+        "mentions": mentions,
+        "created_at": str(msg.created_at),
+    }
+    if stream_id:
+        data["stream_id"] = stream_id
+    await broadcast({"type": "new_message", "data": data})
     return msg
 
 
+async def _recent_history(db: AsyncSession, limit: int = 10) -> list[dict]:
+    """最近 limit 条消息（按时间正序），给 runner 作为聊天上下文"""
+    recent = await db.execute(
+        select(Message)
+        .options(joinedload(Message.agent))
+        .order_by(Message.created_at.desc())
+        .limit(limit)
+    )
+    return [
+        {
+            "name": m.agent.name if m.agent else "unknown",
+            "content": m.content,
+        }
+        for m in reversed(recent.scalars().all())
+    ]
+
+
+class _Stagger:
+    """可选的展示节奏：相邻两条回复至少间隔 interval 秒（按生成完成的先后排队）"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next = 0.0
+
+    def delay(self) -> float:
+        now = time.monotonic()
+        delay = max(0.0, self._next - now)
+        self._next = now + delay + self.interval
+        return delay
+
+
+async def _reply_for_agent(agent_info: dict, semaphore: asyncio.Semaphore, stagger: _Stagger | None):
+    """流水线的一段：生成（限并发 + 流式增量 + 超时）→ 生成完立即落库广播，不等其他 agent"""
+    runner = runner_manager.get_or_create(
+        agent_info["agent_id"],
+        agent_info["agent_name"],
+        agent_info["persona"],
+        agent_info["model"],
+        agent_info.get("personality_json"),
+    )
+    # 流式：边生成边把增量推给订阅的客户端，结束后再持久化 + 广播完整消息
+    stream = ReplyStream(agent_info["agent_id"], agent_info["agent_name"]) if settings.chat_streaming else None
+    reply = usage_info = used_memory_ids = None
+    timeout = settings.wakeup_reply_timeout
+    async with semaphore:  # 只限制生成阶段，保存 / 错开展示不占并发名额
+        try:
+            async with asyncio.timeout(timeout if timeout > 0 else None):
+                async with async_session() as mem_db:
+                    reply, usage_info, used_memory_ids = await runner.generate_reply(
+                        agent_info["history"], db=mem_db, on_delta=stream.push if stream else None,
+                    )
+            logger.info("Agent %s generated reply", agent_info["agent_name"])
+        except TimeoutError:
+            logger.warning("Wakeup: agent %s reply timed out after %.0fs", agent_info["agent_name"], timeout)
+        except Exception:
+            if stream:
+                await stream.abort()  # 客户端丢掉临时消息
+            raise
+    if stream:
+        await stream.flush()
+        if not reply:
+            await stream.abort()
+    if not reply:
+        return
+
+    stream_id = stream.id if stream else None
+    if stagger is not None:
+        await delayed_send(agent_info, reply, usage_info, stagger.delay(), used_memory_ids, stream_id)
+    else:
+        await _persist_reply(agent_info, reply, usage_info, used_memory_ids, stream_id)
+
+
 async def handle_wakeup(message: Message):
-    """异步唤醒处理：选人 → 如果 Bot 在线则跳过，否则 fallback 生成回复"""
+    """异步唤醒处理：选人 → 如果 Bot 在线则跳过，否则 fallback 生成回复
+
+    多个 agent 被唤醒时并发生成（最多 wakeup_max_concurrency 个），每个回复生成完立即保存广播。
+    """
     try:
         # 第一阶段：读取数据（短时间持有数据库会话）
         wake_list = []
         agents_to_reply = []
 
         async with async_session() as db:
-            online_ids = set(human_connections.keys()) | set(bot_connections.keys())
+            online_ids = broadcast_bus.online_ids()  # 所有 worker 的在线连接
             logger.debug("Wakeup: online_ids=%s", online_ids)
             wake_list = await wakeup_service.process(message, online_ids, db)
             logger.debug("Wakeup: wake_list=%s", wake_list)
@@ -295,9 +455,10 @@ async def handle_wakeup(message: Message):
             if not wake_list:
                 return
 
+            history = None
             for agent_id in wake_list:
-                # Bot 在线 → 跳过，Bot 自己会处理
-                if agent_id in bot_connections:
+                # Bot 在线（任一 worker）→ 跳过，Bot 自己会处理
+                if broadcast_bus.bot_online(agent_id):
                     logger.info("Agent %d has bot online, skipping server-side reply", agent_id)
                     continue
 
@@ -315,20 +476,9 @@ async def handle_wakeup(message: Message):
 
                 logger.debug("Wakeup: generating reply for agent %d (%s)", agent_id, agent.name)
 
-                # 构建聊天历史给 runner
-                recent = await db.execute(
-                    select(Message)
-                    .options(joinedload(Message.agent))
-                    .order_by(Message.created_at.desc())
-                    .limit(10)
-                )
-                history = [
-                    {
-                        "name": m.agent.name if m.agent else "unknown",
-                        "content": m.content,
-                    }
-                    for m in reversed(recent.scalars().all())
-                ]
+                # 构建聊天历史给 runner（所有被唤醒的 agent 共用同一份，只查一次）
+                if history is None:
+                    history = await _recent_history(db)
 
                 agents_to_reply.append({
                     "agent_id": agent.id,
@@ -336,55 +486,24 @@ async def handle_wakeup(message: Message):
                     "persona": agent.persona,
                     "model": agent.model,
                     "personality_json": agent.personality_json,
-                    "history": history,
+                    "history": list(history),
                 })
         # 数据库会话已关闭，释放锁
 
-        # 第二阶段：LLM 调用（记忆注入需要短暂 db 访问）
-        for agent_info in agents_to_reply:
-            runner = runner_manager.get_or_create(
-                agent_info["agent_id"],
-                agent_info["agent_name"],
-                agent_info["persona"],
-                agent_info["model"],
-                agent_info.get("personality_json"),
-            )
-            async with async_session() as mem_db:
-                reply, usage_info, used_memory_ids = await runner.generate_reply(
-                    agent_info["history"], db=mem_db
-                )
-            logger.info("Agent %s generated reply", agent_info["agent_name"])
+        if not agents_to_reply:
+            return
 
-            # 第三阶段：保存结果（创建新的数据库会话，一次性写入所有数据）
-            if reply:
-                async with async_session() as db:
-                    msg = await send_agent_message(agent_info["agent_id"], agent_info["agent_name"], reply, db)
-                    await economy_service.deduct_quota(agent_info["agent_id"], db)
-                    if usage_info:
-                        from ..models.tables import LLMUsage
-                        record = LLMUsage(
-                            model=usage_info["model"],
-                            agent_id=usage_info["agent_id"],
-                            prompt_tokens=usage_info["prompt_tokens"],
-                            completion_tokens=usage_info["completion_tokens"],
-                            total_tokens=usage_info["total_tokens"],
-                            latency_ms=usage_info["latency_ms"],
-                        )
-                        db.add(record)
-                    # 写入记忆引用
-                    if used_memory_ids and msg:
-                        for mid in used_memory_ids:
-                            db.add(MemoryReference(message_id=msg.id, memory_id=mid))
-                    await db.commit()
-
-                # M2-4: 异步记忆提取（fire-and-forget）
-                # 将 Agent 回复追加到 history，确保摘要包含完整对话
-                agent_info["history"].append({"name": agent_info["agent_name"], "content": reply})
-                task = asyncio.create_task(
-                    _extract_memory(agent_info["agent_id"], agent_info["history"])
-                )
-                _background_tasks.add(task)
-                task.add_done_callback(_background_tasks.discard)
+        # 第二阶段：并发生成 + 各自完成即保存（记忆注入需要短暂 db 访问，每个 agent 独立会话）
+        semaphore = asyncio.Semaphore(max(1, settings.wakeup_max_concurrency))
+        stagger = _Stagger(settings.wakeup_stagger_seconds) if settings.wakeup_stagger_seconds > 0 else None
+
+        async def run(agent_info: dict):
+            try:
+                await _reply_for_agent(agent_info, semaphore, stagger)
+            except Exception as e:
+                logger.error("Wakeup reply failed for agent %s: %s", agent_info["agent_name"], e, exc_info=True)
+
+        await asyncio.gather(*(run(info) for info in agents_to_reply))
 
     except Exception as e:
         logger.error("Wakeup handling failed: %s", e, exc_info=True)
@@ -429,13 +548,12 @@ async def get_messages(
 
 
 async def _heartbeat(ws: WebSocket):
-    """定期发送 ping，检测僵尸连接"""
-    try:
-        while True:
-            await asyncio.sleep(HEARTBEAT_INTERVAL)
-            await ws.send_json({"type": "ping"})
-    except Exception:
-        pass  # 连接已断开，心跳自然停止
+    """定期发送 ping，检测僵尸连接（走发送队列，不与广播并发写同一个 socket）"""
+    ping = json.dumps({"type": "ping"})
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        if not broadcast_hub.send(ws, ping):
+            return  # 连接已断开，心跳自然停止
 
 
 @router.websocket("/ws/{agent_id}")
@@ -443,6 +561,7 @@ async def websocket_endpoint(
     websocket: WebSocket,
     agent_id: int,
     token: str | None = Query(default=None),
+    stream: bool = Query(default=False),
 ):
     # Bot 认证（需要先 accept 再 close，Starlette 不支持 accept 前 close）
     if agent_id != 0:
@@ -476,16 +595,22 @@ async def websocket_endpoint(
         # 踢旧连接
         if agent_id in bot_connections:
             old_ws = bot_connections[agent_id]
+            broadcast_hub.unregister(old_ws)
             try:
                 await old_ws.close(code=4001, reason="Replaced by new connection")
             except Exception:
                 pass
         bot_connections[agent_id] = websocket
+        broadcast_bus.notify_peers("bot_connected", {"agent_id": agent_id})  # 踢掉其他 worker 上的旧连接
     else:
         # 人类支持多标签页
         if agent_id not in human_connections:
             human_connections[agent_id] = []
         human_connections[agent_id].append(websocket)
+    # ?stream=1：同时接收流式回复的 message_delta 增量
+    broadcast_hub.register(agent_id, websocket, on_close=_forget_connection,
+                           channels=(STREAM_CHANNEL,) if stream else ())
+    broadcast_bus.presence_changed()
 
     # 启动心跳
     heartbeat_task = asyncio.create_task(_heartbeat(websocket))
@@ -518,8 +643,7 @@ async def websocket_endpoint(
 
             # 解析 @提及
             async with async_session() as db:
-                name_map = await get_agent_name_map(db)
-                mentions = parse_mentions(content, name_map)
+                mentions = await agent_directory.parse_mentions(content, db)
 
                 # 持久化消息
                 msg = Message(
@@ -557,6 +681,7 @@ async def websocket_endpoint(
         pass
     finally:
         heartbeat_task.cancel()
+        broadcast_hub.unregister(websocket)
         # 清理连接
         if conn_type == "bot":
             if bot_connections.get(agent_id) is websocket:
@@ -571,4 +696,5 @@ async def websocket_endpoint(
                     pass
                 if not human_connections[agent_id]:
                     human_connections.pop(agent_id, None)
+        broadcast_bus.presence_changed()
         await broadcast_system_event("agent_offline", agent_id, agent_name)
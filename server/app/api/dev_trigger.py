@@ -15,11 +15,10 @@ from sqlalchemy import select, update as sql_update
 from ..core import get_db
 from ..core.database import async_session
 from ..models import Agent, Message
-from .chat import (
-    parse_mentions, get_agent_name_map, broadcast, handle_wakeup,
-    _background_tasks,
-)
+from .chat import broadcast, handle_wakeup, _background_tasks
+from ..services.agent_directory import agent_directory
 from ..services.economy_service import economy_service
+from ..services.world_state import world_state
 from ..services import autonomy_service
 
 logger = logging.getLogger(__name__)
@@ -58,8 +57,7 @@ async def trigger_message(req: TriggerRequest, db: AsyncSession = Depends(get_db
     sender_type = "human" if agent.id == 0 else "agent"
 
     # 解析 @提及
-    name_map = await get_agent_name_map(db)
-    mentions = parse_mentions(req.content, name_map)
+    mentions = await agent_directory.parse_mentions(req.content, db)
 
     # 持久化
     msg = Message(
@@ -123,6 +121,7 @@ async def dev_set_credits(agent_id: int, credits: int, quota_used: int | None =
     )
     if result.rowcount == 0:
         raise HTTPException(404, "Agent not found")
+    world_state.touch_agents(agent_id, db=db)
     await db.commit()
     return {"ok": True, "agent_id": agent_id, "credits": credits}
 
@@ -139,9 +138,9 @@ async def dev_set_resource(agent_id: int, resource_type: str, quantity: float, d
 
 @router.post("/trigger-autonomy")
 async def trigger_autonomy():
-    """手动触发一次 autonomy tick（跳过定时器等待）"""
-    await autonomy_service.tick()
-    return {"ok": True}
+    """手动触发一次 autonomy tick（跳过定时器等待），返回本轮报告（分片 token 用量 / 耗时）"""
+    report = await autonomy_service.tick()
+    return {"ok": True, "report": report}
 
 
 @router.post("/probe-llm-decide")
@@ -162,5 +161,6 @@ async def dev_probe_llm_decide(db: AsyncSession = Depends(get_db)):
 
 @router.post("/execute-strategies")
 async def dev_execute_strategies(db: AsyncSession = Depends(get_db)):
-    """开发用：策略系统 dormant（DEV-40），返回空结果。"""
-    return {"executed": 0, "skipped": 0, "completed": 0, "dormant": True}
+    """开发用：策略自动机全量巡检一次（平时按事件触发）。"""
+    from ..services.autonomy_service import execute_strategies
+    return await execute_strategies(db)
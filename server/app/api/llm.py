@@ -0,0 +1,18 @@
+from fastapi import APIRouter
+from ..core.llm_clients import llm_clients
+from ..core.llm_limiter import llm_limiter
+from ..core.llm_router import llm_router
+from .chat import wakeup_service
+
+router = APIRouter(prefix="/llm", tags=["llm"])
+
+
+@router.get("/health")
+async def llm_health():
+    """LLM 供应商健康度（EWMA 延迟 / 错误率 / p95 / 熔断状态）、准入队列、连接池和唤醒选人指标（本 worker）"""
+    return {
+        "providers": llm_router.stats(),
+        "limiter": llm_limiter.stats(),
+        "clients": llm_clients.stats(),
+        "wakeup": wakeup_service.decision_stats(),
+    }
@@ -3,6 +3,7 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 from ..core import get_db
+from ..services import vector_store
 from ..services.memory_admin_service import (
     list_memories, get_memory_detail, get_agent_memory_stats, get_message_memory_refs,
     create_memory, update_memory, delete_memory,
@@ -50,6 +51,11 @@ async def api_memory_stats(
     return await get_agent_memory_stats(agent_id, db)
 
 
+@router.get("/embedding-cache")
+async def api_embedding_cache_stats():
+    return vector_store.embedding_cache.stats()
+
+
 @router.get("/{memory_id}")
 async def api_memory_detail(
     memory_id: int,
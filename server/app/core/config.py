@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import BaseModel, Field, AliasChoices
 from pathlib import Path
+from typing import Callable
 
 
 class Settings(BaseSettings):
@@ -35,11 +36,90 @@ class Settings(BaseSettings):
     embedding_api_key: str = Field(default="", validation_alias=AliasChoices("EMBEDDING_API_KEY", "SILICONFLOW_API_KEY"))
     embedding_model: str = "BAAI/bge-m3"
     embedding_dim: int = 1024
+    embedding_batch_size: int = 32  # 单次 /embeddings 请求最多携带的文本条数
+    embedding_batch_linger_ms: int = 5  # 并发 embed() 合并等待窗口（毫秒），0 = 不合并
+    embedding_cache_size: int = 4096  # embedding 内存缓存条数（按 模型+维度+文本 哈希）
+    embedding_cache_path: str = ""  # embedding 持久缓存（SQLite 文件），留空 = 仅内存
+
+    # 向量检索（IVF 近似最近邻索引，每个 agent 一个 + 公共记忆一个）
+    vector_search_mode: str = "ann"  # ann / exact（exact = 全量暴力扫描）
+    vector_index_dir: str = str(Path(__file__).parent.parent.parent / "data" / "vector_index")
+    vector_ivf_nprobe: int = 8
+    vector_ivf_min_train: int = 2048  # 少于该条数时索引不分桶，直接精确扫描
+    vector_cache_max_mb: int = 256  # 常驻索引总内存上限，超出按 LRU 淘汰 agent 索引
+    vector_search_workers: int = 2  # 向量打分 / 解码线程池大小（0 = 在事件循环里直接算）
+    embedding_storage: str = "float32"  # 数据库 embedding 存储格式：float32 / float16 / int8（启动时迁移已有行）
+    vector_index_quantize: bool = False  # 常驻索引用 int8 编码粗排（内存约 1/4），再按存储向量精排
+    vector_rerank_factor: int = 4  # 量化粗排 / 混合检索时取 top_k * factor 个候选
+    memory_search_keyword_weight: float = 0.3  # 混合检索中 BM25（FTS5 trigram）的权重，0 = 纯向量
+    memory_access_flush_seconds: int = 30  # 记忆命中计数在内存中累积，每隔多少秒批量写回并晋升
+
+    # WebSocket 广播：每个连接一个有界发送队列 + 独立写协程，慢客户端不拖累其他人
+    ws_send_queue_size: int = 256  # 每个连接最多排队的待发消息数
+    ws_slow_consumer_policy: str = "drop_oldest"  # 队列满时：drop_oldest / drop_newest / disconnect
+    ws_send_timeout: float = 10.0  # 单条消息发送超时（秒），超时断开该连接；0 = 不限
+    # 多 worker 广播总线：local = 单进程；unix = 同机多个 uvicorn worker 通过 Unix socket 互相转发广播、汇总在线状态
+    broadcast_backend: str = "local"
+    broadcast_bus_dir: str = str(Path(__file__).parent.parent.parent / "data" / "ws_bus")
+    broadcast_bus_refresh_seconds: float = 1.0  # 扫描新 worker socket 的间隔（秒）
+    broadcast_bus_max_buffer_mb: int = 8  # 发往单个 worker 的未写出缓冲上限，超出断开重连
+
+    # Agent 状态广播（F35）：batch = 合并后一条 UPDATE + 一条 agent_status_batch；event = 逐条提交 + agent_status_change（兼容模式）
+    agent_status_mode: str = "batch"
+    agent_status_flush_ms: int = 100  # batch 模式下 tick 之外的状态变化合并窗口（毫秒）
+
+    # 流式回复：服务端兜底生成回复时把 token 增量作为 message_delta 推给订阅的连接（/api/ws/{id}?stream=1）
+    chat_streaming: bool = True
+    chat_stream_flush_ms: int = 50  # 增量合并窗口（毫秒），避免每个 token 一帧
+
+    # 唤醒回复流水线：多个 agent 被唤醒时并发生成，每条回复生成完立即保存广播
+    wakeup_max_concurrency: int = 4
+    wakeup_reply_timeout: float = 90.0  # 单个 agent 生成回复的超时（秒），超时放弃该 agent；0 = 不限
+    wakeup_stagger_seconds: float = 0.0  # >0 时相邻两条回复至少间隔这么多秒再展示（delayed_send），0 = 生成完立即发送
+    # 唤醒选人：先用本地规则打分（人设 / 擅长领域关键词 + 点名 + 最近发言），拿不准才调用 wakeup-model
+    wakeup_scorer: bool = True  # False = 每条消息都问小模型（旧行为）
+    wakeup_scorer_min_score: float = 2.0  # 第一名至少这么多分才算有把握；Agent 消息无人达到则不触发
+    wakeup_scorer_margin: float = 1.5  # 第一名领先第二名至少这么多分
+    wakeup_cache_ttl: float = 300.0  # 小模型选人结果按上下文指纹缓存的秒数
+
+    # LLM 客户端连接池：按 (base_url, api_key) 复用 AsyncOpenAI，底层共用一个 httpx 连接池
+    llm_http2: bool = True  # 需要安装 h2，未安装时自动退回 HTTP/1.1 keep-alive
+    llm_max_connections: int = 100
+    llm_max_keepalive_connections: int = 20
+    llm_keepalive_expiry: float = 60.0  # 空闲连接保留秒数
+    llm_timeout: float = 600.0  # 单次请求超时（与 openai SDK 默认值一致）
+    llm_connect_timeout: float = 10.0
+
+    # LLM 准入控制（按供应商）：并发上限 + 每分钟请求数 / token 数预算，0 = 不限；按 agent 轮转排队
+    llm_max_inflight: int = 8
+    llm_requests_per_minute: int = 0
+    llm_tokens_per_minute: int = 0
+    llm_provider_limits: dict[str, dict[str, int]] = {}  # 单个供应商覆盖，如 {"openrouter": {"max_inflight": 4, "rpm": 20, "tpm": 100000}}
+    llm_rate_limit_backoff: float = 5.0  # 收到 429 且没有 Retry-After 时暂停该供应商的秒数
+    llm_queue_timeout: float = 120.0  # 排队超过该秒数放弃本次调用（0 = 一直等）
+
+    # LLM 供应商路由：按健康分（EWMA 延迟 × 错误率）选供应商，熔断 + 失败转移，可选对冲请求
+    llm_health_alpha: float = 0.2  # EWMA 平滑系数
+    llm_health_prior_latency_ms: float = 3000.0  # 还没有样本的供应商按这个延迟打分
+    llm_health_error_penalty: float = 4.0  # 健康分 = 延迟 × (1 + 惩罚 × 错误率)，越低越好
+    llm_breaker_failures: int = 5  # 连续失败次数达到后熔断
+    llm_breaker_cooldown: float = 30.0  # 熔断多少秒后放一个试探请求（半开）
+    llm_hedge: bool = False  # 对冲：主供应商超过 p95 延迟还没返回，同时请求下一个供应商，取先返回的
+    llm_hedge_delay_ms: float = 5000.0  # 样本不足时的对冲等待时间（毫秒）
+    llm_hedge_min_samples: int = 20  # 至少这么多成功样本才用 p95 作为对冲等待时间
 
     # Agent 默认配置
     default_speak_interval: int = 60  # 默认发言间隔（秒）
     max_agents: int = 20
 
+    # 自主行为分片决策：居民按组拆成多个较小的 prompt（共享世界概要 + 本组明细）并发决策
+    autonomy_shard_size: int = 8  # 每片最多多少个居民；人数不超过一片 / 0 = 单次完整快照
+    autonomy_shard_concurrency: int = 3  # 同时进行的分片 LLM 调用数
+    autonomy_execute_chunk: int = 8  # 执行决策时每个写事务最多几条 action（限制单次持锁时间）；0 = 整轮一个事务
+    strategy_runtime: bool = True  # 策略自动机按事件触发（挂单 / 成交 / 生产 / 打卡，提交后毫秒级执行）；False = 只能手动巡检
+    world_state_cache: bool = True  # 世界快照增量维护（只重读有变更的居民 / 段落）；多 worker 部署自动退回每轮全量读取
+    world_state_verify_seconds: float = 600.0  # 每隔多少秒全量重建一次并与缓存比对，记录漂移
+
 
 settings = Settings()
 
@@ -128,21 +208,32 @@ MODEL_REGISTRY: dict[str, ModelEntry] = {
 }
 
 
+# 供应商排序钩子（llm_router 导入时注册）：按健康分把可用供应商排在前面
+_provider_ranker: Callable[[list[ModelProvider]], list[ModelProvider]] | None = None
+
+
+def set_provider_ranker(ranker: Callable[[list[ModelProvider]], list[ModelProvider]] | None) -> None:
+    global _provider_ranker
+    _provider_ranker = ranker
+
+
 def resolve_model(model_key: str) -> tuple[str, str, str] | None:
     """
     解析模型标识，返回 (base_url, auth_token, model_id)。
+    多个可用供应商时取健康分最好的（没有健康数据时按注册顺序）。
     找不到或没有可用供应商返回 None。
     """
     entry = MODEL_REGISTRY.get(model_key)
     if not entry:
         return None
-    provider = entry.get_active_provider()
-    if not provider:
-        return None
-    model_id = provider.get_model_id()
-    if not model_id:
-        return None
-    return provider.get_base_url(), provider.get_auth_token(), model_id
+    providers = [p for p in entry.providers if p.is_available()]
+    if _provider_ranker is not None and len(providers) > 1:
+        providers = _provider_ranker(providers)
+    for provider in providers:
+        model_id = provider.get_model_id()
+        if model_id:
+            return provider.get_base_url(), provider.get_auth_token(), model_id
+    return None
 
 
 def list_available_models() -> list[dict]:
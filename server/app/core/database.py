@@ -1,6 +1,8 @@
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy import text, event
+from sqlalchemy.exc import OperationalError
+from contextlib import asynccontextmanager
 from pathlib import Path
 from .config import settings
 
@@ -61,14 +63,179 @@ async def _migrate_personality_json(conn):
         await conn.execute(text("ALTER TABLE agents ADD COLUMN personality_json JSON"))
 
 
+async def _migrate_llm_usage_queue_wait(conn):
+    """给 llm_usage 表加 queue_wait_ms 字段（LLM 准入排队耗时）"""
+    result = await conn.execute(text("PRAGMA table_info(llm_usage)"))
+    columns = [row[1] for row in result.fetchall()]
+    if "queue_wait_ms" not in columns:
+        await conn.execute(text("ALTER TABLE llm_usage ADD COLUMN queue_wait_ms INTEGER DEFAULT 0"))
+
+
+async def _migrate_embedding_storage(conn):
+    """把 memories.embedding 转成 settings.embedding_storage 指定的格式（按 blob 长度识别旧格式，分批转换）"""
+    from ..services import embedding_codec
+
+    dim = settings.embedding_dim
+    target = settings.embedding_storage
+    target_size = embedding_codec.blob_size(target, dim)
+    # 只转换能识别的格式，长度不符的脏数据原样保留
+    sizes = [embedding_codec.blob_size(fmt, dim) for fmt in embedding_codec.FORMATS if fmt != target]
+    last_id, converted = 0, 0
+    while True:
+        rows = (await conn.execute(text(
+            "SELECT id, embedding FROM memories "
+            "WHERE id > :last_id AND embedding IS NOT NULL AND length(embedding) IN (:s1, :s2) "
+            "ORDER BY id LIMIT 1000"
+        ), {"last_id": last_id, "s1": sizes[0], "s2": sizes[1]})).fetchall()
+        if not rows:
+            break
+        await conn.execute(
+            text("UPDATE memories SET embedding = :blob WHERE id = :id"),
+            [{"id": mid, "blob": embedding_codec.encode(embedding_codec.decode(blob, dim), target)} for mid, blob in rows],
+        )
+        last_id = rows[-1][0]
+        converted += len(rows)
+    if converted:
+        print(f"[DB] embedding 存储格式迁移为 {target}（{target_size} 字节/条）：{converted} 条", flush=True)
+
+
+async def _migrate_memories_fts(conn):
+    """给已有库补建 memories_fts 全文索引，并从 memories 回填"""
+    from ..models.tables import MEMORIES_FTS_DDL
+
+    result = await conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'memories_fts'"))
+    if result.first():
+        return
+    try:
+        for stmt in MEMORIES_FTS_DDL:
+            await conn.execute(text(stmt))
+    except OperationalError as e:
+        print(f"[DB] FTS5 不可用，记忆关键词检索退回 LIKE: {e}", flush=True)
+        return
+    await conn.execute(text("INSERT INTO memories_fts(memories_fts) VALUES ('rebuild')"))
+
+
+async def _migrate_memory_indexes(conn):
+    """给已有库补建记忆过期清理用的索引（create_all 不会给已存在的表加索引）"""
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_memories_type_expires ON memories (memory_type, expires_at)"
+    ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_memory_references_memory_id ON memory_references (memory_id)"
+    ))
+
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
         await _migrate_bot_token(conn)
         await _migrate_satiety_mood(conn)
         await _migrate_personality_json(conn)
+        await _migrate_llm_usage_queue_wait(conn)
+        await _migrate_embedding_storage(conn)
+        await _migrate_memories_fts(conn)
+        await _migrate_memory_indexes(conn)
 
 
 async def get_db():
     async with async_session() as session:
         yield session
+
+
+# ---- 单事务批量执行（autonomy 执行阶段）----
+# 服务层函数照常写 commit(db) / rollback(db) / after_commit(db, ...)：平时等同于直接提交、回滚、立即广播；
+# 在 unit_of_work(db) 块内则 commit 只 flush、rollback 只回滚当前 action 的 SAVEPOINT、广播推迟到整体提交之后，
+# 这样一轮的所有 action 只占一个写事务，单条失败也不影响其他 action。
+
+_UOW_KEY = "unit_of_work"
+
+
+class UnitOfWork:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.events: list[tuple] = []  # (协程函数, args, kwargs)，提交后按顺序执行
+        self.savepoints = 0
+        self.rolled_back = 0
+        self._savepoint = None
+        self._mark = 0
+
+    async def begin_action(self):
+        """为下一条 action 开一个 SAVEPOINT"""
+        await _begin_immediate(self.db)
+        self._savepoint = await self.db.begin_nested()
+        self._mark = len(self.events)
+        self.savepoints += 1
+
+    async def end_action(self, ok: bool):
+        """ok → 释放 SAVEPOINT；否则回滚它并丢掉这条 action 排队的广播"""
+        if ok:
+            if self._savepoint is not None and self._savepoint.is_active:
+                await self._savepoint.commit()
+        else:
+            await self.discard()
+        self._savepoint = None
+
+    async def discard(self):
+        if self._savepoint is not None and self._savepoint.is_active:
+            await self._savepoint.rollback()
+            self.rolled_back += 1
+        del self.events[self._mark:]
+
+    async def commit(self) -> list[tuple]:
+        """真正提交，返回提交后要发出的事件"""
+        await self.db.commit()
+        events, self.events = self.events, []
+        return events
+
+
+async def _begin_immediate(db: AsyncSession):
+    """sqlite3 只在 DML 前自动 BEGIN IMMEDIATE，SAVEPOINT 会开出一个 DEFERRED 事务：
+    先读后写时升级写锁若撞上别的连接刚提交，会直接报 database is locked（busy_timeout 不管用）。
+    所以第一个 SAVEPOINT 之前先拿写锁，别的写者按 busy_timeout 排队等。"""
+    conn = await db.connection()
+    if conn.dialect.name != "sqlite":
+        return
+    raw = await conn.get_raw_connection()
+    if not raw.driver_connection.in_transaction:
+        await conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def _unit_of_work(db) -> UnitOfWork | None:
+    info = getattr(getattr(db, "sync_session", None), "info", None)
+    return info.get(_UOW_KEY) if isinstance(info, dict) else None
+
+
+@asynccontextmanager
+async def unit_of_work(db: AsyncSession):
+    uow = UnitOfWork(db)
+    db.sync_session.info[_UOW_KEY] = uow
+    try:
+        yield uow
+    finally:
+        db.sync_session.info.pop(_UOW_KEY, None)
+
+
+async def commit(db: AsyncSession):
+    """提交；在 unit_of_work 块内只 flush，由外层统一提交"""
+    if _unit_of_work(db) is not None:
+        await db.flush()
+    else:
+        await db.commit()
+
+
+async def rollback(db: AsyncSession):
+    """回滚；在 unit_of_work 块内只回滚当前 action 的 SAVEPOINT"""
+    uow = _unit_of_work(db)
+    if uow is not None:
+        await uow.discard()
+    else:
+        await db.rollback()
+
+
+async def after_commit(db: AsyncSession, fn, *args, **kwargs):
+    """提交后要做的事（通常是广播）；不在 unit_of_work 块内时立即执行"""
+    uow = _unit_of_work(db)
+    if uow is not None:
+        uow.events.append((fn, args, kwargs))
+    else:
+        await fn(*args, **kwargs)
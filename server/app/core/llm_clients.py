@@ -0,0 +1,92 @@
+"""Shared, pooled HTTP clients for LLM providers: one cached ``AsyncOpenAI`` per
+``(base_url, api_key)``, all on one keep-alive ``httpx`` pool (HTTP/2 when ``h2`` is installed)."""
+
+import asyncio
+import importlib.util
+import logging
+
+import httpx
+from openai import AsyncOpenAI
+
+from .config import settings
+from .llm_limiter import llm_limiter
+
+logger = logging.getLogger(__name__)
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class LLMClientPool:
+    """Rebuilt when used from a different event loop; ``close_llm_clients()`` runs on shutdown."""
+
+    def __init__(self):
+        self._http: httpx.AsyncClient | None = None
+        self._clients: dict[tuple[str, str], AsyncOpenAI] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.created = 0  # AsyncOpenAI wrappers built (one per key per pool lifetime)
+
+    def _check_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # sockets of the old pool are bound to the old loop; drop without awaiting
+            self._http = None
+            self._clients.clear()
+            self._loop = loop
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """The shared connection pool (also used directly for raw /chat/completions calls)."""
+        self._check_loop()
+        if self._http is None:
+            http2 = settings.llm_http2 and HTTP2_AVAILABLE
+            if settings.llm_http2 and not HTTP2_AVAILABLE:
+                logger.info("h2 not installed; LLM clients use HTTP/1.1 keep-alive")
+            self._http = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=settings.llm_max_connections,
+                    max_keepalive_connections=settings.llm_max_keepalive_connections,
+                    keepalive_expiry=settings.llm_keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(settings.llm_timeout, connect=settings.llm_connect_timeout),
+                event_hooks={"response": [llm_limiter.observe_response]},  # 429 -> pause provider
+            )
+        return self._http
+
+    def client(self, base_url: str, api_key: str) -> AsyncOpenAI:
+        http = self.http
+        key = (base_url, api_key)
+        client = self._clients.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=api_key, base_url=base_url, http_client=http, timeout=settings.llm_timeout,
+            )
+            self._clients[key] = client
+            self.created += 1
+        return client
+
+    async def aclose(self) -> None:
+        http, self._http = self._http, None
+        self._clients.clear()
+        if http is not None and self._loop is asyncio.get_running_loop():
+            await http.aclose()
+        self._loop = None
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._clients),
+            "http2": bool(self._http is not None and settings.llm_http2 and HTTP2_AVAILABLE),
+            "created": self.created,
+        }
+
+
+llm_clients = LLMClientPool()
+
+
+def llm_client(*, base_url: str, api_key: str) -> AsyncOpenAI:
+    """Pooled ``AsyncOpenAI`` for one provider endpoint + key. Do not close it."""
+    return llm_clients.client(base_url, api_key)
+
+
+async def close_llm_clients() -> None:
+    await llm_clients.aclose()
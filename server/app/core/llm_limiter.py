@@ -0,0 +1,292 @@
+"""Admission control for LLM calls, per provider.
+
+Every chat completion goes through ``llm_limiter.slot(...)``, keyed by the
+``ModelProvider`` that ``MODEL_REGISTRY`` resolves the model to (one account /
+rate limit per provider name). A slot is granted when the provider has
+
+* fewer than ``max_inflight`` requests running,
+* a request left in its requests-per-minute bucket, and
+* enough of its tokens-per-minute bucket for the call's estimated tokens
+  (prompt characters / 2 + ``max_tokens``; refunded with the real usage).
+
+Waiters are queued per agent and served round-robin, so one agent's burst
+(e.g. ``batch_generate``) cannot starve the others. A 429 from the provider,
+seen by the shared HTTP client's response hook or raised to the caller,
+pauses the whole provider for ``Retry-After`` (or
+``settings.llm_rate_limit_backoff``) seconds.
+
+Limits come from ``settings.llm_max_inflight`` / ``llm_requests_per_minute`` /
+``llm_tokens_per_minute`` (0 = unlimited), overridable per provider with
+``settings.llm_provider_limits = {"openrouter": {"max_inflight": 4, "rpm": 20}}``.
+"""
+
+import asyncio
+import contextvars
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+from .config import MODEL_REGISTRY, ModelProvider, settings
+
+logger = logging.getLogger(__name__)
+
+_current_slot: contextvars.ContextVar["Slot | None"] = contextvars.ContextVar("llm_slot", default=None)
+
+
+def estimate_tokens(messages, max_tokens: int = 0) -> int:
+    """Rough upper bound for budget purposes: ~2 chars per token for mixed CJK / English."""
+    chars = 0
+    for m in messages or ():
+        content = m.get("content") if isinstance(m, dict) else getattr(m, "content", None)
+        chars += len(content) if isinstance(content, str) else 0
+    return chars // 2 + max(0, max_tokens)
+
+
+def parse_retry_after(headers) -> float | None:
+    """Seconds to wait from ``retry-after-ms`` / ``Retry-After`` (seconds or HTTP date)."""
+    if headers is None:
+        return None
+    raw_ms = headers.get("retry-after-ms")
+    if raw_ms:
+        try:
+            return max(0.0, float(raw_ms) / 1000)
+        except ValueError:
+            pass
+    raw = headers.get("retry-after")
+    if not raw:
+        return None
+    try:
+        return max(0.0, float(raw))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(raw).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _status_and_headers(exc: BaseException):
+    response = getattr(exc, "response", None)
+    status = getattr(exc, "status_code", None) or getattr(response, "status_code", None)
+    return status, getattr(response, "headers", None)
+
+
+class _Bucket:
+    """Token bucket refilled continuously at ``per_minute / 60`` per second, capacity ``per_minute``."""
+
+    def __init__(self):
+        self.level: float | None = None  # None = full on first use
+        self.updated = time.monotonic()
+
+    def _refill(self, per_minute: int, now: float) -> None:
+        if self.level is None:
+            self.level = float(per_minute)
+        else:
+            self.level = min(per_minute, self.level + (now - self.updated) * per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, per_minute: int, now: float) -> float:
+        if per_minute <= 0:
+            return 0.0
+        self._refill(per_minute, now)
+        missing = min(amount, per_minute) - self.level
+        return max(0.0, missing * 60 / per_minute)
+
+    def take(self, amount: float, per_minute: int) -> None:
+        if per_minute > 0:
+            self.level -= min(amount, per_minute)
+
+    def give_back(self, amount: float, per_minute: int) -> None:
+        if per_minute > 0 and self.level is not None:
+            self.level = min(per_minute, self.level + amount)  # negative amount = extra debt
+
+
+class Slot:
+    """A granted admission: release it exactly once (the ``slot()`` context does)."""
+
+    __slots__ = ("provider", "agent_key", "tokens", "wait_ms", "rate_limited", "_future")
+
+    def __init__(self, provider: "ProviderLimiter", agent_key, tokens: int):
+        self.provider = provider
+        self.agent_key = agent_key
+        self.tokens = tokens
+        self.wait_ms = 0
+        self.rate_limited = False
+        self._future: asyncio.Future | None = None
+
+    def record_usage(self, response) -> None:
+        """Settle the token budget with the provider-reported usage (SDK object or raw JSON dict)."""
+        usage = response.get("usage") if isinstance(response, dict) else getattr(response, "usage", None)
+        total = usage.get("total_tokens") if isinstance(usage, dict) else getattr(usage, "total_tokens", None)
+        if isinstance(total, int):
+            self.provider.settle(self, total)
+
+
+class ProviderLimiter:
+    def __init__(self, name: str):
+        self.name = name
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.granted = 0
+        self.throttled = 0  # 429s seen
+        self.wait_ms_total = 0
+        self._requests = _Bucket()
+        self._tokens = _Bucket()
+        self._queues: OrderedDict = OrderedDict()  # agent key -> deque[Slot], round-robin order
+        self._timer: asyncio.TimerHandle | None = None
+
+    def limits(self) -> tuple[int, int, int]:
+        override = settings.llm_provider_limits.get(self.name, {})
+        return (
+            max(1, override.get("max_inflight", settings.llm_max_inflight)),
+            override.get("rpm", settings.llm_requests_per_minute),
+            override.get("tpm", settings.llm_tokens_per_minute),
+        )
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for q in self._queues.values() for s in q if not s._future.done())
+
+    async def acquire(self, agent_key, tokens: int) -> Slot:
+        slot = Slot(self, agent_key, tokens)
+        slot._future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(agent_key, deque()).append(slot)
+        start = time.monotonic()
+        self._pump()
+        if not slot._future.done():
+            timeout = settings.llm_queue_timeout
+            try:
+                async with asyncio.timeout(timeout if timeout > 0 else None):
+                    await asyncio.shield(slot._future)
+            except BaseException:
+                if slot._future.done() and not slot._future.cancelled():
+                    self.release(slot)  # granted in the same instant we gave up
+                else:
+                    slot._future.cancel()
+                    self._pump()  # let the next waiter take our place in line
+                raise
+        slot.wait_ms = int((time.monotonic() - start) * 1000)
+        self.wait_ms_total += slot.wait_ms
+        return slot
+
+    def release(self, slot: Slot) -> None:
+        self.in_flight -= 1
+        self._pump()
+
+    def settle(self, slot: Slot, actual_tokens: int) -> None:
+        self._tokens.give_back(slot.tokens - actual_tokens, self.limits()[2])
+        slot.tokens = actual_tokens
+
+    def rate_limited(self, retry_after: float | None) -> None:
+        delay = retry_after if retry_after is not None else settings.llm_rate_limit_backoff
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        self.throttled += 1
+        logger.warning("LLM provider %s rate limited; pausing new requests for %.1fs", self.name, delay)
+
+    def _pump(self) -> None:
+        """Grant queued slots round-robin across agents while the limits allow."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        max_inflight, rpm, tpm = self.limits()
+        while self._queues and self.in_flight < max_inflight:
+            agent_key, queue = next(iter(self._queues.items()))
+            while queue and queue[0]._future.done():
+                queue.popleft()  # cancelled / timed out
+            if not queue:
+                del self._queues[agent_key]
+                continue
+            slot = queue[0]
+            now = time.monotonic()
+            wait = max(
+                self.blocked_until - now,
+                self._requests.wait_time(1, rpm, now),
+                self._tokens.wait_time(slot.tokens, tpm, now),
+            )
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._pump)
+                return
+            queue.popleft()
+            self._queues.move_to_end(agent_key)
+            if not queue:
+                del self._queues[agent_key]
+            if tpm > 0:
+                slot.tokens = min(slot.tokens, tpm)  # a single call may use at most the whole budget
+            self._requests.take(1, rpm)
+            self._tokens.take(slot.tokens, tpm)
+            self.in_flight += 1
+            self.granted += 1
+            slot._future.set_result(None)
+
+    def stats(self) -> dict:
+        max_inflight, rpm, tpm = self.limits()
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_inflight": max_inflight,
+            "rpm": rpm,
+            "tpm": tpm,
+            "granted": self.granted,
+            "throttled": self.throttled,
+            "avg_wait_ms": round(self.wait_ms_total / self.granted, 1) if self.granted else 0.0,
+            "paused_for": round(max(0.0, self.blocked_until - time.monotonic()), 1),
+        }
+
+
+def provider_name(model: str | ModelProvider) -> str:
+    """Limiter key: the provider the registry resolves ``model`` to (or the key itself)."""
+    if isinstance(model, ModelProvider):
+        return model.name
+    entry = MODEL_REGISTRY.get(model)
+    provider = entry.get_active_provider() if entry else None
+    return provider.name if provider else model
+
+
+class LLMLimiter:
+    def __init__(self):
+        self._providers: dict[str, ProviderLimiter] = {}
+
+    def provider(self, name: str) -> ProviderLimiter:
+        limiter = self._providers.get(name)
+        if limiter is None:
+            limiter = self._providers[name] = ProviderLimiter(name)
+        return limiter
+
+    @asynccontextmanager
+    async def slot(self, model: str | ModelProvider, agent_id: int | None = None,
+                   messages=None, max_tokens: int = 0):
+        """Wait for admission, run the call, release. A 429 raised inside pauses the provider."""
+        limiter = self.provider(provider_name(model))
+        slot = await limiter.acquire(agent_id, estimate_tokens(messages, max_tokens))
+        token = _current_slot.set(slot)
+        try:
+            yield slot
+        except Exception as e:
+            status, headers = _status_and_headers(e)
+            if status == 429 and not slot.rate_limited:
+                slot.rate_limited = True
+                limiter.rate_limited(parse_retry_after(headers))
+            raise
+        finally:
+            _current_slot.reset(token)
+            limiter.release(slot)
+
+    async def observe_response(self, response) -> None:
+        """httpx response hook: 429s (including ones the SDK retries) pause the provider."""
+        if response.status_code != 429:
+            return
+        slot = _current_slot.get()
+        if slot is not None:
+            slot.rate_limited = True
+            slot.provider.rate_limited(parse_retry_after(response.headers))
+
+    def stats(self) -> dict:
+        return {name: p.stats() for name, p in sorted(self._providers.items())}
+
+    def reset(self) -> None:
+        self._providers.clear()
+
+
+llm_limiter = LLMLimiter()
@@ -0,0 +1,325 @@
+"""Health-scored provider selection, failover and hedged requests for LLM calls.
+
+A registry model (``MODEL_REGISTRY``) may be served by several providers.
+For every ``(provider, model_id)`` pair the router keeps a ``ProviderHealth``:
+
+* an EWMA of successful-call latency (queue wait excluded) and an EWMA error
+  rate, combined into a score ``latency * (1 + llm_health_error_penalty * error_rate)``
+  (providers without samples count as ``llm_health_prior_latency_ms``);
+* recent latencies for a p95;
+* a circuit breaker: ``llm_breaker_failures`` consecutive failures open it,
+  after ``llm_breaker_cooldown`` seconds one trial call is let through
+  (half-open) and its outcome closes or re-opens it.
+
+``resolve_model`` ranks a model's available providers by that score (ties keep
+registry order), so every existing call site already picks the healthiest
+provider. ``llm_router.complete(targets, request)`` is the general call path:
+each attempt runs inside an ``llm_limiter`` slot for its provider; a failure
+(exception, ``attempt_timeout`` or a result rejected by ``validate``) fails
+over to the next target. With hedging on (``settings.llm_hedge`` or
+``hedge=True``) the next target is also started once the primary has been
+running longer than its p95 latency (``llm_hedge_delay_ms`` until there are
+``llm_hedge_min_samples`` samples); the first good response wins and the
+other attempt is cancelled.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from . import config
+from .config import settings
+from .llm_limiter import llm_limiter, provider_name
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class InvalidResponse(Exception):
+    """The provider answered, but the caller's ``validate`` rejected the result."""
+
+
+class ProvidersUnavailable(RuntimeError):
+    """Every target's circuit breaker is open."""
+
+
+@dataclass(frozen=True)
+class ProviderTarget:
+    name: str
+    base_url: str
+    api_key: str
+    model_id: str
+
+    @property
+    def key(self) -> str:
+        return health_key(self.name, self.model_id)
+
+
+@dataclass
+class Routed:
+    value: Any
+    target: ProviderTarget
+    queue_wait_ms: int = 0
+    attempts: int = 1
+    hedged: bool = False
+
+
+def health_key(name: str, model_id) -> str:
+    return f"{name}:{model_id}"
+
+
+class ProviderHealth:
+    def __init__(self, key: str):
+        self.key = key
+        self.latency_ms: float | None = None  # EWMA over successful calls
+        self.error_rate = 0.0  # EWMA of 0 (success) / 1 (failure)
+        self.successes = 0
+        self.failures = 0
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial = False  # half-open: the single trial call is in flight
+        self._recent: deque[float] = deque(maxlen=100)
+
+    def _cooled_down(self) -> bool:
+        return time.monotonic() - self.opened_at >= settings.llm_breaker_cooldown
+
+    def available(self) -> bool:
+        """Whether a call would be let through now (no side effects)."""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return self._cooled_down()
+        return not self._trial
+
+    def allow(self) -> bool:
+        """Admit a call; in half-open state only one trial at a time."""
+        if self.state == OPEN and self._cooled_down():
+            self.state = HALF_OPEN
+            self._trial = False
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def abandon(self) -> None:
+        """A call was cancelled before it had a verdict (hedge loser / caller gave up)."""
+        if self.state == HALF_OPEN:
+            self._trial = False
+
+    def record_success(self, latency_ms: float) -> None:
+        alpha = settings.llm_health_alpha
+        self.latency_ms = latency_ms if self.latency_ms is None else (
+            alpha * latency_ms + (1 - alpha) * self.latency_ms
+        )
+        self.error_rate *= 1 - alpha
+        self._recent.append(latency_ms)
+        self.successes += 1
+        self.consecutive_failures = 0
+        if self.state != CLOSED:
+            logger.info("LLM provider %s recovered; circuit closed", self.key)
+        self.state = CLOSED
+        self._trial = False
+
+    def record_failure(self) -> None:
+        alpha = settings.llm_health_alpha
+        self.error_rate = alpha + (1 - alpha) * self.error_rate
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or (
+            self.state == CLOSED and self.consecutive_failures >= settings.llm_breaker_failures
+        ):
+            logger.warning("LLM provider %s failing; circuit open for %.0fs",
+                           self.key, settings.llm_breaker_cooldown)
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+        self._trial = False
+
+    def p95(self) -> float | None:
+        if not self._recent:
+            return None
+        ordered = sorted(self._recent)
+        return ordered[max(0, int(len(ordered) * 0.95 + 0.5) - 1)]
+
+    def score(self) -> float:
+        latency = self.latency_ms if self.latency_ms is not None else settings.llm_health_prior_latency_ms
+        return latency * (1 + settings.llm_health_error_penalty * self.error_rate)
+
+    def stats(self) -> dict:
+        p95 = self.p95()
+        return {
+            "state": self.state,
+            "ewma_latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "p95_latency_ms": round(p95, 1) if p95 is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "score": round(self.score(), 1),
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+def provider_targets(model_key: str) -> list[ProviderTarget]:
+    """Available providers of a registry model, in registry order."""
+    entry = config.MODEL_REGISTRY.get(model_key)
+    targets = []
+    for p in entry.providers if entry else ():
+        if not p.is_available():
+            continue
+        model_id = p.get_model_id()
+        if model_id:
+            targets.append(ProviderTarget(p.name, p.get_base_url(), p.get_auth_token(), model_id))
+    return targets
+
+
+class LLMRouter:
+    def __init__(self):
+        self._health: dict[str, ProviderHealth] = {}
+
+    def health(self, key: str) -> ProviderHealth:
+        health = self._health.get(key)
+        if health is None:
+            health = self._health[key] = ProviderHealth(key)
+        return health
+
+    def _rank_key(self, key: str) -> tuple[bool, float]:
+        health = self._health.get(key)
+        if health is None:
+            return False, settings.llm_health_prior_latency_ms
+        return not health.available(), health.score()
+
+    def rank(self, targets: list[ProviderTarget]) -> list[ProviderTarget]:
+        """Best first: breaker lets calls through, then lowest score; ties keep the given order."""
+        return sorted(targets, key=lambda t: self._rank_key(t.key))
+
+    def rank_providers(self, providers: list) -> list:
+        """Same ranking for ``ModelProvider`` objects (used by ``resolve_model``)."""
+        return sorted(providers, key=lambda p: self._rank_key(health_key(p.name, p.get_model_id())))
+
+    def targets(self, model_key: str, resolved: tuple[str, str, str] | None = None) -> list[ProviderTarget]:
+        """Failover order for ``model_key``: the provider ``resolve_model`` picked, then the rest ranked.
+
+        A resolved endpoint that is not one of the registry's providers is
+        used on its own, under the model key's limiter name.
+        """
+        candidates = provider_targets(model_key)
+        if resolved is None:
+            return self.rank(candidates)
+        base_url, api_key, model_id = resolved
+        primary = next((t for t in candidates
+                        if (t.base_url, t.api_key, t.model_id) == (base_url, api_key, model_id)), None)
+        if primary is None:
+            return [ProviderTarget(provider_name(model_key), base_url, api_key, model_id)]
+        return [primary, *(t for t in self.rank(candidates) if t != primary)]
+
+    def _hedge_delay(self, target: ProviderTarget) -> float:
+        health = self._health.get(target.key)
+        if health is not None and len(health._recent) >= max(1, settings.llm_hedge_min_samples):
+            return health.p95() / 1000
+        return settings.llm_hedge_delay_ms / 1000
+
+    async def _attempt(self, target: ProviderTarget, request, agent_id, messages, max_tokens,
+                       validate, attempt_timeout) -> tuple[Any, int]:
+        health = self.health(target.key)
+        async with llm_limiter.slot(target.name, agent_id, messages, max_tokens) as slot:
+            started = time.monotonic()
+            try:
+                async with asyncio.timeout(attempt_timeout):
+                    result = await request(target)
+                slot.record_usage(result)
+                if validate is not None and not validate(result):
+                    raise InvalidResponse(f"{target.key} returned an unusable response")
+            except Exception:
+                health.record_failure()
+                raise
+            except BaseException:
+                health.abandon()
+                raise
+            health.record_success((time.monotonic() - started) * 1000)
+            return result, slot.wait_ms
+
+    async def complete(
+        self,
+        targets: list[ProviderTarget],
+        request: Callable[[ProviderTarget], Awaitable[Any]],
+        *,
+        agent_id: int | None = None,
+        messages=None,
+        max_tokens: int = 0,
+        validate: Callable[[Any], bool] | None = None,
+        attempt_timeout: float | None = None,
+        hedge: bool | None = None,
+    ) -> Routed:
+        """Run ``request(target)`` against ``targets`` with failover (and hedging); first good result wins.
+
+        Raises the last attempt's exception when every target failed, or
+        ``ProvidersUnavailable`` when no target's breaker admits a call.
+        """
+        hedge = settings.llm_hedge if hedge is None else hedge
+        waiting = deque(targets)
+        running: dict[asyncio.Task, ProviderTarget] = {}
+        attempts = 0
+        hedged = False
+        last_error: BaseException | None = None
+
+        def launch() -> bool:
+            nonlocal attempts
+            while waiting:
+                target = waiting.popleft()
+                if not self.health(target.key).allow():
+                    continue
+                attempts += 1
+                running[asyncio.create_task(self._attempt(
+                    target, request, agent_id, messages, max_tokens, validate, attempt_timeout,
+                ))] = target
+                return True
+            return False
+
+        try:
+            launch()
+            while running:
+                timeout = None
+                if hedge and not hedged and waiting and len(running) == 1:
+                    timeout = self._hedge_delay(next(iter(running.values())))
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = launch()
+                    if hedged:
+                        logger.info("LLM hedge: %s slow, also asking %s",
+                                    next(iter(running.values())).key, list(running.values())[-1].key)
+                    continue
+                for task in done:
+                    target = running.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        value, wait_ms = task.result()
+                        return Routed(value, target, wait_ms, attempts, hedged)
+                    last_error = error
+                    logger.warning("LLM call via %s failed: %s", target.key, str(error) or type(error).__name__)
+                if not running:
+                    launch()
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        if last_error is not None:
+            raise last_error
+        raise ProvidersUnavailable(f"no provider available ({', '.join(t.key for t in targets) or 'none'})")
+
+    def stats(self) -> dict:
+        return {key: h.stats() for key, h in sorted(self._health.items())}
+
+    def reset(self) -> None:
+        self._health.clear()
+
+
+llm_router = LLMRouter()
+config.set_provider_ranker(llm_router.rank_providers)
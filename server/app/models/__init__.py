@@ -2,12 +2,12 @@ from .tables import (
     Agent, Message, Memory, Job, CheckIn, Bounty, AgentStatus, MemoryType,
     LLMUsage, ItemType, VirtualItem, AgentItem, MemoryReference,
     Building, BuildingWorker, Resource, AgentResource, ProductionLog,
-    MarketOrder, TradeLog,
+    MarketOrder, TradeLog, AgentStrategy,
 )
 
 __all__ = [
     "Agent", "Message", "Memory", "Job", "CheckIn", "Bounty", "AgentStatus", "MemoryType",
     "LLMUsage", "ItemType", "VirtualItem", "AgentItem", "MemoryReference",
     "Building", "BuildingWorker", "Resource", "AgentResource", "ProductionLog",
-    "MarketOrder", "TradeLog",
+    "MarketOrder", "TradeLog", "AgentStrategy",
 ]
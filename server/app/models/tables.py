@@ -1,7 +1,9 @@
 from sqlalchemy import (
     Column, Integer, String, Float, Boolean, DateTime, Date, Text, JSON,
-    ForeignKey, Enum, LargeBinary, CheckConstraint, UniqueConstraint,
+    ForeignKey, Enum, LargeBinary, CheckConstraint, UniqueConstraint, Index,
 )
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from ..core.database import Base
@@ -75,13 +77,43 @@ class Memory(Base):
     agent_id = Column(Integer, ForeignKey("agents.id"), nullable=True)  # NULL = 公共记忆
     memory_type = Column(String(16), default=MemoryType.SHORT)
     content = Column(Text, nullable=False)
-    embedding = Column(LargeBinary, nullable=True)  # float32 embedding blob, size = embedding_dim * 4
+    embedding = Column(LargeBinary, nullable=True)  # embedding blob，格式见 embedding_codec（float32 / float16 / int8）
     access_count = Column(Integer, default=0)
     expires_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, server_default=func.now())
 
     agent = relationship("Agent", back_populates="memories")
 
+    __table_args__ = (
+        Index("ix_memories_type_expires", "memory_type", "expires_at"),  # 过期清理按 (short, expires_at < now) 走索引
+    )
+
+
+# memories.content 的 FTS5 全文索引（trigram 分词，中文按任意 3 字子串命中），由触发器与主表同步
+MEMORIES_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5("
+    "content, content='memories', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS memories_fts_ai AFTER INSERT ON memories BEGIN "
+    "INSERT INTO memories_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS memories_fts_ad AFTER DELETE ON memories BEGIN "
+    "INSERT INTO memories_fts(memories_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS memories_fts_au AFTER UPDATE OF content ON memories BEGIN "
+    "INSERT INTO memories_fts(memories_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO memories_fts(rowid, content) VALUES (new.id, new.content); END",
+]
+
+
+@event.listens_for(Memory.__table__, "after_create")
+def _create_memories_fts(target, connection, **kw):
+    """新建 memories 表时一并建 FTS 表；SQLite 未编译 FTS5/trigram 时跳过（检索退回 LIKE）"""
+    if connection.dialect.name != "sqlite":
+        return
+    try:
+        for stmt in MEMORIES_FTS_DDL:
+            connection.exec_driver_sql(stmt)
+    except OperationalError as e:
+        print(f"[DB] FTS5 不可用，记忆关键词检索退回 LIKE: {e}", flush=True)
+
 
 # 城市工作岗位
 class Job(Base):
@@ -131,6 +163,7 @@ class LLMUsage(Base):
     total_tokens = Column(Integer, default=0)
     cost = Column(Float, default=0.0)
     latency_ms = Column(Integer, default=0)
+    queue_wait_ms = Column(Integer, default=0)  # 在 LLM 准入队列里等待的时间，不计入 latency_ms
     created_at = Column(DateTime, server_default=func.now())
 
 
@@ -175,6 +208,10 @@ class MemoryReference(Base):
     memory_id = Column(Integer, ForeignKey("memories.id"), nullable=False)
     created_at = Column(DateTime, server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_memory_references_memory_id", "memory_id"),  # 删除记忆时级联清理引用
+    )
+
 
 # 城市建筑
 class Building(Base):
@@ -280,3 +317,18 @@ class TradeLog(Base):
     buy_type = Column(String(32), nullable=False)
     buy_amount = Column(Float, nullable=False)           # 本次成交买入量
     created_at = Column(DateTime, server_default=func.now())
+
+
+# M6 策略自动机 — 居民的常驻策略（内存里的 _strategy_store 以这张表为准，启动时载入）
+class AgentStrategy(Base):
+    __tablename__ = "agent_strategies"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    agent_id = Column(Integer, ForeignKey("agents.id"), nullable=False, index=True)
+    strategy = Column(String(32), nullable=False)           # keep_working / opportunistic_buy
+    building_id = Column(Integer, nullable=True)
+    stop_when_resource = Column(String(32), nullable=True)
+    stop_when_amount = Column(Float, nullable=True)
+    resource = Column(String(32), nullable=True)
+    price_below = Column(Float, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
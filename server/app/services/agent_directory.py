@@ -0,0 +1,102 @@
+"""Agent 名字 -> id 的进程内缓存，以及基于它的 @提及 匹配（名字字典树，线性时间）"""
+
+import re
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models import Agent
+
+_END = ""  # trie key marking "a name ends here"; names are never empty
+_ASCII_WORD = re.compile(r"[A-Za-z0-9_]")
+
+
+class MentionMatcher:
+    """Longest-match ``@name`` finder over a fixed set of names.
+
+    A character trie walked only from each ``@`` (anchored Aho-Corasick, so no failure links):
+    linear in the message plus at most one name length per ``@``.
+    """
+
+    def __init__(self, names: dict[str, int]):
+        self.names = names
+        self._trie: dict = {}
+        for name, agent_id in names.items():
+            if not name:
+                continue
+            node = self._trie
+            for ch in name:
+                node = node.setdefault(ch, {})
+            node[_END] = agent_id
+
+    def find(self, content: str) -> list[int]:
+        """Agent ids mentioned in ``content``, in order (repeats kept).
+
+        ``@小明你好`` mentions 小明; a match is rejected only when the name's last character and
+        the next one are both ASCII word characters (``@Bobby`` does not mention ``Bob``).
+        """
+        found: list[int] = []
+        n = len(content)
+        i = content.find("@")
+        while i != -1:
+            node, j = self._trie, i + 1
+            match, end = None, -1
+            while j < n:
+                node = node.get(content[j])
+                if node is None:
+                    break
+                j += 1
+                if _END in node:
+                    match, end = node[_END], j
+            if match is not None and not (
+                end < n and _ASCII_WORD.match(content[end - 1]) and _ASCII_WORD.match(content[end])
+            ):
+                found.append(match)
+                i = content.find("@", end)
+            else:
+                i = content.find("@", i + 1)
+        return found
+
+
+class AgentDirectory:
+    """Cached ``{name: id}`` map plus its precompiled ``MentionMatcher``, kept until ``invalidate()``."""
+
+    def __init__(self):
+        self._names: dict[str, int] | None = None
+        self._matcher: MentionMatcher | None = None
+        self._version = 0
+
+    def invalidate(self) -> None:
+        """Drop the cache; call after any agent insert / rename / delete."""
+        self._names = None
+        self._matcher = None
+        self._version += 1
+
+    async def name_map(self, db: AsyncSession) -> dict[str, int]:
+        if self._names is None:
+            version = self._version
+            rows = (await db.execute(select(Agent.name, Agent.id))).all()
+            names = {name: aid for name, aid in rows}
+            if version != self._version:  # invalidated while loading: don't cache stale rows
+                return names
+            self._names = names
+            self._matcher = MentionMatcher(names)
+        return self._names
+
+    async def matcher(self, db: AsyncSession) -> MentionMatcher:
+        names = await self.name_map(db)
+        if self._matcher is not None and self._matcher.names is names:
+            return self._matcher
+        return MentionMatcher(names)
+
+    def matcher_for(self, names: dict[str, int]) -> MentionMatcher:
+        """The cached matcher if ``names`` is the cached map, else a fresh one."""
+        if self._matcher is not None and self._matcher.names is names:
+            return self._matcher
+        return MentionMatcher(names)
+
+    async def parse_mentions(self, content: str, db: AsyncSession) -> list[int]:
+        return (await self.matcher(db)).find(content)
+
+
+agent_directory = AgentDirectory()
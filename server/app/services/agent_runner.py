@@ -6,9 +6,14 @@ Phase 2：替换为 OpenClaw SDK（外部接口不变）
 """
 import logging
 import time
-from openai import AsyncOpenAI
+from typing import Awaitable, Callable
+from openai.types.chat import ChatCompletion, ChatCompletionMessage, ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion_message_tool_call import Function
 from sqlalchemy.ext.asyncio import AsyncSession
 from ..core.config import resolve_model
+from ..core.llm_clients import llm_client
+from ..core.llm_router import llm_router
 from ..core.database import async_session as session_maker
 from ..models import MemoryType, Agent, AgentStatus
 from .memory_service import memory_service
@@ -69,6 +74,77 @@ def _build_soul_block(pj: dict) -> str:
     return "\n".join(parts)
 
 
+# 流式回复的增量回调：(文本增量, reset)；reset=True 表示之前推送的内容作废（失败转移重试 / 工具调用后的第二轮）
+DeltaCallback = Callable[[str, bool], Awaitable[None]]
+
+
+class _DeltaRelay:
+    """把每一轮流式调用的 content 增量转给 on_delta；新一轮开始时让客户端丢掉上一轮已显示的内容"""
+
+    def __init__(self, on_delta: DeltaCallback):
+        self.on_delta = on_delta
+        self.emitted = False
+        self.restart = False
+
+    def new_round(self) -> None:
+        self.restart = self.emitted
+
+    async def __call__(self, text: str) -> None:
+        await self.on_delta(text, self.restart)
+        self.restart = False
+        self.emitted = True
+
+
+async def _collect_stream(stream, emit: Callable[[str], Awaitable[None]]) -> ChatCompletion:
+    """消费流式响应：content 增量边收边 emit，最后拼回一个完整的 ChatCompletion（含 tool_calls / reasoning / usage）"""
+    completion_id, model, finish_reason, usage = "", "", None, None
+    content: list[str] = []
+    reasoning: list[str] = []
+    tool_calls: dict[int, dict] = {}
+    async with stream:
+        async for chunk in stream:
+            completion_id = completion_id or chunk.id
+            model = model or chunk.model
+            if chunk.usage:
+                usage = chunk.usage
+            for choice in chunk.choices:
+                finish_reason = choice.finish_reason or finish_reason
+                delta = choice.delta
+                if delta is None:
+                    continue
+                if delta.content:
+                    content.append(delta.content)
+                    await emit(delta.content)
+                extra = getattr(delta, "reasoning", None) or getattr(delta, "reasoning_content", None)
+                if isinstance(extra, str):
+                    reasoning.append(extra)
+                for tc in delta.tool_calls or ():
+                    call = tool_calls.setdefault(tc.index, {"id": "", "name": "", "arguments": ""})
+                    call["id"] = tc.id or call["id"]
+                    if tc.function:
+                        call["name"] += tc.function.name or ""
+                        call["arguments"] += tc.function.arguments or ""
+
+    extra_fields = {"reasoning": "".join(reasoning)} if reasoning else {}
+    message = ChatCompletionMessage(
+        role="assistant",
+        content="".join(content) or None,
+        tool_calls=[
+            ChatCompletionMessageToolCall(
+                id=c["id"], type="function", function=Function(name=c["name"], arguments=c["arguments"]),
+            )
+            for _, c in sorted(tool_calls.items())
+        ] or None,
+        **extra_fields,
+    )
+    # model_construct：不校验 finish_reason 取值（部分供应商会返回非标准值）
+    return ChatCompletion.model_construct(
+        id=completion_id, object="chat.completion", created=int(time.time()), model=model,
+        choices=[Choice.model_construct(index=0, finish_reason=finish_reason or "stop", message=message)],
+        usage=usage,
+    )
+
+
 class AgentRunner:
     """单个 Agent 的 LLM 调用管理器"""
 
@@ -81,19 +157,30 @@ class AgentRunner:
         self.model = model
         self.personality_json = personality_json
 
+    def _context(self, chat_history: list[dict]) -> list[dict]:
+        context = list(chat_history)
+        if len(context) > self.MAX_CONTEXT_ROUNDS:
+            context = context[-self.MAX_CONTEXT_ROUNDS:]
+        return context
+
+    def memory_query(self, chat_history: list[dict]) -> str:
+        """记忆检索用的查询文本：最近 3 条消息拼接"""
+        return " ".join(m.get("content", "") for m in self._context(chat_history)[-3:])
+
     async def generate_reply(
-        self, chat_history: list[dict], db: AsyncSession | None = None
+        self, chat_history: list[dict], db: AsyncSession | None = None,
+        memories: list | None = None, on_delta: DeltaCallback | None = None,
     ) -> tuple[str | None, dict | None, list[int]]:
         """
         生成 Agent 回复。
         chat_history: [{"name": "Alice", "content": "xxx"}, ...]
         db: 传入时启用记忆注入
+        memories: 已批量检索好的记忆（batch_generate 传入），为 None 时自行检索
+        on_delta: 传入时流式生成，每段 content 增量回调 on_delta(text, reset)（不对冲，避免两路增量交错）
         返回: (reply, usage_info, used_memory_ids)
         """
         # 使用 chat_history 作为上下文（已从 DB 查询最新历史）
-        context = list(chat_history)
-        if len(context) > self.MAX_CONTEXT_ROUNDS:
-            context = context[-self.MAX_CONTEXT_ROUNDS:]
+        context = self._context(chat_history)
 
         system_msg = ""
         if self.personality_json:
@@ -110,12 +197,10 @@ class AgentRunner:
         used_memory_ids: list[int] = []
         if db is not None:
             try:
-                recent_text = " ".join(
-                    m.get("content", "") for m in context[-3:]
-                )
-                memories = await memory_service.search(
-                    self.agent_id, recent_text, top_k=5, db=db
-                )
+                if memories is None:
+                    memories = await memory_service.search(
+                        self.agent_id, self.memory_query(context), top_k=5, db=db
+                    )
                 if memories:
                     used_memory_ids = [m.id for m in memories]
                     personal = [m for m in memories if m.memory_type in (MemoryType.SHORT, MemoryType.LONG)]
@@ -151,8 +236,7 @@ class AgentRunner:
                 logger.warning("Model %s not configured or no API key", self.model)
                 return None, None, []
 
-            base_url, api_key, model_id = resolved
-            client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+            targets = llm_router.targets(self.model, resolved)
 
             # F35: 状态 → THINKING
             agent_obj = None
@@ -170,15 +254,34 @@ class AgentRunner:
             import json as _json
             tools = tool_registry.get_tools_for_llm()
             create_kwargs: dict = {
-                "model": model_id,
                 "messages": messages,
                 "max_tokens": 800,
             }
             if tools:
                 create_kwargs["tools"] = tools
 
+            relay = _DeltaRelay(on_delta) if on_delta is not None else None
+
+            async def create(target, **kwargs):
+                client = llm_client(base_url=target.base_url, api_key=target.api_key)
+                if relay is None:
+                    return await client.chat.completions.create(model=target.model_id, **kwargs)
+                relay.new_round()
+                stream = await client.chat.completions.create(
+                    model=target.model_id, stream=True, stream_options={"include_usage": True}, **kwargs,
+                )
+                return await _collect_stream(stream, relay)
+
             start = time.time()
-            response = await client.chat.completions.create(**create_kwargs)
+            # 按健康分失败转移 / 对冲到同一模型的其他供应商
+            routed = await llm_router.complete(
+                targets, lambda target: create(target, **create_kwargs),
+                agent_id=self.agent_id, messages=messages, max_tokens=800,
+                hedge=False if relay is not None else None,
+            )
+            response, target = routed.value, routed.target
+            model_id = target.model_id
+            queue_wait_ms = routed.queue_wait_ms
 
             # M5.1: tool_call 处理（最多 1 轮）
             msg = response.choices[0].message
@@ -214,17 +317,23 @@ class AgentRunner:
                         "tool_call_id": tc.id,
                         "content": _json.dumps(result, ensure_ascii=False),
                     })
+                # 工具只 flush 不提交（见 claim_bounty）；batch 状态模式下 set_agent_status 不再顺带提交，
+                # 这里显式提交，也免得写事务跨过下面的第二次模型调用
+                if db is not None:
+                    await db.commit()
                 # 第二次调用：基于工具结果生成最终回复（不传 tools，防止再次触发）
                 # F35: 状态 → THINKING（继续思考）
                 if agent_obj:
                     await set_agent_status(agent_obj, AgentStatus.THINKING, "正在整理回复…", db)
-                response = await client.chat.completions.create(
-                    model=model_id,
-                    messages=messages,
-                    max_tokens=800,
+                # 消息里带着该供应商返回的 tool_calls，第二次调用固定在同一个供应商上
+                routed = await llm_router.complete(
+                    [target], lambda target: create(target, messages=messages, max_tokens=800),
+                    agent_id=self.agent_id, messages=messages, max_tokens=800,
                 )
+                response = routed.value
+                queue_wait_ms += routed.queue_wait_ms
 
-            latency_ms = int((time.time() - start) * 1000)
+            latency_ms = int((time.time() - start) * 1000) - queue_wait_ms
             usage_info = None
             if response.usage:
                 usage_info = {
@@ -234,6 +343,7 @@ class AgentRunner:
                     "completion_tokens": response.usage.completion_tokens or 0,
                     "total_tokens": response.usage.total_tokens or 0,
                     "latency_ms": latency_ms,
+                    "queue_wait_ms": queue_wait_ms,
                 }
             reply = response.choices[0].message.content
             # 某些推理模型把回复放在 reasoning 字段
@@ -316,13 +426,17 @@ class AgentRunnerManager:
                 (info["agent_id"], runner, info["history"])
             )
 
-        # 2. 按模型分组并发调用（每个协程独立 session）
+        # 2. 批量检索记忆：相同历史只 embed 一次，一次打分、一次批量 UPDATE
+        prefetched = await self._prefetch_memories(prompts_by_model)
+
+        # 3. 按模型分组并发调用（每个协程独立 session）
         results: dict[int, tuple[str | None, dict | None, list[int]]] = {}
 
         async def _call_one(agent_id, runner, history):
             try:
                 async with session_maker() as db:
-                    return agent_id, await runner.generate_reply(history, db=db)
+                    memories = prefetched.get(agent_id) if prefetched is not None else None
+                    return agent_id, await runner.generate_reply(history, db=db, memories=memories)
             except Exception as e:
                 logger.error("Batch generate failed for agent %d: %s", agent_id, e)
                 return agent_id, (None, None, [])
@@ -338,6 +452,24 @@ class AgentRunnerManager:
 
         return results
 
+    async def _prefetch_memories(
+        self, prompts_by_model: dict[str, list[tuple[int, "AgentRunner", list[dict]]]],
+    ) -> dict[int, list] | None:
+        """一次性为所有 agent 检索记忆；失败返回 None（各 agent 退回单独检索）"""
+        queries = {
+            agent_id: runner.memory_query(history)
+            for group in prompts_by_model.values()
+            for agent_id, runner, history in group
+        }
+        if not queries:
+            return {}
+        try:
+            async with session_maker() as db:
+                return await memory_service.search_many(queries, top_k=5, db=db)
+        except Exception as e:
+            logger.warning("Batched memory retrieval failed, falling back to per-agent search: %s", e)
+            return None
+
 
 # 全局单例
 runner_manager = AgentRunnerManager()
@@ -0,0 +1,405 @@
+"""Pure NumPy IVF (inverted file) approximate nearest-neighbour index.
+
+Vectors are L2-normalized on insert, so inner product == cosine similarity.
+Each inverted list is an ``EmbeddingMatrix``: one contiguous float32 buffer with
+an id array and a small per-row tag (the memory type), grown by doubling so
+inserts are amortized O(1). Below ``min_train`` vectors the index keeps a
+single list and every search is one exact dot product; once it grows past that
+a spherical k-means coarse quantizer is trained and searches only visit the
+``nprobe`` closest lists.
+
+With ``quantized=True`` the lists hold per-row scaled int8 codes instead of
+float32 (~4x less memory); scores are then approximate and callers should
+over-fetch and re-rank the candidates against the stored vectors.
+
+An ``IVFIndex`` may be searched from worker threads while the event loop
+mutates it, so every public method takes the index's lock.
+"""
+
+import functools
+import logging
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from .embedding_codec import quantize_int8
+
+logger = logging.getLogger(__name__)
+
+KMEANS_ITERS = 10
+KMEANS_SAMPLES_PER_LIST = 64
+RETRAIN_GROWTH = 4  # retrain once the index is this many times larger than at training time
+SCORE_CHUNK = 4096  # rows dequantized at a time when scoring int8 codes
+
+
+def normalize_rows(x: np.ndarray) -> np.ndarray:
+    """Return a float32 copy of ``x`` with every row scaled to unit length."""
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-8)
+
+
+def _kmeans(x: np.ndarray, k: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on unit vectors, returns (k, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+    for _ in range(KMEANS_ITERS):
+        assign = np.argmax(x @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = x[rng.choice(len(x), size=int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class EmbeddingMatrix:
+    """Contiguous, growable (n, dim) float32 matrix with parallel id/tag arrays.
+
+    Rows are kept dense: removal moves the last row into the freed slot, so
+    ``ids`` / ``tags`` are always plain slices of the buffers. When
+    ``quantized`` the row buffer holds int8 codes plus a float32 scale per row.
+    """
+
+    INITIAL_CAPACITY = 64
+
+    def __init__(self, dim: int, quantized: bool = False):
+        self.dim = dim
+        self.quantized = quantized
+        self._n = 0
+        self._vecs = np.empty((0, dim), dtype=np.int8 if quantized else np.float32)
+        self._scales = np.empty(0, dtype=np.float32)  # only used when quantized
+        self._ids = np.empty(0, dtype=np.int64)
+        self._tags = np.empty(0, dtype=np.int8)
+        self._pos: dict[int, int] = {}  # id -> row
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def vecs(self) -> np.ndarray:
+        """Row vectors as float32 (dequantized copy when quantized)."""
+        if self.quantized:
+            return self._vecs[:self._n].astype(np.float32) * self._scales[:self._n, None]
+        return self._vecs[:self._n]
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self._n]
+
+    @property
+    def tags(self) -> np.ndarray:
+        return self._tags[:self._n]
+
+    @property
+    def nbytes(self) -> int:
+        return self._vecs.nbytes + self._scales.nbytes + self._ids.nbytes + self._tags.nbytes
+
+    def scores(self, q: np.ndarray) -> np.ndarray:
+        """Inner products of every row with the unit query ``q``."""
+        if not self.quantized:
+            return self.vecs @ q
+        return self.scores_many(q[None])[0]
+
+    def scores_many(self, queries: np.ndarray) -> np.ndarray:
+        """(m, n) inner products of ``m`` unit queries with every row, in one GEMM."""
+        if not self.quantized:
+            return queries @ self.vecs.T
+        out = np.empty((len(queries), self._n), dtype=np.float32)
+        for start in range(0, self._n, SCORE_CHUNK):
+            end = min(start + SCORE_CHUNK, self._n)
+            out[:, start:end] = (queries @ self._vecs[start:end].T.astype(np.float32)) * self._scales[start:end]
+        return out
+
+    def append(self, ids: np.ndarray, vecs: np.ndarray, tags: np.ndarray) -> None:
+        """Append rows whose ids are not already present."""
+        need = self._n + len(ids)
+        if need > len(self._ids):
+            self._grow(need)
+        end = self._n + len(ids)
+        if self.quantized:
+            self._vecs[self._n:end], self._scales[self._n:end] = quantize_int8(vecs)
+        else:
+            self._vecs[self._n:end] = vecs
+        self._ids[self._n:end] = ids
+        self._tags[self._n:end] = tags
+        for row, i in enumerate(ids.tolist(), start=self._n):
+            self._pos[i] = row
+        self._n = end
+
+    def remove(self, ids) -> None:
+        for i in ids:
+            row = self._pos.pop(int(i), None)
+            if row is None:
+                continue
+            last = self._n - 1
+            if row != last:
+                self._vecs[row] = self._vecs[last]
+                if self.quantized:
+                    self._scales[row] = self._scales[last]
+                self._ids[row] = self._ids[last]
+                self._tags[row] = self._tags[last]
+                self._pos[int(self._ids[row])] = row
+            self._n = last
+
+    def tag_of(self, memory_id: int) -> int:
+        return int(self._tags[self._pos[memory_id]])
+
+    def set_tag(self, memory_id: int, tag: int) -> None:
+        self._tags[self._pos[memory_id]] = tag
+
+    def _grow(self, need: int) -> None:
+        cap = max(need, 2 * len(self._ids), self.INITIAL_CAPACITY)
+        vecs = np.empty((cap, self.dim), dtype=self._vecs.dtype)
+        ids = np.empty(cap, dtype=np.int64)
+        tags = np.empty(cap, dtype=np.int8)
+        vecs[:self._n] = self._vecs[:self._n]
+        ids[:self._n] = self.ids
+        tags[:self._n] = self.tags
+        self._vecs, self._ids, self._tags = vecs, ids, tags
+        if self.quantized:
+            scales = np.empty(cap, dtype=np.float32)
+            scales[:self._n] = self._scales[:self._n]
+            self._scales = scales
+
+
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class IVFIndex:
+    """IVF index over unit-normalized float32 vectors keyed by integer ids."""
+
+    def __init__(self, dim: int, nprobe: int = 8, min_train: int = 2048, quantized: bool = False):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.min_train = min_train
+        self.quantized = quantized
+        self._lock = threading.RLock()
+        self._centroids: np.ndarray | None = None
+        self._trained_size = 0
+        self._lists: list[EmbeddingMatrix] = [EmbeddingMatrix(dim, quantized)]
+        self._where: dict[int, int] = {}  # id -> list number
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, memory_id: int) -> bool:
+        return memory_id in self._where
+
+    @property
+    def is_trained(self) -> bool:
+        return self._centroids is not None
+
+    @property
+    def nbytes(self) -> int:
+        return sum(m.nbytes for m in self._lists)
+
+    @_locked
+    def ids(self) -> np.ndarray:
+        return np.concatenate([m.ids for m in self._lists])
+
+    @_locked
+    def tags(self) -> np.ndarray:
+        """Tags aligned with ``ids()``."""
+        return np.concatenate([m.tags for m in self._lists])
+
+    @_locked
+    def add(self, ids, vecs: np.ndarray, tags=None) -> None:
+        """Insert (or replace) vectors. ``vecs`` need not be normalized."""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        if len(ids) == 0:
+            return
+        vecs = normalize_rows(np.asarray(vecs, dtype=np.float32).reshape(len(ids), self.dim))
+        tags = np.zeros(len(ids), dtype=np.int8) if tags is None else np.asarray(tags, dtype=np.int8).reshape(-1)
+        existing = [int(i) for i in ids if int(i) in self._where]
+        if existing:
+            self.remove(existing)
+
+        assign = self._assign(vecs)
+        for lst in np.unique(assign):
+            mask = assign == lst
+            self._lists[lst].append(ids[mask], vecs[mask], tags[mask])
+        for i, lst in zip(ids.tolist(), assign.tolist()):
+            self._where[i] = lst
+
+        if self._needs_training():
+            self.train()
+
+    @_locked
+    def remove(self, ids) -> int:
+        """Remove ids that are present; returns how many were removed."""
+        removed = 0
+        for i in ids:
+            lst = self._where.pop(int(i), None)
+            if lst is not None:
+                self._lists[lst].remove([int(i)])
+                removed += 1
+        return removed
+
+    @_locked
+    def tag_of(self, memory_id: int) -> int:
+        return self._lists[self._where[memory_id]].tag_of(memory_id)
+
+    @_locked
+    def set_tag(self, memory_id: int, tag: int) -> bool:
+        lst = self._where.get(memory_id)
+        if lst is None:
+            return False
+        self._lists[lst].set_tag(memory_id, tag)
+        return True
+
+    @_locked
+    def search_tagged(self, query: np.ndarray, k: int) -> list[tuple[int, float, int]]:
+        """Like ``search`` but returns [(id, similarity, tag)] read under one lock."""
+        ids, sims = self.search(query, k)
+        return [(i, s, self.tag_of(i)) for i, s in zip(ids.tolist(), sims.tolist())]
+
+    @_locked
+    def search(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return (ids, cosine similarities) of the top-k hits, best first."""
+        if not self._where or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        q = normalize_rows(np.asarray(query, dtype=np.float32).reshape(1, self.dim))[0]
+
+        if self._centroids is None:
+            probe = [0]
+        else:
+            nprobe = min(self.nprobe, len(self._centroids))
+            probe = np.argpartition(-(self._centroids @ q), nprobe - 1)[:nprobe]
+
+        lists = [self._lists[p] for p in probe if len(self._lists[p])]
+        if not lists:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if len(lists) == 1:
+            ids, sims = lists[0].ids, lists[0].scores(q)
+        else:
+            ids = np.concatenate([m.ids for m in lists])
+            sims = np.concatenate([m.scores(q) for m in lists])
+
+        k = min(k, len(ids))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        return ids[top], sims[top]
+
+    @_locked
+    def search_many(self, queries: np.ndarray, k: int) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Top-k for several queries at once; each list is scored with one GEMM
+        over all the queries that probe it. Returns one (ids, sims) per query."""
+        queries = normalize_rows(np.asarray(queries, dtype=np.float32).reshape(-1, self.dim))
+        m = len(queries)
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        if not self._where or k <= 0 or m == 0:
+            return [empty] * m
+
+        if self._centroids is None:
+            probes = np.zeros((m, 1), dtype=np.int64)
+        else:
+            nprobe = min(self.nprobe, len(self._centroids))
+            probes = np.argpartition(-(queries @ self._centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        ids_parts: list[list[np.ndarray]] = [[] for _ in range(m)]
+        sim_parts: list[list[np.ndarray]] = [[] for _ in range(m)]
+        for lst in np.unique(probes):
+            matrix = self._lists[lst]
+            if not len(matrix):
+                continue
+            rows = np.flatnonzero((probes == lst).any(axis=1))
+            sims = matrix.scores_many(queries[rows])
+            for row, row_sims in zip(rows.tolist(), sims):
+                ids_parts[row].append(matrix.ids)
+                sim_parts[row].append(row_sims)
+
+        out = []
+        for id_list, sim_list in zip(ids_parts, sim_parts):
+            if not id_list:
+                out.append(empty)
+                continue
+            ids, sims = np.concatenate(id_list), np.concatenate(sim_list)
+            kk = min(k, len(ids))
+            top = np.argpartition(-sims, kk - 1)[:kk]
+            top = top[np.argsort(-sims[top])]
+            out.append((ids[top], sims[top]))
+        return out
+
+    @_locked
+    def train(self) -> None:
+        """(Re)train the coarse quantizer and redistribute every vector."""
+        ids = self.ids()
+        if len(ids) < self.min_train:
+            return
+        vecs = np.vstack([m.vecs for m in self._lists])
+        tags = np.concatenate([m.tags for m in self._lists])
+        nlist = int(np.clip(np.sqrt(len(ids)), 16, 4096))
+        rng = np.random.default_rng(len(ids))
+        sample_size = min(len(ids), nlist * KMEANS_SAMPLES_PER_LIST)
+        sample = vecs[rng.choice(len(ids), size=sample_size, replace=False)]
+        self._centroids = _kmeans(sample, nlist)
+        self._trained_size = len(ids)
+
+        assign = self._assign(vecs)
+        self._lists = [EmbeddingMatrix(self.dim, self.quantized) for _ in range(nlist)]
+        for lst in np.unique(assign):
+            mask = assign == lst
+            self._lists[lst].append(ids[mask], vecs[mask], tags[mask])
+        self._where = dict(zip(ids.tolist(), assign.tolist()))
+        logger.info("IVF index trained: %d vectors, %d lists", len(ids), nlist)
+
+    def _needs_training(self) -> bool:
+        n = len(self._where)
+        if self._centroids is None:
+            return n >= self.min_train
+        return n > self._trained_size * RETRAIN_GROWTH
+
+    def _assign(self, vecs: np.ndarray) -> np.ndarray:
+        if self._centroids is None:
+            return np.zeros(len(vecs), dtype=np.int64)
+        return np.argmax(vecs @ self._centroids.T, axis=1)
+
+    # -- persistence --------------------------------------------------------
+
+    @_locked
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp,
+            dim=np.int64(self.dim),
+            ids=self.ids(),
+            vecs=np.vstack([m.vecs for m in self._lists]),
+            tags=np.concatenate([m.tags for m in self._lists]),
+            centroids=self._centroids if self._centroids is not None else np.empty((0, self.dim), dtype=np.float32),
+            trained_size=np.int64(self._trained_size),
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def load(
+        cls, path: Path, dim: int, nprobe: int = 8, min_train: int = 2048, quantized: bool = False,
+    ) -> "IVFIndex | None":
+        """Load a saved index; returns None if missing, corrupt or of another dimension."""
+        try:
+            with np.load(path) as data:
+                if int(data["dim"]) != dim:
+                    return None
+                index = cls(dim, nprobe=nprobe, min_train=min_train, quantized=quantized)
+                ids, vecs, centroids = data["ids"], data["vecs"], data["centroids"]
+                tags = data["tags"]
+                trained_size = int(data["trained_size"])
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning("Failed to load vector index %s: %s", path, e)
+            return None
+        if len(centroids):
+            index._centroids = centroids.astype(np.float32)
+            index._trained_size = trained_size
+            index._lists = [EmbeddingMatrix(dim, quantized) for _ in range(len(centroids))]
+        if len(ids):
+            index.add(ids, vecs, tags)
+        return index
@@ -1,31 +1,32 @@
 """
 Agent 自主行为引擎 (M4)
 
-每小时一次：构建世界状态快照 → 单次 LLM 决策 → 逐条执行 → 广播事件
+每小时一次：构建世界状态快照 → LLM 决策（居民多时按分片并发）→ 逐条执行 → 广播事件
 """
-import json
 import logging
 import asyncio
 import random
+import time
 from datetime import datetime, timezone
 
-from openai import AsyncOpenAI
-from sqlalchemy import select, func as sa_func
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload
 
-from ..core.config import resolve_model
-from ..core.database import async_session
-from ..models import Agent, Message, Job, CheckIn, VirtualItem, AgentItem, Building, BuildingWorker, AgentResource, AgentStatus
-from ..models.tables import Bounty
+from ..core.config import resolve_model, settings
+from ..core.llm_clients import llm_client
+from ..core.llm_router import llm_router
+from ..core.database import after_commit, async_session, unit_of_work
+from ..models import Agent, Message, Job, BuildingWorker, AgentStatus
 from .work_service import work_service
 from .shop_service import shop_service
 from .economy_service import economy_service
 from .agent_runner import runner_manager
-from .city_service import assign_worker, remove_worker, eat_food, get_agent_resources, construct_building, BUILDING_RECIPES
-# 策略系统 dormant（DEV-40: 调度架构不匹配，冻结等待事件驱动重做）
-# from .strategy_engine import Strategy, StrategyType, parse_strategies, update_strategies, get_strategies
-from .status_helper import set_agent_status
+from .city_service import assign_worker, remove_worker, eat_food, get_agent_resources, construct_building
+from .strategy_runtime import strategy_runtime  # 同时注册策略事件的 ORM 监听
+from .status_helper import flush_status_batch, set_agent_status, status_batch
+from .json_extract import extract_actions, looks_like_action
+from .world_state import WorldView, world_state
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +34,9 @@ logger = logging.getLogger(__name__)
 _last_round_log: list[dict] = []
 _round_log_lock = asyncio.Lock()
 
+# 最近一轮 tick 的决策报告（分片 token 用量 / 耗时），供 dev 接口查看
+last_tick_report: dict = {}
+
 AUTONOMY_MODEL = "wakeup-model"  # 复用免费小模型做决策
 
 SYSTEM_PROMPT = """你是虚拟城市模拟器。根据世界状态为每个居民决定本轮立即执行的行为。
@@ -61,290 +65,102 @@ params: checkin={}, purchase={"item_id": <int>}, chat={}, rest={}, assign_buildi
 
 async def build_world_snapshot(db: AsyncSession) -> str:
     """构建世界状态快照，返回结构化文本。"""
-    now = datetime.now(timezone.utc)
-    today_utc = sa_func.date("now")
-
-    # 1. 所有非人类 Agent
-    result = await db.execute(select(Agent).where(Agent.id != 0))
-    agents = result.scalars().all()
-    if not agents:
-        return ""
-
-    # 2. 每个 Agent 的今日打卡状态
-    checkin_result = await db.execute(
-        select(CheckIn.agent_id)
-        .where(sa_func.date(CheckIn.checked_at) == today_utc)
-    )
-    checked_in_agents = {row[0] for row in checkin_result.all()}
-
-    # 3. 每个 Agent 持有的物品
-    items_result = await db.execute(
-        select(AgentItem.agent_id, VirtualItem.name)
-        .join(VirtualItem, AgentItem.item_id == VirtualItem.id)
-    )
-    agent_items: dict[int, list[str]] = {}
-    for aid, item_name in items_result.all():
-        agent_items.setdefault(aid, []).append(item_name)
-
-    # 4. 构建居民状态（含三维属性 + 个人资源 + 工作状态）
-    # 预加载工作状态
-    worker_result = await db.execute(
-        select(BuildingWorker.agent_id, Building.id, Building.name, Building.building_type)
-        .join(Building, BuildingWorker.building_id == Building.id)
-    )
-    agent_work: dict[int, dict] = {}
-    for aid, bid, bname, btype in worker_result.all():
-        agent_work[aid] = {"building_id": bid, "building_name": bname, "building_type": btype}
-
-    # 预加载个人资源
-    res_result = await db.execute(select(AgentResource))
-    agent_res_map: dict[int, list[str]] = {}
-    for ar in res_result.scalars().all():
-        frozen_str = f"(冻结{ar.frozen_amount})" if ar.frozen_amount > 0 else ""
-        agent_res_map.setdefault(ar.agent_id, []).append(f"{ar.resource_type}={ar.quantity}{frozen_str}")
-
-    agent_lines = []
-    for a in agents:
-        checked = "已打卡" if a.id in checked_in_agents else "未打卡"
-        items = ", ".join(agent_items.get(a.id, [])) or "无"
-        persona_brief = a.persona[:60] + ("…" if len(a.persona) > 60 else "")
-        work_info = agent_work.get(a.id)
-        work_str = f"[在岗：{work_info['building_name']}]" if work_info else "无业"
-        res_str = ", ".join(agent_res_map.get(a.id, [])) or "无"
-        stamina_tag = " [体力不足，无法工作]" if a.stamina < 20 else ""
-        agent_lines.append(
-            f"- ID={a.id} {a.name}: {persona_brief} | "
-            f"余额={a.credits} | 饱腹={a.satiety} 心情={a.mood} 体力={a.stamina}{stamina_tag} | "
-            f"今日{checked} | {work_str} | 资源=[{res_str}] | 物品=[{items}]"
-        )
-
-    # 5. 最近 10 条聊天
-    msg_result = await db.execute(
-        select(Message)
-        .options(joinedload(Message.agent))
-        .order_by(Message.created_at.desc())
-        .limit(10)
-    )
-    messages = list(reversed(msg_result.scalars().all()))
-    msg_lines = [
-        f"- {m.agent.name if m.agent else '?'}: {m.content[:80]}"
-        for m in messages
-    ] or ["(无)"]
-
-    # 6. 岗位列表
-    jobs = await work_service.get_jobs(db)
-    job_lines = [
-        f"- ID={j['id']} {j['title']}: 日薪{j['daily_reward']} | "
-        f"今日{j['today_workers']}/{j['max_workers']}人"
-        for j in jobs
-    ]
+    world = await collect_world(db)
+    return world.render() if world else ""
 
-    # 7. 商品列表
-    shop_items = await shop_service.get_items(db)
-    shop_lines = [
-        f"- ID={i['id']} {i['name']}: {i['price']}信用点 ({i['item_type']})"
-        for i in shop_items
-    ]
-
-    # 8. 建筑列表
-    building_result = await db.execute(select(Building))
-    building_lines = []
-    for b in building_result.scalars().all():
-        w_count_result = await db.execute(
-            select(sa_func.count()).select_from(BuildingWorker)
-            .where(BuildingWorker.building_id == b.id)
-        )
-        w_count = w_count_result.scalar() or 0
-        if getattr(b, 'status', 'active') == "constructing":
-            started = b.construction_started_at
-            if started:
-                if started.tzinfo is None:
-                    started = started.replace(tzinfo=timezone.utc)
-                elapsed = (now - started).days
-                remaining = max(0, b.construction_days - elapsed)
-                status_tag = f" [建造中，剩余 {remaining} 天]"
-            else:
-                status_tag = " [建造中]"
-        else:
-            status_tag = ""
-        building_lines.append(
-            f"- ID={b.id} {b.name}({b.building_type}): {w_count}/{b.max_workers}人{status_tag}"
-        )
-
-    # 8.1 可建造建筑类型
-    recipe_lines = []
-    for btype, recipe in BUILDING_RECIPES.items():
-        cost_str = ", ".join(f"{k}={v}" for k, v in recipe["cost"].items())
-        recipe_lines.append(f"- {btype}: 需要 {cost_str}，工期 {recipe['construction_days']} 天")
 
-    # 9. 上一轮行为
+async def collect_world(db: AsyncSession) -> WorldView | None:
+    """读取一轮决策需要的世界状态；没有居民时返回 None。居民与共享段落来自增量维护的 world_state"""
+    world = await world_state.view(db)
+    if world is None:
+        return None
     async with _round_log_lock:
         last_snapshot = list(_last_round_log)
-    last_lines = [
-        f"- {log['agent_name']}: {log['action']} — {log['reason']}"
+    world.last_round = [
+        (log.get("agent_id"), f"- {log['agent_name']}: {log['action']} — {log['reason']}")
         for log in last_snapshot
-    ] or ["(首轮)"]
-
-    # 10. 交易市场挂单
-    from .market_service import list_orders
-    market_orders = await list_orders(db=db)
-    market_lines = [
-        f"- 挂单#{o['id']}: 卖家ID={o['seller_id']} 卖{o['sell_type']}x{o['remain_sell_amount']} 换{o['buy_type']}x{o['remain_buy_amount']} ({o['status']})"
-        for o in market_orders
-    ] or ["(无挂单)"]
-
-    # 11. 悬赏任务
-    bounty_result = await db.execute(
-        select(Bounty).where(Bounty.status.in_(["open", "claimed"]))
-    )
-    bounties = bounty_result.scalars().all()
-    bounty_lines = []
-    for b in bounties:
-        if b.status == "open":
-            bounty_lines.append(
-                f"- 悬赏#{b.id}: {b.title} | 奖励={b.reward}信用点 | 状态=开放"
-            )
-        else:
-            bounty_lines.append(
-                f"- 悬赏#{b.id}: {b.title} | 奖励={b.reward}信用点 | "
-                f"状态=进行中(接取者ID={b.claimed_by})"
-            )
-    bounty_lines = bounty_lines or ["(无悬赏)"]
-
-    snapshot = f"""当前时间：{now.strftime('%Y-%m-%d %H:%M UTC')}
-
-== 居民状态 ==
-{chr(10).join(agent_lines)}
-
-== 最近聊天 ==
-{chr(10).join(msg_lines)}
-
-== 上一轮行为 ==
-{chr(10).join(last_lines)}
-
-== 可用岗位 ==
-{chr(10).join(job_lines)}
-
-== 商店商品 ==
-{chr(10).join(shop_lines)}
-
-== 城市建筑 ==
-{chr(10).join(building_lines)}
-
-== 可建造建筑 ==
-{chr(10).join(recipe_lines)}
-
-== 交易市场 ==
-{chr(10).join(market_lines)}
-
-== 悬赏任务 ==
-{chr(10).join(bounty_lines)}
-
-请为每个居民决定下一步行为。"""
-
-    return snapshot
+    ]
+    return world
 
 
 async def decide(snapshot: str) -> list[dict]:
     """调用 LLM 做出行为决策，返回 actions 列表。
 
-    策略系统 dormant（DEV-40），只返回立即行为。
+    策略不由每轮决策输出（经 /agents/{id}/strategies 设置，由 strategy_runtime 按事件执行），只返回立即行为。
     兼容旧格式 {"actions": [...]} 和纯数组 [...]。
     """
+    actions, _ = await _decide(snapshot)
+    return actions
+
+
+async def _decide(snapshot: str, max_tokens: int = 4000) -> tuple[list[dict], dict]:
+    """decide 的实现：返回 (actions, 本次调用的 token 用量与耗时)"""
+    call = {"prompt_chars": len(snapshot), "prompt_tokens": 0, "completion_tokens": 0,
+            "total_tokens": 0, "latency_ms": 0}
     if not snapshot:
-        return []
+        return [], call
 
     resolved = resolve_model(AUTONOMY_MODEL)
     if not resolved:
         logger.warning("Autonomy model not configured")
-        return []
-
-    base_url, api_key, model_id = resolved
+        return [], call
 
     raw = ""
+    started = time.monotonic()
     try:
-        client = AsyncOpenAI(api_key=api_key, base_url=base_url)
-        response = await client.chat.completions.create(
-            model=model_id,
-            messages=[
-                {"role": "user", "content": SYSTEM_PROMPT + "\n\n" + snapshot},
-            ],
-            max_tokens=4000,
-        )
+        messages = [{"role": "user", "content": SYSTEM_PROMPT + "\n\n" + snapshot}]
+
+        async def request(target):
+            client = llm_client(base_url=target.base_url, api_key=target.api_key)
+            return await client.chat.completions.create(
+                model=target.model_id,
+                messages=messages,
+                max_tokens=max_tokens,
+            )
+
+        try:
+            routed = await llm_router.complete(
+                llm_router.targets(AUTONOMY_MODEL, resolved), request, messages=messages, max_tokens=max_tokens,
+            )
+        finally:
+            call["latency_ms"] = int((time.monotonic() - started) * 1000)
+        response = routed.value
+        usage = getattr(response, "usage", None)
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            value = getattr(usage, key, None)
+            if isinstance(value, int):
+                call[key] = value
         raw = response.choices[0].message.content or ""
+        # 兼容 markdown 代码块、前后说明文字、尾逗号；旧格式 {"actions": [...], "strategies": [...]} 只取 actions
+        parsed = extract_actions(raw)
         # 某些推理模型把回复放在 reasoning 字段，content 为空
-        if not raw.strip():
+        if parsed is None and not raw.strip():
             msg_data = response.choices[0].message
             reasoning = getattr(msg_data, 'reasoning', None) or getattr(msg_data, 'reasoning_content', None)
-            if reasoning:
-                # 用正则提取 reasoning 中所有可能的 JSON 对象或数组
-                import re
-                # 贪婪匹配，从 { 或 [ 开始到对应的 } 或 ] 结束
-                json_matches = []
-                for match in re.finditer(r'[\[{]', reasoning):
-                    start = match.start()
-                    # 尝试从这个位置解析 JSON
-                    for end in range(start + 1, len(reasoning) + 1):
-                        candidate = reasoning[start:end]
-                        try:
-                            parsed = json.loads(candidate)
-                            if isinstance(parsed, (list, dict)):
-                                json_matches.append(candidate)
-                                break
-                        except json.JSONDecodeError:
-                            continue
-
-                # 从最长的开始尝试（更可能是完整 JSON）
-                for candidate in sorted(json_matches, key=len, reverse=True):
-                    try:
-                        parsed = json.loads(candidate)
-                        if isinstance(parsed, (list, dict)):
-                            raw = candidate
-                            logger.info("Autonomy decide: extracted JSON from reasoning field")
-                            break
-                    except json.JSONDecodeError:
-                        continue
-
-        # 清理 markdown 代码块
-        raw = raw.strip()
-        if raw.startswith("```"):
-            lines = raw.split("\n")
-            lines = [l for l in lines if not l.strip().startswith("```")]
-            raw = "\n".join(lines)
-
-        parsed = json.loads(raw)
-
-        # 兼容旧格式：{"actions": [...], "strategies": [...]}（忽略 strategies）
-        if isinstance(parsed, dict) and "actions" in parsed:
-            actions_raw = parsed.get("actions", [])
-            actions = _validate_actions(actions_raw)
-            logger.info("Autonomy decide: %d actions (dict format)", len(actions))
-            return actions
-
-        # 新格式：[{action...}]
-        if isinstance(parsed, list):
-            actions = _validate_actions(parsed)
-            logger.info("Autonomy decide: %d actions (list format)", len(actions))
-            return actions
-
-        logger.warning("Autonomy decide: unexpected format %s", type(parsed))
-        return []
-
-    except json.JSONDecodeError as e:
-        logger.error("Autonomy decide: JSON parse failed: %s, raw=%s", e, raw[:200])
-        return []
+            if isinstance(reasoning, str) and reasoning:
+                parsed = extract_actions(reasoning)
+                if parsed is not None:
+                    logger.info("Autonomy decide: extracted JSON from reasoning field")
+                raw = reasoning
+
+        if parsed is None:
+            logger.error("Autonomy decide: no action list in response, raw=%s", raw[:200])
+            return [], call
+
+        actions = _validate_actions(parsed)
+        logger.info("Autonomy decide: %d actions", len(actions))
+        return actions, call
+
     except Exception as e:
         logger.error("Autonomy decide: LLM call failed: %s", e)
-        return []
+        return [], call
 
 
 def _validate_actions(raw_list: list) -> list[dict]:
     """校验 action 列表，过滤不合法条目。"""
     valid = []
     for d in raw_list:
-        if not isinstance(d, dict):
-            continue
-        if "agent_id" not in d or "action" not in d:
+        if not looks_like_action(d):
             continue
         if d["action"] not in ("checkin", "purchase", "chat", "rest", "assign_building", "unassign_building", "eat", "transfer_resource", "create_market_order", "accept_market_order", "cancel_market_order", "construct_building", "claim_bounty"):
             d["action"] = "rest"
@@ -352,248 +168,299 @@ def _validate_actions(raw_list: list) -> list[dict]:
     return valid
 
 
+def _partition(agent_ids: list[int], size: int) -> list[list[int]]:
+    """按 id 顺序切成大小尽量均匀、每片不超过 size 的分片"""
+    count = max(1, -(-len(agent_ids) // max(1, size)))
+    base, extra = divmod(len(agent_ids), count)
+    shards, start = [], 0
+    for i in range(count):
+        end = start + base + (1 if i < extra else 0)
+        shards.append(agent_ids[start:end])
+        start = end
+    return shards
+
+
+# 同一个目标只能成功一次的行为：多个分片各自选中同一目标时只保留第一个
+_EXCLUSIVE_TARGETS = {"claim_bounty": "bounty_id", "accept_market_order": "order_id", "cancel_market_order": "order_id"}
+
+
+def _reconcile_actions(shard_results: list[tuple[list[int], list[dict]]]) -> tuple[list[dict], dict]:
+    """合并各分片的 actions：去掉不属于本分片的 agent、同一 agent 的重复决策、争抢同一悬赏 / 挂单的冲突"""
+    merged: list[dict] = []
+    dropped = {"out_of_shard": 0, "duplicate": 0, "conflict": 0}
+    decided: set = set()
+    claimed: set[tuple] = set()
+    for members, actions in shard_results:
+        members = set(members)
+        for action in actions:
+            aid = action.get("agent_id")
+            if aid not in members:
+                dropped["out_of_shard"] += 1
+                continue
+            if aid in decided:
+                dropped["duplicate"] += 1
+                continue
+            target_key = _EXCLUSIVE_TARGETS.get(action["action"])
+            params = action.get("params") if isinstance(action.get("params"), dict) else {}
+            target = (action["action"], params.get(target_key)) if target_key else None
+            if target is not None and target[1] is not None:
+                if target in claimed:
+                    dropped["conflict"] += 1
+                    logger.info("Autonomy merge: agent %s %s conflicts with another shard, dropped", aid, target)
+                    continue
+                claimed.add(target)
+            decided.add(aid)
+            merged.append(action)
+    return merged, dropped
+
+
+async def decide_world(world: WorldView) -> tuple[list[dict], dict]:
+    """分片决策：居民按 autonomy_shard_size 分组，每组一份共享世界状态 + 本组明细，并发调用 LLM，合并后校验冲突。
+
+    人数不超过一片时退化为单次 decide（完整快照）。返回 (actions, 每片的 token 用量 / 耗时报告)。
+    """
+    agent_ids = [aid for aid, _ in world.agents]
+    size = settings.autonomy_shard_size
+    started = time.monotonic()
+    if size <= 0 or len(agent_ids) <= size:
+        shards = [agent_ids]
+        prompts = [world.render()]
+        budgets = [4000]
+    else:
+        shards = _partition(agent_ids, size)
+        prompts = [world.render(shard) for shard in shards]
+        # 输出按人数估算：每人一条 action 约 100~200 token，留出余量
+        budgets = [min(4000, 600 + 300 * len(shard)) for shard in shards]
+
+    semaphore = asyncio.Semaphore(max(1, settings.autonomy_shard_concurrency))
+
+    async def run(prompt: str, max_tokens: int):
+        async with semaphore:
+            return await _decide(prompt, max_tokens)
+
+    results = await asyncio.gather(*(run(p, m) for p, m in zip(prompts, budgets)))
+    actions, dropped = _reconcile_actions([(shard, acts) for shard, (acts, _) in zip(shards, results)])
+
+    report = {
+        "agents": len(agent_ids),
+        "decide_ms": int((time.monotonic() - started) * 1000),
+        "shards": [
+            {"agents": len(shard), "actions": len(acts), **call}
+            for shard, (acts, call) in zip(shards, results)
+        ],
+        "dropped": dropped,
+    }
+    for i, shard in enumerate(report["shards"]):
+        logger.info(
+            "Autonomy shard %d/%d: %d agents, %d actions, %d prompt chars, tokens %d+%d, %dms",
+            i + 1, len(shards), shard["agents"], shard["actions"], shard["prompt_chars"],
+            shard["prompt_tokens"], shard["completion_tokens"], shard["latency_ms"],
+        )
+    return actions, report
+
+
+# action → (必填参数, 处理函数)。处理函数返回服务层的 {"ok": ..., "reason": ...}，
+# 在 execute_decisions 的 unit_of_work 里跑：服务层的 commit 只 flush，广播排到整批提交之后
+async def _act_checkin(aid: int, agent_name: str, params: dict, db: AsyncSession) -> dict:
+    # 自动选岗位：用 params 中的 job_id，否则随机选一个有空位的
+    job_id = params.get("job_id")
+    if not job_id:
+        jobs = await work_service.get_jobs(db)
+        available = [j for j in jobs if j["max_workers"] == 0 or j["today_workers"] < j["max_workers"]]
+        if not available:
+            return {"ok": False, "reason": "no job available"}
+        job_id = random.choice(available)["id"]
+    return await work_service.check_in(aid, job_id, db)
+
+
+async def _act_purchase(aid: int, agent_name: str, params: dict, db: AsyncSession) -> dict:
+    return await shop_service.purchase(aid, params["item_id"], db)
+
+
+async def _act_assign_building(aid: int, agent_name: str, params: dict, db: AsyncSession) -> dict:
+    return await assign_worker("长安", params["building_id"], aid, db)
+
+
+async def _act_unassign_building(aid: int, agent_name: str, params: dict, db: AsyncSession) -> dict:
+    # TDD: 自动查找 agent 当前所在建筑，不需要 LLM 传 building_id
+    bw = (await db.execute(select(BuildingWorker).where(BuildingWorker.agent_id == aid))).scalar()
+    if not bw:
+        return {"ok": False, "reason": "not assigned to any building"}
+    return await remove_worker("长安", bw.building_id, aid, db)
+
+
+async def _act_eat(aid: int, agent_name: str, params: dict, db: AsyncSession) -> dict:
+    return await eat_food(aid, db)
+
+
+async def _act_transfer_resource(aid: int, agent_name: str, params: dict, db: AsyncSession) -> dict:
+    from .city_service import transfer_resource
+    return await transfer_resource(aid, params["to_agent_id"], params["resource_type"], params["quantity"], db)
+
+
+async def _act_create_market_order(aid: int, agent_name: str, params: dict, db: AsyncSession) -> dict:
+    from .market_service import create_order
+    return await create_order(
+        aid, params["sell_type"], params["sell_amount"], params["buy_type"], params["buy_amount"], db=db,
+    )
+
+
+async def _act_accept_market_order(aid: int, agent_name: str, params: dict, db: AsyncSession) -> dict:
+    from .market_service import accept_order
+    return await accept_order(aid, params["order_id"], params.get("buy_ratio", 1.0), db=db)
+
+
+async def _act_cancel_market_order(aid: int, agent_name: str, params: dict, db: AsyncSession) -> dict:
+    from .market_service import cancel_order
+    return await cancel_order(aid, params["order_id"], db=db)
+
+
+async def _act_construct_building(aid: int, agent_name: str, params: dict, db: AsyncSession) -> dict:
+    return await construct_building(aid, params["building_type"], params["name"], "长安", db=db)
+
+
+async def _act_claim_bounty(aid: int, agent_name: str, params: dict, db: AsyncSession) -> dict:
+    from .bounty_service import claim_bounty
+    res = await claim_bounty(agent_id=aid, bounty_id=params["bounty_id"], db=db)
+    if res["ok"]:
+        await after_commit(db, _broadcast_bounty_event, "bounty_claimed", {
+            "bounty_id": res["bounty_id"],
+            "title": res["title"],
+            "reward": res["reward"],
+            "claimed_by": aid,
+            "claimed_by_name": agent_name,
+        })
+    return res
+
+
+_ACTIONS = {
+    "checkin": ((), _act_checkin),
+    "purchase": (("item_id",), _act_purchase),
+    "assign_building": (("building_id",), _act_assign_building),
+    "unassign_building": ((), _act_unassign_building),
+    "eat": ((), _act_eat),
+    "transfer_resource": (("to_agent_id", "resource_type", "quantity"), _act_transfer_resource),
+    "create_market_order": (("sell_type", "sell_amount", "buy_type", "buy_amount"), _act_create_market_order),
+    "accept_market_order": (("order_id",), _act_accept_market_order),
+    "cancel_market_order": (("order_id",), _act_cancel_market_order),
+    "construct_building": (("building_type", "name"), _act_construct_building),
+    "claim_bounty": (("bounty_id",), _act_claim_bounty),
+}
+
+
 async def execute_decisions(decisions: list[dict], db: AsyncSession, snapshot: str = "") -> dict:
-    """逐条执行决策，返回统计。"""
-    from ..api.chat import broadcast, send_agent_message
+    """执行一轮决策，返回统计。
 
+    先用预加载的数据校验（未知居民、缺参数、rest、chat 配额），再把写操作放进少数几个事务
+    （每 autonomy_execute_chunk 条一个）：每条 action 一个 SAVEPOINT，失败只回滚它自己；
+    全部提交后才按顺序发广播。
+    """
     stats = {"success": 0, "failed": 0, "skipped": 0}
     chat_tasks: list[dict] = []
     round_log: list[dict] = []
 
-    # 预加载 agent 名称映射
-    result = await db.execute(select(Agent.id, Agent.name).where(Agent.id != 0))
-    agent_names = {aid: name for aid, name in result.all()}
+    # 预加载所有居民：校验用，也让服务层的 db.get(Agent) 直接命中 identity map
+    # （identity map 是弱引用，这里持有对象，整轮执行期间不会被回收后重新查询）
+    result = await db.execute(select(Agent).where(Agent.id != 0))
+    agents = {a.id: a for a in result.scalars().all()}
+    agent_names = {aid: a.name for aid, a in agents.items()}
 
+    # 1. 校验：不写库，只决定哪些 action 进事务
+    planned: list[tuple] = []
+    executing: list[tuple[int, str]] = []
     for dec in decisions:
         aid = dec.get("agent_id")
         action = dec.get("action", "rest")
-        params = dec.get("params", {})
+        params = dec.get("params") or {}
         reason = dec.get("reason", "")
         agent_name = agent_names.get(aid, f"Agent#{aid}")
+        entry = {"agent_id": aid, "agent_name": agent_name, "action": action, "reason": reason}
 
         if aid not in agent_names:
             logger.warning("Autonomy execute: unknown agent_id=%s, skipping", aid)
             stats["skipped"] += 1
             continue
 
-        # F35: 状态 → EXECUTING
-        # TODO: set_agent_status 内部 commit 会提前提交 session 中的 pending 变更，
-        #       破坏 flush-not-commit 的事务隔离意图。后续重构应改为 flush 或独立 session。
-        agent_obj = await db.get(Agent, aid)
-        if agent_obj and action != "rest":
-            await set_agent_status(agent_obj, AgentStatus.EXECUTING, f"执行 {action}…", db)
+        if action == "rest":
+            stats["skipped"] += 1
+            round_log.append(entry)
+            # F35: rest 时立即恢复 IDLE（不等最终兜底）
+            await set_agent_status(agents[aid], AgentStatus.IDLE, "", db)
+            continue
 
-        try:
-            if action == "rest":
+        if action == "chat":
+            # 经济预检查
+            can_speak = await economy_service.check_quota(aid, "chat", db)
+            if can_speak.allowed:
+                agent = agents[aid]
+                chat_tasks.append({
+                    "agent_id": aid,
+                    "agent_name": agent_name,
+                    "persona": agent.persona,
+                    "model": agent.model,
+                    "personality_json": agent.personality_json,
+                    "reason": reason,
+                })
+                executing.append((aid, action))
+            else:
+                logger.info("Autonomy chat quota denied for %s", agent_name)
                 stats["skipped"] += 1
-                round_log.append({"agent_id": aid, "agent_name": agent_name, "action": "rest", "reason": reason})
-                # F35: rest 时立即恢复 IDLE（不等最终兜底）
-                if agent_obj:
-                    await set_agent_status(agent_obj, AgentStatus.IDLE, "", db)
-                continue
+            round_log.append(entry)
+            continue
 
-            if action == "checkin":
-                # 自动选岗位：用 params 中的 job_id，否则随机选一个有空位的
-                job_id = params.get("job_id")
-                if not job_id:
-                    jobs = await work_service.get_jobs(db)
-                    available = [j for j in jobs if j["max_workers"] == 0 or j["today_workers"] < j["max_workers"]]
-                    if available:
-                        job_id = random.choice(available)["id"]
-                if job_id:
-                    res = await work_service.check_in(aid, job_id, db)
-                    if res["ok"]:
-                        stats["success"] += 1
-                        await _broadcast_action(agent_name, aid, "checkin", reason)
-                    else:
-                        logger.info("Autonomy checkin failed for %s: %s", agent_name, res["reason"])
-                        stats["failed"] += 1
-                else:
-                    stats["failed"] += 1
-
-            elif action == "purchase":
-                item_id = params.get("item_id")
-                if item_id:
-                    res = await shop_service.purchase(aid, item_id, db)
-                    if res["ok"]:
-                        stats["success"] += 1
-                        await _broadcast_action(agent_name, aid, "purchase", reason)
-                    else:
-                        logger.info("Autonomy purchase failed for %s: %s", agent_name, res["reason"])
-                        stats["failed"] += 1
-                else:
-                    stats["failed"] += 1
-
-            elif action == "chat":
-                # 经济预检查
-                can_speak = await economy_service.check_quota(aid, "chat", db)
-                if can_speak.allowed:
-                    agent = await db.get(Agent, aid)
-                    if agent:
-                        chat_tasks.append({
-                            "agent_id": aid,
-                            "agent_name": agent_name,
-                            "persona": agent.persona,
-                            "model": agent.model,
-                            "personality_json": agent.personality_json,
-                            "reason": reason,
-                        })
-                else:
-                    logger.info("Autonomy chat quota denied for %s", agent_name)
-                    stats["skipped"] += 1
-
-            elif action == "assign_building":
-                building_id = params.get("building_id")
-                if building_id:
-                    res = await assign_worker("长安", building_id, aid, db)
-                    if res["ok"]:
-                        stats["success"] += 1
-                        await _broadcast_action(agent_name, aid, "assign_building", reason)
-                    else:
-                        logger.info("Autonomy assign_building failed for %s: %s", agent_name, res["reason"])
-                        stats["failed"] += 1
-                else:
-                    stats["failed"] += 1
-
-            elif action == "unassign_building":
-                # TDD: 自动查找 agent 当前所在建筑，不需要 LLM 传 building_id
-                bw_result = await db.execute(
-                    select(BuildingWorker).where(BuildingWorker.agent_id == aid)
-                )
-                bw = bw_result.scalar()
-                if bw:
-                    res = await remove_worker("长安", bw.building_id, aid, db)
-                    if res["ok"]:
-                        stats["success"] += 1
-                        await _broadcast_action(agent_name, aid, "unassign_building", reason)
-                    else:
-                        logger.info("Autonomy unassign_building failed for %s: %s", agent_name, res["reason"])
-                        stats["failed"] += 1
-                else:
-                    logger.info("Autonomy unassign_building: %s not assigned to any building", agent_name)
-                    stats["failed"] += 1
-
-            elif action == "eat":
-                res = await eat_food(aid, db)
+        spec = _ACTIONS.get(action)
+        if spec is None or not all(params.get(key) for key in spec[0]):
+            logger.info("Autonomy %s rejected for %s: unknown action or missing params", action, agent_name)
+            stats["failed"] += 1
+            round_log.append(entry)
+            continue
+        planned.append((aid, agent_name, action, params, reason, spec[1], entry))
+        executing.append((aid, action))
+
+    # F35: 状态 → EXECUTING。在事务开始前设置：event 模式下 set_agent_status 自己 commit，
+    # 放在事务里会把前面 action 的改动提前提交。batch 模式下立即刷出，
+    # 否则会被 tick 同一 status_batch 块里最后的 IDLE 覆盖，执行和聊天期间客户端看不到
+    for aid, action in executing:
+        await set_agent_status(agents[aid], AgentStatus.EXECUTING, f"执行 {action}…", db)
+    if executing:
+        await flush_status_batch()
+
+    # 2. 执行：每 autonomy_execute_chunk 条 action 一个事务，每条 action 一个 SAVEPOINT
+    chunk = settings.autonomy_execute_chunk
+    events: list[tuple] = []
+    tx_started = time.monotonic()
+    async with unit_of_work(db) as uow:
+        for i, (aid, agent_name, action, params, reason, handler, entry) in enumerate(planned):
+            if chunk > 0 and i and i % chunk == 0:
+                events += await uow.commit()
+            await uow.begin_action()
+            try:
+                res = await handler(aid, agent_name, params, db)
                 if res["ok"]:
-                    stats["success"] += 1
-                    await _broadcast_action(agent_name, aid, "eat", reason)
-                else:
-                    logger.info("Autonomy eat failed for %s: %s", agent_name, res["reason"])
-                    stats["failed"] += 1
-
-            elif action == "transfer_resource":
-                to_id = params.get("to_agent_id")
-                res_type = params.get("resource_type")
-                qty = params.get("quantity")
-                if to_id and res_type and qty:
-                    from .city_service import transfer_resource
-                    res = await transfer_resource(aid, to_id, res_type, qty, db)
-                    if res["ok"]:
-                        stats["success"] += 1
-                        await _broadcast_action(agent_name, aid, "transfer_resource", reason)
-                    else:
-                        logger.info("Autonomy transfer_resource failed for %s: %s", agent_name, res["reason"])
-                        stats["failed"] += 1
-                else:
-                    stats["failed"] += 1
-
-            elif action == "create_market_order":
-                sell_type = params.get("sell_type")
-                sell_amount = params.get("sell_amount")
-                buy_type = params.get("buy_type")
-                buy_amount = params.get("buy_amount")
-                if sell_type and sell_amount and buy_type and buy_amount:
-                    from .market_service import create_order
-                    res = await create_order(aid, sell_type, sell_amount, buy_type, buy_amount, db=db)
-                    if res["ok"]:
-                        stats["success"] += 1
-                        await _broadcast_action(agent_name, aid, "create_market_order", reason)
-                    else:
-                        logger.info("Autonomy create_market_order failed for %s: %s", agent_name, res["reason"])
-                        stats["failed"] += 1
-                else:
-                    stats["failed"] += 1
-
-            elif action == "accept_market_order":
-                order_id = params.get("order_id")
-                buy_ratio = params.get("buy_ratio", 1.0)
-                if order_id:
-                    from .market_service import accept_order
-                    res = await accept_order(aid, order_id, buy_ratio, db=db)
-                    if res["ok"]:
-                        stats["success"] += 1
-                        await _broadcast_action(agent_name, aid, "accept_market_order", reason)
-                    else:
-                        logger.info("Autonomy accept_market_order failed for %s: %s", agent_name, res["reason"])
-                        stats["failed"] += 1
-                else:
-                    stats["failed"] += 1
-
-            elif action == "cancel_market_order":
-                order_id = params.get("order_id")
-                if order_id:
-                    from .market_service import cancel_order
-                    res = await cancel_order(aid, order_id, db=db)
-                    if res["ok"]:
-                        stats["success"] += 1
-                        await _broadcast_action(agent_name, aid, "cancel_market_order", reason)
-                    else:
-                        logger.info("Autonomy cancel_market_order failed for %s: %s", agent_name, res["reason"])
-                        stats["failed"] += 1
-                else:
-                    stats["failed"] += 1
-
-            elif action == "construct_building":
-                building_type = params.get("building_type")
-                bname = params.get("name")
-                if building_type and bname:
-                    res = await construct_building(aid, building_type, bname, "长安", db=db)
-                    if res["ok"]:
-                        stats["success"] += 1
-                        await _broadcast_action(agent_name, aid, "construct_building", reason)
-                    else:
-                        logger.info("Autonomy construct_building failed for %s: %s", agent_name, res["reason"])
-                        stats["failed"] += 1
-                else:
-                    stats["failed"] += 1
-
-            elif action == "claim_bounty":
-                bounty_id = params.get("bounty_id")
-                if bounty_id:
-                    from .bounty_service import claim_bounty
-                    res = await claim_bounty(
-                        agent_id=aid, bounty_id=bounty_id, db=db,
-                    )
-                    if res["ok"]:
-                        stats["success"] += 1
-                        await _broadcast_action(
-                            agent_name, aid, "claim_bounty", reason,
-                        )
-                        await _broadcast_bounty_event("bounty_claimed", {
-                            "bounty_id": res["bounty_id"],
-                            "title": res["title"],
-                            "reward": res["reward"],
-                            "claimed_by": aid,
-                            "claimed_by_name": agent_name,
-                        })
-                    else:
-                        logger.info(
-                            "Autonomy claim_bounty failed for %s: %s",
-                            agent_name, res["reason"],
-                        )
-                        stats["failed"] += 1
-                else:
-                    stats["failed"] += 1
-
-            round_log.append({"agent_id": aid, "agent_name": agent_name, "action": action, "reason": reason})
-
+                    await after_commit(db, _broadcast_action, agent_name, aid, action, reason)
+            except Exception as e:
+                await uow.end_action(False)
+                logger.error("Autonomy execute failed for agent %s action %s: %s", agent_name, action, e)
+                stats["failed"] += 1
+                round_log.append({**entry, "reason": f"执行失败: {e}"})
+                continue
+            await uow.end_action(res["ok"])
+            if res["ok"]:
+                stats["success"] += 1
+            else:
+                logger.info("Autonomy %s failed for %s: %s", action, agent_name, res.get("reason"))
+                stats["failed"] += 1
+            round_log.append(entry)
+        events += await uow.commit()
+    stats["tx_ms"] = round((time.monotonic() - tx_started) * 1000, 1)
+    stats["rolled_back"] = uow.rolled_back
+
+    # 3. 提交成功后再广播：回滚掉的 action 不会有广播
+    for fn, args, kwargs in events:
+        try:
+            await fn(*args, **kwargs)
         except Exception as e:
-            logger.error("Autonomy execute failed for agent %s action %s: %s", agent_name, action, e)
-            stats["failed"] += 1
-            round_log.append({"agent_id": aid, "agent_name": agent_name, "action": action, "reason": f"执行失败: {e}"})
-
-    await db.commit()
+            logger.warning("Autonomy broadcast failed (non-fatal): %s", e)
 
     # 聊天统一走 batch_generate
     if chat_tasks:
@@ -676,6 +543,7 @@ async def _execute_chats(
                         completion_tokens=usage_info["completion_tokens"],
                         total_tokens=usage_info["total_tokens"],
                         latency_ms=usage_info["latency_ms"],
+                        queue_wait_ms=usage_info.get("queue_wait_ms", 0),
                     )
                     send_db.add(record)
                 await send_db.commit()
@@ -741,171 +609,73 @@ async def _broadcast_bounty_event(event: str, data: dict):
 
 
 async def execute_strategies(db: AsyncSession) -> dict:
-    """策略自动机：遍历所有 Agent 的活跃策略，匹配当前世界状态并执行。
+    """策略自动机全量巡检：每条活跃策略按当前世界状态检查一次（开发触发 / 手动补偿用）。
 
+    平时策略由 strategy_runtime 按事件触发，不需要轮询。
     返回 {"executed": N, "skipped": N, "completed": N}
     """
-    from .market_service import list_orders, accept_order
-    from .strategy_engine import get_all_strategies, StrategyType
-
-    stats = {"executed": 0, "skipped": 0, "completed": 0}
-    all_strategies = get_all_strategies()
-    if not all_strategies:
-        return stats
-
-    # 预加载 agent 名称和 credits
-    result = await db.execute(select(Agent.id, Agent.name, Agent.credits).where(Agent.id != 0))
-    agent_names = {}
-    agent_resources: dict[int, dict[str, float]] = {}
-    for aid, name, agent_credits in result.all():
-        agent_names[aid] = name
-        agent_resources[aid] = {"credits": float(agent_credits)}
-
-    # 预加载 agent 资源（wheat, flour 等）
-    res_result = await db.execute(select(AgentResource))
-    for ar in res_result.scalars().all():
-        if ar.agent_id not in agent_resources:
-            agent_resources[ar.agent_id] = {"credits": 0.0}
-        agent_resources[ar.agent_id][ar.resource_type] = ar.quantity
-
-    # 预加载工作状态
-    worker_result = await db.execute(
-        select(BuildingWorker.agent_id, BuildingWorker.building_id)
-    )
-    agent_building: dict[int, int] = {aid: bid for aid, bid in worker_result.all()}
-
-    # 预加载市场挂单（opportunistic_buy 用）
-    market_orders = await list_orders(db=db)
-    open_orders = [o for o in market_orders if o["status"] in ("open", "partial")]
-
-    for aid, strategies in all_strategies.items():
-        if aid not in agent_names:
-            continue
-        agent_name = agent_names[aid]
-        my_resources = agent_resources.get(aid, {})
-
-        for s in strategies:
-            try:
-                if s.strategy == StrategyType.KEEP_WORKING:
-                    # 终止条件：资源达标
-                    if s.stop_when_resource and s.stop_when_amount is not None:
-                        current = my_resources.get(s.stop_when_resource, 0)
-                        if current >= s.stop_when_amount:
-                            logger.info("Strategy completed: agent %s keep_working, %s reached %.1f",
-                                        agent_name, s.stop_when_resource, current)
-                            stats["completed"] += 1
-                            continue
-
-                    # 执行：如果已在目标建筑，执行 checkin
-                    if s.building_id and agent_building.get(aid) == s.building_id:
-                        jobs = await work_service.get_jobs(db)
-                        available = [j for j in jobs if j["max_workers"] == 0 or j["today_workers"] < j["max_workers"]]
-                        if available:
-                            res = await work_service.check_in(aid, random.choice(available)["id"], db)
-                            if res["ok"]:
-                                stats["executed"] += 1
-                                await _broadcast_action(agent_name, aid, "checkin", f"策略自动执行: 持续工作")
-                            else:
-                                stats["skipped"] += 1
-                        else:
-                            stats["skipped"] += 1
-                    else:
-                        stats["skipped"] += 1
-
-                elif s.strategy == StrategyType.OPPORTUNISTIC_BUY:
-                    # 终止条件：库存达标
-                    if s.stop_when_amount is not None and s.resource:
-                        current = my_resources.get(s.resource, 0)
-                        if current >= s.stop_when_amount:
-                            logger.info("Strategy completed: agent %s opportunistic_buy, %s reached %.1f",
-                                        agent_name, s.resource, current)
-                            stats["completed"] += 1
-                            continue
-
-                    # 执行：扫描市场找低价单
-                    bought = False
-                    if s.resource and s.price_below is not None:
-                        for order in open_orders:
-                            if (order["sell_type"] == s.resource
-                                    and order["remain_sell_amount"] > 0
-                                    and order["remain_buy_amount"] > 0
-                                    and order["seller_id"] != aid):
-                                unit_price = order["remain_buy_amount"] / order["remain_sell_amount"]
-                                if unit_price <= s.price_below:
-                                    pay_resource = order["buy_type"]
-                                    pay_amount = order["remain_buy_amount"]
-                                    my_pay = my_resources.get(pay_resource, 0)
-                                    if my_pay >= pay_amount:
-                                        res = await accept_order(aid, order["id"], 1.0, db=db)
-                                        if res["ok"]:
-                                            stats["executed"] += 1
-                                            await _broadcast_action(
-                                                agent_name, aid, "accept_market_order",
-                                                f"策略自动执行: 低价买入 {s.resource}"
-                                            )
-                                            my_resources[s.resource] = my_resources.get(s.resource, 0) + order["remain_sell_amount"]
-                                            my_resources[pay_resource] = my_pay - pay_amount
-                                            bought = True
-                                            break
-                    if not bought:
-                        stats["skipped"] += 1
-
-            except Exception as e:
-                logger.error("Strategy execution failed: agent %s, strategy %s: %s", agent_name, s.strategy, e)
-                stats["skipped"] += 1
-
-    await db.commit()
-    return stats
+    return await strategy_runtime.sweep(db)
 
 
 async def tick():
-    """一次完整的自主行为循环。
+    """一次完整的自主行为循环，返回本轮报告（每个分片的 token 用量 / 耗时 + 整轮耗时）。
 
-    流程：构建快照 → LLM 决策(actions) → 执行 actions
-    策略自动机 dormant（DEV-40: 调度架构不匹配）
+    流程：构建快照 → LLM 决策(actions，人多时分片并发) → 执行 actions
+    策略自动机不在 tick 里轮询：strategy_runtime 在挂单 / 成交 / 生产 / 打卡提交后按事件执行
     """
+    global last_tick_report
     logger.info("Autonomy tick: starting")
+    started = time.monotonic()
     try:
         async with async_session() as db:
-            snapshot = await build_world_snapshot(db)
+            world = await collect_world(db)
 
-        if not snapshot:
+        if world is None:
             logger.info("Autonomy tick: no agents, skipping")
-            return
-
-        # F35: 所有 agent → THINKING（LLM 决策中）
-        async with async_session() as db:
-            agents_result = await db.execute(select(Agent).where(Agent.id != 0))
-            all_agents = agents_result.scalars().all()
-            for agent in all_agents:
-                await set_agent_status(agent, AgentStatus.THINKING, "正在分析环境…", db)
-
-        actions = await decide(snapshot)
+            return None
+        snapshot = world.render()
 
-        # 执行立即行为
-        if actions:
-            logger.info("Autonomy tick: executing %d actions", len(actions))
+        # F35: 所有 agent → THINKING（LLM 决策中）；batch 模式下一条 UPDATE + 一条广播，决策前刷出
+        async with status_batch():
             async with async_session() as db:
-                stats = await execute_decisions(actions, db, snapshot)
-            logger.info("Autonomy tick: actions done — %s", stats)
-        else:
-            logger.info("Autonomy tick: no actions")
+                agents_result = await db.execute(select(Agent).where(Agent.id != 0))
+                all_agents = agents_result.scalars().all()
+                for agent in all_agents:
+                    await set_agent_status(agent, AgentStatus.THINKING, "正在分析环境…", db)
+
+        actions, report = await decide_world(world)
+
+        async with status_batch():
+            # 执行立即行为
+            if actions:
+                logger.info("Autonomy tick: executing %d actions", len(actions))
+                async with async_session() as db:
+                    stats = await execute_decisions(actions, db, snapshot)
+                logger.info("Autonomy tick: actions done — %s", stats)
+            else:
+                logger.info("Autonomy tick: no actions")
 
-        # 策略自动机 dormant（DEV-40）
+            # F35: 所有 agent → IDLE
+            async with async_session() as db:
+                agents_result = await db.execute(select(Agent).where(Agent.id != 0))
+                for agent in agents_result.scalars().all():
+                    await set_agent_status(agent, AgentStatus.IDLE, "", db)
 
-        # F35: 所有 agent → IDLE
-        async with async_session() as db:
-            agents_result = await db.execute(select(Agent).where(Agent.id != 0))
-            for agent in agents_result.scalars().all():
-                await set_agent_status(agent, AgentStatus.IDLE, "", db)
+        report["tick_ms"] = int((time.monotonic() - started) * 1000)
+        report["world"] = dict(world_state.stats)  # 增量刷新 / 全量重建 / 漂移计数
+        last_tick_report = report
+        logger.info("Autonomy tick: done in %dms (%d shards, decide %dms)",
+                    report["tick_ms"], len(report["shards"]), report["decide_ms"])
+        return report
 
     except Exception as e:
         logger.error("Autonomy tick failed: %s", e, exc_info=True)
         # F35: 异常时也恢复 IDLE
         try:
-            async with async_session() as db:
-                agents_result = await db.execute(select(Agent).where(Agent.id != 0))
-                for agent in agents_result.scalars().all():
-                    await set_agent_status(agent, AgentStatus.IDLE, "", db)
+            async with status_batch():
+                async with async_session() as db:
+                    agents_result = await db.execute(select(Agent).where(Agent.id != 0))
+                    for agent in agents_result.scalars().all():
+                        await set_agent_status(agent, AgentStatus.IDLE, "", db)
         except Exception:
             pass
@@ -10,6 +10,7 @@ from sqlalchemy import select, update, exists
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..models.tables import Bounty, Agent
+from .world_state import BOUNTIES, world_state
 
 logger = logging.getLogger(__name__)
 
@@ -71,6 +72,7 @@ async def claim_bounty(
         return {"ok": False, "reason": "该悬赏已被接取或不再开放"}
 
     # 4. flush 刷新状态，不 commit（调用方负责）
+    world_state.touch_sections(BOUNTIES, db=db)
     await db.flush()
 
     return {
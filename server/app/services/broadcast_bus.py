@@ -0,0 +1,362 @@
+"""Cross-worker fan-out of chat broadcasts and WebSocket presence.
+
+Each worker process only holds its own sockets (``chat.human_connections`` /
+``chat.bot_connections`` and the ``broadcast_hub`` queues). The bus lets
+several uvicorn workers on one host behave like one server:
+
+* ``publish`` delivers a frame to this worker's hub and forwards it to every
+  peer, which delivers it to its own sockets;
+* ``online_ids`` / ``bot_online`` answer for all workers, from the presence
+  snapshots peers push whenever their connection pools change;
+* ``notify_peers`` / ``subscribe`` carry small control messages (a bot that
+  reconnected to another worker, an agent rename that invalidates caches).
+
+Backends (``settings.broadcast_backend``):
+
+* ``local`` -- single process, no forwarding (default);
+* ``unix``  -- every worker listens on ``<broadcast_bus_dir>/<pid>.sock`` and
+  keeps one outbound stream to each peer socket it finds in that directory.
+  Frames are newline-delimited JSON. Forwarding never awaits a peer: a peer
+  whose outbound buffer exceeds ``broadcast_bus_max_buffer_mb`` is dropped
+  and reconnected on the next directory scan.
+
+Loops with global side effects (daily grants and decay, autonomy ticks,
+the embedding backfill) must run once per host, not once per worker:
+``wait_leadership`` returns in exactly one worker, the one holding an
+exclusive ``flock`` on ``<broadcast_bus_dir>/leader.lock``. The lock dies
+with its process, so another worker takes over within one refresh interval.
+Per-worker state (memory access counters) is still flushed by every worker.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from collections.abc import Callable, Hashable
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: no unix backend either
+    fcntl = None
+
+from ..core.config import settings
+from .broadcast_hub import BroadcastHub, broadcast_hub
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("local", "unix")
+STALE_AFTER_REFUSALS = 3  # a socket file refusing this many scans in a row belongs to a dead worker
+
+Presence = tuple[set[int], set[int]]  # (human agent ids, bot agent ids)
+
+
+class LocalBus:
+    """Single worker: publish goes straight to the hub, presence is the local pool."""
+
+    backend = "local"
+
+    def __init__(self, hub: BroadcastHub | None = None):
+        self.hub = hub if hub is not None else broadcast_hub  # an empty hub is falsy (__len__)
+        self.is_leader = False
+        self._presence_source: Callable[[], Presence] | None = None
+        self._handlers: dict[str, list[Callable[[dict], None]]] = {}
+
+    def set_presence_source(self, source: Callable[[], Presence]) -> None:
+        """``source()`` returns this worker's ``(human ids, bot ids)``."""
+        self._presence_source = source
+
+    def local_presence(self) -> Presence:
+        if self._presence_source is None:
+            return set(), set()
+        humans, bots = self._presence_source()
+        return set(humans), set(bots)
+
+    def online_ids(self) -> set[int]:
+        humans, bots = self.local_presence()
+        return humans | bots
+
+    def bot_online(self, agent_id: int) -> bool:
+        return agent_id in self.local_presence()[1]
+
+    def publish(self, text: str, coalesce_key: Hashable | None = None, channel: str | None = None) -> int:
+        """Deliver to this worker's sockets; returns how many local connections accepted it."""
+        return self.hub.publish(text, coalesce_key, channel)
+
+    def presence_changed(self) -> None:
+        """Call after this worker's connection pool changed."""
+
+    def subscribe(self, topic: str, handler: Callable[[dict], None]) -> None:
+        """Run ``handler(payload)`` when a peer sends ``topic``."""
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def notify_peers(self, topic: str, payload: dict | None = None) -> None:
+        """Send a control message to the other workers (not to this one)."""
+
+    def _dispatch(self, topic: str, payload: dict) -> None:
+        for handler in self._handlers.get(topic, ()):
+            try:
+                handler(payload)
+            except Exception as e:
+                logger.warning("Bus handler for %r failed: %s", topic, e)
+
+    async def wait_leadership(self) -> None:
+        """Return once this worker should run the once-per-host background loops."""
+        self.is_leader = True
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "workers": 1, "leader": self.is_leader}
+
+
+class UnixSocketBus(LocalBus):
+    """Peer-to-peer bus between workers over Unix domain sockets in one directory."""
+
+    backend = "unix"
+
+    def __init__(self, directory: str, worker_id: str | None = None, hub: BroadcastHub | None = None):
+        super().__init__(hub)
+        self.directory = Path(directory)
+        self.worker_id = worker_id or str(os.getpid())
+        self.path = self.directory / f"{self.worker_id}.sock"
+        self.lock_path = self.directory / "leader.lock"
+        self.forwarded = 0
+        self.received = 0
+        self.peer_drops = 0
+        self._server: asyncio.AbstractServer | None = None
+        self._peers: dict[str, asyncio.StreamWriter] = {}  # outbound stream per peer worker
+        self._remote: dict[str, Presence] = {}  # presence last reported by each peer
+        self._refused: dict[str, int] = {}
+        self._sent_presence: Presence | None = None
+        self._inbound: set[asyncio.StreamWriter] = set()  # streams peers opened to us
+        self._tasks: set[asyncio.Task] = set()
+        self._refresh_task: asyncio.Task | None = None
+        self._lock_fd: int | None = None
+
+    # -- lifecycle -------------------------------------------------------
+
+    async def start(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path.unlink(missing_ok=True)
+        self._server = await asyncio.start_unix_server(
+            self._serve_peer, path=str(self.path), limit=64 * 1024 * 1024,
+        )
+        await self.refresh_peers()
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+        logger.info("Broadcast bus listening on %s", self.path)
+
+    async def stop(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        for wid in list(self._peers):
+            self._drop_peer(wid)
+        for task in list(self._tasks):
+            task.cancel()
+        for writer in list(self._inbound):
+            writer.close()  # the serving coroutine sees EOF and forgets that peer
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        self.path.unlink(missing_ok=True)
+        self._release_leadership()
+
+    async def wait_leadership(self) -> None:
+        """Block until this worker holds the leader lock (retried every refresh interval)."""
+        while not self._try_lock():
+            await asyncio.sleep(max(0.05, settings.broadcast_bus_refresh_seconds))
+        self.is_leader = True
+        logger.info("Broadcast bus worker %s is the leader", self.worker_id)
+
+    def _try_lock(self) -> bool:
+        if fcntl is None:
+            return True
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, self.worker_id.encode())
+        self._lock_fd = fd
+        return True
+
+    def _release_leadership(self) -> None:
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self.is_leader = False
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(max(0.05, settings.broadcast_bus_refresh_seconds))
+            try:
+                await self.refresh_peers()
+            except Exception as e:
+                logger.warning("Broadcast bus peer scan failed: %s", e)
+
+    async def refresh_peers(self) -> None:
+        """Connect to peer sockets that appeared; clean up files of dead workers."""
+        for sock in sorted(self.directory.glob("*.sock")):
+            wid = sock.stem
+            if wid == self.worker_id or wid in self._peers:
+                continue
+            try:
+                reader, writer = await asyncio.open_unix_connection(str(sock))
+            except (ConnectionRefusedError, FileNotFoundError):
+                self._refused[wid] = self._refused.get(wid, 0) + 1
+                if self._refused[wid] >= STALE_AFTER_REFUSALS:
+                    sock.unlink(missing_ok=True)
+                    self._refused.pop(wid, None)
+                    logger.info("Removed stale bus socket %s", sock)
+                continue
+            except OSError as e:
+                logger.debug("Cannot reach bus peer %s: %s", wid, e)
+                continue
+            self._refused.pop(wid, None)
+            self._peers[wid] = writer
+            self._spawn(self._watch_peer(wid, reader, writer))
+            self._write(writer, self._presence_frame(self.local_presence()))
+
+    # -- outbound --------------------------------------------------------
+
+    def publish(self, text: str, coalesce_key: Hashable | None = None, channel: str | None = None) -> int:
+        accepted = self.hub.publish(text, coalesce_key, channel)
+        key = list(coalesce_key) if isinstance(coalesce_key, tuple) else coalesce_key
+        if not isinstance(key, (list, str, int, type(None))):
+            key = None  # not representable on the wire; peers just won't coalesce it
+        self._send({"k": "pub", "w": self.worker_id, "text": text, "key": key, "ch": channel})
+        return accepted
+
+    def presence_changed(self) -> None:
+        presence = self.local_presence()
+        if presence != self._sent_presence:
+            self._send(self._presence_frame(presence))
+
+    def notify_peers(self, topic: str, payload: dict | None = None) -> None:
+        self._send({"k": "topic", "w": self.worker_id, "topic": topic, "data": payload or {}})
+
+    def _presence_frame(self, presence: Presence) -> dict:
+        self._sent_presence = presence
+        humans, bots = presence
+        return {"k": "presence", "w": self.worker_id, "humans": sorted(humans), "bots": sorted(bots)}
+
+    def _send(self, frame: dict) -> None:
+        if not self._peers:
+            return
+        line = (json.dumps(frame, ensure_ascii=False) + "\n").encode()
+        limit = settings.broadcast_bus_max_buffer_mb * 1024 * 1024
+        for wid, writer in list(self._peers.items()):
+            if writer.is_closing() or writer.transport.get_write_buffer_size() > limit:
+                logger.warning("Dropping broadcast bus peer %s (closed or backed up)", wid)
+                self._drop_peer(wid)
+                continue
+            self._write(writer, line)
+        self.forwarded += 1
+
+    @staticmethod
+    def _write(writer: asyncio.StreamWriter, frame: dict | bytes) -> None:
+        if isinstance(frame, dict):
+            frame = (json.dumps(frame, ensure_ascii=False) + "\n").encode()
+        try:
+            writer.write(frame)
+        except Exception:
+            pass  # the watcher notices the broken stream and drops the peer
+
+    def _drop_peer(self, wid: str) -> None:
+        writer = self._peers.pop(wid, None)
+        if writer is not None:
+            self.peer_drops += 1
+            writer.close()
+
+    async def _watch_peer(self, wid: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Peers never write on our outbound stream; EOF means the peer went away."""
+        try:
+            await reader.read()
+        except Exception:
+            pass
+        if self._peers.get(wid) is writer:
+            self._drop_peer(wid)
+
+    # -- inbound ---------------------------------------------------------
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._inbound.add(writer)
+        seen: set[str] = set()
+        try:
+            while line := await reader.readline():
+                try:
+                    frame = json.loads(line)
+                except ValueError:
+                    logger.warning("Malformed broadcast bus frame dropped")
+                    continue
+                seen.add(frame.get("w", ""))
+                self._handle(frame)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            logger.debug("Broadcast bus peer stream ended: %s", e)
+        finally:
+            self._inbound.discard(writer)
+            for wid in seen:
+                self._remote.pop(wid, None)
+            writer.close()
+
+    def _handle(self, frame: dict) -> None:
+        kind = frame.get("k")
+        if kind == "pub":
+            key = frame.get("key")
+            self.hub.publish(frame["text"], tuple(key) if isinstance(key, list) else key, frame.get("ch"))
+            self.received += 1
+        elif kind == "presence":
+            self._remote[frame["w"]] = (set(frame.get("humans", ())), set(frame.get("bots", ())))
+        elif kind == "topic":
+            self._dispatch(frame.get("topic", ""), frame.get("data") or {})
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    # -- queries ---------------------------------------------------------
+
+    def online_ids(self) -> set[int]:
+        online = super().online_ids()
+        for humans, bots in self._remote.values():
+            online |= humans | bots
+        return online
+
+    def bot_online(self, agent_id: int) -> bool:
+        return super().bot_online(agent_id) or any(agent_id in bots for _, bots in self._remote.values())
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "worker_id": self.worker_id,
+            "workers": 1 + len(set(self._peers) | set(self._remote)),
+            "leader": self.is_leader,
+            "peers": sorted(self._peers),
+            "forwarded": self.forwarded,
+            "received": self.received,
+            "peer_drops": self.peer_drops,
+        }
+
+
+def create_bus(backend: str | None = None) -> LocalBus:
+    backend = backend or settings.broadcast_backend
+    if backend == "unix":
+        if hasattr(asyncio, "start_unix_server"):
+            return UnixSocketBus(settings.broadcast_bus_dir)
+        logger.warning("Unix sockets are not available on this platform; using the local broadcast bus")
+    elif backend != "local":
+        logger.warning("Unknown broadcast_backend %r; using the local broadcast bus", backend)
+    return LocalBus()
+
+
+broadcast_bus = create_bus()
@@ -0,0 +1,258 @@
+"""Fan-out of broadcast frames to WebSocket clients through per-connection queues.
+
+``publish`` never awaits a socket: it appends the pre-serialized frame to
+every connection's bounded queue and wakes that connection's writer task.
+A client that cannot keep up only ever fills its own queue, which is then
+handled by ``settings.ws_slow_consumer_policy``:
+
+* ``drop_oldest`` -- discard the oldest queued frame (the client keeps up with
+  the latest events and misses some in between)
+* ``drop_newest`` -- discard the incoming frame
+* ``disconnect``  -- close the socket (code 1013); the client reconnects and
+  refetches history
+
+Frames published with a ``coalesce_key`` replace a still-queued frame with the
+same key in place, so a burst of e.g. status changes for one agent costs a
+backed-up client one slot and delivers only the latest state.
+
+Frames published on a ``channel`` (e.g. ``message_delta`` token streams) only
+go to connections that opted into that channel when they registered.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from collections.abc import Callable, Hashable, Iterable
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("drop_oldest", "drop_newest", "disconnect")
+SLOW_CONSUMER_CLOSE_CODE = 1013  # "try again later"
+
+
+async def _close(ws, code: int) -> None:
+    try:
+        await ws.close(code=code, reason="Too slow, reconnect")
+    except Exception:
+        pass
+
+
+class _Frame:
+    __slots__ = ("text", "key")
+
+    def __init__(self, text: str, key: Hashable | None):
+        self.text = text
+        self.key = key
+
+
+class Connection:
+    """One client socket: its outbound queue, writer task and counters."""
+
+    def __init__(self, agent_id: int, ws, on_close: Callable | None, channels: frozenset[str] = frozenset()):
+        self.agent_id = agent_id
+        self.ws = ws
+        self.on_close = on_close
+        self.channels = channels
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.closed = False
+        self._queue: deque[_Frame] = deque()
+        self._keyed: dict[Hashable, _Frame] = {}
+        self._wake = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def _offer(self, text: str, key: Hashable | None, maxsize: int, policy: str) -> bool:
+        """Queue one frame; False means the policy wants this client disconnected."""
+        if key is not None:
+            frame = self._keyed.get(key)
+            if frame is not None:
+                frame.text = text
+                self.coalesced += 1
+                return True
+        if len(self._queue) >= maxsize:
+            if policy == "disconnect":
+                return False
+            self.dropped += 1
+            if policy == "drop_newest":
+                return True
+            old = self._queue.popleft()
+            if old.key is not None and self._keyed.get(old.key) is old:
+                del self._keyed[old.key]
+        frame = _Frame(text, key)
+        self._queue.append(frame)
+        if key is not None:
+            self._keyed[key] = frame
+        self.max_depth = max(self.max_depth, len(self._queue))
+        self._notify()
+        return True
+
+    def _notify(self) -> None:
+        self._call_soon(self._wake.set)
+
+    def _call_soon(self, fn: Callable) -> None:
+        """Run ``fn`` on the writer's loop, which may belong to another thread
+        (e.g. a sync test client portal publishing into a server loop)."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            fn()
+            return
+        try:
+            self._loop.call_soon_threadsafe(fn)
+        except RuntimeError:
+            pass  # writer loop already closed
+
+    def _stop(self, close_code: int | None = None) -> None:
+        """Cancel the writer and optionally close the socket, on the writer's loop."""
+        def stop():
+            if self._task is not None and self._task is not asyncio.current_task():
+                self._task.cancel()
+            if close_code is not None:
+                self._loop.create_task(_close(self.ws, close_code))
+        self._call_soon(stop)
+
+    async def _run(self, hub: "BroadcastHub") -> None:
+        reason = "closed"
+        try:
+            while True:
+                while not self._queue:
+                    self._wake.clear()
+                    await self._wake.wait()
+                frame = self._queue.popleft()
+                if frame.key is not None and self._keyed.get(frame.key) is frame:
+                    del self._keyed[frame.key]
+                # asyncio.timeout rather than wait_for: on 3.11 wait_for can swallow a
+                # cancel that races with a completed send, leaving the writer unkillable
+                timeout = settings.ws_send_timeout
+                async with asyncio.timeout(timeout if timeout > 0 else None):
+                    await self.ws.send_text(frame.text)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except TimeoutError:
+            reason = "send timeout"
+        except Exception as e:
+            reason = f"send failed: {e}"
+        logger.warning("WebSocket writer for agent_id=%s stopped: %s", self.agent_id, reason)
+        hub._discard(self)
+
+
+class BroadcastHub:
+    """Registry of live connections; ``publish`` is a non-blocking enqueue."""
+
+    def __init__(self):
+        self._conns: dict[int, Connection] = {}  # id(ws) -> Connection
+        # totals, including connections that are already gone
+        self.published = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.slow_disconnects = 0
+
+    def __len__(self) -> int:
+        return len(self._conns)
+
+    def register(self, agent_id: int, ws, on_close: Callable | None = None,
+                 channels: Iterable[str] = ()) -> Connection:
+        """Start a writer task for ``ws``. ``on_close(agent_id, ws)`` runs once if the
+        hub gives up on the socket (send error, timeout, slow-consumer disconnect).
+        ``channels``: opt-in frame channels this client also wants."""
+        self.unregister(ws)
+        conn = Connection(agent_id, ws, on_close, frozenset(channels))
+        conn._task = asyncio.create_task(conn._run(self))
+        self._conns[id(ws)] = conn
+        return conn
+
+    def unregister(self, ws) -> None:
+        """Forget ``ws`` (the caller is tearing it down); queued frames are discarded."""
+        conn = self._conns.pop(id(ws), None)
+        if conn is None:
+            return
+        self._retire(conn)
+        conn._stop()
+
+    def publish(self, text: str, coalesce_key: Hashable | None = None, channel: str | None = None) -> int:
+        """Queue ``text`` for every connection (on ``channel``: only its subscribers);
+        returns how many accepted it."""
+        maxsize = max(1, settings.ws_send_queue_size)
+        policy = settings.ws_slow_consumer_policy
+        self.published += 1
+        accepted = 0
+        for conn in list(self._conns.values()):
+            if channel is not None and channel not in conn.channels:
+                continue
+            if self._offer(conn, text, coalesce_key, maxsize, policy):
+                accepted += 1
+        return accepted
+
+    def send(self, ws, text: str) -> bool:
+        """Queue ``text`` for a single connection (heartbeats, direct replies)."""
+        conn = self._conns.get(id(ws))
+        if conn is None:
+            return False
+        return self._offer(conn, text, None, max(1, settings.ws_send_queue_size),
+                           settings.ws_slow_consumer_policy)
+
+    def _offer(self, conn: Connection, text: str, key, maxsize: int, policy: str) -> bool:
+        if conn._offer(text, key, maxsize, policy):
+            return True
+        self.slow_disconnects += 1
+        logger.warning("Disconnecting slow WebSocket client agent_id=%s (queue full)", conn.agent_id)
+        self._discard(conn)
+        conn._stop(close_code=SLOW_CONSUMER_CLOSE_CODE)
+        return False
+
+    def _discard(self, conn: Connection) -> None:
+        """Drop a connection the hub gave up on and tell its owner."""
+        if self._conns.get(id(conn.ws)) is conn:
+            del self._conns[id(conn.ws)]
+        if conn.closed:
+            return
+        self._retire(conn)
+        if conn.on_close is not None:
+            try:
+                conn.on_close(conn.agent_id, conn.ws)
+            except Exception as e:
+                logger.warning("on_close callback failed for agent_id=%s: %s", conn.agent_id, e)
+
+    def _retire(self, conn: Connection) -> None:
+        if conn.closed:
+            return
+        conn.closed = True
+        self.sent += conn.sent
+        self.dropped += conn.dropped
+        self.coalesced += conn.coalesced
+
+    def stats(self) -> dict:
+        conns = list(self._conns.values())
+        depths = [c.depth for c in conns]
+        return {
+            "connections": len(conns),
+            "policy": settings.ws_slow_consumer_policy,
+            "queue_size": settings.ws_send_queue_size,
+            "published": self.published,
+            "sent": self.sent + sum(c.sent for c in conns),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "dropped": self.dropped + sum(c.dropped for c in conns),
+            "coalesced": self.coalesced + sum(c.coalesced for c in conns),
+            "slow_disconnects": self.slow_disconnects,
+            "lagging": [
+                {"agent_id": c.agent_id, "depth": c.depth, "dropped": c.dropped}
+                for c in sorted(conns, key=lambda c: c.depth, reverse=True)[:10] if c.depth
+            ],
+        }
+
+
+broadcast_hub = BroadcastHub()
@@ -3,6 +3,7 @@ import logging
 from datetime import datetime, timezone
 from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from ..core.database import after_commit, commit
 from ..models import Agent, Building, BuildingWorker, Resource, AgentResource, ProductionLog
 
 HUMAN_ID = 0
@@ -74,9 +75,9 @@ async def construct_building(
     await db.flush()
 
     estimated = recipe["construction_days"]
-    await db.commit()
+    await commit(db)
 
-    await _broadcast_city_event("building_construction_started", {
+    await after_commit(db, _broadcast_city_event, "building_construction_started", {
         "building_id": building.id,
         "building_type": building_type,
         "name": name,
@@ -155,12 +156,12 @@ async def transfer_resource(from_agent_id: int, to_agent_id: int, resource_type:
     to_res = await _get_or_create_agent_resource(to_agent_id, resource_type, db)
     from_res.quantity -= quantity
     to_res.quantity += quantity
-    await db.commit()
+    await commit(db)
 
     # M5.1: 广播转赠事件
     from_agent = await db.get(Agent, from_agent_id)
     to_agent = await db.get(Agent, to_agent_id)
-    await _broadcast_city_event("resource_transferred", {
+    await after_commit(db, _broadcast_city_event, "resource_transferred", {
         "from_agent_id": from_agent_id,
         "from_agent_name": from_agent.name if from_agent else f"Agent#{from_agent_id}",
         "to_agent_id": to_agent_id,
@@ -270,8 +271,8 @@ async def assign_worker(city: str, building_id: int, agent_id: int, db: AsyncSes
         return {"ok": False, "reason": "已在其他建筑工作，请先离职"}
 
     db.add(BuildingWorker(building_id=building_id, agent_id=agent_id))
-    await db.commit()
-    await _broadcast_city_event("worker_assigned", {
+    await commit(db)
+    await after_commit(db, _broadcast_city_event, "worker_assigned", {
         "agent_id": agent_id, "building_id": building_id,
     })
     return {"ok": True, "reason": "分配成功"}
@@ -287,8 +288,8 @@ async def remove_worker(city: str, building_id: int, agent_id: int, db: AsyncSes
     if not bw:
         return {"ok": False, "reason": "该工人不在此建筑"}
     await db.delete(bw)
-    await db.commit()
-    await _broadcast_city_event("worker_unassigned", {
+    await commit(db)
+    await after_commit(db, _broadcast_city_event, "worker_unassigned", {
         "agent_id": agent_id, "building_id": building_id,
     })
     return {"ok": True, "reason": "移除成功"}
@@ -319,8 +320,8 @@ async def eat_food(agent_id: int, db: AsyncSession) -> dict:
     agent.satiety = min(100, agent.satiety + 30)
     agent.mood = min(100, agent.mood + 10)
     agent.stamina = min(100, agent.stamina + 20)
-    await db.commit()
-    await _broadcast_city_event("agent_ate", {
+    await commit(db)
+    await after_commit(db, _broadcast_city_event, "agent_ate", {
         "agent_id": agent_id, "satiety": agent.satiety, "mood": agent.mood, "stamina": agent.stamina,
     })
     return {"ok": True, "reason": "吃饱了", "satiety": agent.satiety, "mood": agent.mood, "stamina": agent.stamina}
@@ -5,6 +5,7 @@ from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..models import Agent
+from .world_state import world_state
 
 HUMAN_ID = 0
 
@@ -65,7 +66,10 @@ class EconomyService:
             .where(Agent.id == agent_id, Agent.credits > 0)
             .values(credits=Agent.credits - 1)
         )
-        return result.rowcount > 0
+        if result.rowcount > 0:
+            world_state.touch_agents(agent_id, db=db)
+            return True
+        return False
 
     async def transfer_credits(
         self, from_id: int, to_id: int, amount: int, db: AsyncSession
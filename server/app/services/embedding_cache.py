@@ -0,0 +1,117 @@
+"""Content-addressed cache for embedding vectors.
+
+Keys are ``sha256(model, dim, text)``, so a model or dimension change never
+serves stale vectors. Lookups go through a bounded in-memory LRU first and,
+when ``settings.embedding_cache_path`` is set, a small SQLite table that
+survives restarts. The persistent tier uses the stdlib ``sqlite3`` module on a
+separate file: lookups are single primary-key reads and are cheap enough to
+run inline.
+"""
+
+import hashlib
+import logging
+import sqlite3
+from collections import OrderedDict
+from pathlib import Path
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(text: str, model: str | None = None, dim: int | None = None) -> str:
+    model = settings.embedding_model if model is None else model
+    dim = settings.embedding_dim if dim is None else dim
+    return hashlib.sha256(f"{model}\0{dim}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Two-tier (memory LRU + optional SQLite) embedding cache with hit counters."""
+
+    def __init__(self, max_entries: int = 4096, path: str = ""):
+        self.max_entries = max_entries
+        self._lru: OrderedDict[str, bytes] = OrderedDict()
+        self._db: sqlite3.Connection | None = None
+        self._path = path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            self._open(path)
+
+    def _open(self, path: str) -> None:
+        try:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL)"
+            )
+        except sqlite3.Error as e:
+            logger.warning("Embedding cache %s unavailable, using memory only: %s", path, e)
+            self._db = None
+
+    def get(self, text: str) -> bytes | None:
+        key = cache_key(text)
+        blob = self._lru.get(key)
+        if blob is not None:
+            self._lru.move_to_end(key)
+            self.hits += 1
+            return blob
+        if self._db is not None:
+            try:
+                row = self._db.execute("SELECT vec FROM embeddings WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning("Embedding cache read failed: %s", e)
+                row = None
+            if row is not None:
+                self._remember(key, row[0])
+                self.hits += 1
+                self.disk_hits += 1
+                return row[0]
+        self.misses += 1
+        return None
+
+    def put(self, text: str, blob: bytes) -> None:
+        self.put_many([text], [blob])
+
+    def put_many(self, texts: list[str], blobs: list[bytes]) -> None:
+        keys = [cache_key(t) for t in texts]
+        for key, blob in zip(keys, blobs):
+            self._remember(key, blob)
+        if self._db is not None and keys:
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)", list(zip(keys, blobs))
+                )
+            except sqlite3.Error as e:
+                logger.warning("Embedding cache write failed: %s", e)
+
+    def _remember(self, key: str, blob: bytes) -> None:
+        self._lru[key] = blob
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._lru),
+            "max_entries": self.max_entries,
+            "persistent": self._db is not None,
+        }
+
+    def clear(self) -> None:
+        """Drop the in-memory tier and reset counters (the SQLite tier is kept)."""
+        self._lru.clear()
+        self.hits = self.disk_hits = self.misses = 0
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,69 @@
+"""Storage codecs for ``Memory.embedding`` blobs.
+
+Three layouts are supported and told apart by blob length alone, so rows
+written under different ``settings.embedding_storage`` values can coexist
+(e.g. half-way through a migration):
+
+* ``float32`` -- ``dim * 4`` bytes, the raw API output
+* ``float16`` -- ``dim * 2`` bytes
+* ``int8``    -- 4-byte float32 scale followed by ``dim`` int8 codes,
+  ``value = code * scale`` with ``scale = max(|v|) / 127`` per vector
+"""
+
+import numpy as np
+
+FORMATS = ("float32", "float16", "int8")
+
+
+def blob_size(fmt: str, dim: int) -> int:
+    if fmt == "float32":
+        return dim * 4
+    if fmt == "float16":
+        return dim * 2
+    if fmt == "int8":
+        return dim + 4
+    raise ValueError(f"Unknown embedding storage format: {fmt!r}")
+
+
+def detect_format(blob: bytes, dim: int) -> str | None:
+    for fmt in FORMATS:
+        if len(blob) == blob_size(fmt, dim):
+            return fmt
+    return None
+
+
+def quantize_int8(vecs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Per-row symmetric int8 quantization; returns (codes, scales)."""
+    vecs = np.asarray(vecs, dtype=np.float32)
+    scales = np.abs(vecs).max(axis=-1) / 127.0
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    codes = np.clip(np.rint(vecs / scales[..., None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+def encode(vec: np.ndarray | bytes, fmt: str) -> bytes:
+    """Encode one float32 vector (array or raw float32 bytes) as ``fmt``."""
+    if isinstance(vec, (bytes, bytearray)):
+        vec = np.frombuffer(vec, dtype=np.float32)
+    vec = np.asarray(vec, dtype=np.float32).reshape(-1)
+    if fmt == "float32":
+        return vec.tobytes()
+    if fmt == "float16":
+        return vec.astype(np.float16).tobytes()
+    if fmt == "int8":
+        codes, scale = quantize_int8(vec)
+        return np.float32(scale).tobytes() + codes.tobytes()
+    raise ValueError(f"Unknown embedding storage format: {fmt!r}")
+
+
+def decode(blob: bytes, dim: int) -> np.ndarray | None:
+    """Decode a stored blob to a float32 vector; None if the length matches no format."""
+    fmt = detect_format(blob, dim)
+    if fmt == "float32":
+        return np.frombuffer(blob, dtype=np.float32)
+    if fmt == "float16":
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    if fmt == "int8":
+        scale = np.frombuffer(blob[:4], dtype=np.float32)[0]
+        return np.frombuffer(blob[4:], dtype=np.int8).astype(np.float32) * scale
+    return None
@@ -0,0 +1,144 @@
+"""LLM 输出里的 JSON 提取：单遍括号扫描找候选片段，逐个解析取最佳动作数组（线性时间）"""
+
+import json
+import re
+from typing import Any, Iterator
+
+_OPENERS = {"[": "]", "{": "}"}
+_OPEN = re.compile(r"[\[{]")
+_INNER = re.compile(r'[\[\]{}"]')
+_STRING_BODY = re.compile(r'(?:[^"\\\n]|\\.)*["\n]?')  # 开头引号之后：到结尾引号或换行为止
+_TRAILING_COMMA = re.compile(r'("(?:[^"\\\n]|\\.)*")|,(?=\s*[\]}])')
+_decoder = json.JSONDecoder()
+MAX_HEIGHT = 32  # 动作数组本身只有三四层括号
+WORK_BUDGET_FACTOR = 4  # 解析的字符数最多是原文长度的 4 倍（兜底）
+
+
+def iter_spans(text: str) -> Iterator[tuple[int, int, int]]:
+    """Balanced ``[...]`` / ``{...}`` spans as ``(start, end, height)``, in document order (end is exclusive).
+
+    One pass; outer spans come before the spans nested in them. Quotes only count inside a
+    bracket (prose around the JSON is ignored) and a raw newline ends a string. Closers that do
+    not match are skipped, and openers that never close yield no span of their own.
+    """
+    # 平行数组而不是每个 span 一个对象：百万级 span 时不给 GC 添负担
+    starts: list[int] = []
+    ends: list[int] = []
+    heights: list[int] = []
+    stack: list[int] = []  # 未闭合左括号在 starts 里的下标
+    pos = 0
+    while True:
+        # 括号外只找左括号（右括号、引号都是正文）；括号内字符串整段用正则跳过
+        m = (_INNER if stack else _OPEN).search(text, pos)
+        if m is None:
+            break
+        i = m.start()
+        ch = text[i]
+        pos = i + 1
+        if ch == '"':
+            pos = _STRING_BODY.match(text, pos).end()
+        elif ch in _OPENERS:
+            stack.append(len(starts))
+            starts.append(i)
+            ends.append(-1)
+            heights.append(0)
+        else:
+            depth = len(stack) - 1
+            floor = max(-1, depth - MAX_HEIGHT)  # 往下最多找 MAX_HEIGHT 层，避免成串的错配右括号反复扫整个栈
+            while depth > floor and _OPENERS[text[starts[stack[depth]]]] != ch:
+                depth -= 1
+            if depth == floor:
+                continue  # 多余的右括号
+            k = stack[depth]
+            height = max(heights[j] for j in stack[depth:])  # 中间没闭合的左括号作废，里面的 span 归到这一层
+            del stack[depth:]
+            ends[k] = i + 1
+            heights[k] = height + 1
+            if stack:
+                parent = stack[-1]
+                heights[parent] = max(heights[parent], height + 1)
+    for k, end in enumerate(ends):
+        if end > 0:
+            yield starts[k], end, heights[k]
+
+
+def _strip_trailing_commas(s: str) -> str:
+    return _TRAILING_COMMA.sub(lambda m: m.group(1) or "", s)
+
+
+def _decode(text: str, start: int, end: int) -> Any:
+    """Decode ``text[start:end]`` as one JSON value; raises ``json.JSONDecodeError`` (position relative to the span)."""
+    # 先切片再解析：JSONDecodeError 会从文档开头数行号，在整段原文上原地解析，每次失败都是 O(位置)
+    chunk = text[start:end]
+    try:
+        value, stop = _decoder.raw_decode(chunk)
+    except json.JSONDecodeError as e:
+        if not (0 < e.pos < len(chunk) and chunk[e.pos] in "]}" and chunk[:e.pos].rstrip().endswith(",")):
+            raise
+        try:
+            return json.loads(_strip_trailing_commas(chunk))
+        except json.JSONDecodeError:
+            raise e from None
+    if stop != len(chunk):
+        raise json.JSONDecodeError("span is not a single value", chunk, stop)
+    return value
+
+
+def looks_like_action(item: Any) -> bool:
+    return isinstance(item, dict) and "agent_id" in item and "action" in item
+
+
+def _action_lists(value: Any):
+    """Action arrays inside a decoded value: lists holding action dicts (or empty), ``{"actions": [...]}``."""
+    if isinstance(value, list):
+        if not value or any(looks_like_action(v) for v in value):
+            yield value
+            return
+        for v in value:
+            yield from _action_lists(v)
+    elif isinstance(value, dict):
+        actions = value.get("actions")
+        if isinstance(actions, list):
+            yield actions
+            return
+        for v in value.values():
+            yield from _action_lists(v)
+
+
+def extract_actions(text: str) -> list | None:
+    """The best action array in ``text``, or ``None`` when there is none.
+
+    Spans nested in a decoded span, and those containing the position where an outer span failed
+    to decode, are skipped; spans taller than ``MAX_HEIGHT`` are only decoded through their inner
+    spans. That bounds how many decodes touch any character. The array with the most
+    action-shaped entries wins, ties going to the later one; ``{"actions": [...]}`` counts as its
+    inner array.
+    """
+    text = text or ""
+    best: list | None = None
+    best_score = -1
+    budget = WORK_BUDGET_FACTOR * len(text)
+    skip_before = 0  # 已成功解析的 span 的结尾：它里面的 span 不再单独解析
+    failed_at: list[int] = []  # 失败位置（升序）：包含它的内层 span 同样会失败
+    for start, end, height in iter_spans(text):
+        if start < skip_before or height > MAX_HEIGHT:
+            continue
+        while failed_at and failed_at[-1] < start:
+            failed_at.pop()
+        if failed_at and end > failed_at[-1]:
+            continue
+        try:
+            value = _decode(text, start, end)
+        except json.JSONDecodeError as e:
+            budget -= e.pos + 1
+            failed_at.append(start + e.pos)
+        else:
+            budget -= end - start
+            skip_before = end
+            for actions in _action_lists(value):
+                score = sum(looks_like_action(a) for a in actions)
+                if score >= best_score:  # 同分取后出现的（推理文本里最终答案一般在最后）
+                    best, best_score = actions, score
+        if budget < 0:
+            break
+    return best
@@ -2,6 +2,7 @@
 import logging
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
+from ..core.database import after_commit, commit
 from ..models import AgentResource
 from ..models.tables import MarketOrder, TradeLog
 
@@ -61,15 +62,12 @@ async def create_order(
         status="open",
     )
     db.add(order)
-    await db.flush()
-
-    await _broadcast_market_event("order_created", {
+    await commit(db)
+    await after_commit(db, _broadcast_market_event, "order_created", {
         "order_id": order.id, "seller_id": seller_id,
         "sell_type": sell_type, "sell_amount": sell_amount,
         "buy_type": buy_type, "buy_amount": buy_amount,
     })
-
-    await db.commit()
     return {"ok": True, "order_id": order.id}
 
 
@@ -145,15 +143,12 @@ async def accept_order(
         buy_type=order.buy_type, buy_amount=trade_buy,
     )
     db.add(log)
-    await db.flush()
-
-    await _broadcast_market_event("order_traded", {
+    await commit(db)
+    await after_commit(db, _broadcast_market_event, "order_traded", {
         "order_id": order.id, "seller_id": order.seller_id, "buyer_id": buyer_id,
         "sell_type": order.sell_type, "sell_amount": trade_sell,
         "buy_type": order.buy_type, "buy_amount": trade_buy,
     })
-
-    await db.commit()
     return {"ok": True, "trade_sell": trade_sell, "trade_buy": trade_buy, "order_status": order.status}
 
 
@@ -178,13 +173,10 @@ async def cancel_order(seller_id: int, order_id: int, *, db: AsyncSession) -> di
     ar.frozen_amount -= order.remain_sell_amount
 
     order.status = "cancelled"
-    await db.flush()
-
-    await _broadcast_market_event("order_cancelled", {
+    await commit(db)
+    await after_commit(db, _broadcast_market_event, "order_cancelled", {
         "order_id": order.id, "seller_id": seller_id,
     })
-
-    await db.commit()
     return {"ok": True}
 
 
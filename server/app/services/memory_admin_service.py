@@ -1,7 +1,8 @@
 """记忆管理服务 — 供 REST API 使用的查询/统计功能"""
-from sqlalchemy import select, func
+from sqlalchemy import select, func, text, column
 from sqlalchemy.ext.asyncio import AsyncSession
 from ..models import Memory, MemoryReference
+from . import memory_fts, vector_store
 
 
 async def list_memories(
@@ -16,7 +17,12 @@ async def list_memories(
     if memory_type is not None:
         q = q.where(Memory.memory_type == memory_type)
     if keyword:
-        q = q.where(Memory.content.ilike(f"%{keyword}%"))
+        match = memory_fts.phrase_query(keyword)
+        if match is not None and await memory_fts.available(db):
+            fts_ids = text("SELECT rowid FROM memories_fts WHERE memories_fts MATCH :fts_match")
+            q = q.where(Memory.id.in_(fts_ids.bindparams(fts_match=match).columns(column("rowid"))))
+        else:  # 少于 3 个字符 trigram 无法命中，或库里没有 FTS 表
+            q = q.where(Memory.content.ilike(f"%{keyword}%"))
     q = q.order_by(Memory.created_at.desc())
 
     # 总数
@@ -111,6 +117,8 @@ async def update_memory(
     if memory_type is not None:
         m.memory_type = memory_type
     await db.commit()
+    if memory_type is not None:
+        vector_store.set_memory_type(memory_id, memory_type)
     await db.refresh(m)
     return {
         "id": m.id, "agent_id": m.agent_id,
@@ -128,4 +136,5 @@ async def delete_memory(memory_id: int, db: AsyncSession) -> bool:
         return False
     await db.delete(m)
     await db.commit()
+    await vector_store.delete_memory(memory_id)
     return True
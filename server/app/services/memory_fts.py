@@ -0,0 +1,88 @@
+"""Keyword search over ``memories.content`` through the ``memories_fts`` FTS5 table.
+
+The table uses the trigram tokenizer, so any substring of 3+ characters is
+indexed regardless of script -- Chinese text needs no word segmentation.
+Shorter keywords cannot use the index; callers fall back to ``LIKE``.
+The table is optional (SQLite builds without FTS5, old test fixtures):
+``available()`` reports whether it exists for the session's database.
+"""
+
+import logging
+import re
+import weakref
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+MIN_TERM = 3  # trigram tokenizer cannot match anything shorter
+MAX_QUERY_TRIGRAMS = 32  # cap for hybrid queries built from long chat context
+
+_SKIP = re.compile(r"[\s\W_]", re.UNICODE)
+
+# sync engine -> whether memories_fts exists (checked once per database)
+_available: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+async def available(db: AsyncSession) -> bool:
+    engine = db.bind.sync_engine if db.bind is not None else None
+    if engine is not None and engine in _available:
+        return _available[engine]
+    row = (await db.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'memories_fts'"
+    ))).first()
+    if engine is not None:
+        _available[engine] = row is not None
+    return row is not None
+
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def phrase_query(keyword: str) -> str | None:
+    """MATCH expression equivalent to ``content LIKE '%keyword%'`` (None if too short)."""
+    keyword = keyword.strip()
+    if len(keyword) < MIN_TERM:
+        return None
+    return _quote(keyword)
+
+
+def trigram_query(query: str, limit: int = MAX_QUERY_TRIGRAMS) -> str | None:
+    """OR of the query's distinct trigrams, for BM25 relevance against free text.
+
+    Trigrams spanning whitespace or punctuation carry no signal and are skipped.
+    """
+    grams: dict[str, None] = {}
+    q = query.lower()
+    for i in range(len(q) - MIN_TERM + 1):
+        gram = q[i:i + MIN_TERM]
+        if _SKIP.search(gram):
+            continue
+        grams[gram] = None
+        if len(grams) >= limit:
+            break
+    if not grams:
+        return None
+    return " OR ".join(_quote(g) for g in grams)
+
+
+async def keyword_scores(
+    db: AsyncSession, query: str, agent_id: int, limit: int,
+) -> dict[int, float]:
+    """Top ``limit`` embedded memories visible to ``agent_id`` by BM25.
+
+    Returns ``{memory_id: relevance}`` with relevance = -bm25 (higher is better).
+    """
+    match = trigram_query(query)
+    if match is None or not await available(db):
+        return {}
+    rows = (await db.execute(text(
+        "SELECT m.id, bm25(memories_fts) FROM memories_fts "
+        "JOIN memories m ON m.id = memories_fts.rowid "
+        "WHERE memories_fts MATCH :match AND m.embedding IS NOT NULL "
+        "AND (m.agent_id = :agent_id OR m.agent_id IS NULL) "
+        "ORDER BY bm25(memories_fts) LIMIT :limit"
+    ), {"match": match, "agent_id": agent_id, "limit": limit})).all()
+    return {mid: -score for mid, score in rows}
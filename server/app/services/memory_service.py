@@ -1,20 +1,30 @@
+import asyncio
 import logging
+import time
+from collections import Counter
 from datetime import datetime, timedelta, timezone
 
-from sqlalchemy import select, delete
+from sqlalchemy import case, delete, func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import defer
 
-from ..models import Memory, MemoryType
+from ..models import Memory, MemoryReference, MemoryType
 from . import vector_store
 
 logger = logging.getLogger(__name__)
 
 SHORT_MEMORY_TTL_DAYS = 7
 PROMOTE_THRESHOLD = 5
+FLUSH_CHUNK = 500  # ids per UPDATE ... CASE (3 bound params each)
+CLEANUP_CHUNK = 1000  # expired rows deleted per transaction
 
 
 class MemoryService:
 
+    def __init__(self):
+        # memory_id -> hits not yet written; flushed by flush_access_counts()
+        self._pending_hits: Counter[int] = Counter()
+
     async def save_memory(
         self, agent_id: int | None, content: str, memory_type: MemoryType, db: AsyncSession
     ) -> Memory:
@@ -42,6 +52,7 @@ class MemoryService:
         except Exception as e:
             logger.error("Vector upsert failed for memory %d, deleting SQLite row: %s", memory_id, e)
             await db.rollback()
+            vector_store.remove_from_indexes([memory_id])
             await db.execute(delete(Memory).where(Memory.id == memory_id))
             await db.commit()
             raise
@@ -59,39 +70,136 @@ class MemoryService:
             return results
 
         memory_ids = [r["memory_id"] for r in results]
-        stmt = select(Memory).where(Memory.id.in_(memory_ids))
-        rows = (await db.execute(stmt)).scalars().all()
+        found = await self._load(memory_ids, db)
 
-        if len(rows) != len(memory_ids):
-            found_ids = {m.id for m in rows}
-            orphans = [mid for mid in memory_ids if mid not in found_ids]
+        if len(found) != len(memory_ids):
+            orphans = [mid for mid in memory_ids if mid not in found]
             logger.warning("Vector/SQLite mismatch: orphan memory_ids=%s", orphans)
 
-        for mem in rows:
-            mem.access_count += 1
-            if mem.memory_type == MemoryType.SHORT and mem.access_count >= PROMOTE_THRESHOLD:
-                mem.memory_type = MemoryType.LONG
-                mem.expires_at = None
-
-        await db.commit()
-
+        self._pending_hits.update(found.keys())
         # Preserve vector similarity ranking
-        row_map = {m.id: m for m in rows}
-        return [row_map[mid] for mid in memory_ids if mid in row_map]
+        return [found[mid] for mid in memory_ids if mid in found]
 
-    async def cleanup_expired(self, db: AsyncSession) -> int:
-        now = datetime.now(timezone.utc)
-        stmt = select(Memory).where(
-            Memory.memory_type == MemoryType.SHORT,
-            Memory.expires_at < now,
-        )
-        expired = (await db.execute(stmt)).scalars().all()
+    async def search_many(
+        self, queries: dict[int, str], top_k: int = 5, db: AsyncSession | None = None
+    ) -> dict[int, list[Memory]]:
+        """Batched ``search`` for several agents (``{agent_id: query}``).
 
-        for mem in expired:
-            await db.delete(mem)
+        Retrieval is batched in vector_store and the hit rows are loaded with
+        one SELECT; a memory hit by several agents counts once per agent.
+        """
+        results = await vector_store.search_memories_many(queries, top_k, db)
+        if db is None:
+            return {agent_id: [] for agent_id in queries}
+
+        found = await self._load({r["memory_id"] for hits in results.values() for r in hits}, db)
+        for hits in results.values():
+            self._pending_hits.update(r["memory_id"] for r in hits if r["memory_id"] in found)
+        return {
+            agent_id: [found[r["memory_id"]] for r in hits if r["memory_id"] in found]
+            for agent_id, hits in results.items()
+        }
+
+    async def _load(self, ids, db: AsyncSession) -> dict[int, Memory]:
+        """Hit rows by id, without the embedding blob (never needed for prompts)."""
+        if not ids:
+            return {}
+        rows = (await db.execute(
+            select(Memory).where(Memory.id.in_(list(ids))).options(defer(Memory.embedding))
+        )).scalars().all()
+        return {m.id: m for m in rows}
+
+    @property
+    def pending_hits(self) -> int:
+        return len(self._pending_hits)
+
+    async def flush_access_counts(self, db: AsyncSession) -> int:
+        """Write buffered hits: ``access_count += n`` via one ``UPDATE ... CASE`` per
+        chunk, then promote every hot short-term memory among them set-wise.
+
+        Returns the number of memories updated. On failure the hits are put back
+        so the next flush retries them.
+        """
+        if not self._pending_hits:
+            return 0
+        pending, self._pending_hits = self._pending_hits, Counter()
+        items = list(pending.items())
+        promoted: list[int] = []
+        try:
+            for start in range(0, len(items), FLUSH_CHUNK):
+                chunk = dict(items[start:start + FLUSH_CHUNK])
+                ids = list(chunk)
+                await db.execute(
+                    update(Memory)
+                    .where(Memory.id.in_(ids))
+                    .values(access_count=func.coalesce(Memory.access_count, 0) + case(chunk, value=Memory.id, else_=0))
+                    .execution_options(synchronize_session=False)
+                )
+                promoted += (await db.execute(
+                    update(Memory)
+                    .where(
+                        Memory.id.in_(ids),
+                        Memory.memory_type == MemoryType.SHORT,
+                        Memory.access_count >= PROMOTE_THRESHOLD,
+                    )
+                    .values(memory_type=MemoryType.LONG, expires_at=None)
+                    .returning(Memory.id)
+                    .execution_options(synchronize_session=False)
+                )).scalars().all()
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            self._pending_hits.update(pending)
+            raise
 
-        await db.commit()
-        return len(expired)
+        for mid in promoted:
+            vector_store.set_memory_type(mid, MemoryType.LONG)
+        if promoted:
+            logger.info("Promoted %d short-term memories to long-term", len(promoted))
+        return len(items)
+
+    async def cleanup_expired(self, db: AsyncSession, chunk_size: int = CLEANUP_CHUNK) -> int:
+        """Delete expired short-term memories in chunks of ``chunk_size``.
+
+        Each chunk is one indexed id scan plus set-based DELETEs of the rows and
+        their ``memory_references``, committed on its own so the SQLite write
+        lock is released (and the event loop yielded) between chunks. Returns
+        the number of memories deleted.
+        """
+        await self.flush_access_counts(db)  # apply pending promotions before expiring
+        now = datetime.now(timezone.utc)
+        started = time.perf_counter()
+        total = 0
+        while True:
+            ids = (await db.execute(
+                select(Memory.id)
+                .where(Memory.memory_type == MemoryType.SHORT, Memory.expires_at < now)
+                .limit(chunk_size)
+            )).scalars().all()
+            if not ids:
+                break
+            await db.execute(
+                delete(MemoryReference).where(MemoryReference.memory_id.in_(ids))
+                .execution_options(synchronize_session=False)
+            )
+            await db.execute(
+                delete(Memory).where(Memory.id.in_(ids))
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            vector_store.remove_from_indexes(ids)
+            total += len(ids)
+            if len(ids) < chunk_size:
+                break
+            await asyncio.sleep(0)
+
+        elapsed = time.perf_counter() - started
+        if total:
+            logger.info(
+                "Expired-memory cleanup: %d rows in %.2fs (%.0f rows/s)",
+                total, elapsed, total / elapsed if elapsed > 0 else float("inf"),
+            )
+        return total
 
 
 memory_service = MemoryService()
@@ -0,0 +1,156 @@
+"""唤醒选人的本地打分（关键词相关度 / 点名 / 最近发言），拿不准时才问模型，模型的选择按上下文缓存"""
+
+import math
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from ..core.config import settings
+
+_LATIN = re.compile(r"[a-z0-9]+")
+_CJK = re.compile(r"[\u3400-\u9fff]+")
+_NORMALISE = re.compile(r"[\W_]+")
+
+NAME_BONUS = 10.0
+LAST_SPEAKER_BONUS = 1.0
+FLAGGED_FACTOR = 0.5
+
+MISSING = object()
+
+
+def terms(text: str) -> set[str]:
+    """Latin words (2+ chars) and CJK character bigrams (single chars for 1-char runs)."""
+    text = (text or "").lower()
+    out = {w for w in _LATIN.findall(text) if len(w) > 1}
+    for run in _CJK.findall(text):
+        if len(run) == 1:
+            out.add(run)
+        out.update(run[i:i + 2] for i in range(len(run) - 1))
+    return out
+
+
+def normalise(text: str) -> str:
+    """Fingerprint form of a message: lower-case, punctuation and whitespace dropped."""
+    return _NORMALISE.sub("", (text or "").lower())
+
+
+def _domains(agent) -> list[str]:
+    pj = getattr(agent, "personality_json", None)
+    domains = pj.get("knowledge_domains") if isinstance(pj, dict) else None
+    return [d for d in domains or () if isinstance(d, str)]
+
+
+@dataclass
+class Decision:
+    agent_id: int | None
+    confident: bool
+    scores: dict[int, float]
+
+    @property
+    def top(self) -> int | None:
+        """Best-scoring candidate, whether or not the scorer is confident about it."""
+        return max(self.scores, key=self.scores.get) if self.scores else None
+
+
+class ResponderScorer:
+    def __init__(self):
+        self._profiles: dict[tuple, tuple[set[str], set[str]]] = {}
+
+    def _profile(self, agent) -> tuple[set[str], set[str]]:
+        """(persona terms, domain terms), memoised per persona / domain content."""
+        domains = _domains(agent)
+        key = (agent.id, agent.name, agent.persona, tuple(domains))
+        profile = self._profiles.get(key)
+        if profile is None:
+            if len(self._profiles) > 1024:
+                self._profiles.clear()
+            profile = self._profiles[key] = (
+                terms(f"{agent.name} {agent.persona or ''}"),
+                set().union(*(terms(d) for d in domains)) if domains else set(),
+            )
+        return profile
+
+    def score(self, content: str, candidates: list, recent: list, no_response: dict[int, int]) -> dict[int, float]:
+        """IDF-weighted term overlap with persona / knowledge domains, plus name and last-speaker bonuses."""
+        message_terms = terms(content)
+        profiles = {a.id: self._profile(a) for a in candidates}
+        df: dict[str, int] = {}
+        for persona_terms, domain_terms in profiles.values():
+            for t in (persona_terms | domain_terms) & message_terms:
+                df[t] = df.get(t, 0) + 1
+        n = len(candidates)
+        last_speaker = recent[-1].agent_id if recent else None
+        text = (content or "").lower()
+
+        scores = {}
+        for agent in candidates:
+            persona_terms, domain_terms = profiles[agent.id]
+            score = sum(
+                math.log(1 + n / df[t]) * (2.0 if t in domain_terms else 1.0)
+                for t in message_terms & (persona_terms | domain_terms)
+                if df[t] < n or n == 1
+            )
+            if agent.name and agent.name.lower() in text:
+                score += NAME_BONUS
+            if agent.id == last_speaker:
+                score += LAST_SPEAKER_BONUS
+            if no_response.get(agent.id, 0) >= 3:
+                score *= FLAGGED_FACTOR
+            scores[agent.id] = round(score, 3)
+        return scores
+
+    def decide(self, content: str, candidates: list, recent: list, no_response: dict[int, int],
+               *, from_agent: bool = False) -> Decision:
+        """Confident when the top score clears min_score by margin; agent chatter nobody fits wakes nobody."""
+        scores = self.score(content, candidates, recent, no_response)
+        ranked = sorted(scores.values(), reverse=True)
+        best = ranked[0] if ranked else 0.0
+        runner_up = ranked[1] if len(ranked) > 1 else 0.0
+        if best >= settings.wakeup_scorer_min_score and best - runner_up >= settings.wakeup_scorer_margin:
+            return Decision(max(scores, key=scores.get), True, scores)
+        if from_agent and best < settings.wakeup_scorer_min_score:
+            return Decision(None, True, scores)
+        return Decision(None, False, scores)
+
+
+class DecisionCache:
+    """TTL + LRU map from context fingerprint to the model's choice (``None`` = nobody)."""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[float, int | None]] = OrderedDict()
+
+    @staticmethod
+    def fingerprint(kind: str, content: str, candidates: list, recent: list,
+                    no_response: dict[int, int]) -> tuple:
+        ids = tuple(sorted(a.id for a in candidates))
+        flagged = tuple(i for i in ids if no_response.get(i, 0) >= 3)
+        last_speaker = recent[-1].agent_id if recent else None
+        if last_speaker not in ids:
+            last_speaker = None  # only a candidate speaking last changes the scores
+        return kind, normalise(content), ids, flagged, last_speaker
+
+    def get(self, key: tuple):
+        """Cached choice, or ``MISSING``."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+        stored_at, agent_id = entry
+        if time.monotonic() - stored_at > settings.wakeup_cache_ttl:
+            del self._entries[key]
+            return MISSING
+        self._entries.move_to_end(key)
+        return agent_id
+
+    def put(self, key: tuple, agent_id: int | None) -> None:
+        self._entries[key] = (time.monotonic(), agent_id)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
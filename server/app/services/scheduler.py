@@ -3,6 +3,7 @@
 
 - 每日 00:00：信用点发放 + 过期记忆清理
 - 每小时：autonomy tick（行为决策 + 聊天，统一循环）
+- 每 memory_access_flush_seconds 秒：记忆命中计数批量写回 + 短期记忆晋升
 - 使用 asyncio.sleep 实现，无外部依赖
 """
 import asyncio
@@ -11,10 +12,12 @@ from datetime import datetime, timezone, timedelta
 
 from sqlalchemy import update
 
+from ..core.config import settings
 from ..core.database import async_session
 from ..models import Agent
 from .memory_service import memory_service
 from . import autonomy_service
+from .world_state import world_state
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +34,7 @@ async def daily_grant(db_session_maker=None) -> int:
             .where(Agent.id != HUMAN_ID)
             .values(credits=Agent.credits + DAILY_CREDIT_GRANT)
         )
+        world_state.touch_all(db=db)
         await db.commit()
         return result.rowcount
 
@@ -43,6 +47,25 @@ async def daily_memory_cleanup(db_session_maker=None) -> int:
         return count
 
 
+async def flush_memory_access(db_session_maker=None) -> int:
+    """把内存里累积的记忆命中计数写回数据库，返回更新的记忆条数"""
+    if not memory_service.pending_hits:
+        return 0
+    maker = db_session_maker or async_session
+    async with maker() as db:
+        return await memory_service.flush_access_counts(db)
+
+
+async def memory_access_flush_loop():
+    """定期写回记忆命中计数（检索路径本身不再写库）"""
+    while True:
+        await asyncio.sleep(max(1, settings.memory_access_flush_seconds))
+        try:
+            await flush_memory_access()
+        except Exception as e:
+            logger.error("Memory access flush failed: %s", e)
+
+
 def _seconds_until_midnight() -> float:
     """计算到次日 00:00 UTC 的秒数"""
     now = datetime.now(timezone.utc)
@@ -1,6 +1,7 @@
 from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from ..core.database import rollback
 from ..models import Agent, VirtualItem, AgentItem
 
 
@@ -61,7 +62,7 @@ class ShopService:
         try:
             await db.flush()
         except IntegrityError as e:
-            await db.rollback()
+            await rollback(db)  # 批量执行时只回滚本条 action 的 SAVEPOINT
             err = str(e).lower()
             if "unique" in err or "uq_agent_item" in err:
                 return {"ok": False, "reason": "already_owned"}
@@ -1,18 +1,174 @@
-"""Agent 状态变更 + WebSocket 广播（F35）"""
+"""Agent 状态变更 + WebSocket 广播（F35）
+
+两种模式（settings.agent_status_mode）：
+- event：每次状态变化单独 commit + 广播一条 agent_status_change（兼容旧客户端）
+- batch：状态变化只记在内存里（同一 agent 只保留最新一条），到点后用一条
+  UPDATE ... CASE 批量写库，并广播一条 agent_status_batch 事件。
+  status_batch() 块内的变化在退出时统一刷出（autonomy tick 每个阶段一次）；
+  块外的变化在 agent_status_flush_ms 窗口内合并。
+"""
+import asyncio
+import contextvars
 import logging
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import case, inspect, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm.attributes import set_committed_value
 
-from ..models import AgentStatus
+from ..core.config import settings
+from ..core.database import engine
+from ..models import Agent, AgentStatus
 
 logger = logging.getLogger(__name__)
 
 
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+class StatusBatcher:
+    """待写回的状态变化：{bind: {agent_id: update}}，按数据库分组刷出"""
+
+    def __init__(self):
+        self._pending: dict = {}
+        self._timer: asyncio.Task | None = None
+        self.closed = False  # status_batch 块已退出，之后的变化改走全局批次
+
+    def __len__(self) -> int:
+        return sum(len(updates) for updates in self._pending.values())
+
+    def record(self, agent, status: AgentStatus, activity: str, db: AsyncSession):
+        bind = db.bind if db.bind is not None else engine
+        self._pending.setdefault(bind, {})[agent.id] = {
+            "agent_id": agent.id,
+            "agent_name": agent.name,
+            "status": status.value,
+            "activity": activity,
+            "timestamp": _now(),
+        }
+
+    def schedule(self, delay: float):
+        """delay 秒后自动刷出（已有定时器时不重复安排）"""
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later(delay))
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error("Agent status flush failed: %s", e)
+
+    async def flush(self) -> int:
+        """一个数据库一条 UPDATE + 一次 commit，全部变化合成一条广播；返回刷出的条数"""
+        pending, self._pending = self._pending, {}
+        updates: list[dict] = []
+        for bind, by_agent in pending.items():
+            statuses = {aid: u["status"] for aid, u in by_agent.items()}
+            activities = {aid: u["activity"] for aid, u in by_agent.items()}
+            try:
+                async with async_sessionmaker(bind, expire_on_commit=False)() as db:
+                    await db.execute(
+                        update(Agent)
+                        .where(Agent.id.in_(list(by_agent)))
+                        .values(
+                            status=case(statuses, value=Agent.id),
+                            activity=case(activities, value=Agent.id),
+                        )
+                        .execution_options(synchronize_session=False)
+                    )
+                    await db.commit()
+            except Exception as e:
+                # 没落库的状态不广播，免得客户端看到的和库里不一致
+                logger.warning("Agent status bulk update failed (%d agents): %s", len(by_agent), e)
+                continue
+            updates.extend(by_agent.values())
+        if not updates:
+            return 0
+
+        from ..api.chat import broadcast
+        await broadcast({
+            "type": "system_event",
+            "data": {
+                "event": "agent_status_batch",
+                "updates": updates,
+                "timestamp": _now(),
+            },
+        })
+        return len(updates)
+
+    def clear(self):
+        """丢弃未刷出的变化（测试隔离用）"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending = {}
+
+    async def flush_now(self) -> int:
+        """取消定时器并立即刷出"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return await self.flush()
+
+
+# tick 内的批次（status_batch 块）；块外用全局批次 + 定时刷出
+_current_batch: contextvars.ContextVar[StatusBatcher | None] = contextvars.ContextVar(
+    "agent_status_batch", default=None
+)
+_global_batch = StatusBatcher()
+
+
+@asynccontextmanager
+async def status_batch():
+    """块内所有 set_agent_status 合并，退出时一条 UPDATE + 一条 agent_status_batch 广播。
+    event 模式下不做任何事（块内照常逐条提交）。"""
+    if settings.agent_status_mode != "batch":
+        yield None
+        return
+    batch = StatusBatcher()
+    token = _current_batch.set(batch)
+    try:
+        yield batch
+    finally:
+        _current_batch.reset(token)
+        batch.closed = True
+        await batch.flush_now()
+
+
+async def flush_status_batch() -> int:
+    """立即刷出当前批次（块内刷块内的，块外刷全局批次）。
+    耗时阶段开始前调用，中间状态才能落库、广播出去，不会被同一块里后面的状态覆盖掉"""
+    if settings.agent_status_mode != "batch":
+        return 0
+    batch = _current_batch.get()
+    if batch is None or batch.closed:
+        batch = _global_batch
+    return await batch.flush_now()
+
+
+async def flush_agent_status() -> int:
+    """立即刷出块外累积的状态变化（如关闭服务前）"""
+    return await _global_batch.flush_now()
+
+
 async def set_agent_status(
     agent, status: AgentStatus, activity: str, db: AsyncSession
 ):
     """更新 Agent 状态 + activity，写入 DB 并广播 WebSocket 事件。"""
+    if settings.agent_status_mode == "batch":
+        _set_in_memory(agent, status.value, activity)
+        batch = _current_batch.get()
+        if batch is not None and not batch.closed:
+            batch.record(agent, status, activity, db)
+        else:
+            _global_batch.record(agent, status, activity, db)
+            _global_batch.schedule(max(0, settings.agent_status_flush_ms) / 1000)
+        return
+
     agent.status = status.value
     agent.activity = activity
     await db.commit()
@@ -26,6 +182,16 @@ async def set_agent_status(
             "agent_name": agent.name,
             "status": status.value,
             "activity": activity,
-            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "timestamp": _now(),
         },
-    })
+    }, coalesce_key=("agent_status", agent.id))  # 慢客户端只需要最新状态
+
+
+def _set_in_memory(agent, status: str, activity: str):
+    """更新对象上的值但不标脏：批量 UPDATE 负责写库，调用方 session 的 commit 不再重复写这一行"""
+    if inspect(agent, raiseerr=False) is not None:
+        set_committed_value(agent, "status", status)
+        set_committed_value(agent, "activity", activity)
+    else:
+        agent.status = status
+        agent.activity = activity
@@ -2,11 +2,17 @@
 M6 Phase 1 — 策略自动机引擎
 
 两层架构：LLM 每小时输出策略指令 → 自动机按策略匹配事件自动执行
+（事件触发见 strategy_runtime）
 """
+import bisect
 import logging
 from enum import Enum
 from typing import Optional
 from pydantic import BaseModel, field_validator
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models import AgentStrategy
 
 logger = logging.getLogger(__name__)
 
@@ -57,15 +63,49 @@ def parse_strategies(raw_list: list[dict]) -> list[Strategy]:
     return valid
 
 
-# ── 策略存储（内存，重启丢失可接受）──────────────────────
+# ── 策略存储（内存 + agent_strategies 表）──────────────────
+#
+# 内存里的 _strategy_store 是运行时的权威副本，改动经 save_strategies / delete_strategies 写表，
+# 启动时 load_strategies 载回。update_strategies / clear_strategies 只改内存（测试、单进程调试用）。
+# 两个索引让事件直接找到相关策略，不用遍历所有居民：
+#   _buy_index:  resource -> [(price_below, agent_id)]（按价格升序），新挂单按单价二分查找
+#   _work_index: building_id -> {agent_id}，生产事件按建筑查找
 
 # agent_id -> list[Strategy]
 _strategy_store: dict[int, list[Strategy]] = {}
+_buy_index: dict[str, list[tuple[float, int]]] = {}
+_work_index: dict[int, set[int]] = {}
+
+
+def _index_remove(agent_id: int):
+    for s in _strategy_store.get(agent_id, []):
+        if s.strategy == StrategyType.OPPORTUNISTIC_BUY and s.resource and s.price_below is not None:
+            entries = _buy_index.get(s.resource, [])
+            i = bisect.bisect_left(entries, (s.price_below, agent_id))
+            if i < len(entries) and entries[i] == (s.price_below, agent_id):
+                del entries[i]
+            if not entries:
+                _buy_index.pop(s.resource, None)
+        elif s.strategy == StrategyType.KEEP_WORKING and s.building_id is not None:
+            agents = _work_index.get(s.building_id, set())
+            agents.discard(agent_id)
+            if not agents:
+                _work_index.pop(s.building_id, None)
+
+
+def _index_add(agent_id: int):
+    for s in _strategy_store.get(agent_id, []):
+        if s.strategy == StrategyType.OPPORTUNISTIC_BUY and s.resource and s.price_below is not None:
+            bisect.insort(_buy_index.setdefault(s.resource, []), (s.price_below, agent_id))
+        elif s.strategy == StrategyType.KEEP_WORKING and s.building_id is not None:
+            _work_index.setdefault(s.building_id, set()).add(agent_id)
 
 
 def update_strategies(agent_id: int, strategies: list[Strategy]):
-    """全量覆盖某 Agent 的策略（每次 hourly tick 后调用）。"""
+    """全量覆盖某 Agent 的策略（只改内存，持久化用 save_strategies）。"""
+    _index_remove(agent_id)
     _strategy_store[agent_id] = [s for s in strategies if s.agent_id == agent_id]
+    _index_add(agent_id)
 
 
 def get_strategies(agent_id: int) -> list[Strategy]:
@@ -78,9 +118,73 @@ def get_all_strategies() -> dict[int, list[Strategy]]:
     return {aid: list(ss) for aid, ss in _strategy_store.items()}
 
 
+def has_strategies() -> bool:
+    return any(_strategy_store.values())
+
+
 def clear_strategies(agent_id: int | None = None):
     """清空策略（agent_id=None 清全部，否则只清指定 agent）。"""
     if agent_id is None:
         _strategy_store.clear()
+        _buy_index.clear()
+        _work_index.clear()
     else:
+        _index_remove(agent_id)
         _strategy_store.pop(agent_id, None)
+
+
+def match_buyers(resource: str, unit_price: float) -> list[int]:
+    """愿意以 unit_price 买入 resource 的居民，出价上限高的在前（同一居民只出现一次）。"""
+    entries = _buy_index.get(resource)
+    if not entries:
+        return []
+    i = bisect.bisect_left(entries, (unit_price, -1))
+    return list(dict.fromkeys(aid for _, aid in reversed(entries[i:])))
+
+
+def keep_working_agents(building_id: int) -> list[int]:
+    """对该建筑有 keep_working 策略的居民。"""
+    return sorted(_work_index.get(building_id, ()))
+
+
+# ── 持久化 ──
+
+_FIELDS = ("building_id", "stop_when_resource", "stop_when_amount", "resource", "price_below")
+
+
+async def load_strategies(db: AsyncSession):
+    """从 agent_strategies 表重建内存存储（启动时 / 多 worker 部署处理事件前）。"""
+    rows = (await db.execute(select(AgentStrategy).order_by(AgentStrategy.id))).scalars().all()
+    loaded: dict[int, list[Strategy]] = {}
+    for row in rows:
+        try:
+            s = Strategy(agent_id=row.agent_id, strategy=row.strategy, **{f: getattr(row, f) for f in _FIELDS})
+        except Exception as e:
+            logger.warning("Stored strategy #%s skipped: %s", row.id, e)
+            continue
+        loaded.setdefault(row.agent_id, []).append(s)
+    clear_strategies()
+    for agent_id, strategies in loaded.items():
+        update_strategies(agent_id, strategies)
+
+
+async def save_strategies(agent_id: int, strategies: list[Strategy], db: AsyncSession):
+    """全量覆盖某 Agent 的策略并写表；提交后更新内存。"""
+    strategies = [s for s in strategies if s.agent_id == agent_id]
+    await db.execute(delete(AgentStrategy).where(AgentStrategy.agent_id == agent_id))
+    db.add_all(
+        AgentStrategy(agent_id=agent_id, strategy=s.strategy.value, **{f: getattr(s, f) for f in _FIELDS})
+        for s in strategies
+    )
+    await db.commit()
+    update_strategies(agent_id, strategies)
+
+
+async def delete_strategies(agent_id: int | None, db: AsyncSession):
+    """清空策略并写表（agent_id=None 清全部）。"""
+    stmt = delete(AgentStrategy)
+    if agent_id is not None:
+        stmt = stmt.where(AgentStrategy.agent_id == agent_id)
+    await db.execute(stmt)
+    await db.commit()
+    clear_strategies(agent_id)
@@ -0,0 +1,328 @@
+"""事件驱动的策略执行：挂单 / 成交 / 打卡 / 生产提交后触发相关居民的常驻策略（由 ORM 监听器收集事件）"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..core.database import after_commit, async_session, unit_of_work
+from ..models import Agent, AgentResource, BuildingWorker, CheckIn, MarketOrder, ProductionLog, TradeLog
+from .strategy_engine import (
+    Strategy, StrategyType, get_all_strategies, get_strategies, has_strategies,
+    keep_working_agents, load_strategies, match_buyers,
+)
+from .work_service import work_service
+
+logger = logging.getLogger(__name__)
+
+_PENDING = "strategy_events"
+_MARKS = "strategy_event_marks"  # SAVEPOINT -> 开始时已记录的事件数，回滚时截断到这里
+_OPEN = ("open", "partial")
+
+# 事件：("order", order_id) 挂单可买 / ("holdings", agent_id) 持仓变化 / ("work", agent_id, building_id) 生产
+
+
+async def _broadcast(agent_id: int, action: str, reason: str, db: AsyncSession):
+    from . import autonomy_service  # 运行时查找，测试可以 patch autonomy_service._broadcast_action
+    agent = await db.get(Agent, agent_id)
+    await after_commit(db, autonomy_service._broadcast_action,
+                       agent.name if agent else f"Agent#{agent_id}", agent_id, action, reason)
+
+
+async def _holding(agent_id: int, resource: str, db: AsyncSession) -> float:
+    if resource == "credits":  # 信用点看 Agent.credits（与旧自动机一致）
+        agent = await db.get(Agent, agent_id)
+        return float(agent.credits) if agent else 0.0
+    quantity = await db.scalar(select(AgentResource.quantity).where(
+        AgentResource.agent_id == agent_id, AgentResource.resource_type == resource))
+    return float(quantity or 0)
+
+
+async def _available(agent_id: int, resource: str, db: AsyncSession) -> float:
+    """接单时可支付的量（与 accept_order 的校验一致）"""
+    row = (await db.execute(select(AgentResource.quantity, AgentResource.frozen_amount).where(
+        AgentResource.agent_id == agent_id, AgentResource.resource_type == resource))).first()
+    return float(row[0] - row[1]) if row else 0.0
+
+
+async def _completed(agent_id: int, s: Strategy, db: AsyncSession) -> bool:
+    resource = s.stop_when_resource if s.strategy == StrategyType.KEEP_WORKING else s.resource
+    if not resource or s.stop_when_amount is None:
+        return False
+    current = await _holding(agent_id, resource, db)
+    if current >= s.stop_when_amount:
+        logger.info("Strategy completed: agent %s %s, %s reached %.1f", agent_id, s.strategy.value, resource, current)
+        return True
+    return False
+
+
+async def _try_buy(agent_id: int, s: Strategy, order: MarketOrder, db: AsyncSession, uow) -> bool:
+    """按策略接一张单：买到停止数量为止，钱不够就买能买的部分"""
+    from .market_service import accept_order
+
+    if order.status not in _OPEN or order.seller_id == agent_id or order.remain_sell_amount <= 0:
+        return False
+    ratio = min(1.0, await _available(agent_id, order.buy_type, db) / order.remain_buy_amount)
+    if s.stop_when_amount is not None:
+        need = s.stop_when_amount - await _holding(agent_id, s.resource, db)
+        ratio = min(ratio, need / order.remain_sell_amount)
+    if ratio <= 0:
+        return False
+    await uow.begin_action()
+    try:
+        res = await accept_order(agent_id, order.id, ratio, db=db)
+        if res["ok"]:
+            await _broadcast(agent_id, "accept_market_order", f"策略自动执行: 低价买入 {s.resource}", db)
+    except Exception:
+        await uow.end_action(False)
+        raise
+    await uow.end_action(res["ok"])
+    return res["ok"]
+
+
+async def _buy_cheapest(agent_id: int, s: Strategy, db: AsyncSession, uow) -> bool:
+    """在该资源的挂单里从最便宜的开始接，成功一张即止（成交事件会再触发下一次）"""
+    if not s.resource or s.price_below is None:
+        return False
+    orders = (await db.execute(
+        select(MarketOrder)
+        .where(
+            MarketOrder.sell_type == s.resource,
+            MarketOrder.status.in_(_OPEN),
+            MarketOrder.seller_id != agent_id,
+            MarketOrder.remain_sell_amount > 0,
+            MarketOrder.remain_buy_amount <= s.price_below * MarketOrder.remain_sell_amount,
+        )
+        .order_by(MarketOrder.remain_buy_amount / MarketOrder.remain_sell_amount, MarketOrder.id)
+    )).scalars().all()
+    for order in orders:
+        if await _try_buy(agent_id, s, order, db, uow):
+            return True
+    return False
+
+
+async def _check_in(agent_id: int, s: Strategy, db: AsyncSession, uow) -> bool:
+    """keep_working：人在目标建筑时，随机选一个有空位的岗位打卡"""
+    if not s.building_id:
+        return False
+    building_id = await db.scalar(select(BuildingWorker.building_id).where(BuildingWorker.agent_id == agent_id))
+    if building_id != s.building_id:
+        return False
+    jobs = await work_service.get_jobs(db)
+    available = [j for j in jobs if j["max_workers"] == 0 or j["today_workers"] < j["max_workers"]]
+    if not available:
+        return False
+    await uow.begin_action()
+    try:
+        res = await work_service.check_in(agent_id, random.choice(available)["id"], db)
+        if res["ok"]:
+            await _broadcast(agent_id, "checkin", "策略自动执行: 持续工作", db)
+    except Exception:
+        await uow.end_action(False)
+        raise
+    await uow.end_action(res["ok"])
+    return res["ok"]
+
+
+class StrategyRuntime:
+    """策略事件队列 + 处理它的后台任务
+
+    挂单新建或部分成交 → 该资源阈值不低于单价的买家尝试购买；持仓变化 → 该居民的策略重新检查；
+    建筑生产 → 该建筑 keep_working 的居民打卡。自己的成交会再产生事件，买家一直买到停止条件为止。
+    """
+
+    def __init__(self):
+        self._queue: deque[tuple[tuple, float]] = deque()  # (事件, 发生时刻)
+        self._worker: asyncio.Task | None = None
+        self.reset()
+
+    def reset(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+        self._worker = None
+        self._queue.clear()
+        self.stats = {"events": 0, "executed": 0, "completed": 0, "skipped": 0, "latency_ms": 0.0}
+
+    def tracking(self) -> bool:
+        """是否需要收集事件：有策略，或多 worker 部署（别的进程可能有）"""
+        return settings.strategy_runtime and (has_strategies() or settings.broadcast_backend != "local")
+
+    def publish(self, events) -> None:
+        """提交后调用：排队并确保后台任务在跑（没有事件循环时丢弃）"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        now = time.monotonic()
+        self._queue.extend((ev, now) for ev in events)
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+
+    async def drain(self) -> None:
+        """等队列里的事件处理完（测试 / 关停用）"""
+        while self._worker is not None and not self._worker.done():
+            await asyncio.wait({self._worker})
+
+    async def _run(self):
+        while self._queue:
+            batch = list(self._queue)
+            self._queue.clear()
+            events = list(dict.fromkeys(ev for ev, _ in batch))  # 同一批里去重，保持顺序
+            try:
+                await self._handle(events)
+            except Exception as e:
+                logger.error("Strategy runtime batch failed (%d events): %s", len(events), e)
+            self.stats["events"] += len(events)
+            self.stats["latency_ms"] = round((time.monotonic() - batch[0][1]) * 1000, 1)
+
+    async def _handle(self, events: list[tuple]):
+        async with async_session() as db:
+            if settings.broadcast_backend != "local":
+                await load_strategies(db)
+            if not has_strategies():
+                return
+            async with unit_of_work(db) as uow:
+                for ev in events:
+                    try:
+                        await getattr(self, f"_on_{ev[0]}")(*ev[1:], db=db, uow=uow, stats=self.stats)
+                    except Exception as e:
+                        logger.error("Strategy event %s failed: %s", ev, e)
+                        self.stats["skipped"] += 1
+                queued = await uow.commit()
+        for fn, args, kwargs in queued:
+            try:
+                await fn(*args, **kwargs)
+            except Exception as e:
+                logger.warning("Strategy broadcast failed (non-fatal): %s", e)
+
+    # --- 事件处理 ---
+
+    async def _on_order(self, order_id: int, *, db, uow, stats):
+        order = await db.get(MarketOrder, order_id)
+        if order is None or order.status not in _OPEN or order.remain_sell_amount <= 0:
+            return
+        unit_price = order.remain_buy_amount / order.remain_sell_amount
+        for agent_id in match_buyers(order.sell_type, unit_price):
+            for s in get_strategies(agent_id):
+                if (s.strategy != StrategyType.OPPORTUNISTIC_BUY or s.resource != order.sell_type
+                        or s.price_below is None or unit_price > s.price_below):
+                    continue
+                if await _completed(agent_id, s, db):
+                    stats["completed"] += 1
+                elif await _try_buy(agent_id, s, order, db, uow):
+                    stats["executed"] += 1
+                break  # 同一居民对同一张单只接一次
+            if order.status not in _OPEN:
+                break
+
+    async def _on_holdings(self, agent_id: int, *, db, uow, stats):
+        for s in get_strategies(agent_id):
+            if await _completed(agent_id, s, db):
+                stats["completed"] += 1
+            elif s.strategy == StrategyType.OPPORTUNISTIC_BUY and await _buy_cheapest(agent_id, s, db, uow):
+                stats["executed"] += 1
+
+    async def _on_work(self, agent_id: int, building_id: int, *, db, uow, stats):
+        if agent_id not in keep_working_agents(building_id):
+            return
+        for s in get_strategies(agent_id):
+            if s.strategy != StrategyType.KEEP_WORKING or s.building_id != building_id:
+                continue
+            if await _completed(agent_id, s, db):
+                stats["completed"] += 1
+            elif await _check_in(agent_id, s, db, uow):
+                stats["executed"] += 1
+
+    # --- 全量巡检 ---
+
+    async def sweep(self, db: AsyncSession) -> dict:
+        """每条策略检查一次；返回 {"executed": N, "skipped": N, "completed": N}"""
+        stats = {"executed": 0, "skipped": 0, "completed": 0}
+        agent_ids = set((await db.execute(select(Agent.id).where(Agent.id != 0))).scalars().all())
+        async with unit_of_work(db) as uow:
+            for agent_id, strategies in get_all_strategies().items():
+                if agent_id not in agent_ids:
+                    continue
+                for s in strategies:
+                    try:
+                        if await _completed(agent_id, s, db):
+                            stats["completed"] += 1
+                            continue
+                        if s.strategy == StrategyType.KEEP_WORKING:
+                            done = await _check_in(agent_id, s, db, uow)
+                        else:
+                            done = await _buy_cheapest(agent_id, s, db, uow)
+                        stats["executed" if done else "skipped"] += 1
+                    except Exception as e:
+                        logger.error("Strategy execution failed: agent %s, strategy %s: %s", agent_id, s.strategy, e)
+                        stats["skipped"] += 1
+            queued = await uow.commit()
+        for fn, args, kwargs in queued:
+            try:
+                await fn(*args, **kwargs)
+            except Exception as e:
+                logger.warning("Strategy broadcast failed (non-fatal): %s", e)
+        return stats
+
+
+strategy_runtime = StrategyRuntime()
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session: Session, flush_context) -> None:
+    if not strategy_runtime.tracking():
+        return
+    events: list[tuple] = []
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, MarketOrder):
+            if obj.status in _OPEN:
+                events.append(("order", obj.id))
+        elif obj in session.new:
+            if isinstance(obj, TradeLog):
+                events += [("holdings", obj.buyer_id), ("holdings", obj.seller_id)]
+            elif isinstance(obj, ProductionLog) and obj.agent_id:
+                events += [("work", obj.agent_id, obj.building_id), ("holdings", obj.agent_id)]
+            elif isinstance(obj, CheckIn):
+                events.append(("holdings", obj.agent_id))
+    if events:
+        session.info.setdefault(_PENDING, []).extend(events)
+
+
+@event.listens_for(Session, "after_transaction_create")
+def _mark_savepoint(session: Session, transaction) -> None:
+    if transaction.nested:
+        session.info.setdefault(_MARKS, {})[transaction] = len(session.info.get(_PENDING, ()))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _truncate_to_savepoint(session: Session, previous_transaction) -> None:
+    """只回滚了一个 SAVEPOINT：丢掉它期间记录的事件，其余的外层提交时照常发出"""
+    if not previous_transaction.nested:
+        return
+    mark = session.info.get(_MARKS, {}).pop(previous_transaction, None)
+    if mark is not None and _PENDING in session.info:
+        del session.info[_PENDING][mark:]
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(session: Session) -> None:
+    if session.in_nested_transaction():
+        return  # 释放 SAVEPOINT，外层事务还没提交
+    session.info.pop(_MARKS, None)
+    events = session.info.pop(_PENDING, None)
+    if events:
+        strategy_runtime.publish(events)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session: Session) -> None:
+    if session.in_nested_transaction():
+        return  # SAVEPOINT 回滚由 _truncate_to_savepoint 处理
+    session.info.pop(_MARKS, None)
+    session.info.pop(_PENDING, None)
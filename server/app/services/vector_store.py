@@ -1,28 +1,78 @@
 """SQLite BLOB + NumPy cosine similarity vector store for agent memories.
 
-Scalability note: search_memories loads all embeddings for the agent into memory
-and computes cosine similarity with NumPy. This is fine for <10k memories per agent.
-For larger scale, consider SQLite FTS5 for coarse filtering before vector ranking.
+Embeddings live in ``Memory.embedding``. Searches go through an in-process IVF
+index (see ann_index.py): one per agent plus one shared index for public
+memories (``agent_id IS NULL``). Each index keeps its pre-normalized vectors,
+ids and memory types resident, so a search is a dot product plus one
+``SELECT id, content`` for the top-k — no per-row BLOB decoding and no ORM
+hydration. Indexes are built lazily on first search, reconciled against the
+table, kept up to date by upsert/delete/type changes, evicted LRU-first once
+``settings.vector_cache_max_mb`` is exceeded, and persisted to
+``settings.vector_index_dir`` on eviction/shutdown.
+With several workers (``broadcast_backend != "local"``) every index change is
+announced on the broadcast bus once committed (ids added / removed / retagged);
+peers patch their resident copies, fetching added rows before the next search.
+``vector_search_mode="exact"`` falls back to the original full scan.
+Blobs are stored as float32, float16 or int8 per ``settings.embedding_storage``
+(embedding_codec.py). With ``settings.vector_index_quantize`` the resident
+indexes hold int8 codes and the top ``top_k * vector_rerank_factor``
+candidates are re-ranked exactly against the stored vectors.
+CPU-bound work (scoring, blob decoding, index builds) runs in a bounded thread
+pool (``settings.vector_search_workers``) so it never stalls the event loop;
+NumPy releases the GIL for the heavy parts.
+Embedding calls go through a content-hash keyed cache (embedding_cache.py)
+and are batched: ``embed_many`` sends lists of inputs, and concurrent
+``embed`` callers are coalesced into one request.
+With ``settings.memory_search_keyword_weight > 0`` search is hybrid: BM25
+hits from the ``memories_fts`` trigram index (memory_fts.py) join the vector
+candidates and the final order blends cosine with normalized BM25.
 """
 
+import asyncio
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 import httpx
 import numpy as np
-from sqlalchemy import select, delete
+from sqlalchemy import event, select, delete
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
 
 from ..core.config import settings
-from ..models import Memory
+from ..models import Memory, MemoryType
+from . import embedding_codec, memory_fts
+from .ann_index import IVFIndex
+from .broadcast_bus import broadcast_bus
+from .embedding_cache import EmbeddingCache
 
 logger = logging.getLogger(__name__)
 
 _client: httpx.AsyncClient | None = None
 
+# content-hash keyed cache in front of the embedding API (re-created with the
+# persistent tier in init_vector_store)
+embedding_cache = EmbeddingCache(settings.embedding_cache_size)
+_inflight: dict[str, asyncio.Future] = {}  # text -> pending request, shared by identical callers
+
+_executor: ThreadPoolExecutor | None = None
+
+# agent_id -> index in LRU order; key None is the shared public-memory index (never evicted)
+_indexes: OrderedDict[int | None, IVFIndex] = OrderedDict()
+_dirty: set[int | None] = set()
+_peer_added: dict[int | None, set[int]] = {}  # rows other workers embedded; fetched before next use
+
+INDEX_LOAD_CHUNK = 5000  # rows per query when (re)building an index; stays below SQLite's variable limit
+
+# memory_type is kept next to each vector as an int8 tag
+_TYPE_CODES = {MemoryType.SHORT.value: 0, MemoryType.LONG.value: 1, MemoryType.PUBLIC.value: 2}
+_TYPE_NAMES = {code: name for name, code in _TYPE_CODES.items()}
+
 
 async def init_vector_store() -> None:
     """Initialize the embedding API client."""
-    global _client
+    global _client, embedding_cache
     if not settings.embedding_api_key:
         logger.warning("EMBEDDING_API_KEY not configured — vector search will be unavailable")
     _client = httpx.AsyncClient(
@@ -30,38 +80,171 @@ async def init_vector_store() -> None:
         headers={"Authorization": f"Bearer {settings.embedding_api_key}"},
         timeout=30.0,
     )
+    embedding_cache.close()
+    embedding_cache = EmbeddingCache(settings.embedding_cache_size, settings.embedding_cache_path)
     logger.info("Vector store initialized (embedding API: %s, model: %s)",
                 settings.embedding_api_base, settings.embedding_model)
 
 
 async def close_vector_store() -> None:
     """Shutdown the embedding API client."""
-    global _client
+    global _client, _executor
+    save_vector_indexes()
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+    embedding_cache.close()
     if _client is not None:
         await _client.aclose()
         _client = None
         logger.info("Vector store client closed")
 
 
+async def _run_cpu(fn, *args):
+    """Run a CPU-bound callable in the scoring pool, keeping the event loop responsive."""
+    global _executor
+    if settings.vector_search_workers <= 0:
+        return fn(*args)
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.vector_search_workers, thread_name_prefix="vector-search",
+        )
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
 async def embed(text: str) -> bytes:
-    """Call embedding API and return float32 bytes."""
+    """Embed one text and return float32 bytes.
+
+    Served from ``embedding_cache`` when possible; identical texts already in
+    flight share one request. Concurrent cache misses are coalesced: requests
+    arriving within ``settings.embedding_batch_linger_ms`` of each other share
+    a single ``/embeddings`` call (up to ``settings.embedding_batch_size`` inputs).
+    """
+    if _client is None:
+        raise RuntimeError("vector_store not initialized. Call init_vector_store() first.")
+    cached = embedding_cache.get(text)
+    if cached is not None:
+        return cached
+    pending = _inflight.get(text)
+    if pending is None:
+        pending = asyncio.ensure_future(_embed_uncached(text))
+        _inflight[text] = pending
+        pending.add_done_callback(lambda _: _inflight.pop(text, None))
+    return await asyncio.shield(pending)
+
+
+async def _embed_uncached(text: str) -> bytes:
+    if settings.embedding_batch_linger_ms <= 0 or settings.embedding_batch_size <= 1:
+        blob = (await _request_embeddings([text]))[0]
+    else:
+        blob = await _coalescer.submit(text)
+    embedding_cache.put(text, blob)
+    return blob
+
+
+async def embed_many(texts: list[str]) -> list[bytes]:
+    """Embed many texts with as few API calls as possible; order is preserved."""
     if _client is None:
         raise RuntimeError("vector_store not initialized. Call init_vector_store() first.")
+    found: dict[str, bytes] = {}
+    missing: list[str] = []
+    for text in dict.fromkeys(texts):
+        blob = embedding_cache.get(text)
+        if blob is None:
+            missing.append(text)
+        else:
+            found[text] = blob
+    size = max(1, settings.embedding_batch_size)
+    for i in range(0, len(missing), size):
+        chunk = missing[i:i + size]
+        blobs = await _request_embeddings(chunk)
+        embedding_cache.put_many(chunk, blobs)
+        found.update(zip(chunk, blobs))
+    return [found[text] for text in texts]
+
+
+async def _request_embeddings(texts: list[str]) -> list[bytes]:
+    """One ``/embeddings`` round trip for ``texts``."""
     resp = await _client.post("/embeddings", json={
         "model": settings.embedding_model,
-        "input": text,
+        "input": texts[0] if len(texts) == 1 else texts,
         "encoding_format": "float",
     })
     resp.raise_for_status()
     data = resp.json()
-    if not data.get("data") or not data["data"][0].get("embedding"):
+    items = data.get("data") or []
+    if len(items) != len(texts) or not all(item.get("embedding") for item in items):
         raise ValueError(f"Unexpected embedding API response: {list(data.keys())}")
-    vec = data["data"][0]["embedding"]
-    blob = np.array(vec, dtype=np.float32).tobytes()
+    items = sorted(items, key=lambda item: item.get("index", 0))
     expected_size = settings.embedding_dim * 4
-    if len(blob) != expected_size:
-        raise ValueError(f"Embedding dimension mismatch: got {len(blob) // 4}, expected {settings.embedding_dim}")
-    return blob
+    blobs = []
+    for item in items:
+        blob = np.array(item["embedding"], dtype=np.float32).tobytes()
+        if len(blob) != expected_size:
+            raise ValueError(f"Embedding dimension mismatch: got {len(blob) // 4}, expected {settings.embedding_dim}")
+        blobs.append(blob)
+    return blobs
+
+
+class _EmbedCoalescer:
+    """Collects concurrent ``embed()`` calls and flushes them as one batch.
+
+    A batch is sent when it reaches ``embedding_batch_size`` or when the first
+    waiter has lingered ``embedding_batch_linger_ms``. If a multi-text batch
+    fails, its texts are retried one by one so a single bad input only fails
+    its own caller.
+    """
+
+    def __init__(self) -> None:
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self.batches = 0
+        self.texts = 0
+
+    def submit(self, text: str) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((text, fut))
+        if len(self._pending) >= settings.embedding_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(settings.embedding_batch_linger_ms / 1000, self._flush)
+        return fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.create_task(self._send(batch))
+
+    async def _send(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        self.batches += 1
+        self.texts += len(batch)
+        try:
+            blobs = await _request_embeddings([text for text, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                _settle(batch[0][1], exc=e)
+                return
+            logger.warning("Batched embedding of %d texts failed (%s), retrying individually", len(batch), e)
+            await asyncio.gather(*(self._send([item]) for item in batch))
+            return
+        for (_, fut), blob in zip(batch, blobs):
+            _settle(fut, result=blob)
+
+
+def _settle(fut: asyncio.Future, result=None, exc: BaseException | None = None) -> None:
+    if fut.done():  # caller was cancelled
+        return
+    if exc is not None:
+        fut.set_exception(exc)
+    else:
+        fut.set_result(result)
+
+
+_coalescer = _EmbedCoalescer()
 
 
 async def upsert_memory(
@@ -74,13 +257,55 @@ async def upsert_memory(
     mem = await db.get(Memory, memory_id)
     if mem is None:
         raise ValueError(f"Memory {memory_id} not found in database")
-    mem.embedding = blob
+    store_embedding(mem, blob)
+
+
+def store_embedding(mem: Memory, blob: bytes) -> None:
+    """Attach a precomputed float32 embedding (e.g. from ``embed_many``) to a Memory row."""
+    mem.embedding = embedding_codec.encode(blob, settings.embedding_storage)
+    _index_add(mem.agent_id, mem.id, blob, mem.memory_type)
+    session = object_session(mem)
+    if session is None:
+        _notify_peers(added=[[mem.agent_id, mem.id]])
+    else:  # peers can only fetch the row once it is committed
+        session.info.setdefault(_PEER_ADDED, []).append([mem.agent_id, mem.id])
+
+
+async def backfill_embeddings(db: AsyncSession) -> int:
+    """Embed every memory that has no embedding yet, in batches.
+
+    Returns the number of rows filled. Batches that fail are left for the next run.
+    """
+    ids = (await db.execute(
+        select(Memory.id).where(Memory.embedding.is_(None)).order_by(Memory.id)
+    )).scalars().all()
+    filled = 0
+    size = max(1, settings.embedding_batch_size)
+    for i in range(0, len(ids), size):
+        mems = (await db.execute(
+            select(Memory).where(Memory.id.in_(ids[i:i + size]))
+        )).scalars().all()
+        mems = [m for m in mems if m.content and m.content.strip()]
+        if not mems:
+            continue
+        try:
+            blobs = await embed_many([m.content for m in mems])
+        except Exception as e:
+            logger.warning("Embedding backfill batch failed, %d rows left for later: %s", len(mems), e)
+            continue
+        for mem, blob in zip(mems, blobs):
+            store_embedding(mem, blob)
+        await db.commit()
+        filled += len(mems)
+    if filled:
+        logger.info("Embedding backfill: %d/%d rows embedded", filled, len(ids))
+    return filled
 
 
 async def search_memories(
     query: str, agent_id: int, top_k: int = 5, db: AsyncSession | None = None
 ) -> list[dict]:
-    """Search memories by cosine similarity."""
+    """Search the agent's and public memories by cosine similarity."""
     if not query or not query.strip():
         return []
     if db is None:
@@ -95,6 +320,175 @@ async def search_memories(
         logger.warning("Query embedding has near-zero norm, returning empty results")
         return []
 
+    if settings.vector_search_mode == "exact":
+        return await _search_exact(query_vec, agent_id, top_k, db)
+
+    fetch_k = _fetch_k(top_k)
+    indexes = [await _get_index(key, db) for key in (agent_id, None)]
+    hits = await _run_cpu(_search_indexes, indexes, query_vec, fetch_k)
+    ranked = await _rank(query, query_vec, agent_id, top_k, hits, indexes, db)
+    return (await _with_content({agent_id: ranked}, db))[agent_id]
+
+
+async def search_memories_many(
+    queries: dict[int, str], top_k: int = 5, db: AsyncSession | None = None
+) -> dict[int, list[dict]]:
+    """Batched ``search_memories`` for several agents: ``{agent_id: query}`` -> ``{agent_id: results}``.
+
+    Distinct query texts are embedded in one ``embed_many`` call, the shared
+    public index is scored for all of them with a single GEMM, and contents
+    are fetched with one SELECT.
+    """
+    results: dict[int, list[dict]] = {agent_id: [] for agent_id in queries}
+    if db is None:
+        return results
+    texts = list(dict.fromkeys(q for q in queries.values() if q and q.strip()))
+    if not texts:
+        return results
+    vecs = {
+        text: np.frombuffer(blob, dtype=np.float32)
+        for text, blob in zip(texts, await embed_many(texts))
+    }
+    texts = [t for t in texts if np.linalg.norm(vecs[t]) >= 1e-8]
+    agents = [agent_id for agent_id, q in queries.items() if q in texts]
+    if not agents:
+        return results
+
+    if settings.vector_search_mode == "exact":
+        for agent_id in agents:
+            results[agent_id] = await _search_exact(vecs[queries[agent_id]], agent_id, top_k, db)
+        return results
+
+    fetch_k = _fetch_k(top_k)
+    agent_indexes = {agent_id: await _get_index(agent_id, db) for agent_id in agents}
+    public = await _get_index(None, db)
+    row_of = {text: i for i, text in enumerate(texts)}
+    batch_hits = await _run_cpu(
+        _search_batch, agent_indexes, public, np.stack([vecs[t] for t in texts]),
+        {agent_id: row_of[queries[agent_id]] for agent_id in agents}, fetch_k,
+    )
+    ranked = {
+        agent_id: await _rank(
+            queries[agent_id], vecs[queries[agent_id]], agent_id, top_k,
+            batch_hits[agent_id], [agent_indexes[agent_id], public], db,
+        )
+        for agent_id in agents
+    }
+    results.update(await _with_content(ranked, db))
+    return results
+
+
+def _fetch_k(top_k: int) -> int:
+    """Candidates to pull from the indexes before re-ranking / hybrid scoring."""
+    widen = settings.vector_index_quantize or settings.memory_search_keyword_weight > 0
+    return top_k * max(1, settings.vector_rerank_factor) if widen else top_k
+
+
+async def _rank(
+    query: str, query_vec: np.ndarray, agent_id: int, top_k: int,
+    hits: list[tuple[int, float, int]], indexes: list[IVFIndex], db: AsyncSession,
+) -> list[tuple[int, float, int]]:
+    """Merge keyword candidates, re-rank exactly where needed, return the final top-k."""
+    keyword_weight = settings.memory_search_keyword_weight
+    fetch_k = _fetch_k(top_k)
+    keyword = await memory_fts.keyword_scores(db, query, agent_id, fetch_k) if keyword_weight > 0 else {}
+    seen = {h[0] for h in hits}
+    for mid in keyword:
+        if mid in seen:
+            continue
+        owner = next((index for index in indexes if mid in index), None)
+        if owner is not None:  # keyword-only candidate: scored exactly below
+            hits.append((mid, 0.0, owner.tag_of(mid)))
+    if hits and (settings.vector_index_quantize or len(hits) > len(seen)):
+        hits = await _rerank(hits, query_vec, db)
+
+    if keyword:
+        best = max(keyword.values())
+        rank = {
+            mid: (1 - keyword_weight) * sim + keyword_weight * keyword.get(mid, 0.0) / best
+            for mid, sim, _ in hits
+        }
+        hits.sort(key=lambda h: rank[h[0]], reverse=True)
+    else:
+        hits.sort(key=lambda h: h[1], reverse=True)
+    return hits[:max(1, top_k)]
+
+
+async def _with_content(
+    ranked: dict[int, list[tuple[int, float, int]]], db: AsyncSession
+) -> dict[int, list[dict]]:
+    """Attach memory text to ranked hits with a single SELECT."""
+    ids = {mid for hits in ranked.values() for mid, _, _ in hits}
+    content: dict[int, str] = {}
+    if ids:
+        rows = (await db.execute(select(Memory.id, Memory.content).where(Memory.id.in_(ids)))).all()
+        content = {mid: text for mid, text in rows}
+    return {
+        key: [
+            {"memory_id": mid, "text": content[mid], "memory_type": _TYPE_NAMES[tag], "_distance": float(1 - sim)}
+            for mid, sim, tag in hits if mid in content
+        ]
+        for key, hits in ranked.items()
+    }
+
+
+def _search_indexes(
+    indexes: list[IVFIndex], query_vec: np.ndarray, k: int
+) -> list[tuple[int, float, int]]:
+    hits = []
+    for index in indexes:
+        hits.extend(index.search_tagged(query_vec, k))
+    return hits
+
+
+def _search_batch(
+    agent_indexes: dict[int, IVFIndex], public: IVFIndex, queries: np.ndarray,
+    row_of: dict[int, int], k: int,
+) -> dict[int, list[tuple[int, float, int]]]:
+    """Score every agent's query against its own index plus the shared public index.
+
+    The public index sees all distinct queries in one GEMM; each agent index
+    is its own matrix, so it is scored once for that agent's query.
+    """
+    public_hits = public.search_many(queries, k)
+    hits: dict[int, list[tuple[int, float, int]]] = {}
+    for agent_id, index in agent_indexes.items():
+        row = row_of[agent_id]
+        ids, sims = index.search_many(queries[row:row + 1], k)[0]
+        agent_hits = [(i, s, index.tag_of(i)) for i, s in zip(ids.tolist(), sims.tolist())]
+        p_ids, p_sims = public_hits[row]
+        agent_hits.extend((i, s, public.tag_of(i)) for i, s in zip(p_ids.tolist(), p_sims.tolist()))
+        hits[agent_id] = agent_hits
+    return hits
+
+
+async def _rerank(
+    hits: list[tuple[int, float, int]], query_vec: np.ndarray, db: AsyncSession
+) -> list[tuple[int, float, int]]:
+    """Replace approximate (int8) scores with exact cosine against the stored vectors."""
+    rows = (await db.execute(
+        select(Memory.id, Memory.embedding).where(Memory.id.in_([h[0] for h in hits]))
+    )).all()
+    return await _run_cpu(_score_stored, hits, dict(rows), query_vec)
+
+
+def _score_stored(
+    hits: list[tuple[int, float, int]], blobs: dict[int, bytes], query_vec: np.ndarray
+) -> list[tuple[int, float, int]]:
+    q = query_vec / np.linalg.norm(query_vec)
+    exact = []
+    for mid, _, tag in hits:
+        vec = embedding_codec.decode(blobs[mid], settings.embedding_dim) if blobs.get(mid) else None
+        if vec is None:
+            continue  # deleted since it was indexed
+        exact.append((mid, float(vec @ q / max(np.linalg.norm(vec), 1e-8)), tag))
+    return exact
+
+
+async def _search_exact(
+    query_vec: np.ndarray, agent_id: int, top_k: int, db: AsyncSession
+) -> list[dict]:
+    """Brute-force scan over every embedded row visible to the agent."""
     stmt = select(Memory).where(
         Memory.embedding.isnot(None),
         (Memory.agent_id == agent_id) | (Memory.agent_id.is_(None))
@@ -102,20 +496,257 @@ async def search_memories(
     rows = (await db.execute(stmt)).scalars().all()
     if not rows:
         return []
+    top = await _run_cpu(_score_blobs, [r.embedding for r in rows], query_vec, top_k)
+    return [
+        {"memory_id": rows[i].id, "text": rows[i].content, "memory_type": rows[i].memory_type,
+         "_distance": float(1 - sim)}
+        for i, sim in top
+    ]
+
 
-    vecs = np.array([np.frombuffer(r.embedding, dtype=np.float32) for r in rows])
-    row_norms = np.linalg.norm(vecs, axis=1)
-    norms = row_norms * query_norm + 1e-8
+def _score_blobs(blobs: list[bytes], query_vec: np.ndarray, top_k: int) -> list[tuple[int, float]]:
+    """Decode blobs and return [(position, cosine)] of the top-k, best first."""
+    decoded = [embedding_codec.decode(b, settings.embedding_dim) for b in blobs]
+    positions = np.array([i for i, v in enumerate(decoded) if v is not None], dtype=np.int64)
+    if not len(positions):
+        return []
+    vecs = np.stack([decoded[i] for i in positions])
+    norms = np.linalg.norm(vecs, axis=1) * np.linalg.norm(query_vec) + 1e-8
     sims = vecs @ query_vec / norms
-    top_k = max(1, min(top_k, len(rows)))
-    top_idx = np.argsort(sims)[-top_k:][::-1]
+    k = max(1, min(top_k, len(sims)))
+    top = np.argpartition(-sims, k - 1)[:k]
+    top = top[np.argsort(-sims[top])]
+    return [(int(positions[i]), float(sims[i])) for i in top]
 
-    return [
-        {"memory_id": rows[i].id, "text": rows[i].content, "_distance": float(1 - sims[i])}
-        for i in top_idx
+
+# -- ANN index registry ------------------------------------------------------
+
+def _index_path(key: int | None) -> Path:
+    name = "public" if key is None else f"agent_{key}"
+    return Path(settings.vector_index_dir) / f"{name}.npz"
+
+
+def _new_index() -> IVFIndex:
+    return IVFIndex(
+        settings.embedding_dim,
+        nprobe=settings.vector_ivf_nprobe,
+        min_train=settings.vector_ivf_min_train,
+        quantized=settings.vector_index_quantize,
+    )
+
+
+def _load_index(key: int | None) -> IVFIndex | None:
+    return IVFIndex.load(
+        _index_path(key), settings.embedding_dim,
+        nprobe=settings.vector_ivf_nprobe, min_train=settings.vector_ivf_min_train,
+        quantized=settings.vector_index_quantize,
+    )
+
+
+def _owner_clause(key: int | None):
+    return Memory.agent_id.is_(None) if key is None else Memory.agent_id == key
+
+
+async def _get_index(key: int | None, db: AsyncSession) -> IVFIndex:
+    """Return the resident index for ``key``, loading/building it on first use.
+
+    A persisted index is reconciled against the table so rows written or deleted
+    while it was not resident (other process, crash before save) are picked up,
+    and so are memory_type changes (promotions / admin edits only patch resident
+    indexes). Rows other workers embedded meanwhile are fetched into a resident
+    index before it is returned.
+    """
+    index = _indexes.get(key)
+    if index is not None:
+        added = _peer_added.pop(key, None)
+        if added:
+            rows = (await db.execute(
+                select(Memory.id, Memory.embedding, Memory.memory_type).where(Memory.id.in_(added))
+            )).all()
+            await _run_cpu(_add_rows, index, rows)
+            _dirty.add(key)
+        _indexes.move_to_end(key)
+        return index
+
+    index = await _run_cpu(_load_index, key) if _index_path(key).exists() else None
+    index = index or _new_index()
+    await _reconcile(key, index, db)
+
+    # another coroutine may have finished building while we awaited
+    index = _indexes.setdefault(key, index)
+    _indexes.move_to_end(key)
+    _evict_lru()
+    return index
+
+
+async def _reconcile(key: int | None, index: IVFIndex, db: AsyncSession) -> None:
+    """Bring ``index`` in line with the table: add missing rows, drop deleted ones, fix type tags."""
+    db_types = dict((await db.execute(
+        select(Memory.id, Memory.memory_type).where(Memory.embedding.isnot(None), _owner_clause(key))
+    )).all())
+    indexed_ids = index.ids().tolist()
+    retagged = 0
+    for mid, tag in zip(indexed_ids, index.tags().tolist()):
+        code = _TYPE_CODES.get(db_types.get(mid), tag)
+        if code != tag:
+            index.set_tag(mid, code)
+            retagged += 1
+    indexed = set(indexed_ids)
+    stale = indexed - db_types.keys()
+    missing = db_types.keys() - indexed
+    if stale:
+        index.remove(stale)
+    missing_list = sorted(missing)
+    for i in range(0, len(missing_list), INDEX_LOAD_CHUNK):
+        rows = (await db.execute(
+            select(Memory.id, Memory.embedding, Memory.memory_type)
+            .where(Memory.id.in_(missing_list[i:i + INDEX_LOAD_CHUNK]))
+        )).all()
+        await _run_cpu(_add_rows, index, rows)
+    if stale or missing or retagged:
+        _dirty.add(key)
+        logger.info("Vector index %s reconciled: %d vectors (+%d/-%d/~%d)",
+                    "public" if key is None else f"agent {key}", len(index), len(missing), len(stale), retagged)
+
+
+def _add_rows(index: IVFIndex, rows) -> None:
+    """Decode (id, blob, memory_type) rows and add them to ``index``."""
+    decoded = [
+        (mid, embedding_codec.decode(blob, settings.embedding_dim), mtype) for mid, blob, mtype in rows
     ]
+    decoded = [r for r in decoded if r[1] is not None]
+    if decoded:
+        index.add(
+            [mid for mid, _, _ in decoded],
+            np.stack([vec for _, vec, _ in decoded]),
+            [_TYPE_CODES.get(mtype, 0) for _, _, mtype in decoded],
+        )
+
+
+def _index_add(key: int | None, memory_id: int, blob: bytes, memory_type: str | None) -> None:
+    index = _indexes.get(key)
+    if index is None:
+        return  # not resident: picked up by reconciliation on first search
+    index.add([memory_id], np.frombuffer(blob, dtype=np.float32), [_TYPE_CODES.get(memory_type, 0)])
+    _dirty.add(key)
+    _evict_lru()
+
+
+def _evict_lru() -> None:
+    """Evict least-recently-used agent indexes until the cache fits its budget."""
+    budget = settings.vector_cache_max_mb * 1024 * 1024
+    total = sum(index.nbytes for index in _indexes.values())
+    for key in list(_indexes):
+        if total <= budget or len(_indexes) <= 2:
+            break  # always keep the public index and the one just used
+        if key is None:
+            continue
+        index = _indexes.pop(key)
+        total -= index.nbytes
+        if key in _dirty:
+            try:
+                index.save(_index_path(key))
+            except OSError as e:
+                logger.warning("Failed to persist evicted vector index %s: %s", key, e)
+            _dirty.discard(key)
+        logger.info("Vector index for agent %s evicted (LRU)", key)
+
+
+def set_memory_type(memory_id: int, memory_type: str) -> None:
+    """Keep the resident memory_type tag in sync after a promotion / admin edit.
+
+    Indexes on disk are fixed up by ``_get_index`` reconciliation when loaded.
+    """
+    _retag(memory_id, memory_type)
+    _notify_peers(types=[[memory_id, str(getattr(memory_type, "value", memory_type))]])  # callers have committed
+
+
+def _retag(memory_id: int, memory_type: str) -> None:
+    code = _TYPE_CODES.get(memory_type, 0)
+    for key, index in _indexes.items():
+        if index.set_tag(memory_id, code):
+            _dirty.add(key)
+
+
+def remove_from_indexes(memory_ids) -> int:
+    """Drop memory ids from every resident index; returns how many were removed."""
+    memory_ids = [int(mid) for mid in memory_ids]
+    _notify_peers(removed=memory_ids)  # callers have committed the delete
+    return _remove(memory_ids)
+
+
+def _remove(memory_ids: list[int]) -> int:
+    removed = 0
+    for key, index in _indexes.items():
+        n = index.remove(memory_ids)
+        if n:
+            removed += n
+            _dirty.add(key)
+    for pending in _peer_added.values():
+        pending.difference_update(memory_ids)
+    return removed
+
+
+# -- cross-worker invalidation ---------------------------------------------
+
+_PEER_ADDED = "vector_index_peer_added"
+
+
+def _notify_peers(**changes) -> None:
+    """Tell other workers about committed index changes: added=[[owner, id]], removed=[id], types=[[id, type]]."""
+    if broadcast_bus.backend != "local":
+        broadcast_bus.notify_peers("vector_index", changes)
+
+
+def _on_peer_change(payload: dict) -> None:
+    if payload.get("removed"):
+        _remove(payload["removed"])
+    for memory_id, memory_type in payload.get("types", ()):
+        _retag(memory_id, memory_type)
+    for key, memory_id in payload.get("added", ()):
+        if key in _indexes:  # not resident: picked up by reconciliation on load
+            _peer_added.setdefault(key, set()).add(memory_id)
+
+
+broadcast_bus.subscribe("vector_index", _on_peer_change)
+
+
+@event.listens_for(Session, "after_commit")
+def _announce_after_commit(session: Session) -> None:
+    if session.in_nested_transaction():
+        return  # SAVEPOINT release; wait for the real commit
+    added = session.info.pop(_PEER_ADDED, None)
+    if added:
+        _notify_peers(added=added)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session: Session) -> None:
+    if not session.in_nested_transaction():
+        session.info.pop(_PEER_ADDED, None)
+
+
+def save_vector_indexes() -> None:
+    """Persist every modified resident index to ``settings.vector_index_dir``."""
+    for key in list(_dirty):
+        index = _indexes.get(key)
+        if index is None:
+            continue
+        try:
+            index.save(_index_path(key))
+        except OSError as e:
+            logger.warning("Failed to persist vector index %s: %s", key, e)
+            continue
+        _dirty.discard(key)
+
+
+def reset_vector_indexes() -> None:
+    """Forget all resident indexes without saving (tests / DB swaps)."""
+    _indexes.clear()
+    _dirty.clear()
+    _peer_added.clear()
 
 
 async def delete_memory(memory_id: int) -> None:
-    """No-op: SQLite cascade handles deletion."""
-    pass
+    """Drop a deleted memory from the resident indexes (the row itself is deleted by the caller)."""
+    remove_from_indexes([memory_id])
@@ -3,15 +3,17 @@
 
 两种触发方式：
 1. @提及 → 必定唤醒
-2. 人类/Agent 消息 → 小模型选人
+2. 人类/Agent 消息 → 规则打分选人，拿不准时才问小模型（结果按上下文指纹缓存）
 （定时聊天已合并到 autonomy_service）
 """
 import logging
-import httpx
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from ..models import Agent, Message
-from ..core.config import resolve_model
+from ..core.config import resolve_model, settings
+from ..core.llm_clients import llm_clients
+from ..core.llm_router import llm_router
+from .responder_scorer import MISSING, DecisionCache, ResponderScorer
 
 logger = logging.getLogger(__name__)
 
@@ -30,46 +32,56 @@ WAKEUP_PROMPT = """你是一个聊天室管理员。根据以下信息，选择
 只返回名称，不要解释。"""
 
 
-async def call_wakeup_model(prompt: str) -> str:
-    """调用小模型进行唤醒选人"""
+async def call_wakeup_model(prompt: str) -> str | None:
+    """调用小模型进行唤醒选人；调用失败返回 None（与模型答 "NONE" 区分开，失败结果不能缓存）"""
     resolved = resolve_model("wakeup-model")
     if not resolved:
         print("[WAKEUP] model not configured, returning NONE", flush=True)
         return "NONE"
 
-    base_url, api_key, model_id = resolved
-
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            response = await client.post(
-                f"{base_url}/chat/completions",
-                headers={"Authorization": f"Bearer {api_key}"},
+        # 共享连接池，复用到供应商的长连接
+        messages = [{"role": "user", "content": prompt}]
+
+        async def request(target):
+            response = await llm_clients.http.post(
+                f"{target.base_url}/chat/completions",
+                headers={"Authorization": f"Bearer {target.api_key}"},
                 json={
-                    "model": model_id,
-                    "messages": [{"role": "user", "content": prompt}],
+                    "model": target.model_id,
+                    "messages": messages,
                     "max_tokens": 800,
                 },
+                timeout=15,
             )
             response.raise_for_status()
-            data = response.json()
-            msg = data["choices"][0]["message"]
-            content = (msg.get("content") or "").strip()
-            # 某些推理模型把答案放在 reasoning 末尾，content 为空
-            if not content and msg.get("reasoning"):
-                # 取 reasoning 最后一行作为答案
-                lines = msg["reasoning"].strip().splitlines()
-                content = lines[-1].strip() if lines else ""
-            print(f"[WAKEUP] model returned: {content!r}", flush=True)
-            return content
+            return response.json()
+
+        routed = await llm_router.complete(
+            llm_router.targets("wakeup-model", resolved), request, messages=messages, max_tokens=800,
+        )
+        data = routed.value
+        msg = data["choices"][0]["message"]
+        content = (msg.get("content") or "").strip()
+        # 某些推理模型把答案放在 reasoning 末尾，content 为空
+        if not content and msg.get("reasoning"):
+            # 取 reasoning 最后一行作为答案
+            lines = msg["reasoning"].strip().splitlines()
+            content = lines[-1].strip() if lines else ""
+        print(f"[WAKEUP] model returned: {content!r}", flush=True)
+        return content
     except Exception as e:
         print(f"[WAKEUP] model call failed: {e}", flush=True)
         logger.error("Wakeup model call failed: %s", e, exc_info=True)
-        return "NONE"
+        return None
 
 
 class WakeupService:
     def __init__(self) -> None:
         self._no_response_count: dict[int, int] = {}  # {agent_id: 连续无回应次数}
+        self._scorer = ResponderScorer()
+        self._cache = DecisionCache()
+        self.stats = dict.fromkeys(("decisions", "rule", "cached", "llm", "compared", "agreed"), 0)
 
     def record_response(self, agent_id: int) -> None:
         """有人回应时重置计数器"""
@@ -121,43 +133,48 @@ class WakeupService:
     async def _select_responder(
         self, message: Message, online_agent_ids: set[int], db: AsyncSession
     ) -> int | None:
-        """小模型选人：人类消息时选择最合适的回复者"""
+        """人类消息时选择最合适的回复者：规则打分有把握就直接选，否则问小模型"""
         candidates = await self._get_candidates(online_agent_ids, message.agent_id, db)
         print(f"[WAKEUP:select] candidates={[(c.id, c.name) for c in candidates]}", flush=True)
         if not candidates:
             return None
-
-        recent = await self._get_recent_messages(db, limit=10)
-        agent_list = "\n".join(
-            f"- {a.name}: {a.persona[:80]}"
-            + ("（最近发言较多，建议让其他人说话）" if self._no_response_count.get(a.id, 0) >= 3 else "")
-            for a in candidates
-        )
-        recent_text = "\n".join(
-            f"{m.agent.name if m.agent else 'unknown'}: {m.content[:100]}"
-            for m in recent
-        )
-
-        prompt = WAKEUP_PROMPT.format(
-            agent_list=agent_list,
-            recent_messages=recent_text or "(无)",
-            new_message=message.content[:200],
-        )
-
-        print(f"[WAKEUP:select] calling wakeup model...", flush=True)
-        result = await call_wakeup_model(prompt)
-        print(f"[WAKEUP:select] model result={result!r}", flush=True)
-        return self._resolve_name(result, candidates)
+        return await self._choose("select", message, candidates, db)
 
     async def _maybe_trigger(
         self, message: Message, online_agent_ids: set[int], db: AsyncSession
     ) -> int | None:
-        """Agent 消息时，小概率触发另一个 Agent 参与对话"""
+        """Agent 消息时，小概率触发另一个 Agent 参与对话（没人相关时规则直接判定不触发）"""
         candidates = await self._get_candidates(online_agent_ids, message.agent_id, db)
         if not candidates:
             return None
+        return await self._choose("trigger", message, candidates, db)
 
+    async def _choose(
+        self, kind: str, message: Message, candidates: list[Agent], db: AsyncSession
+    ) -> int | None:
+        """规则打分 → 决策缓存 → 小模型，三级选人"""
         recent = await self._get_recent_messages(db, limit=10)
+        prior = [m for m in recent if m.id is None or m.id != message.id]  # 新消息本身已入库，不算"上一个发言者"
+        self.stats["decisions"] += 1
+
+        decision = None
+        if settings.wakeup_scorer:
+            decision = self._scorer.decide(
+                message.content, candidates, prior, self._no_response_count,
+                from_agent=kind == "trigger",
+            )
+            if decision.confident:
+                self.stats["rule"] += 1
+                print(f"[WAKEUP:{kind}] rule picked {decision.agent_id} scores={decision.scores}", flush=True)
+                return decision.agent_id
+
+        key = DecisionCache.fingerprint(kind, message.content, candidates, prior, self._no_response_count)
+        cached = self._cache.get(key)
+        if cached is not MISSING:
+            self.stats["cached"] += 1
+            print(f"[WAKEUP:{kind}] cached decision {cached}", flush=True)
+            return cached
+
         agent_list = "\n".join(
             f"- {a.name}: {a.persona[:80]}"
             + ("（最近发言较多，建议让其他人说话）" if self._no_response_count.get(a.id, 0) >= 3 else "")
@@ -174,8 +191,34 @@ class WakeupService:
             new_message=message.content[:200],
         )
 
+        print(f"[WAKEUP:{kind}] calling wakeup model...", flush=True)
+        self.stats["llm"] += 1
         result = await call_wakeup_model(prompt)
-        return self._resolve_name(result, candidates)
+        print(f"[WAKEUP:{kind}] model result={result!r}", flush=True)
+        if result is None:
+            return None  # 供应商临时故障：这次没人回复，但不缓存，同样的上下文下次重新问
+        selected = self._resolve_name(result, candidates)
+        self._cache.put(key, selected)
+        # 影子对比：规则打分的第一名和模型的选择是否一致（衡量规则层的准确度）
+        if decision is not None and selected is not None:
+            self.stats["compared"] += 1
+            self.stats["agreed"] += int(decision.top == selected)
+        return selected
+
+    def decision_stats(self) -> dict:
+        """选人决策统计：规则直出 / 缓存命中 / 调用模型的次数，省掉的模型调用比例，规则与模型的一致率"""
+        total = self.stats["decisions"]
+        compared = self.stats["compared"]
+        return {
+            **self.stats,
+            "cache_entries": len(self._cache),
+            "llm_avoided_ratio": round(1 - self.stats["llm"] / total, 4) if total else 0.0,
+            "rule_agreement": round(self.stats["agreed"] / compared, 4) if compared else None,
+        }
+
+    def reset_decisions(self) -> None:
+        self._cache.clear()
+        self.stats = dict.fromkeys(self.stats, 0)
 
     async def _get_candidates(
         self, online_agent_ids: set[int], exclude_id: int, db: AsyncSession
@@ -0,0 +1,461 @@
+"""自主行为 prompt 用的内存世界状态：居民明细与各段落按脏标记增量刷新，定期整体重建校验漂移"""
+
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from sqlalchemy import event, func as sa_func, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
+
+from ..core.config import settings
+from ..models import (
+    Agent, AgentItem, AgentResource, Bounty, Building, BuildingWorker, CheckIn, Job, MarketOrder, Message, VirtualItem,
+)
+
+logger = logging.getLogger(__name__)
+
+CHAT = "最近聊天"
+JOBS = "可用岗位"
+SHOP = "商店商品"
+BUILDINGS = "城市建筑"
+RECIPES = "可建造建筑"
+MARKET = "交易市场"
+BOUNTIES = "悬赏任务"
+SECTIONS = (CHAT, JOBS, SHOP, BUILDINGS, RECIPES, MARKET, BOUNTIES)
+
+_PENDING = "world_state_pending"
+
+# ORM 行 → (是否影响所属居民 agent_id, 影响的共享段落)
+_TRACKED = {
+    CheckIn: (True, {JOBS}),
+    AgentItem: (True, set()),
+    BuildingWorker: (True, {BUILDINGS}),
+    AgentResource: (True, set()),
+    Building: (False, {BUILDINGS}),
+    Job: (False, {JOBS}),
+    VirtualItem: (False, {SHOP}),
+    MarketOrder: (False, {MARKET}),
+    Bounty: (False, {BOUNTIES}),
+}
+_AGENT_FIELDS = ("name", "persona", "credits", "satiety", "mood", "stamina")  # 快照里出现的 Agent 字段
+
+
+@dataclass
+class WorldView:
+    """一轮决策用的世界状态：居民明细按 agent 分开存放，其余段落全体共享，可整体或按分片渲染成 prompt"""
+    now: datetime
+    agents: list[tuple[int, str]]  # [(id, name)]，按 id 排序
+    agent_lines: dict[int, str]
+    last_round: list[tuple[int, str]]  # [(agent_id, 行)]
+    sections: dict[str, list[str]] = field(default_factory=dict)  # 共享段落：最近聊天 / 岗位 / 商店 / 建筑 / 市场 / 悬赏
+
+    def render(self, agent_ids: list[int] | None = None) -> str:
+        """agent_ids=None → 完整快照；否则只含这些居民的明细 + 其他居民的简表"""
+        if agent_ids is None:
+            agent_lines = [self.agent_lines[aid] for aid, _ in self.agents]
+            last_lines = [line for _, line in self.last_round] or ["(首轮)"]
+            roster = ""
+        else:
+            members = set(agent_ids)
+            agent_lines = [self.agent_lines[aid] for aid, _ in self.agents if aid in members]
+            last_lines = [line for aid, line in self.last_round if aid in members] or (
+                ["(无)"] if self.last_round else ["(首轮)"]
+            )
+            others = [f"ID={aid} {name}" for aid, name in self.agents if aid not in members]
+            roster = f"\n\n== 其他居民（本轮不由你决定）==\n{'、'.join(others)}" if others else ""
+        section = lambda name: chr(10).join(self.sections[name])  # noqa: E731
+
+        return f"""当前时间：{self.now.strftime('%Y-%m-%d %H:%M UTC')}
+
+== 居民状态 ==
+{chr(10).join(agent_lines)}{roster}
+
+== 最近聊天 ==
+{section(CHAT)}
+
+== 上一轮行为 ==
+{chr(10).join(last_lines)}
+
+== 可用岗位 ==
+{section(JOBS)}
+
+== 商店商品 ==
+{section(SHOP)}
+
+== 城市建筑 ==
+{section(BUILDINGS)}
+
+== 可建造建筑 ==
+{section(RECIPES)}
+
+== 交易市场 ==
+{section(MARKET)}
+
+== 悬赏任务 ==
+{section(BOUNTIES)}
+
+请为每个居民决定下一步行为。"""
+
+
+@dataclass
+class AgentRecord:
+    id: int
+    name: str
+    persona: str
+    credits: int
+    satiety: int
+    mood: int
+    stamina: int
+    checked_in: bool = False
+    items: list[str] = field(default_factory=list)
+    building: tuple[int, str, str] | None = None  # (id, name, type)
+    resources: dict[str, tuple[float, float]] = field(default_factory=dict)  # type -> (quantity, frozen)
+    line: str = ""
+
+    def render(self) -> str:
+        checked = "已打卡" if self.checked_in else "未打卡"
+        items = ", ".join(self.items) or "无"
+        persona_brief = self.persona[:60] + ("…" if len(self.persona) > 60 else "")
+        work_str = f"[在岗：{self.building[1]}]" if self.building else "无业"
+        res_str = ", ".join(
+            f"{rtype}={qty}" + (f"(冻结{frozen})" if frozen > 0 else "")
+            for rtype, (qty, frozen) in self.resources.items()
+        ) or "无"
+        stamina_tag = " [体力不足，无法工作]" if self.stamina < 20 else ""
+        return (
+            f"- ID={self.id} {self.name}: {persona_brief} | "
+            f"余额={self.credits} | 饱腹={self.satiety} 心情={self.mood} 体力={self.stamina}{stamina_tag} | "
+            f"今日{checked} | {work_str} | 资源=[{res_str}] | 物品=[{items}]"
+        )
+
+
+def _scoped(stmt, column, ids: set[int] | None):
+    return stmt if ids is None else stmt.where(column.in_(ids))
+
+
+async def _load_agents(db: AsyncSession, ids: set[int] | None) -> dict[int, AgentRecord]:
+    """读取居民记录；ids=None 读全部"""
+    today_utc = sa_func.date("now")
+    result = await db.execute(_scoped(select(Agent).where(Agent.id != 0), Agent.id, ids))
+    records = {
+        a.id: AgentRecord(a.id, a.name, a.persona, a.credits, a.satiety, a.mood, a.stamina)
+        for a in result.scalars().all()
+    }
+    if not records:
+        return records
+    scope = None if ids is None else set(records)
+
+    checkins = await db.execute(_scoped(
+        select(CheckIn.agent_id).where(sa_func.date(CheckIn.checked_at) == today_utc), CheckIn.agent_id, scope,
+    ))
+    for (aid,) in checkins.all():
+        if aid in records:
+            records[aid].checked_in = True
+
+    items = await db.execute(_scoped(
+        select(AgentItem.agent_id, VirtualItem.name).join(VirtualItem, AgentItem.item_id == VirtualItem.id),
+        AgentItem.agent_id, scope,
+    ))
+    for aid, item_name in items.all():
+        if aid in records:
+            records[aid].items.append(item_name)
+
+    workers = await db.execute(_scoped(
+        select(BuildingWorker.agent_id, Building.id, Building.name, Building.building_type)
+        .join(Building, BuildingWorker.building_id == Building.id),
+        BuildingWorker.agent_id, scope,
+    ))
+    for aid, bid, bname, btype in workers.all():
+        if aid in records:
+            records[aid].building = (bid, bname, btype)
+
+    resources = await db.execute(_scoped(
+        select(AgentResource).order_by(AgentResource.id), AgentResource.agent_id, scope,
+    ))
+    for ar in resources.scalars().all():
+        if ar.agent_id in records:
+            records[ar.agent_id].resources[ar.resource_type] = (ar.quantity, ar.frozen_amount)
+
+    for record in records.values():
+        record.line = record.render()
+    return records
+
+
+async def _chat_section(db: AsyncSession) -> tuple[list[str], bool]:
+    result = await db.execute(
+        select(Message).options(joinedload(Message.agent)).order_by(Message.created_at.desc()).limit(10)
+    )
+    messages = list(reversed(result.scalars().all()))
+    return [f"- {m.agent.name if m.agent else '?'}: {m.content[:80]}" for m in messages] or ["(无)"], True
+
+
+async def _jobs_section(db: AsyncSession) -> tuple[list[str], bool]:
+    from .work_service import work_service
+    jobs = await work_service.get_jobs(db)
+    return [
+        f"- ID={j['id']} {j['title']}: 日薪{j['daily_reward']} | 今日{j['today_workers']}/{j['max_workers']}人"
+        for j in jobs
+    ], False
+
+
+async def _shop_section(db: AsyncSession) -> tuple[list[str], bool]:
+    from .shop_service import shop_service
+    items = await shop_service.get_items(db)
+    return [f"- ID={i['id']} {i['name']}: {i['price']}信用点 ({i['item_type']})" for i in items], False
+
+
+async def _buildings_section(db: AsyncSession) -> tuple[list[str], bool]:
+    now = datetime.now(timezone.utc)
+    counts = dict((await db.execute(
+        select(BuildingWorker.building_id, sa_func.count()).group_by(BuildingWorker.building_id)
+    )).all())
+    lines = []
+    constructing = False
+    for b in (await db.execute(select(Building))).scalars().all():
+        status_tag = ""
+        if getattr(b, "status", "active") == "constructing":
+            constructing = True
+            started = b.construction_started_at
+            if started:
+                if started.tzinfo is None:
+                    started = started.replace(tzinfo=timezone.utc)
+                remaining = max(0, b.construction_days - (now - started).days)
+                status_tag = f" [建造中，剩余 {remaining} 天]"
+            else:
+                status_tag = " [建造中]"
+        lines.append(f"- ID={b.id} {b.name}({b.building_type}): {counts.get(b.id, 0)}/{b.max_workers}人{status_tag}")
+    return lines, constructing
+
+
+async def _recipes_section(db: AsyncSession) -> tuple[list[str], bool]:
+    from .city_service import BUILDING_RECIPES
+    return [
+        f"- {btype}: 需要 {', '.join(f'{k}={v}' for k, v in recipe['cost'].items())}，"
+        f"工期 {recipe['construction_days']} 天"
+        for btype, recipe in BUILDING_RECIPES.items()
+    ], False
+
+
+async def _market_section(db: AsyncSession) -> tuple[list[str], bool]:
+    from .market_service import list_orders
+    orders = await list_orders(db=db)
+    return [
+        f"- 挂单#{o['id']}: 卖家ID={o['seller_id']} 卖{o['sell_type']}x{o['remain_sell_amount']} "
+        f"换{o['buy_type']}x{o['remain_buy_amount']} ({o['status']})"
+        for o in orders
+    ] or ["(无挂单)"], False
+
+
+async def _bounties_section(db: AsyncSession) -> tuple[list[str], bool]:
+    result = await db.execute(select(Bounty).where(Bounty.status.in_(["open", "claimed"])))
+    lines = []
+    for b in result.scalars().all():
+        if b.status == "open":
+            lines.append(f"- 悬赏#{b.id}: {b.title} | 奖励={b.reward}信用点 | 状态=开放")
+        else:
+            lines.append(f"- 悬赏#{b.id}: {b.title} | 奖励={b.reward}信用点 | 状态=进行中(接取者ID={b.claimed_by})")
+    return lines or ["(无悬赏)"], False
+
+
+_SECTION_LOADERS = {
+    CHAT: _chat_section,
+    JOBS: _jobs_section,
+    SHOP: _shop_section,
+    BUILDINGS: _buildings_section,
+    RECIPES: _recipes_section,
+    MARKET: _market_section,
+    BOUNTIES: _bounties_section,
+}
+
+
+class WorldState:
+    """增量维护的世界状态
+
+    ORM 写入由 after_flush 自动标记，批量 UPDATE 由调用方 touch_*；标记记在 session.info，提交后生效、回滚丢弃。
+    聊天段每次重读，施工中的建筑段随时钟重读，跨天整体重建；非 local 广播后端（多进程）下每次都整体重建。
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self._records: dict[int, AgentRecord] | None = None  # None = 还没加载
+        self._sections: dict[str, list[str]] = {}
+        self._dirty_agents: set[int] = set()
+        self._dirty_sections: set[str] = set(SECTIONS)
+        self._day: str | None = None
+        self._verified_at = 0.0
+        self.stats = dict.fromkeys(
+            ("renders", "full_rebuilds", "agent_refreshes", "section_refreshes", "drift"), 0
+        )
+
+    # --- 变更钩子（ORM 写入由 after_flush 自动标记，这里给批量 UPDATE 用）---
+
+    def touch_agents(self, *agent_ids: int, db=None) -> None:
+        """这些居民的状态变了（余额 / 属性 / 打卡 / 物品 / 岗位 / 资源）；传 db 则在提交后生效"""
+        self._mark(db, agents={a for a in agent_ids if a})
+
+    def touch_sections(self, *names: str, db=None) -> None:
+        self._mark(db, sections=set(names))
+
+    def touch_all(self, db=None) -> None:
+        """批量更新了所有居民（如每日发放），下次读取时整体重建"""
+        self._mark(db, everyone=True)
+
+    def _mark(self, db, agents: set[int] = frozenset(), sections: set[str] = frozenset(),
+              everyone: bool = False) -> None:
+        info = getattr(getattr(db, "sync_session", db), "info", None) if db is not None else None
+        if not isinstance(info, dict):
+            self._apply(agents, sections, everyone)
+            return
+        pending = info.setdefault(_PENDING, {"agents": set(), "sections": set(), "everyone": False})
+        pending["agents"] |= agents
+        pending["sections"] |= sections
+        pending["everyone"] = pending["everyone"] or everyone
+
+    def _apply(self, agents, sections, everyone: bool) -> None:
+        if everyone:
+            self._records = None
+        else:
+            self._dirty_agents |= agents
+        self._dirty_sections |= sections
+
+    # --- 读取 ---
+
+    def _must_rebuild(self) -> bool:
+        return (
+            not settings.world_state_cache
+            or settings.broadcast_backend != "local"
+            or self._records is None
+        )
+
+    async def _rebuild(self, db: AsyncSession) -> tuple[dict[int, AgentRecord], dict[str, list[str]], set[str]]:
+        records = await _load_agents(db, None)
+        sections, volatile = {}, set()
+        for name, loader in _SECTION_LOADERS.items():
+            sections[name], is_volatile = await loader(db)
+            if is_volatile:
+                volatile.add(name)
+        return records, sections, volatile
+
+    async def refresh(self, db: AsyncSession) -> None:
+        """把脏的部分从数据库重新读出来（首次 / 跨天 / 到期校验时整体重建）"""
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        if today != self._day:
+            self._day = today
+            self._records = None  # 打卡状态、岗位人数、工期都按天变
+            self._dirty_sections |= {JOBS, BUILDINGS}
+
+        verify_due = time.monotonic() - self._verified_at >= settings.world_state_verify_seconds
+        if self._must_rebuild() or verify_due:
+            cached = None if self._records is None else (self._records, self._sections)
+            if cached is not None and verify_due and not self._must_rebuild():
+                await self._refresh_dirty(db)  # 先把已知的变化补上，剩下的差异才算漏掉的
+                cached = (self._records, self._sections)
+            records, sections, volatile = await self._rebuild(db)
+            if cached is not None:
+                self._check_drift(cached, records, sections)
+            self._records, self._sections = records, sections
+            self._dirty_agents.clear()
+            self._dirty_sections = volatile
+            self._verified_at = time.monotonic()
+            self.stats["full_rebuilds"] += 1
+            return
+        await self._refresh_dirty(db)
+
+    async def _refresh_dirty(self, db: AsyncSession) -> None:
+        if self._dirty_agents:
+            ids = set(self._dirty_agents)
+            self._dirty_agents.clear()
+            fresh = await _load_agents(db, ids)
+            for aid in ids:
+                if aid in fresh:
+                    self._records[aid] = fresh[aid]
+                else:
+                    self._records.pop(aid, None)  # 已删除
+            self.stats["agent_refreshes"] += len(ids)
+        names = [n for n in SECTIONS if n in self._dirty_sections]
+        self._dirty_sections = set()
+        for name in names:
+            self._sections[name], volatile = await _SECTION_LOADERS[name](db)
+            if volatile:
+                self._dirty_sections.add(name)
+            self.stats["section_refreshes"] += 1
+
+    def _check_drift(self, cached, records: dict[int, AgentRecord], sections: dict[str, list[str]]) -> None:
+        old_records, old_sections = cached
+        stale_agents = sorted(
+            aid for aid in set(old_records) | set(records)
+            if aid not in old_records or aid not in records or old_records[aid].line != records[aid].line
+        )
+        stale_sections = [n for n in SECTIONS if n != CHAT and old_sections.get(n) != sections.get(n)]
+        if stale_agents or stale_sections:
+            self.stats["drift"] += len(stale_agents) + len(stale_sections)
+            logger.warning("World state drifted from the database: agents=%s sections=%s (missing change hook?)",
+                           stale_agents, stale_sections)
+
+    async def records(self, db: AsyncSession) -> dict[int, AgentRecord]:
+        """最新的居民记录（只读，调用方不要修改）"""
+        await self.refresh(db)
+        return self._records
+
+    async def view(self, db: AsyncSession) -> WorldView | None:
+        """当前世界状态（不含上一轮行为）；没有居民时返回 None"""
+        await self.refresh(db)
+        self.stats["renders"] += 1
+        if not self._records:
+            return None
+        ordered = sorted(self._records)
+        return WorldView(
+            now=datetime.now(timezone.utc),
+            agents=[(aid, self._records[aid].name) for aid in ordered],
+            agent_lines={aid: self._records[aid].line for aid in ordered},
+            last_round=[],
+            sections=dict(self._sections),
+        )
+
+
+world_state = WorldState()
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session: Session, flush_context) -> None:
+    agents: set[int] = set()
+    sections: set[str] = set()
+    everyone = False
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Agent):
+            if obj in session.deleted:
+                everyone = True  # 级联删除的岗位 / 资源等不会出现在本次 flush 里
+            elif obj in session.new or any(
+                inspect(obj).attrs[f].history.has_changes() for f in _AGENT_FIELDS
+            ):
+                agents.add(obj.id)
+            continue
+        tracked = _TRACKED.get(type(obj))
+        if tracked is None:
+            continue
+        per_agent, affected = tracked
+        if per_agent and obj.agent_id:
+            agents.add(obj.agent_id)
+        sections |= affected
+    if agents or sections or everyone:
+        world_state._mark(session, agents, sections | (set(SECTIONS) if everyone else set()), everyone)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending(session: Session) -> None:
+    if session.in_nested_transaction():
+        return  # 释放 SAVEPOINT，外层事务还没提交
+    pending = session.info.pop(_PENDING, None)
+    if pending:
+        world_state._apply(pending["agents"], pending["sections"], pending["everyone"])
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session: Session) -> None:
+    if session.in_nested_transaction():
+        return  # 只回滚了一个 SAVEPOINT：前面 action 的标记还要在外层提交时生效
+    session.info.pop(_PENDING, None)
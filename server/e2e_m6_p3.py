@@ -3,6 +3,7 @@ E2E Test — M6 Phase 3 Agent 状态可视化端到端验证
 
 覆盖场景：
   ST-1: 状态变更序列 — trigger-autonomy 后 WebSocket 收到 agent_status_change 事件序列
+        （batch 模式下是 agent_status_batch，按 updates 展开成逐条事件再校验）
   ST-2: activity 字段 — status_change 事件的 activity 字段非空（thinking 时）
   ST-3: ActivityFeed tool_call — 若 Agent 执行了 tool_call，agent_action 事件包含 action
   ST-4: 多 Agent 状态互不干扰 — 各 agent_id 的 status_change 事件独立
@@ -69,6 +70,17 @@ async def collect_ws_events(timeout: float = 30) -> list[dict]:
     return events
 
 
+def status_change_events(events: list[dict]) -> list[dict]:
+    """逐条的 agent_status_change；batch 模式的 agent_status_batch 按 updates 展开成同样格式"""
+    out: list[dict] = []
+    for e in events:
+        if e.get("event") == "agent_status_change":
+            out.append(e)
+        elif e.get("event") == "agent_status_batch":
+            out.extend({"event": "agent_status_change", **u} for u in e.get("updates", []))
+    return out
+
+
 # ─── ST-1: 状态变更序列 ──────────────────────────────────────────
 
 async def test_status_change_sequence():
@@ -81,7 +93,7 @@ async def test_status_change_sequence():
         fail("ST-1 WebSocket 连接/tick 失败", str(e))
         return events
 
-    status_events = [e for e in events if e.get("event") == "agent_status_change"]
+    status_events = status_change_events(events)
 
     if not status_events:
         fail("ST-1 未收到 agent_status_change 事件")
@@ -119,7 +131,7 @@ async def test_status_change_sequence():
 async def test_activity_field(events: list[dict]):
     print("\n=== ST-2: activity 字段 ===")
 
-    status_events = [e for e in events if e.get("event") == "agent_status_change"]
+    status_events = status_change_events(events)
 
     if not status_events:
         fail("ST-2 无 status_change 事件可验证")
@@ -189,7 +201,7 @@ async def test_activity_feed_tool_call(events: list[dict]):
 async def test_multi_agent_isolation(events: list[dict]):
     print("\n=== ST-4: 多 Agent 状态互不干扰 ===")
 
-    status_events = [e for e in events if e.get("event") == "agent_status_change"]
+    status_events = status_change_events(events)
 
     if not status_events:
         fail("ST-4 无 status_change 事件可验证")
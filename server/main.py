@@ -17,10 +17,17 @@ from sqlalchemy import select, func as sa_func
 from app.core import init_db
 from app.core.config import settings
 from app.core.database import async_session
+from app.core.llm_clients import close_llm_clients
 from app.models import Agent, Job, VirtualItem, Building, Resource, Memory, MemoryType
-from app.api import agents_router, chat_router, dev_router, bounties_router, work_router, shop_router, memory_router, city_router
-from app.services.vector_store import init_vector_store, close_vector_store, upsert_memory
-from app.services.scheduler import scheduler_loop, autonomy_loop
+from app.api import agents_router, chat_router, dev_router, bounties_router, work_router, shop_router, memory_router, city_router, llm_router
+from app.services.vector_store import (
+    init_vector_store, close_vector_store, upsert_memory, embed_many, store_embedding, backfill_embeddings,
+)
+from app.services.scheduler import scheduler_loop, autonomy_loop, memory_access_flush_loop, flush_memory_access
+from app.services.status_helper import flush_agent_status
+from app.services.broadcast_bus import broadcast_bus
+from app.services.strategy_engine import load_strategies
+from app.services.strategy_runtime import strategy_runtime
 
 logger = logging.getLogger(__name__)
 
@@ -105,8 +112,15 @@ async def seed_public_memories():
             logger.info("公共记忆种子数据已完整，跳过填充")
             return
 
+        # 先批量生成 embedding；整批失败时退回逐条生成，保持"单条失败只跳过该条"
+        try:
+            blobs = await embed_many([item["content"] for item in to_insert])
+        except Exception as e:
+            logger.warning("公共记忆批量 embedding 失败，改为逐条生成: %s", e)
+            blobs = [None] * len(to_insert)
+
         inserted = 0
-        for item in to_insert:
+        for item, blob in zip(to_insert, blobs):
             content = item["content"]
             try:
                 async with db.begin_nested():
@@ -117,7 +131,10 @@ async def seed_public_memories():
                     )
                     db.add(memory)
                     await db.flush()
-                    await upsert_memory(memory.id, -1, content, db)
+                    if blob is None:
+                        await upsert_memory(memory.id, -1, content, db)
+                    else:
+                        store_embedding(memory, blob)
                 inserted += 1
             except Exception as e:
                 logger.warning("公共记忆 embedding 生成失败，跳过: %s — %s", content[:20], e)
@@ -126,6 +143,25 @@ async def seed_public_memories():
         logger.info("公共记忆种子填充完成: %d/%d 条", inserted, len(to_insert))
 
 
+async def backfill_embeddings_in_background():
+    """补齐缺少 embedding 的记忆；放在后台跑，embedding 服务慢或不可用时不拖住启动"""
+    try:
+        async with async_session() as db:
+            await backfill_embeddings(db)
+    except Exception as e:
+        logger.error("Embedding backfill failed: %s", e)
+
+
+async def run_leader_loops():
+    """每台机器只跑一份的后台循环（每日发放 / 衰减、autonomy tick、embedding 回填）：
+    多 worker 时只有拿到 leader 锁的 worker 执行，它退出后由其他 worker 接手"""
+    await broadcast_bus.wait_leadership()
+    loops = [scheduler_loop(), autonomy_loop()]
+    if settings.embedding_api_key:
+        loops.append(backfill_embeddings_in_background())
+    await asyncio.gather(*loops)
+
+
 async def lifespan(app: FastAPI):
     await init_db()
     await ensure_human_agent()
@@ -133,19 +169,32 @@ async def lifespan(app: FastAPI):
     await seed_city_buildings()
     await init_vector_store()
     await seed_public_memories()
-    scheduler_task = asyncio.create_task(scheduler_loop())
-    autonomy_task = asyncio.create_task(autonomy_loop())
+    async with async_session() as db:
+        await load_strategies(db)
+    await broadcast_bus.start()
+    tasks = [
+        asyncio.create_task(run_leader_loops()),
+        asyncio.create_task(memory_access_flush_loop()),  # 每个 worker 写回自己内存里的命中计数
+    ]
     yield
-    scheduler_task.cancel()
-    autonomy_task.cancel()
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
     try:
-        await scheduler_task
-    except asyncio.CancelledError:
-        pass
+        await flush_memory_access()
+    except Exception as e:
+        logger.error("Final memory access flush failed: %s", e)
     try:
-        await autonomy_task
-    except asyncio.CancelledError:
-        pass
+        await flush_agent_status()
+    except Exception as e:
+        logger.error("Final agent status flush failed: %s", e)
+    strategy_runtime.reset()
+    await broadcast_bus.stop()
+    await close_llm_clients()
     await close_vector_store()
 
 
@@ -167,6 +216,7 @@ app.include_router(work_router, prefix="/api")
 app.include_router(shop_router, prefix="/api")
 app.include_router(memory_router, prefix="/api")
 app.include_router(city_router, prefix="/api")
+app.include_router(llm_router, prefix="/api")
 
 
 @app.get("/api/health")
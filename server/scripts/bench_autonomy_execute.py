@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+自主行为执行基准：一轮 execute_decisions 的写事务数、持锁时间与总耗时
+
+在临时 SQLite 文件库（与线上相同的 PRAGMA 与 BEGIN IMMEDIATE 设置）里造 N 个居民，
+每人一条决策（打卡 / 购买 / 吃饭 / 转赠 / 挂单 / 上岗 / 接悬赏 / 休息轮流分配），
+和 tick 一样包在 status_batch() 里执行，统计：
+  - 写事务数（COMMIT 次数）
+  - 持锁时间：每个事务从第一条写语句到 COMMIT / ROLLBACK 的时间之和与最大值
+  - execute_decisions 总耗时
+
+用法:
+  python scripts/bench_autonomy_execute.py
+  python scripts/bench_autonomy_execute.py --agents 200 --rounds 3
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import AsyncMock, patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine  # noqa: E402
+
+from app.core.database import Base, _set_sqlite_pragma  # noqa: E402
+from app.models import Agent, AgentResource, Building, Job, VirtualItem  # noqa: E402
+from app.models.tables import Bounty  # noqa: E402
+from app.services import autonomy_service  # noqa: E402
+from app.services.status_helper import status_batch  # noqa: E402
+
+_WRITES = ("INSERT", "UPDATE", "DELETE")  # SQLite 在第一条写语句时拿写锁
+
+
+def instrument(engine) -> dict:
+    m = {"commits": 0, "lock_total": 0.0, "lock_max": 0.0}
+
+    event.listen(engine.sync_engine, "connect", _set_sqlite_pragma)
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _first_write(conn, cursor, statement, *args):
+        if "write_started" not in conn.info and statement.lstrip().upper().startswith(_WRITES):
+            conn.info["write_started"] = time.perf_counter()
+
+    def _end(conn, committed: bool):
+        started = conn.info.pop("write_started", None)
+        if started is None:
+            return
+        held = time.perf_counter() - started
+        m["commits"] += committed
+        m["lock_total"] += held
+        m["lock_max"] = max(m["lock_max"], held)
+
+    event.listen(engine.sync_engine, "commit", lambda conn: _end(conn, True))
+    event.listen(engine.sync_engine, "rollback", lambda conn: _end(conn, False))
+    return m
+
+
+async def seed(maker, n: int):
+    async with maker() as db:
+        db.add(Agent(id=0, name="Human", persona="h"))
+        db.add(Job(id=1, title="矿工", daily_reward=8, max_workers=0))
+        db.add(VirtualItem(id=1, name="金框", item_type="avatar_frame", price=5))
+        db.add(Building(id=1, name="农场", building_type="farm", max_workers=n))
+        for i in range(1, n + 1):
+            db.add(Agent(id=i, name=f"A{i}", persona="居民", credits=100, satiety=50))
+            for rtype in ("wheat", "flour", "wood", "stone"):
+                db.add(AgentResource(agent_id=i, resource_type=rtype, quantity=50))
+            db.add(Bounty(id=i, title=f"悬赏{i}", reward=5))
+        await db.commit()
+
+
+def decisions_for(n: int) -> list[dict]:
+    cycle = [
+        ("checkin", {}),
+        ("purchase", {"item_id": 1}),
+        ("eat", {}),
+        ("transfer_resource", lambda i: {"to_agent_id": i % n + 1, "resource_type": "wood", "quantity": 1}),
+        ("create_market_order", {"sell_type": "wood", "sell_amount": 2, "buy_type": "stone", "buy_amount": 1}),
+        ("assign_building", {"building_id": 1}),
+        ("claim_bounty", lambda i: {"bounty_id": i}),
+        ("rest", {}),
+    ]
+    out = []
+    for i in range(1, n + 1):
+        action, params = cycle[i % len(cycle)]
+        out.append({"agent_id": i, "action": action, "params": params(i) if callable(params) else dict(params),
+                    "reason": "bench"})
+    return out
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+        metrics = instrument(engine)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        await seed(maker, args.agents)
+        decisions = decisions_for(args.agents)
+
+        with patch("app.api.chat.broadcast", new_callable=AsyncMock):
+            for r in range(args.rounds):
+                metrics.update(commits=0, lock_total=0.0, lock_max=0.0)
+                started = time.perf_counter()
+                async with status_batch():
+                    async with maker() as db:
+                        stats = await autonomy_service.execute_decisions([dict(d) for d in decisions], db)
+                elapsed = time.perf_counter() - started
+                print(f"round {r + 1}: {args.agents} agents  {stats}")
+                print(f"  写事务 {metrics['commits']}  持锁合计 {metrics['lock_total'] * 1000:.1f}ms  "
+                      f"单次最长 {metrics['lock_max'] * 1000:.1f}ms  总耗时 {elapsed * 1000:.1f}ms")
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=2)
+    asyncio.run(main(parser.parse_args()))
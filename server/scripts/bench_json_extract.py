@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+LLM 输出 JSON 提取基准：MB 级推理文本与病态输入的 extract_actions 耗时
+
+  - 推理文本：随机中英文说明 + 中途一份草稿数组 + 结尾代码块里的最终答案
+  - 病态输入：极深嵌套 / 每层同处失败 / 未闭合 / 成串错配，后面跟最终答案
+每种输入分别测 n 与 2n 两个规模，耗时应大致翻倍（线性）
+
+用法:
+  python scripts/bench_json_extract.py
+  python scripts/bench_json_extract.py --size 8000000 --depth 200000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.services.json_extract import extract_actions  # noqa: E402
+
+FINAL = [{"agent_id": i, "action": "rest", "params": {}, "reason": "累了"} for i in range(1, 4)]
+
+
+def reasoning_blob(size: int) -> str:
+    rnd = random.Random(7)
+    words = ["居民", "体力", "不足", "需要", "休息", "the", "agent", "should", "(1)", "[注]", '"引用"', "，", "。", "\n"]
+    prose = " ".join(rnd.choice(words) for _ in range(size // 3))
+    draft = json.dumps([{"agent_id": 1, "action": "eat", "params": {}}])
+    half = len(prose) // 2
+    return prose[:half] + "\n草稿：" + draft + "\n" + prose[half:] + "\n```json\n" + json.dumps(FINAL) + "\n```"
+
+
+PATHOLOGICAL = {
+    "deep": lambda n: "[" * n + "]" * n,
+    "same-failure": lambda n: "[1," * n + "x",
+    "unclosed": lambda n: '{"a":' * (n // 2),
+    "mismatched": lambda n: "{" * n + "]" * n,
+}
+
+
+def timed(text: str) -> float:
+    started = time.perf_counter()
+    result = extract_actions(text)
+    elapsed = time.perf_counter() - started
+    if result != FINAL:
+        raise SystemExit("没有提取到最终答案")
+    return elapsed
+
+
+def main(args):
+    rows = [("reasoning", reasoning_blob, args.size)]
+    rows += [(name, lambda n, b=build: b(n) + json.dumps(FINAL), args.depth) for name, build in PATHOLOGICAL.items()]
+    print(f"{'输入':<14}{'n':>10}{'耗时(n)':>12}{'耗时(2n)':>12}{'比值':>8}")
+    for name, build, n in rows:
+        small, large = timed(build(n)), timed(build(2 * n))
+        print(f"{name:<14}{n:>10}{small * 1000:>10.1f}ms{large * 1000:>10.1f}ms{large / small:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=4_000_000, help="推理文本的大致字符数")
+    parser.add_argument("--depth", type=int, default=100_000, help="病态输入的括号层数")
+    main(parser.parse_args())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+LLM 客户端基准：每次调用新建 AsyncOpenAI vs 共享连接池（app.core.llm_clients）
+
+本地起一个最小 HTTP/1.1 keep-alive stub（固定返回一个 chat completion，可模拟服务端耗时），
+分别用两种方式发 N 次请求（可并发），对比单次延迟 p50 / p95 / 均值和新建的 TCP 连接数。
+本地回环没有 TLS，也几乎没有 RTT；真实供应商每条新连接还要多付 1~2 个 RTT 的 TLS 握手，
+差距只会更大。
+
+用法:
+  python scripts/bench_llm_clients.py
+  python scripts/bench_llm_clients.py --calls 500 --concurrency 8 --server-ms 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from openai import AsyncOpenAI  # noqa: E402
+
+from app.core.llm_clients import llm_client, llm_clients  # noqa: E402
+
+COMPLETION = json.dumps({
+    "id": "bench", "object": "chat.completion", "created": 0, "model": "stub",
+    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "ok"}}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}).encode()
+
+
+async def start_stub(server_ms: float, connections: list):
+    async def handle(reader, writer):
+        connections.append(1)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                await reader.readexactly(length)
+                if server_ms:
+                    await asyncio.sleep(server_ms / 1000)
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: " + str(len(COMPLETION)).encode() + b"\r\n\r\n" + COMPLETION
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0, backlog=1024)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/v1"
+
+
+async def call_per_call_client(base_url: str):
+    async with AsyncOpenAI(api_key="sk-bench", base_url=base_url) as client:
+        await client.chat.completions.create(model="stub", messages=[{"role": "user", "content": "hi"}])
+
+
+async def call_pooled(base_url: str):
+    client = llm_client(base_url=base_url, api_key="sk-bench")
+    await client.chat.completions.create(model="stub", messages=[{"role": "user", "content": "hi"}])
+
+
+async def run(name, fn, base_url, calls, concurrency, connections):
+    latencies: list[float] = []
+    sem = asyncio.Semaphore(concurrency)
+    before = len(connections)
+
+    async def one():
+        async with sem:
+            start = time.perf_counter()
+            await fn(base_url)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    wall = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    wall = time.perf_counter() - wall
+    latencies.sort()
+    return (
+        name,
+        statistics.median(latencies),
+        latencies[int(len(latencies) * 0.95) - 1],
+        statistics.fmean(latencies),
+        calls / wall,
+        len(connections) - before,
+    )
+
+
+async def main_async(args):
+    connections: list = []
+    server, base_url = await start_stub(args.server_ms, connections)
+    try:
+        # 预热：导入 / 首次构造的开销不计入
+        await call_per_call_client(base_url)
+        await call_pooled(base_url)
+        rows = [
+            await run("每次新建 AsyncOpenAI", call_per_call_client, base_url, args.calls, args.concurrency, connections),
+            await run("共享连接池", call_pooled, base_url, args.calls, args.concurrency, connections),
+        ]
+    finally:
+        await llm_clients.aclose()
+        server.close()
+
+    print(f"{args.calls} 次调用，并发 {args.concurrency}，服务端耗时 {args.server_ms} ms")
+    print(f"\n{'方式':<20} {'p50(ms)':>9} {'p95(ms)':>9} {'均值(ms)':>9} {'吞吐(次/s)':>11} {'新建连接':>9}")
+    for name, p50, p95, mean, qps, conns in rows:
+        print(f"  {name:<18} {p50:>9.2f} {p95:>9.2f} {mean:>9.2f} {qps:>11.0f} {conns:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--server-ms", type=float, default=0.0, help="stub 每个请求的模拟处理时间")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
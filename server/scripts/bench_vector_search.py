@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+向量检索基准：IVF 对比暴力扫描的延迟，以及打分放进线程池后事件循环的调度延迟
+
+  - 延迟    同一批查询分别走 IVFIndex.search 与全量矩阵乘 + argsort
+  - 卡顿    并发发起若干次不分桶的全量搜索，期间用 2ms 的 ticker 测事件循环最大调度延迟，
+            对比 vector_search_workers=0（在事件循环里算）与线程池两种方式
+
+用法:
+  python scripts/bench_vector_search.py
+  python scripts/bench_vector_search.py --n 60000 --dim 1024 --workers 2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.core.config import settings  # noqa: E402
+from app.services import vector_store  # noqa: E402
+from app.services.ann_index import IVFIndex, normalize_rows  # noqa: E402
+
+
+def clustered(n: int, dim: int, seed: int, clusters: int = 64) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    out = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 10000):  # 分块生成，避免一次性的大临时数组
+        end = min(start + 10000, n)
+        labels = rng.integers(0, clusters, size=end - start)
+        out[start:end] = centers[labels] + 0.35 * rng.standard_normal((end - start, dim)).astype(np.float32)
+    return out
+
+
+def bench_latency(vecs: np.ndarray, queries: np.ndarray, k: int):
+    index = IVFIndex(vecs.shape[1], nprobe=8, min_train=2048)
+    index.add(np.arange(len(vecs)), vecs)
+
+    start = time.perf_counter()
+    for q in queries:
+        index.search(q, k)
+    ann = (time.perf_counter() - start) / len(queries) * 1000
+
+    start = time.perf_counter()
+    for q in queries:
+        np.argsort(vecs @ normalize_rows(q[None])[0])[-k:]
+    brute = (time.perf_counter() - start) / len(queries) * 1000
+    print(f"  IVF (nprobe=8)   {ann:>10.2f} ms/查询")
+    print(f"  暴力扫描          {brute:>10.2f} ms/查询")
+
+
+async def max_loop_lag(index: IVFIndex, q: np.ndarray, n_searches: int) -> float:
+    lag, done = 0.0, False
+
+    async def ticker():
+        nonlocal lag
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.002)
+            lag = max(lag, time.perf_counter() - start - 0.002)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    await asyncio.gather(*(vector_store._run_cpu(index.search, q, 5) for _ in range(n_searches)))
+    done = True
+    await tick
+    return lag
+
+
+async def bench_loop_lag(vecs: np.ndarray, workers: int, n_searches: int):
+    index = IVFIndex(vecs.shape[1], min_train=len(vecs) + 1)  # 不分桶：每次搜索都是一次全量矩阵乘
+    index.add(np.arange(len(vecs)), vecs)
+    q = np.ones(vecs.shape[1], dtype=np.float32)
+    start = time.perf_counter()
+    index.search(q, 5)
+    one = time.perf_counter() - start
+
+    settings.vector_search_workers = 0
+    inline = await max_loop_lag(index, q, n_searches)
+    settings.vector_search_workers = workers
+    pooled = await max_loop_lag(index, q, n_searches)
+    print(f"  单次全量搜索      {one * 1000:>10.1f} ms")
+    print(f"  事件循环内计算    {inline * 1000:>10.1f} ms 最大调度延迟")
+    print(f"  线程池 x{workers:<9} {pooled * 1000:>10.1f} ms 最大调度延迟")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=50_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--lag-n", type=int, default=60_000, help="卡顿测试的语料条数（维度取 embedding_dim）")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--searches", type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"延迟：语料 {args.n} × {args.dim}，查询 {args.queries}，k={args.k}")
+    bench_latency(normalize_rows(clustered(args.n, args.dim, seed=0)), clustered(args.queries, args.dim, seed=3), args.k)
+
+    print(f"\n卡顿：语料 {args.lag_n} × {settings.embedding_dim}，并发搜索 {args.searches}")
+    asyncio.run(bench_loop_lag(clustered(args.lag_n, settings.embedding_dim, seed=0), args.workers, args.searches))
+
+
+if __name__ == "__main__":
+    main()
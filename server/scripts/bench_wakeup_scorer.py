@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+唤醒选人规则层回放：在已记录的聊天记录上评估 ResponderScorer
+
+按时间顺序回放数据库里的消息。对每条没有 @提及 的消息，把紧随其后（--window 条以内）
+第一个开口的其他 Agent 当作"实际回复者"（没人接话 = NONE），然后统计：
+  - 规则层有把握直接决定的比例（= 省掉的 wakeup-model 调用比例）
+  - 这些直接决定与实际回复者的一致率
+  - 拿不准的消息里，打分第一名与实际回复者的一致率（规则层给模型的参考价值）
+  - 决策缓存（同一上下文指纹）在回放中的命中次数
+
+用法:
+  python scripts/bench_wakeup_scorer.py
+  python scripts/bench_wakeup_scorer.py --limit 5000 --window 3 --min-score 2 --margin 1.5
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import select  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.core.database import async_session  # noqa: E402
+from app.models import Agent, Message  # noqa: E402
+from app.services.responder_scorer import DecisionCache, ResponderScorer  # noqa: E402
+
+
+def actual_responder(messages: list, i: int, window: int) -> int | None:
+    sender = messages[i].agent_id
+    for m in messages[i + 1:i + 1 + window]:
+        if m.sender_type == "agent" and m.agent_id not in (0, sender):
+            return m.agent_id
+    return None
+
+
+async def main(args):
+    settings.wakeup_scorer_min_score = args.min_score
+    settings.wakeup_scorer_margin = args.margin
+    async with async_session() as db:
+        agents = list((await db.execute(select(Agent).where(Agent.id != 0))).scalars().all())
+        messages = list((await db.execute(
+            select(Message).order_by(Message.created_at.desc()).limit(args.limit)
+        )).scalars().all())
+    messages.reverse()
+    if not agents or not messages:
+        print("数据库里没有 Agent 或消息可回放")
+        return
+
+    scorer = ResponderScorer()
+    cache_keys: set = set()
+    total = confident = confident_agree = ambiguous = ambiguous_agree = cache_hits = 0
+    for i, msg in enumerate(messages):
+        if msg.mentions or msg.sender_type not in ("human", "agent"):
+            continue
+        candidates = [a for a in agents if a.id != msg.agent_id]
+        if not candidates:
+            continue
+        prior = messages[max(0, i - 9):i]
+        from_agent = msg.sender_type == "agent"
+        decision = scorer.decide(msg.content, candidates, prior, {}, from_agent=from_agent)
+        truth = actual_responder(messages, i, args.window)
+        total += 1
+        if decision.confident:
+            confident += 1
+            confident_agree += decision.agent_id == truth
+            continue
+        ambiguous += 1
+        ambiguous_agree += decision.top == truth and truth is not None
+        key = DecisionCache.fingerprint(msg.sender_type, msg.content, candidates, prior, {})
+        cache_hits += key in cache_keys
+        cache_keys.add(key)
+
+    def pct(a, b):
+        return f"{a / b:.1%}" if b else "-"
+
+    print(f"回放消息: {total}（{len(agents)} 个 Agent，窗口 {args.window}）")
+    print(f"规则直接决定: {confident}  省掉模型调用 {pct(confident, total)}")
+    print(f"  与实际回复者一致: {pct(confident_agree, confident)}")
+    print(f"拿不准（走模型）: {ambiguous}  其中缓存可命中 {cache_hits}")
+    print(f"  打分第一名与实际回复者一致: {pct(ambiguous_agree, ambiguous)}")
+    print(f"合计省掉模型调用: {pct(confident + cache_hits, total)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=2000, help="回放最近多少条消息")
+    parser.add_argument("--window", type=int, default=3, help="多少条消息以内开口算作回复")
+    parser.add_argument("--min-score", type=float, default=settings.wakeup_scorer_min_score)
+    parser.add_argument("--margin", type=float, default=settings.wakeup_scorer_margin)
+    asyncio.run(main(parser.parse_args()))
@@ -13,3 +13,40 @@ async def db():
     async with session_maker() as session:
         yield session
     await engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def _isolated_vector_index(tmp_path, monkeypatch):
+    """每个用例独立的向量索引、embedding 缓存、待写回的命中计数、agent 目录、状态批次、LLM 准入队列、供应商健康度、世界状态缓存和策略自动机（都是进程级的，跨用例会串状态）"""
+    from app.core.config import settings
+    from app.core.llm_limiter import llm_limiter
+    from app.core.llm_router import llm_router
+    from app.services import vector_store
+    from app.services.agent_directory import agent_directory
+    from app.services.memory_service import memory_service
+    from app.services.status_helper import _global_batch
+    from app.services.strategy_engine import clear_strategies
+    from app.services.strategy_runtime import strategy_runtime
+    from app.services.world_state import world_state
+    monkeypatch.setattr(settings, "vector_index_dir", str(tmp_path / "vector_index"))
+    vector_store.reset_vector_indexes()
+    vector_store.embedding_cache.clear()
+    memory_service._pending_hits.clear()
+    agent_directory.invalidate()
+    _global_batch.clear()
+    llm_limiter.reset()
+    llm_router.reset()
+    world_state.reset()
+    clear_strategies()
+    strategy_runtime.reset()
+    yield
+    vector_store.reset_vector_indexes()
+    vector_store.embedding_cache.clear()
+    memory_service._pending_hits.clear()
+    agent_directory.invalidate()
+    _global_batch.clear()
+    llm_limiter.reset()
+    llm_router.reset()
+    world_state.reset()
+    clear_strategies()
+    strategy_runtime.reset()
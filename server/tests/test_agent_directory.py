@@ -0,0 +1,112 @@
+"""
+Agent 目录缓存 + @提及匹配器：每条消息零查询，agent 增删改时失效
+"""
+from unittest.mock import patch
+
+import pytest
+
+from app.api import agents as agents_api
+from app.api.chat import parse_mentions
+from app.api.schemas import AgentCreate, AgentUpdate
+from app.models import Agent
+from app.services.agent_directory import MentionMatcher, agent_directory
+
+NAMES = {"Human": 0, "Alice": 1, "Bob": 2, "小明": 3, "小明明": 4, "Bob_2": 5}
+
+
+@pytest.mark.parametrize("content,expected", [
+    ("@Alice 你好", [1]),
+    ("@Alice,@Bob 一起吗", [1, 2]),
+    ("@小明你好", [3]),  # 中文名后面直接接正文
+    ("@小明明在吗", [4]),  # 最长匹配
+    ("@Bobby 你好", []),  # 英文名要求词边界
+    ("@Bob_2 和 @Bob", [5, 2]),
+    ("@Alice @Alice", [1, 1]),
+    ("email@Alice.com", [1]),
+    ("@@Alice", [1]),
+    ("@Carol 不存在", []),
+    ("没有提及", []),
+    ("@", []),
+])
+def test_matcher(content, expected):
+    assert MentionMatcher(NAMES).find(content) == expected
+
+
+class _CountingStr(str):
+    """记录按下标取字符的次数 = 字典树走的步数"""
+
+    def __getitem__(self, key):
+        self.steps += 1
+        return super().__getitem__(key)
+
+
+def _trie_steps(matcher: MentionMatcher, text: str) -> tuple[int, int]:
+    content = _CountingStr(text)
+    content.steps = 0
+    found = matcher.find(content)
+    return len(found), content.steps
+
+
+def test_matcher_is_linear():
+    """只从每个 @ 起走字典树，每个 @ 最多走一个名字长度，步数与消息长度无关"""
+    names = {f"agent{i}": i for i in range(500)}
+    matcher = MentionMatcher(names)
+    chunk = "@agent42 " + "普通聊天内容" * 20
+    found, steps = _trie_steps(matcher, chunk * 200)
+    assert found == 200
+    assert steps <= 200 * (len("agent499") + 2)  # 名字字符 + 结尾判断
+    assert _trie_steps(matcher, chunk * 400) == (400, 2 * steps)
+
+    # 只有前缀能匹配上的 @ 也不回溯
+    _, partial = _trie_steps(matcher, "@agen " * 1000)
+    assert partial <= 1000 * (len("agen") + 1)
+
+
+def test_parse_mentions_keeps_signature():
+    assert parse_mentions("@Alice 在吗 @Bob", NAMES) == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_name_map_cached_until_invalidated(db):
+    db.add_all([Agent(id=1, name="Alice", persona="p", model="m"), Agent(id=2, name="Bob", persona="p", model="m")])
+    await db.commit()
+
+    with patch.object(db, "execute", wraps=db.execute) as execute:
+        assert await agent_directory.parse_mentions("@Alice", db) == [1]
+        assert await agent_directory.parse_mentions("@Bob", db) == [2]
+        assert await agent_directory.name_map(db) == {"Alice": 1, "Bob": 2}
+    assert execute.await_count == 1
+
+    db.add(Agent(id=3, name="Carol", persona="p", model="m"))
+    await db.commit()
+    assert await agent_directory.parse_mentions("@Carol", db) == []  # 绕过 API 写库不会失效
+    agent_directory.invalidate()
+    assert await agent_directory.parse_mentions("@Carol", db) == [3]
+
+
+@pytest.mark.asyncio
+async def test_agent_api_invalidates_directory(db):
+    created = await agents_api.create_agent(AgentCreate(name="Alice", persona="p"), db)
+    assert await agent_directory.parse_mentions("@Alice", db) == [created.id]
+
+    await agents_api.update_agent(created.id, AgentUpdate(name="Alicia"), db)
+    assert await agent_directory.parse_mentions("@Alice 或 @Alicia", db) == [created.id]
+
+    await agents_api.delete_agent(created.id, db)
+    assert await agent_directory.parse_mentions("@Alicia", db) == []
+
+
+@pytest.mark.asyncio
+async def test_invalidate_during_load_is_not_cached(db):
+    db.add(Agent(id=1, name="Alice", persona="p", model="m"))
+    await db.commit()
+    real_execute = db.execute
+
+    async def racing_execute(*args, **kwargs):
+        result = await real_execute(*args, **kwargs)
+        agent_directory.invalidate()  # 并发的改名在查询期间提交
+        return result
+
+    with patch.object(db, "execute", side_effect=racing_execute):
+        assert await agent_directory.name_map(db) == {"Alice": 1}
+    assert agent_directory._names is None
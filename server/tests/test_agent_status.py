@@ -36,6 +36,13 @@ def test_status_enum_count():
 # set_agent_status
 # ---------------------------------------------------------------------------
 
+@pytest.fixture(autouse=True)
+def _event_mode(monkeypatch):
+    """下面的用例覆盖逐条提交 + 广播的兼容模式（batch 模式见文件末尾）"""
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "agent_status_mode", "event")
+
+
 def _make_agent(agent_id=1, name="Alice"):
     agent = MagicMock(spec=Agent)
     agent.id = agent_id
@@ -124,3 +131,153 @@ async def test_status_flow_thinking_executing_idle():
     assert mock_bc.await_count == 3
     statuses = [call[0][0]["data"]["status"] for call in mock_bc.call_args_list]
     assert statuses == ["thinking", "executing", "idle"]
+
+
+# ---------------------------------------------------------------------------
+# batch 模式：一条 UPDATE + 一条 agent_status_batch 广播
+# ---------------------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_status_batch_coalesces_to_one_update_and_frame(db, monkeypatch):
+    from sqlalchemy import select
+    from app.core.config import settings
+    from app.services.status_helper import status_batch
+
+    monkeypatch.setattr(settings, "agent_status_mode", "batch")
+    agents = [Agent(id=i, name=f"A{i}", persona="p", model="m") for i in (1, 2, 3)]
+    db.add_all(agents)
+    await db.commit()
+
+    statements = []
+    from sqlalchemy import event
+    engine = db.bind.sync_engine
+    listener = lambda conn, cursor, stmt, *a: statements.append(stmt)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        with patch("app.api.chat.broadcast", new_callable=AsyncMock) as mock_bc, \
+             patch.object(db, "commit", wraps=db.commit) as commit:
+            async with status_batch():
+                for agent in agents:
+                    await set_agent_status(agent, AgentStatus.THINKING, "分析中…", db)
+                await set_agent_status(agents[0], AgentStatus.EXECUTING, "执行 checkin…", db)
+                await set_agent_status(agents[1], AgentStatus.IDLE, "", db)
+                assert agents[0].status == "executing"  # 内存里立即可见
+                mock_bc.assert_not_awaited()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    commit.assert_not_awaited()  # 调用方 session 不再逐条提交
+    assert sum(s.lstrip().upper().startswith("UPDATE AGENTS") for s in statements) == 1
+    mock_bc.assert_awaited_once()
+    data = mock_bc.call_args[0][0]["data"]
+    assert data["event"] == "agent_status_batch"
+    assert {u["agent_id"]: u["status"] for u in data["updates"]} == {1: "executing", 2: "idle", 3: "thinking"}
+
+    db.expire_all()
+    rows = (await db.execute(select(Agent.id, Agent.status, Agent.activity).order_by(Agent.id))).all()
+    assert rows == [(1, "executing", "执行 checkin…"), (2, "idle", ""), (3, "thinking", "分析中…")]
+
+
+@pytest.mark.asyncio
+async def test_status_batch_skips_broadcast_when_update_fails(db, monkeypatch):
+    """批量 UPDATE 失败时不广播没落库的状态"""
+    from sqlalchemy import event, select
+    from app.core.config import settings
+    from app.services.status_helper import status_batch
+
+    monkeypatch.setattr(settings, "agent_status_mode", "batch")
+    agent = Agent(id=1, name="Alice", persona="p", model="m")
+    db.add(agent)
+    await db.commit()
+
+    def fail_update(conn, cursor, stmt, *a):
+        if stmt.lstrip().upper().startswith("UPDATE AGENTS"):
+            raise RuntimeError("database is locked")
+
+    engine = db.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", fail_update)
+    try:
+        with patch("app.api.chat.broadcast", new_callable=AsyncMock) as mock_bc:
+            async with status_batch() as batch:
+                await set_agent_status(agent, AgentStatus.THINKING, "思考中…", db)
+                assert await batch.flush_now() == 0
+    finally:
+        event.remove(engine, "before_cursor_execute", fail_update)
+
+    mock_bc.assert_not_awaited()
+    status = (await db.execute(select(Agent.status).where(Agent.id == 1))).scalar_one()
+    assert status == "idle"
+
+
+@pytest.mark.asyncio
+async def test_status_outside_batch_flushes_after_window(db, monkeypatch):
+    import asyncio
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "agent_status_mode", "batch")
+    monkeypatch.setattr(settings, "agent_status_flush_ms", 20)
+    agent = Agent(id=1, name="Alice", persona="p", model="m")
+    db.add(agent)
+    await db.commit()
+
+    with patch("app.api.chat.broadcast", new_callable=AsyncMock) as mock_bc:
+        await set_agent_status(agent, AgentStatus.THINKING, "思考中…", db)
+        await set_agent_status(agent, AgentStatus.IDLE, "", db)
+        mock_bc.assert_not_awaited()
+        await asyncio.sleep(0.1)
+
+    mock_bc.assert_awaited_once()
+    assert mock_bc.call_args[0][0]["data"]["updates"][0]["status"] == "idle"
+    await db.refresh(agent)
+    assert agent.status == "idle"
+
+
+@pytest.mark.asyncio
+async def test_status_batch_is_noop_in_event_mode():
+    from app.services.status_helper import status_batch
+
+    agent = _make_agent()
+    with patch("app.api.chat.broadcast", new_callable=AsyncMock) as mock_bc:
+        async with status_batch():
+            await set_agent_status(agent, AgentStatus.THINKING, "思考中…", AsyncMock())
+            mock_bc.assert_awaited_once()
+    assert mock_bc.call_args[0][0]["data"]["event"] == "agent_status_change"
+
+
+@pytest.mark.asyncio
+async def test_tool_writes_are_committed_in_batch_mode(db, monkeypatch):
+    """batch 模式下 set_agent_status 不提交调用方 session；只 flush 的工具写入（claim_bounty）由 generate_reply 提交"""
+    from sqlalchemy import select
+    from app.core.config import settings
+    from app.models import Bounty
+    from app.services.agent_runner import AgentRunner
+
+    monkeypatch.setattr(settings, "agent_status_mode", "batch")
+    db.add_all([Agent(id=1, name="Alice", persona="p", model="m"), Bounty(id=1, title="修路", reward=10)])
+    await db.commit()
+
+    tool_call = MagicMock()
+    tool_call.id = "call_1"
+    tool_call.function.name = "claim_bounty"
+    tool_call.function.arguments = '{"bounty_id": 1}'
+    first, final = MagicMock(), MagicMock()
+    first.choices = [MagicMock()]
+    first.choices[0].message.tool_calls = [tool_call]
+    final.choices = [MagicMock()]
+    final.choices[0].message.content = "接了"
+    final.choices[0].message.tool_calls = None
+    client = MagicMock()
+    client.chat.completions.create = AsyncMock(side_effect=[first, final])
+
+    with patch("app.services.agent_runner.resolve_model", return_value=("http://x", "k", "m")), \
+         patch("app.services.agent_runner.llm_client", return_value=client), \
+         patch("app.services.agent_runner.memory_service.search", new_callable=AsyncMock, return_value=[]), \
+         patch("app.api.chat.broadcast", new_callable=AsyncMock):
+        reply, _, _ = await AgentRunner(1, "Alice", "p", "m").generate_reply(
+            [{"name": "Bob", "content": "有悬赏吗"}], db=db,
+        )
+    await db.rollback()  # 调用方（chat / batch_generate）从不提交，未提交的写入到这里就没了
+
+    assert reply == "接了"
+    bounty = (await db.execute(select(Bounty.status, Bounty.claimed_by))).one()
+    assert tuple(bounty) == ("claimed", 1)
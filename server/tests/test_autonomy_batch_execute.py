@@ -0,0 +1,183 @@
+"""
+一轮决策在一个事务里执行：每条 action 一个 SAVEPOINT，失败只回滚自己，
+整批只 COMMIT 一次，广播在提交之后、且只发成功的 action；
+EXECUTING 状态在执行前单独刷出，不会被同一 status_batch 块里最后的 IDLE 覆盖
+"""
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from sqlalchemy import event, select
+
+from app.core.database import after_commit, commit
+from app.models import Agent, AgentResource, Job, VirtualItem
+from app.services import autonomy_service
+from app.services.autonomy_service import execute_decisions
+from app.services.status_helper import status_batch
+
+pytestmark = pytest.mark.asyncio
+
+
+async def _seed(db):
+    db.add_all([
+        Agent(id=0, name="Human", persona="h"),
+        Agent(id=1, name="Alice", persona="程序员", credits=50),
+        Agent(id=2, name="Bob", persona="厨师", credits=30),
+        Agent(id=3, name="Carol", persona="农民", credits=10),
+        Job(id=1, title="矿工", daily_reward=8, max_workers=5),
+        VirtualItem(id=1, name="金框", item_type="avatar_frame", price=5),
+        AgentResource(agent_id=3, resource_type="wood", quantity=10),
+    ])
+    await db.commit()
+
+
+def _count_commits(db) -> list:
+    """数据库层面的 COMMIT（Session 的 after_commit 在释放 SAVEPOINT 时也会触发）"""
+    commits = []
+    event.listen(db.bind.sync_engine, "commit", lambda conn: commits.append(conn))
+    return commits
+
+
+async def _write_then_raise(aid, agent_name, params, db):
+    agent = await db.get(Agent, aid)
+    agent.credits = 0
+    await db.flush()
+    raise RuntimeError("boom")
+
+
+async def test_one_commit_and_failed_action_rolled_back(db):
+    await _seed(db)
+    commits = _count_commits(db)
+    decisions = [
+        {"agent_id": 1, "action": "checkin", "params": {"job_id": 1}, "reason": "上班"},
+        {"agent_id": 2, "action": "construct_building", "params": {"building_type": "farm", "name": "x"},
+         "reason": "会抛异常"},
+        {"agent_id": 3, "action": "transfer_resource",
+         "params": {"to_agent_id": 1, "resource_type": "wood", "quantity": 4}, "reason": "送木头"},
+        {"agent_id": 2, "action": "purchase", "params": {"item_id": 1}, "reason": "买框"},
+        {"agent_id": 3, "action": "purchase", "params": {}, "reason": "缺参数"},
+    ]
+    actions = dict(autonomy_service._ACTIONS)
+    actions["construct_building"] = (("building_type", "name"), _write_then_raise)
+    with patch.dict(autonomy_service._ACTIONS, actions), \
+         patch("app.services.autonomy_service._broadcast_action", new_callable=AsyncMock), \
+         patch("app.services.city_service._broadcast_city_event", new_callable=AsyncMock):
+        async with status_batch():  # 和 tick 一样：状态批量写回，不混进这一轮的事务
+            stats = await execute_decisions(decisions, db)
+            assert len(commits) == 2  # EXECUTING 状态先刷出一次 + action 整批一个事务；退出块时的写回不算在内
+
+    assert stats["success"] == 3
+    assert stats["failed"] == 2
+    assert stats["rolled_back"] == 1
+
+    db.expire_all()
+    assert (await db.get(Agent, 1)).credits == 58  # 打卡到账
+    assert (await db.get(Agent, 2)).credits == 25  # 抛异常的 action 被回滚，之后的购买照常生效
+    wood = await db.scalar(select(AgentResource.quantity).where(
+        AgentResource.agent_id == 3, AgentResource.resource_type == "wood"))
+    assert wood == 6
+
+
+async def test_broadcasts_only_after_commit_and_only_for_successes(db):
+    await _seed(db)
+    commits = _count_commits(db)
+    seen: list[tuple[str, int]] = []
+
+    async def record_action(agent_name, agent_id, action, reason):
+        seen.append((action, len(commits)))
+
+    async def record_city(event_type, data):
+        seen.append((event_type, len(commits)))
+
+    decisions = [
+        {"agent_id": 3, "action": "transfer_resource",
+         "params": {"to_agent_id": 1, "resource_type": "wood", "quantity": 4}, "reason": "送木头"},
+        {"agent_id": 1, "action": "eat", "params": {}, "reason": "没吃的，失败"},
+        {"agent_id": 2, "action": "construct_building", "params": {"building_type": "farm", "name": "x"},
+         "reason": "会抛异常"},
+    ]
+    actions = dict(autonomy_service._ACTIONS)
+    actions["construct_building"] = (("building_type", "name"), _write_then_raise)
+    with patch.dict(autonomy_service._ACTIONS, actions), \
+         patch("app.services.autonomy_service._broadcast_action", side_effect=record_action), \
+         patch("app.services.city_service._broadcast_city_event", side_effect=record_city):
+        async with status_batch():  # 和 tick 一样：状态批量写回，不混进这一轮的事务
+            stats = await execute_decisions(decisions, db)
+
+    assert stats["success"] == 1
+    assert seen == [("resource_transferred", 2), ("transfer_resource", 2)]  # 第 1 次提交是 EXECUTING 状态
+
+
+async def test_executing_status_is_flushed_before_idle(db, monkeypatch):
+    from app.core.config import settings
+    from app.services.status_helper import set_agent_status
+    from app.models import AgentStatus
+
+    monkeypatch.setattr(settings, "agent_status_mode", "batch")
+    await _seed(db)
+    decisions = [
+        {"agent_id": 1, "action": "checkin", "params": {"job_id": 1}, "reason": "上班"},
+        {"agent_id": 2, "action": "rest", "params": {}, "reason": "休息"},
+    ]
+    with patch("app.services.autonomy_service._broadcast_action", new_callable=AsyncMock), \
+         patch("app.api.chat.broadcast", new_callable=AsyncMock) as mock_bc:
+        async with status_batch():  # 和 tick 一样：执行完在同一块里把所有人置回 IDLE
+            await execute_decisions(decisions, db)
+            for aid in (1, 2):
+                await set_agent_status(await db.get(Agent, aid), AgentStatus.IDLE, "", db)
+
+    frames = [c.args[0]["data"] for c in mock_bc.call_args_list
+              if c.args[0]["data"].get("event") == "agent_status_batch"]
+    assert [{u["agent_id"]: u["status"] for u in f["updates"]} for f in frames] == [
+        {1: "executing", 2: "idle"},
+        {1: "idle", 2: "idle"},
+    ]
+
+
+async def test_services_commit_normally_outside_unit_of_work(db):
+    await _seed(db)
+    commits = _count_commits(db)
+    called = AsyncMock()
+
+    db.add(Agent(id=4, name="Dave", persona="新来的"))
+    await commit(db)
+    await after_commit(db, called, "now")
+
+    assert len(commits) == 1
+    called.assert_awaited_once_with("now")
+
+
+async def test_unit_of_work_takes_write_lock_before_first_savepoint():
+    """SAVEPOINT 默认开 DEFERRED 事务：期间别的连接先提交写入，再升级写锁会直接 database is locked"""
+    import asyncio
+
+    from app.core.database import Base, async_session, engine, unit_of_work
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    try:
+        async with async_session() as db:
+            await _seed(db)
+
+        async def other_writer():
+            async with async_session() as other:
+                (await other.get(Agent, 2)).credits = 1
+                await other.commit()
+
+        async with async_session() as db:
+            async with unit_of_work(db) as uow:
+                await uow.begin_action()
+                await db.scalar(select(Agent.credits).where(Agent.id == 1))
+                writer = asyncio.create_task(other_writer())
+                await asyncio.sleep(0.05)
+                (await db.get(Agent, 1)).credits = 99
+                await uow.end_action(True)
+                await uow.commit()
+        await writer
+
+        async with async_session() as db:
+            assert (await db.get(Agent, 1)).credits == 99
+            assert (await db.get(Agent, 2)).credits == 1
+    finally:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
@@ -0,0 +1,125 @@
+"""
+自主行为分片决策：居民分组、每组 prompt 只含本组明细 + 共享世界概要、分片并发上限、
+合并时去掉越界 / 重复 / 冲突的 action、每片 token 用量与耗时报告
+"""
+import asyncio
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import pytest
+
+from app.core.config import settings
+from app.models import Agent
+from app.services import autonomy_service
+from app.services.autonomy_service import (
+    WorldView, _partition, _reconcile_actions, build_world_snapshot, collect_world, decide_world,
+)
+
+
+def _world(n: int) -> WorldView:
+    agents = [(i, f"A{i}") for i in range(1, n + 1)]
+    return WorldView(
+        now=datetime(2026, 1, 1, tzinfo=timezone.utc),
+        agents=agents,
+        agent_lines={i: f"- ID={i} A{i}: 明细{i}" for i, _ in agents},
+        last_round=[(1, "- A1: rest — 累了"), (2, "- A2: eat — 饿了")],
+        sections={
+            "最近聊天": ["- A1: 你好"], "可用岗位": ["- ID=1 矿工"], "商店商品": ["- ID=1 金框"],
+            "城市建筑": ["- ID=1 农场(farm): 0/5人"], "可建造建筑": ["- farm: 需要 wood=10"],
+            "交易市场": ["(无挂单)"], "悬赏任务": ["- 悬赏#7: 修桥"],
+        },
+    )
+
+
+def test_partition_balanced():
+    assert [len(s) for s in _partition(list(range(10)), 4)] == [4, 3, 3]
+    assert _partition([1, 2, 3], 8) == [[1, 2, 3]]
+    assert sum(_partition(list(range(25)), 8), []) == list(range(25))
+
+
+def test_shard_prompt_has_own_details_and_shared_summary():
+    world = _world(4)
+    full = world.render()
+    assert all(f"明细{i}" in full for i in range(1, 5))
+    assert "其他居民" not in full and "A2: eat" in full
+
+    shard = world.render([1, 2])
+    assert "明细1" in shard and "明细2" in shard
+    assert "明细3" not in shard and "明细4" not in shard
+    assert "ID=3 A3、ID=4 A4" in shard  # 其他居民只列简表，转赠等行为仍可指定对象
+    assert "悬赏#7" in shard and "金框" in shard  # 共享段落每片都有
+    assert "A2: eat" in world.render([1, 2]) and "A2: eat" not in world.render([3, 4])
+
+
+def test_reconcile_drops_out_of_shard_duplicates_and_conflicts():
+    merged, dropped = _reconcile_actions([
+        ([1, 2], [
+            {"agent_id": 1, "action": "claim_bounty", "params": {"bounty_id": 7}},
+            {"agent_id": 1, "action": "rest", "params": {}},
+            {"agent_id": 3, "action": "eat", "params": {}},  # 不属于本分片
+        ]),
+        ([3, 4], [
+            {"agent_id": 3, "action": "claim_bounty", "params": {"bounty_id": 7}},  # 与分片 1 抢同一悬赏
+            {"agent_id": 4, "action": "accept_market_order", "params": {"order_id": 2}},
+        ]),
+    ])
+    assert [(a["agent_id"], a["action"]) for a in merged] == [(1, "claim_bounty"), (4, "accept_market_order")]
+    assert dropped == {"out_of_shard": 1, "duplicate": 1, "conflict": 1}
+
+
+@pytest.mark.asyncio
+async def test_shards_decided_concurrently_under_cap(monkeypatch):
+    monkeypatch.setattr(settings, "autonomy_shard_size", 2)
+    monkeypatch.setattr(settings, "autonomy_shard_concurrency", 2)
+    running = peak = 0
+    prompts = []
+
+    async def fake_decide(prompt, max_tokens=4000):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        prompts.append(prompt)
+        await asyncio.sleep(0.05)
+        running -= 1
+        ids = [i for i in range(1, 6) if f"明细{i}" in prompt]
+        call = {"prompt_chars": len(prompt), "prompt_tokens": 100, "completion_tokens": 20 * len(ids),
+                "total_tokens": 100 + 20 * len(ids), "latency_ms": 50}
+        return [{"agent_id": i, "action": "rest", "params": {}} for i in ids], call
+
+    with patch.object(autonomy_service, "_decide", side_effect=fake_decide):
+        actions, report = await decide_world(_world(5))
+
+    assert peak == 2
+    assert len(prompts) == 3
+    assert sorted(a["agent_id"] for a in actions) == [1, 2, 3, 4, 5]
+    assert [s["agents"] for s in report["shards"]] == [2, 2, 1]
+    assert [s["completion_tokens"] for s in report["shards"]] == [40, 40, 20]
+    assert report["agents"] == 5 and report["decide_ms"] >= 100  # 3 片、并发 2 → 两批
+
+
+@pytest.mark.asyncio
+async def test_small_population_uses_single_full_prompt(monkeypatch):
+    monkeypatch.setattr(settings, "autonomy_shard_size", 8)
+    world = _world(3)
+    calls = []
+
+    async def fake_decide(prompt, max_tokens=4000):
+        calls.append((prompt, max_tokens))
+        return [], {"prompt_chars": len(prompt), "prompt_tokens": 0, "completion_tokens": 0,
+                    "total_tokens": 0, "latency_ms": 0}
+
+    with patch.object(autonomy_service, "_decide", side_effect=fake_decide):
+        _, report = await decide_world(world)
+    assert calls == [(world.render(), 4000)]
+    assert len(report["shards"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_collect_world_matches_snapshot(db):
+    db.add_all([Agent(id=0, name="Human", persona="h"), Agent(id=2, name="Bob", persona="厨师"),
+                Agent(id=1, name="Alice", persona="程序员")])
+    await db.commit()
+    world = await collect_world(db)
+    assert [aid for aid, _ in world.agents] == [1, 2]
+    assert await build_world_snapshot(db) == world.render()
+    assert "Bob" not in world.render([1]).split("== 其他居民")[0]
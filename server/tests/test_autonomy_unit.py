@@ -80,7 +80,7 @@ async def test_decide_valid_json():
 
     with patch("app.services.autonomy_service.resolve_model",
                return_value=("http://fake", "sk-fake", "test-model")), \
-         patch("app.services.autonomy_service.AsyncOpenAI",
+         patch("app.services.autonomy_service.llm_client",
                return_value=mock_client):
         decisions = await decide("fake snapshot")
 
@@ -107,7 +107,7 @@ async def test_decide_invalid_json():
 
     with patch("app.services.autonomy_service.resolve_model",
                return_value=("http://fake", "sk-fake", "test-model")), \
-         patch("app.services.autonomy_service.AsyncOpenAI",
+         patch("app.services.autonomy_service.llm_client",
                return_value=mock_client):
         decisions = await decide("fake snapshot")
 
@@ -277,7 +277,7 @@ async def test_personality_variance_three_rounds():
 
         with patch("app.services.autonomy_service.resolve_model",
                    return_value=("http://fake", "sk-fake", "test-model")), \
-             patch("app.services.autonomy_service.AsyncOpenAI",
+             patch("app.services.autonomy_service.llm_client",
                    return_value=mock_client):
             decisions = await decide("fake snapshot")
             all_decisions.append(decisions)
@@ -350,7 +350,7 @@ async def test_performance_baseline():
 
     with patch("app.services.autonomy_service.resolve_model",
                return_value=("http://fake", "sk-fake", "test-model")), \
-         patch("app.services.autonomy_service.AsyncOpenAI",
+         patch("app.services.autonomy_service.llm_client",
                return_value=mock_client), \
          patch("app.services.autonomy_service._broadcast_action", new_callable=AsyncMock):
 
@@ -19,7 +19,7 @@ MEMORY_SEARCH = "app.services.agent_runner.memory_service.search"
 
 
 def _mock_llm(reply_text="batch回复"):
-    """返回 resolve_model + AsyncOpenAI 的 patch，使 LLM 调用成功。"""
+    """返回 resolve_model + llm_client 的 patch，使 LLM 调用成功。"""
     mock_choice = MagicMock()
     mock_choice.message.content = reply_text
     mock_response = MagicMock()
@@ -33,7 +33,7 @@ def _mock_llm(reply_text="batch回复"):
 
     return (
         patch(RESOLVE_MODEL, return_value=("http://fake", "sk-fake", "test-model")),
-        patch("app.services.agent_runner.AsyncOpenAI", return_value=mock_client),
+        patch("app.services.agent_runner.llm_client", return_value=mock_client),
     )
 
 
@@ -142,7 +142,7 @@ async def test_batch_generate_partial_failure():
     mock_client.chat.completions.create = AsyncMock(side_effect=_side_effect)
 
     with patch(RESOLVE_MODEL, return_value=("http://fake", "sk-fake", "m1")):
-        with patch("app.services.agent_runner.AsyncOpenAI", return_value=mock_client):
+        with patch("app.services.agent_runner.llm_client", return_value=mock_client):
             with patch(MEMORY_SEARCH, new_callable=AsyncMock, return_value=[]):
                 with patch("app.services.agent_runner.session_maker", return_value=AsyncMock()):
                     results = await mgr.batch_generate(agents_info)
@@ -257,3 +257,45 @@ async def test_delayed_send_does_not_mutate_original_history():
 
     # 原始 history 不应被修改
     assert len(original_history) == 1
+
+
+@pytest.mark.asyncio
+async def test_batch_generate_prefetches_memories_once():
+    """批量检索一次，各 agent 不再单独检索；记忆注入到各自的 prompt"""
+    mgr = AgentRunnerManager()
+    agents_info = [
+        {"agent_id": 1, "agent_name": "Alice", "persona": "友好", "model": "m1", "history": HISTORY},
+        {"agent_id": 2, "agent_name": "Bob", "persona": "幽默", "model": "m1", "history": HISTORY},
+    ]
+    mem = MagicMock(id=42, content="Alice 喜欢猫", memory_type="long")
+
+    p_resolve, p_openai = _mock_llm("回复")
+    with p_resolve, p_openai as mock_openai, \
+         patch(MEMORY_SEARCH, new_callable=AsyncMock) as per_agent, \
+         patch(f"{MEMORY_SEARCH}_many", new_callable=AsyncMock, return_value={1: [mem], 2: []}) as batched, \
+         patch("app.services.agent_runner.session_maker", return_value=AsyncMock()):
+        results = await mgr.batch_generate(agents_info)
+
+    batched.assert_awaited_once()
+    assert batched.await_args.args[0] == {1: "你好 大家好", 2: "你好 大家好"}
+    per_agent.assert_not_awaited()
+    assert results[1][2] == [42] and results[2][2] == []
+    prompts = [c.kwargs["messages"][0]["content"]
+               for c in mock_openai.return_value.chat.completions.create.await_args_list]
+    assert [p for p in prompts if "Alice 喜欢猫" in p] == [p for p in prompts if "你是 Alice" in p]
+
+
+@pytest.mark.asyncio
+async def test_batch_generate_falls_back_when_prefetch_fails():
+    mgr = AgentRunnerManager()
+    agents_info = [{"agent_id": 1, "agent_name": "Alice", "persona": "友好", "model": "m1", "history": HISTORY}]
+
+    p_resolve, p_openai = _mock_llm("回复")
+    with p_resolve, p_openai, \
+         patch(MEMORY_SEARCH, new_callable=AsyncMock, return_value=[]) as per_agent, \
+         patch(f"{MEMORY_SEARCH}_many", new_callable=AsyncMock, side_effect=RuntimeError("boom")), \
+         patch("app.services.agent_runner.session_maker", return_value=AsyncMock()):
+        results = await mgr.batch_generate(agents_info)
+
+    per_agent.assert_awaited_once()
+    assert results[1][0] == "回复"
@@ -191,3 +191,12 @@ def test_since_id_incremental_fetch(bot_agent_sync):
     incremental = r2.json()
     assert all(m["id"] > first_id for m in incremental)
     assert len(incremental) == len(all_msgs) - 1
+
+
+# --- 广播队列指标 ---
+def test_ws_stats_reports_connections(sync_client):
+    with sync_client.websocket_connect("/api/ws/0") as ws:
+        ws.receive_json()  # 上线事件
+        stats = sync_client.get("/api/ws/stats").json()
+        assert stats["connections"] >= 1
+        assert {"queued", "max_queue_depth", "dropped", "coalesced", "slow_disconnects"} <= stats.keys()
@@ -0,0 +1,215 @@
+"""
+多 worker 广播总线：Unix socket 互相转发广播、汇总在线状态、控制消息；local 后端行为不变
+"""
+import asyncio
+import socket
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+import pytest_asyncio
+
+from app.api import chat
+from app.services.broadcast_bus import STALE_AFTER_REFUSALS, LocalBus, UnixSocketBus
+from app.services.broadcast_hub import BroadcastHub
+
+
+class FakeWS:
+    def __init__(self):
+        self.received: list[str] = []
+
+    async def send_text(self, text: str):
+        self.received.append(text)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+
+async def _until(cond, timeout: float = 3.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+
+@pytest_asyncio.fixture
+async def workers(tmp_path):
+    """同一目录下的两个 worker，各自有独立的广播中心和连接池"""
+    made = []
+
+    async def make(worker_id: str, humans=(), bots=()):
+        hub = BroadcastHub()
+        bus = UnixSocketBus(str(tmp_path / "bus"), worker_id=worker_id, hub=hub)
+        pool = {"humans": set(humans), "bots": set(bots)}
+        bus.set_presence_source(lambda: (pool["humans"], pool["bots"]))
+        await bus.start()
+        made.append((bus, hub))
+        return bus, hub, pool
+
+    yield make
+    for bus, hub in made:
+        await bus.stop()
+        for conn in list(hub._conns.values()):
+            hub.unregister(conn.ws)
+
+
+async def _connect(a: UnixSocketBus, b: UnixSocketBus):
+    await a.refresh_peers()
+    await b.refresh_peers()
+    await _until(lambda: b.worker_id in a._remote and a.worker_id in b._remote)
+
+
+@pytest.mark.asyncio
+async def test_publish_reaches_sockets_on_every_worker(workers):
+    a, hub_a, _ = await workers("a")
+    b, hub_b, _ = await workers("b")
+    ws_a, ws_b = FakeWS(), FakeWS()
+    hub_a.register(0, ws_a)
+    hub_b.register(0, ws_b)
+    await _connect(a, b)
+
+    assert a.publish('{"n": 1}') == 1  # 本 worker 的连接数
+    b.publish('{"n": 2}')
+    await _until(lambda: len(ws_a.received) == 2 and len(ws_b.received) == 2)
+    # 各 worker 先投递本地发布的消息，跨 worker 之间不保证全局顺序
+    assert sorted(ws_a.received) == sorted(ws_b.received) == ['{"n": 1}', '{"n": 2}']
+    assert a.stats()["workers"] == 2 and a.stats()["received"] == 1
+
+
+@pytest.mark.asyncio
+async def test_forwarded_frames_keep_coalesce_key_and_channel(workers):
+    a, _, _ = await workers("a")
+    b, hub_b, _ = await workers("b")
+    await _connect(a, b)
+    published = []
+    hub_b.publish = lambda text, key=None, channel=None: published.append((text, key, channel)) or 0
+
+    a.publish("s1", coalesce_key=("agent_status", 3))
+    a.publish("chat")
+    a.publish("delta", channel="message_delta")
+    await _until(lambda: len(published) == 3)
+    assert published == [("s1", ("agent_status", 3), None), ("chat", None, None), ("delta", None, "message_delta")]
+
+
+@pytest.mark.asyncio
+async def test_presence_is_aggregated_and_dropped_with_worker(workers):
+    a, _, pool_a = await workers("a", humans={0})
+    b, _, pool_b = await workers("b", bots={7})
+    await _connect(a, b)
+    assert a.online_ids() == b.online_ids() == {0, 7}
+    assert a.bot_online(7) and not b.bot_online(0)
+
+    pool_b["bots"].add(8)
+    b.presence_changed()
+    await _until(lambda: a.bot_online(8))
+
+    await b.stop()
+    await _until(lambda: a.online_ids() == {0})
+    assert not a.bot_online(7)
+
+
+@pytest.mark.asyncio
+async def test_topics_go_to_peers_only(workers):
+    a, _, _ = await workers("a")
+    b, _, _ = await workers("b")
+    got_a, got_b = [], []
+    a.subscribe("agent_directory", got_a.append)
+    b.subscribe("agent_directory", got_b.append)
+    await _connect(a, b)
+
+    a.notify_peers("agent_directory", {"agent_id": 5})
+    await _until(lambda: got_b)
+    assert got_b == [{"agent_id": 5}] and got_a == []
+
+
+@pytest.mark.asyncio
+async def test_only_one_worker_is_leader_until_it_stops(workers, monkeypatch):
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "broadcast_bus_refresh_seconds", 0.05)
+    a, _, _ = await workers("a")
+    b, _, _ = await workers("b")
+
+    await asyncio.wait_for(a.wait_leadership(), timeout=1)
+    waiting = asyncio.create_task(b.wait_leadership())
+    await asyncio.sleep(0.2)
+    assert a.is_leader and not waiting.done()
+
+    await a.stop()  # leader 退出（进程死掉时锁同样随之释放）
+    await asyncio.wait_for(waiting, timeout=1)
+    assert b.is_leader and not a.is_leader
+    assert b.stats()["leader"]
+
+
+@pytest.mark.asyncio
+async def test_local_bus_is_always_leader():
+    bus = LocalBus(BroadcastHub())
+    await asyncio.wait_for(bus.wait_leadership(), timeout=1)
+    assert bus.is_leader
+
+
+@pytest.mark.asyncio
+async def test_stale_socket_file_is_removed(workers, tmp_path):
+    a, _, _ = await workers("a")
+    stale = tmp_path / "bus" / "dead.sock"
+    sock = socket.socket(socket.AF_UNIX)
+    sock.bind(str(stale))  # 绑定但不 listen = 进程已死留下的文件
+    sock.close()
+
+    for _ in range(STALE_AFTER_REFUSALS):
+        assert stale.exists()
+        await a.refresh_peers()
+    assert not stale.exists()
+    assert a._peers == {}
+
+
+@pytest.mark.asyncio
+async def test_local_bus_reads_live_pool():
+    bus = LocalBus(BroadcastHub())
+    pool = {"humans": {0}, "bots": set()}
+    bus.set_presence_source(lambda: (pool["humans"], pool["bots"]))
+    assert bus.online_ids() == {0} and not bus.bot_online(4)
+    pool["bots"].add(4)
+    assert bus.online_ids() == {0, 4} and bus.bot_online(4)
+
+
+# ---------------------------------------------------------------------------
+# chat 接入
+# ---------------------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_wakeup_skips_bot_online_on_other_worker():
+    """bot 连在别的 worker 上：本 worker 不做服务端兜底回复"""
+    bus = LocalBus(BroadcastHub())
+    bus.online_ids = lambda: {0, 9}
+    bus.bot_online = lambda aid: aid == 9
+    db = MagicMock()
+    session = MagicMock()
+    session.__aenter__ = AsyncMock(return_value=db)
+    session.__aexit__ = AsyncMock(return_value=False)
+
+    with patch.object(chat, "broadcast_bus", bus), \
+         patch.object(chat, "async_session", return_value=session), \
+         patch.object(chat, "wakeup_service") as wakeup, \
+         patch.object(chat, "runner_manager") as rm:
+        wakeup.process = AsyncMock(return_value=[9])
+        await chat.handle_wakeup(MagicMock())
+
+    assert wakeup.process.await_args[0][1] == {0, 9}
+    rm.get_or_create.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_bot_reconnect_elsewhere_closes_local_socket():
+    hub = BroadcastHub()
+    old = FakeWS()
+    old.close = AsyncMock()
+    with patch.object(chat, "broadcast_hub", hub), \
+         patch.object(chat, "bot_connections", {9: old}) as bots:
+        hub.register(9, old)
+        chat._drop_replaced_bot({"agent_id": 9})
+        await asyncio.sleep(0)
+        assert bots == {}
+    assert len(hub) == 0
+    old.close.assert_awaited_once()
+    assert old.close.await_args.kwargs["code"] == 4001
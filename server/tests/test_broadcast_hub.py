@@ -0,0 +1,209 @@
+"""
+WebSocket 广播中心：每连接有界队列 + 写协程，慢客户端按策略丢弃 / 合并 / 断开，不阻塞其他人
+"""
+import asyncio
+import json
+import time
+from unittest.mock import patch
+
+import pytest
+
+from app.api import chat
+from app.core.config import settings
+from app.services.broadcast_bus import LocalBus
+from app.services.broadcast_hub import SLOW_CONSUMER_CLOSE_CODE, BroadcastHub
+
+
+class FakeWS:
+    """记录收到的文本；delay 模拟慢客户端，block=True 模拟完全卡死"""
+
+    def __init__(self, delay: float = 0.0, block: bool = False, fail: bool = False):
+        self.delay = delay
+        self.block = block
+        self.fail = fail
+        self.received: list[str] = []
+        self.closed_with: int | None = None
+
+    async def send_text(self, text: str):
+        if self.fail:
+            raise RuntimeError("connection reset")
+        if self.block:
+            await asyncio.Event().wait()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received.append(text)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed_with = code
+
+
+async def _drain(hub: BroadcastHub, clients, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while any(hub._conns.get(id(ws)) and hub._conns[id(ws)].depth for ws in clients):
+        assert time.monotonic() < deadline, "queues did not drain"
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(0)
+
+
+async def _stall(hub: BroadcastHub):
+    """发一条占位消息，让卡死的客户端的写协程取走后挂起"""
+    hub.publish("stall")
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+def hub():
+    h = BroadcastHub()
+    yield h
+    for conn in list(h._conns.values()):
+        h.unregister(conn.ws)
+
+
+@pytest.mark.asyncio
+async def test_publish_delivers_in_order(hub):
+    clients = [FakeWS() for _ in range(3)]
+    for i, ws in enumerate(clients):
+        hub.register(i, ws)
+    for n in range(5):
+        assert hub.publish(f"m{n}") == 3
+    await _drain(hub, clients)
+    for ws in clients:
+        assert ws.received == [f"m{n}" for n in range(5)]
+    assert hub.stats()["sent"] == 15
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_keeps_latest(hub, monkeypatch):
+    monkeypatch.setattr(settings, "ws_send_queue_size", 3)
+    ws = FakeWS(block=True)
+    conn = hub.register(1, ws)
+    await _stall(hub)  # 写协程取走第一条后卡住
+    for n in range(10):
+        hub.publish(f"m{n}")
+    assert [f.text for f in conn._queue] == ["m7", "m8", "m9"]
+    assert conn.dropped == 7
+    assert hub.stats()["dropped"] == 7
+
+
+@pytest.mark.asyncio
+async def test_drop_newest(hub, monkeypatch):
+    monkeypatch.setattr(settings, "ws_send_queue_size", 2)
+    monkeypatch.setattr(settings, "ws_slow_consumer_policy", "drop_newest")
+    conn = hub.register(1, FakeWS(block=True))
+    await _stall(hub)
+    for n in range(5):
+        hub.publish(f"m{n}")
+    assert [f.text for f in conn._queue] == ["m0", "m1"]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_replaces_queued_frame(hub):
+    conn = hub.register(1, FakeWS(block=True))
+    await _stall(hub)
+    hub.publish("status-a1", coalesce_key=("agent_status", 1))
+    hub.publish("chat")
+    hub.publish("status-a2", coalesce_key=("agent_status", 1))
+    hub.publish("status-b1", coalesce_key=("agent_status", 2))
+    assert [f.text for f in conn._queue] == ["status-a2", "chat", "status-b1"]
+    assert hub.stats()["coalesced"] == 1
+
+
+@pytest.mark.asyncio
+async def test_disconnect_policy_closes_slow_client(hub, monkeypatch):
+    monkeypatch.setattr(settings, "ws_send_queue_size", 2)
+    monkeypatch.setattr(settings, "ws_slow_consumer_policy", "disconnect")
+    closed = []
+    slow, fast = FakeWS(block=True), FakeWS()
+    hub.register(1, slow, on_close=lambda aid, ws: closed.append(aid))
+    hub.register(2, fast)
+    for n in range(4):
+        hub.publish(f"m{n}")
+        await asyncio.sleep(0.01)  # 快客户端每次都能发完
+    await _drain(hub, [fast])
+
+    assert closed == [1]
+    assert slow.closed_with == SLOW_CONSUMER_CLOSE_CODE
+    assert len(hub) == 1 and hub.stats()["slow_disconnects"] == 1
+    assert fast.received == ["m0", "m1", "m2", "m3"]
+    assert "m2" not in slow.received
+
+
+@pytest.mark.asyncio
+async def test_failed_send_drops_connection(hub):
+    closed = []
+    hub.register(7, FakeWS(fail=True), on_close=lambda aid, ws: closed.append(aid))
+    hub.publish("x")
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert closed == [7] and len(hub) == 0
+
+
+@pytest.mark.asyncio
+async def test_send_timeout_drops_stuck_client(hub, monkeypatch):
+    monkeypatch.setattr(settings, "ws_send_timeout", 0.05)
+    closed = []
+    hub.register(3, FakeWS(block=True), on_close=lambda aid, ws: closed.append(aid))
+    hub.publish("x")
+    await asyncio.sleep(0.2)
+    assert closed == [3]
+
+
+@pytest.mark.asyncio
+async def test_load_slow_clients_do_not_stall_others(hub, monkeypatch):
+    """300 个客户端（30 个慢、10 个卡死）：广播是纯入队，快客户端按序收全，慢客户端队列有界"""
+    monkeypatch.setattr(settings, "ws_send_queue_size", 32)
+    monkeypatch.setattr(settings, "ws_send_timeout", 0)
+    fast = [FakeWS() for _ in range(260)]
+    slow = [FakeWS(delay=0.02) for _ in range(30)]
+    stuck = [FakeWS(block=True) for _ in range(10)]
+    for i, ws in enumerate(fast + slow + stuck):
+        hub.register(i, ws)
+
+    assert not asyncio.iscoroutinefunction(hub.publish)  # 广播是同步入队，不等待任何 socket
+    n_messages = 200
+    for n in range(n_messages):
+        hub.publish(json.dumps({"n": n}))
+        if n == 0:
+            assert not any(ws.received for ws in fast + slow)  # 入队即返回，发送都在各自的写协程里
+        if n % 20 == 0:
+            await asyncio.sleep(0)  # 模拟广播方在两次事件之间让出
+
+    await _drain(hub, fast)
+    expected = [json.dumps({"n": n}) for n in range(n_messages)]
+    for ws in fast:
+        assert ws.received == expected
+
+    stats = hub.stats()
+    assert stats["connections"] == 300
+    assert stats["max_queue_depth"] <= 32
+    assert stats["dropped"] > 0
+    for ws in stuck:
+        assert hub._conns[id(ws)].depth == 32
+    for ws in slow:
+        got = [json.loads(t)["n"] for t in ws.received]
+        assert got == sorted(got)  # 丢的是中间的旧消息，顺序不乱
+
+
+# ---------------------------------------------------------------------------
+# chat.broadcast 接入
+# ---------------------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_chat_broadcast_enqueues_and_cleans_up_failed(hub):
+    good, bad = FakeWS(), FakeWS(fail=True)
+    humans, bots = {0: [good]}, {5: bad}
+    with patch.object(chat, "broadcast_hub", hub), \
+         patch.object(chat, "broadcast_bus", LocalBus(hub)), \
+         patch.object(chat, "human_connections", humans), \
+         patch.object(chat, "bot_connections", bots):
+        hub.register(0, good, on_close=chat._forget_connection)
+        hub.register(5, bad, on_close=chat._forget_connection)
+        await chat.broadcast({"type": "new_message", "data": {"content": "你好"}})
+        await _drain(hub, [good])
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    assert json.loads(good.received[0])["data"]["content"] == "你好"
+    assert "你好" in good.received[0]  # ensure_ascii=False
+    assert bots == {} and humans == {0: [good]}
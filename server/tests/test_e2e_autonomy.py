@@ -43,7 +43,7 @@ MOCK_DECISIONS_CHECKIN_AGAIN = json.dumps([
 
 
 def _mock_llm(reply_text: str):
-    """返回 resolve_model + AsyncOpenAI 的 patch，使 LLM 返回指定文本。"""
+    """返回 resolve_model + llm_client 的 patch，使 LLM 返回指定文本。"""
     mock_choice = MagicMock()
     mock_choice.message.content = reply_text
     mock_response = MagicMock()
@@ -58,7 +58,7 @@ def _mock_llm(reply_text: str):
     return (
         patch("app.services.autonomy_service.resolve_model",
               return_value=("http://fake", "sk-fake", "test-model")),
-        patch("app.services.autonomy_service.AsyncOpenAI",
+        patch("app.services.autonomy_service.llm_client",
               return_value=mock_client),
     )
 
@@ -160,9 +160,9 @@ async def test_e2e_autonomy_websocket_event(client: AsyncClient):
                 r = await client.post("/api/dev/trigger-autonomy")
                 assert r.json()["ok"] is True
 
-            # 收到 agent_action 事件（跳过 agent_status_change 事件）
+            # 收到 agent_action 事件（跳过 agent_status_change / agent_status_batch 事件）
             event = ws.receive_json()
-            while event.get("data", {}).get("event") == "agent_status_change":
+            while event.get("data", {}).get("event") in ("agent_status_change", "agent_status_batch"):
                 event = ws.receive_json()
             assert event["type"] == "system_event"
             assert event["data"]["event"] == "agent_action"
@@ -0,0 +1,104 @@
+"""
+Embedding 批量请求：embed_many 分块 + 并发 embed() 合并为一次 /embeddings 调用
+"""
+import asyncio
+import json
+
+import httpx
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.models import Memory, MemoryType
+from app.services import vector_store
+
+
+def _vec(text: str) -> list[float]:
+    """按文本确定性生成向量，便于核对结果是否回到了正确的调用方"""
+    rng = np.random.default_rng(abs(hash(text)) % (2 ** 32))
+    return rng.standard_normal(settings.embedding_dim).astype(np.float32).tolist()
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """替换 embedding 客户端，记录每次请求的 input"""
+    calls: list[list[str]] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        calls.append(texts)
+        if any(t == "bad" for t in texts):
+            return httpx.Response(400, json={"error": "bad input"})
+        # 故意倒序返回，验证按 index 重排
+        data = [{"index": i, "embedding": _vec(t)} for i, t in enumerate(texts)][::-1]
+        return httpx.Response(200, json={"data": data})
+
+    client = httpx.AsyncClient(base_url="http://embed.test", transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(vector_store, "_client", client)
+    yield calls
+
+
+def _blob(text: str) -> bytes:
+    return np.array(_vec(text), dtype=np.float32).tobytes()
+
+
+@pytest.mark.asyncio
+async def test_embed_many_chunks_by_batch_size(api, monkeypatch):
+    monkeypatch.setattr(settings, "embedding_batch_size", 4)
+    texts = [f"t{i}" for i in range(10)]
+    blobs = await vector_store.embed_many(texts)
+    assert [len(c) for c in api] == [4, 4, 2]
+    assert blobs == [_blob(t) for t in texts]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_embeds_are_coalesced(api, monkeypatch):
+    monkeypatch.setattr(settings, "embedding_batch_linger_ms", 20)
+    texts = [f"q{i}" for i in range(8)]
+    blobs = await asyncio.gather(*(vector_store.embed(t) for t in texts))
+    assert len(api) == 1 and sorted(api[0]) == sorted(texts)
+    assert list(blobs) == [_blob(t) for t in texts]
+
+
+@pytest.mark.asyncio
+async def test_full_batch_flushes_without_waiting(api, monkeypatch):
+    monkeypatch.setattr(settings, "embedding_batch_size", 3)
+    monkeypatch.setattr(settings, "embedding_batch_linger_ms", 10_000)
+    blobs = await asyncio.wait_for(
+        asyncio.gather(*(vector_store.embed(f"x{i}") for i in range(3))), timeout=2,
+    )
+    assert len(api) == 1 and len(blobs) == 3
+
+
+@pytest.mark.asyncio
+async def test_bad_input_only_fails_its_own_caller(api, monkeypatch):
+    monkeypatch.setattr(settings, "embedding_batch_linger_ms", 20)
+    results = await asyncio.gather(
+        vector_store.embed("ok1"), vector_store.embed("bad"), vector_store.embed("ok2"),
+        return_exceptions=True,
+    )
+    assert results[0] == _blob("ok1") and results[2] == _blob("ok2")
+    assert isinstance(results[1], httpx.HTTPStatusError)
+
+
+@pytest.mark.asyncio
+async def test_linger_zero_sends_immediately(api, monkeypatch):
+    monkeypatch.setattr(settings, "embedding_batch_linger_ms", 0)
+    await asyncio.gather(vector_store.embed("a"), vector_store.embed("b"))
+    assert api == [["a"], ["b"]]
+
+
+@pytest.mark.asyncio
+async def test_backfill_embeds_missing_rows_in_batches(api, db, monkeypatch):
+    monkeypatch.setattr(settings, "embedding_batch_size", 2)
+    for i in range(5):
+        db.add(Memory(agent_id=1, memory_type=MemoryType.LONG, content=f"m{i}"))
+    db.add(Memory(agent_id=1, memory_type=MemoryType.LONG, content="done", embedding=_blob("done")))
+    await db.commit()
+
+    assert await vector_store.backfill_embeddings(db) == 5
+    assert [len(c) for c in api] == [2, 2, 1]
+    mems = (await db.execute(select(Memory))).scalars().all()
+    assert all(m.embedding == _blob(m.content) for m in mems)
@@ -0,0 +1,109 @@
+"""
+Embedding 内容哈希缓存：内存 LRU + SQLite 持久层，重复文本不再调用 API
+"""
+import asyncio
+import json
+
+import httpx
+import numpy as np
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app.core.config import settings
+from app.services import vector_store
+from app.services.embedding_cache import EmbeddingCache, cache_key
+
+
+def _blob(seed: int) -> bytes:
+    return np.full(settings.embedding_dim, seed, dtype=np.float32).tobytes()
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """假 embedding API，记录每次请求的 input"""
+    calls: list[list[str]] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        calls.append(texts)
+        data = [{"index": i, "embedding": [float(len(t))] * settings.embedding_dim} for i, t in enumerate(texts)]
+        return httpx.Response(200, json={"data": data})
+
+    client = httpx.AsyncClient(base_url="http://embed.test", transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(vector_store, "_client", client)
+    yield calls
+
+
+def test_key_covers_model_and_dim():
+    assert cache_key("hi", "m1", 1024) != cache_key("hi", "m2", 1024)
+    assert cache_key("hi", "m1", 1024) != cache_key("hi", "m1", 512)
+    assert cache_key("hi", "m1", 1024) == cache_key("hi", "m1", 1024)
+
+
+def test_model_change_misses(monkeypatch):
+    cache = EmbeddingCache()
+    cache.put("hello", _blob(1))
+    monkeypatch.setattr(settings, "embedding_model", "another/model")
+    assert cache.get("hello") is None
+
+
+def test_lru_bound():
+    cache = EmbeddingCache(max_entries=2)
+    cache.put("a", _blob(1))
+    cache.put("b", _blob(2))
+    cache.get("a")  # a 变为最近使用
+    cache.put("c", _blob(3))
+    assert cache.get("b") is None
+    assert cache.get("a") == _blob(1) and cache.get("c") == _blob(3)
+    assert cache.stats()["memory_entries"] == 2
+
+
+def test_persistent_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "cache" / "emb.db")
+    first = EmbeddingCache(path=path)
+    first.put_many(["x", "y"], [_blob(1), _blob(2)])
+    first.close()
+
+    second = EmbeddingCache(path=path)
+    assert second.get("y") == _blob(2)
+    stats = second.stats()
+    assert stats["persistent"] and stats["disk_hits"] == 1 and stats["misses"] == 0
+    second.close()
+
+
+@pytest.mark.asyncio
+async def test_repeated_embed_hits_cache(api):
+    first = await vector_store.embed("同一段聊天上下文")
+    second = await vector_store.embed("同一段聊天上下文")
+    assert first == second
+    assert len(api) == 1
+    stats = vector_store.embedding_cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_identical_inflight_requests_share_one_call(api, monkeypatch):
+    monkeypatch.setattr(settings, "embedding_batch_linger_ms", 0)
+    blobs = await asyncio.gather(*(vector_store.embed("多个 agent 的同一段历史") for _ in range(5)))
+    assert len(set(blobs)) == 1
+    assert api == [["多个 agent 的同一段历史"]]
+
+
+@pytest.mark.asyncio
+async def test_embed_many_only_requests_misses(api):
+    await vector_store.embed("a")
+    blobs = await vector_store.embed_many(["a", "bb", "a", "ccc"])
+    assert api[-1] == ["bb", "ccc"]
+    assert [np.frombuffer(b, dtype=np.float32)[0] for b in blobs] == [1, 2, 1, 3]
+
+
+@pytest.mark.asyncio
+async def test_cache_stats_endpoint(api):
+    from main import app
+    await vector_store.embed("q")
+    await vector_store.embed("q")
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        resp = await client.get("/api/memories/embedding-cache")
+    assert resp.status_code == 200
+    assert resp.json()["hits"] == 1 and resp.json()["misses"] == 1
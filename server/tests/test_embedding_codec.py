@@ -0,0 +1,129 @@
+"""
+Embedding 量化存储：float16 / int8 编解码、int8 常驻索引 + 精排、存量数据迁移
+"""
+from unittest.mock import AsyncMock, patch
+
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.core.database import _migrate_embedding_storage
+from app.models import Memory, MemoryType
+from app.services import embedding_codec, vector_store
+from app.services.ann_index import EmbeddingMatrix, IVFIndex, normalize_rows
+
+EMBED = "app.services.vector_store.embed"
+
+
+@pytest.mark.parametrize("fmt,tol", [("float32", 0), ("float16", 1e-3), ("int8", 2e-2)])
+def test_roundtrip_and_detection(fmt, tol):
+    v = np.random.default_rng(0).standard_normal(64).astype(np.float32)
+    blob = embedding_codec.encode(v, fmt)
+    assert len(blob) == embedding_codec.blob_size(fmt, 64)
+    assert embedding_codec.detect_format(blob, 64) == fmt
+    assert np.abs(embedding_codec.decode(blob, 64) - v).max() <= tol * np.abs(v).max()
+
+
+def test_decode_rejects_unknown_length():
+    assert embedding_codec.decode(b"\x00" * 7, 64) is None
+
+
+def test_quantized_matrix_scores_and_memory():
+    vecs = normalize_rows(np.random.default_rng(1).standard_normal((500, 128)))
+    plain, quant = EmbeddingMatrix(128), EmbeddingMatrix(128, quantized=True)
+    for m in (plain, quant):
+        m.append(np.arange(500), vecs, np.zeros(500, dtype=np.int8))
+    q = vecs[7]
+    assert np.abs(quant.scores(q) - plain.scores(q)).max() < 0.02
+    assert quant.nbytes < plain.nbytes / 3
+
+    quant.remove([3])
+    assert len(quant) == 499 and 3 not in quant.ids.tolist()
+    row = quant.ids.tolist().index(499)  # 末行被换到空位，scale 跟着走
+    assert np.allclose(quant.vecs[row], vecs[499], atol=0.02)
+
+
+def test_quantized_index_survives_training():
+    rng = np.random.default_rng(2)
+    centers = rng.standard_normal((32, 32)).astype(np.float32)
+    vecs = centers[rng.integers(0, 32, 3000)] + 0.3 * rng.standard_normal((3000, 32)).astype(np.float32)
+    index = IVFIndex(32, min_train=1000, quantized=True)
+    index.add(np.arange(3000), vecs)
+    assert index.is_trained
+    ids, _ = index.search(vecs[11], 1)
+    assert ids.tolist() == [11]
+
+
+# ---------------------------------------------------------------------------
+# vector_store 集成
+# ---------------------------------------------------------------------------
+
+async def _seed(db, n=60):
+    rng = np.random.default_rng(3)
+    vecs = {}
+    for i in range(n):
+        v = rng.standard_normal(settings.embedding_dim).astype(np.float32)
+        mem = Memory(agent_id=1, memory_type=MemoryType.LONG, content=f"m{i}", embedding=v.tobytes())
+        db.add(mem)
+        await db.flush()
+        vecs[mem.id] = v
+    await db.commit()
+    return vecs
+
+
+@pytest.mark.asyncio
+async def test_quantized_search_reranks_exactly(db, monkeypatch):
+    await _seed(db)
+    q = np.random.default_rng(4).standard_normal(settings.embedding_dim).astype(np.float32)
+    with patch(EMBED, new_callable=AsyncMock, return_value=q.tobytes()):
+        monkeypatch.setattr(settings, "vector_search_mode", "exact")
+        exact = await vector_store.search_memories("q", 1, top_k=5, db=db)
+        monkeypatch.setattr(settings, "vector_search_mode", "ann")
+        monkeypatch.setattr(settings, "vector_index_quantize", True)
+        ann = await vector_store.search_memories("q", 1, top_k=5, db=db)
+
+    assert [r["memory_id"] for r in ann] == [r["memory_id"] for r in exact]
+    for a, e in zip(ann, exact):
+        assert a["_distance"] == pytest.approx(e["_distance"], abs=1e-5)  # 精排后分数是精确的
+
+
+@pytest.mark.asyncio
+async def test_store_embedding_uses_configured_format(db, monkeypatch):
+    monkeypatch.setattr(settings, "embedding_storage", "float16")
+    mem = Memory(agent_id=1, memory_type=MemoryType.LONG, content="x")
+    db.add(mem)
+    await db.flush()
+    v = np.random.default_rng(5).standard_normal(settings.embedding_dim).astype(np.float32)
+    vector_store.store_embedding(mem, v.tobytes())
+    await db.commit()
+    assert len(mem.embedding) == settings.embedding_dim * 2
+
+    with patch(EMBED, new_callable=AsyncMock, return_value=v.tobytes()):
+        results = await vector_store.search_memories("x", 1, top_k=1, db=db)
+    assert results[0]["memory_id"] == mem.id
+    assert results[0]["_distance"] == pytest.approx(0.0, abs=1e-3)
+
+
+@pytest.mark.asyncio
+async def test_migration_converts_existing_rows(db, monkeypatch):
+    vecs = await _seed(db, n=5)
+    db.add(Memory(agent_id=1, memory_type=MemoryType.LONG, content="junk", embedding=b"\x01\x02\x03"))
+    await db.commit()
+
+    monkeypatch.setattr(settings, "embedding_storage", "int8")
+    conn = await db.connection()
+    await _migrate_embedding_storage(conn)
+    await db.commit()
+    db.expire_all()
+
+    rows = (await db.execute(select(Memory))).scalars().all()
+    for mem in rows:
+        if mem.content == "junk":
+            assert mem.embedding == b"\x01\x02\x03"  # 无法识别的 blob 不动
+            continue
+        assert len(mem.embedding) == settings.embedding_dim + 4
+        decoded = embedding_codec.decode(mem.embedding, settings.embedding_dim)
+        assert np.abs(decoded - vecs[mem.id]).max() < 0.05
+
+    await _migrate_embedding_storage(await db.connection())  # 再跑一次是空操作
@@ -0,0 +1,148 @@
+"""
+LLM 输出里的 JSON 提取：单遍括号扫描（字符串感知）、容忍 markdown 代码块 / 尾逗号 / 前后说明文字，
+取最大的合法动作数组；随机模糊测试不崩溃，MB 级推理文本线性时间
+"""
+import json
+import random
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.services import json_extract
+from app.services.json_extract import extract_actions, iter_spans
+
+FINAL = [{"agent_id": i, "action": "rest", "params": {}, "reason": "累了"} for i in range(1, 4)]
+
+
+def test_spans_nested_and_string_aware():
+    text = '说明 [1, {"a": "]["}] 尾巴 ]'
+    spans = [(text[s:e], h) for s, e, h in iter_spans(text)]
+    assert spans == [('[1, {"a": "]["}]', 2), ('{"a": "]["}', 1)]
+
+
+def test_fences_trailing_commas_and_prose():
+    text = '好的，决定如下：\n```json\n[\n  {"agent_id": 1, "action": "eat", "params": {},},\n]\n```\n以上。'
+    assert extract_actions(text) == [{"agent_id": 1, "action": "eat", "params": {}}]
+
+
+def test_legacy_dict_and_largest_array_wins():
+    text = (
+        '草稿：[{"agent_id": 1, "action": "eat"}]\n'
+        '参考 [1][2]，最终：{"actions": ' + json.dumps(FINAL) + ', "strategies": []}\n'
+        '再确认一遍 [{"agent_id": 2, "action": "chat"}]'
+    )
+    assert extract_actions(text) == FINAL
+
+
+def test_later_array_wins_tie():
+    text = '先想 [{"agent_id": 1, "action": "eat"}] 不对，改成 [{"agent_id": 1, "action": "rest"}]'
+    assert extract_actions(text) == [{"agent_id": 1, "action": "rest"}]
+
+
+def test_stray_quotes_and_mismatched_brackets():
+    text = (
+        '居民说"我饿了 (见 [上轮} 记录 { 未闭合\n'
+        + json.dumps(FINAL, ensure_ascii=False) + '\n] 多余的右括号 }'
+    )
+    assert extract_actions(text) == FINAL
+
+
+def test_no_actions():
+    assert extract_actions("this is not json!!!") is None
+    assert extract_actions('{"thought": [1, 2, 3]}') is None
+    assert extract_actions("") is None
+    assert extract_actions("[]") == []
+
+
+def test_fuzz_never_raises_and_finds_intact_answer():
+    rnd = random.Random(20261017)
+    alphabet = list('[]{}",:\\ \nab1居民') + ["true", "null", '{"agent_id": 2', '"action": "x"}']
+    for _ in range(500):
+        noise = lambda: "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 60)))  # noqa: E731
+        garbage = noise() + noise()
+        result = extract_actions(garbage)
+        assert result is None or isinstance(result, list)
+
+        answer = json.dumps(FINAL, ensure_ascii=False)
+        result = extract_actions(noise() + "\n" + answer + "\n" + noise().replace("]", "").replace("}", ""))
+        assert result is not None and len(result) >= len(FINAL)
+
+
+def _reasoning_blob(size: int) -> str:
+    rnd = random.Random(7)
+    words = ["居民", "体力", "不足", "需要", "休息", "the", "agent", "should", "(1)", "[注]", '"引用"', "，", "。", "\n"]
+    prose = " ".join(rnd.choice(words) for _ in range(size // 3))
+    draft = json.dumps([{"agent_id": 1, "action": "eat", "params": {}}])
+    half = len(prose) // 2
+    return prose[:half] + "\n草稿：" + draft + "\n" + prose[half:] + "\n```json\n" + json.dumps(FINAL) + "\n```"
+
+
+class _CountingStr(str):
+    """数下标访问次数：iter_spans 每处理一个括号/引号读一次 text[i]，错配时往下找栈也要读"""
+
+    def __new__(cls, value):
+        obj = super().__new__(cls, value)
+        obj.reads = 0
+        return obj
+
+    def __getitem__(self, key):
+        self.reads += 1
+        return super().__getitem__(key)
+
+
+def _work(text: str) -> int:
+    """extract_actions 的工作量：扫描时的下标访问次数 + 交给 JSON 解码器的字符数"""
+    decoded = 0
+    real_decode = json_extract._decode
+
+    def decode(t, start, end):
+        nonlocal decoded
+        decoded += end - start
+        return real_decode(t, start, end)
+
+    counting = _CountingStr(text)
+    with patch.object(json_extract, "_decode", decode):
+        assert extract_actions(counting) == FINAL
+    return counting.reads + decoded
+
+
+def _assert_linear(build, n: int):
+    small, large = build(n), build(2 * n)
+    # 输入翻倍，工作量最多翻倍（留一点余量给结尾的答案和随机文本的长度波动）
+    assert _work(large) <= 2.2 * _work(small) + 10 * len(json.dumps(FINAL))
+
+
+def test_multi_megabyte_reasoning_stays_linear():
+    blob = _reasoning_blob(4_000_000)
+    assert len(blob.encode()) > 4_000_000
+    assert extract_actions(blob) == FINAL
+    _assert_linear(_reasoning_blob, 200_000)
+
+
+@pytest.mark.parametrize("build", [
+    lambda n: "[" * n + "]" * n,  # 极深嵌套
+    lambda n: "[1," * n + "x",  # 每一层都在同一处失败
+    lambda n: '{"a":' * (n // 2),  # 未闭合
+    lambda n: "{" * n + "]" * n,  # 成串错配
+], ids=["deep", "same-failure", "unclosed", "mismatched"])
+def test_pathological_input_stays_linear(build):
+    _assert_linear(lambda n: build(n) + json.dumps(FINAL), 50_000)
+
+
+@pytest.mark.asyncio
+async def test_decide_reads_reasoning_with_drafts():
+    from app.services.autonomy_service import decide
+
+    mock_choice = MagicMock()
+    mock_choice.message.content = ""
+    mock_choice.message.reasoning = _reasoning_blob(50_000)
+    mock_response = MagicMock()
+    mock_response.choices = [mock_choice]
+    mock_client = AsyncMock()
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
+
+    with patch("app.services.autonomy_service.resolve_model",
+               return_value=("http://fake", "sk-fake", "test-model")), \
+         patch("app.services.autonomy_service.llm_client", return_value=mock_client):
+        actions = await decide("fake snapshot")
+    assert [a["agent_id"] for a in actions] == [1, 2, 3]
@@ -0,0 +1,119 @@
+"""
+LLM 客户端连接池：按 (base_url, api_key) 复用 AsyncOpenAI，共用 httpx 连接池，跨调用保持长连接
+"""
+import asyncio
+import json
+from unittest.mock import patch
+
+import pytest
+
+from app.core import llm_clients as llm_clients_module
+from app.core.config import settings
+from app.core.llm_clients import LLMClientPool, llm_client, llm_clients
+from app.services.wakeup_service import call_wakeup_model
+
+COMPLETION = {
+    "id": "c1", "object": "chat.completion", "created": 0, "model": "stub",
+    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "Alice"}}],
+}
+
+
+async def _stub_server(connections: list):
+    """最小 HTTP/1.1 keep-alive 服务：每个请求回同一个 chat completion，记录 TCP 连接数"""
+    body = json.dumps(COMPLETION).encode()
+
+    async def handle(reader, writer):
+        connections.append(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                await reader.readexactly(length)
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}/v1"
+
+
+@pytest.mark.asyncio
+async def test_clients_cached_per_key_and_share_pool():
+    pool = LLMClientPool()
+    a = pool.client("https://x/v1", "k1")
+    assert pool.client("https://x/v1", "k1") is a
+    b = pool.client("https://x/v1", "k2")
+    c = pool.client("https://y/v1", "k1")
+    assert len({id(a), id(b), id(c)}) == 3
+    assert a._client is b._client is c._client is pool.http  # 同一个 httpx 连接池
+    assert pool.stats()["clients"] == 3
+    await pool.aclose()
+    assert pool.stats()["clients"] == 0
+
+
+def test_pool_rebuilt_on_new_event_loop():
+    pool = LLMClientPool()
+
+    async def get():
+        return pool.client("https://x/v1", "k")
+
+    first = asyncio.run(get())
+    second = asyncio.run(get())
+    assert first is not second
+    assert pool.created == 2
+
+
+@pytest.mark.asyncio
+async def test_http2_only_when_h2_installed(monkeypatch):
+    monkeypatch.setattr(settings, "llm_http2", True)
+    monkeypatch.setattr(llm_clients_module, "HTTP2_AVAILABLE", False)
+    pool = LLMClientPool()
+    pool.client("https://x/v1", "k")
+    assert pool.stats()["http2"] is False
+    await pool.aclose()
+
+
+@pytest.mark.asyncio
+async def test_calls_reuse_one_connection():
+    connections = []
+    server, base_url = await _stub_server(connections)
+    try:
+        for _ in range(5):
+            client = llm_client(base_url=base_url, api_key="sk-test")
+            resp = await client.chat.completions.create(
+                model="stub", messages=[{"role": "user", "content": "hi"}],
+            )
+            assert resp.choices[0].message.content == "Alice"
+
+        with patch("app.services.wakeup_service.resolve_model", return_value=(base_url, "sk-test", "stub")):
+            assert await call_wakeup_model("选人") == "Alice"
+    finally:
+        await llm_clients.aclose()
+        server.close()
+    assert len(connections) == 1  # 6 次调用（含 wakeup 的原始 httpx 请求）只建一条 TCP 连接
+
+
+@pytest.mark.asyncio
+async def test_close_releases_connections():
+    connections = []
+    server, base_url = await _stub_server(connections)
+    try:
+        await llm_client(base_url=base_url, api_key="k").chat.completions.create(
+            model="stub", messages=[{"role": "user", "content": "hi"}],
+        )
+        http = llm_clients.http
+        await llm_clients.aclose()
+        assert http.is_closed
+        assert llm_clients.stats() == {"clients": 0, "http2": False, "created": llm_clients.created}
+    finally:
+        server.close()
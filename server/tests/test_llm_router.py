@@ -0,0 +1,268 @@
+"""
+LLM 供应商路由：按健康分（EWMA 延迟 × 错误率）选供应商、熔断 / 半开恢复、失败转移、对冲请求
+"""
+import asyncio
+import json
+import time
+
+import pytest
+
+from app.api.chat import _llm_summarize
+from app.api.llm import llm_health
+from app.core.config import resolve_model, settings
+from app.core.llm_clients import llm_clients
+from app.core.llm_router import (
+    LLMRouter, ProviderTarget, ProvidersUnavailable, llm_router, provider_targets,
+)
+
+A = ProviderTarget("a", "http://a/v1", "ka", "m")
+B = ProviderTarget("b", "http://b/v1", "kb", "m")
+C = ProviderTarget("c", "http://c/v1", "kc", "m")
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(settings, "llm_breaker_failures", 3)
+    monkeypatch.setattr(settings, "llm_breaker_cooldown", 30.0)
+    monkeypatch.setattr(settings, "llm_hedge", False)
+    return LLMRouter()
+
+
+def fake_providers(behaviour: dict, calls: list):
+    """本地假供应商：behaviour[name] = (延迟秒, 返回值或异常)"""
+    async def request(target):
+        calls.append(target.name)
+        delay, outcome = behaviour[target.name]
+        await asyncio.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    return request
+
+
+def test_rank_by_latency_and_errors(router):
+    assert router.rank([A, B, C]) == [A, B, C]  # 没有样本：保持注册顺序
+    router.health(A.key).record_success(900)
+    router.health(B.key).record_success(300)
+    router.health(C.key).record_success(100)
+    router.health(C.key).record_failure()  # 100 × (1 + 4 × 0.2) = 180
+    assert router.rank([A, B, C]) == [C, B, A]
+    for _ in range(3):
+        router.health(C.key).record_failure()
+    assert router.health(C.key).state == "open"
+    assert router.rank([A, B, C]) == [B, A, C]  # 熔断的排最后
+
+
+def test_resolve_model_prefers_healthy_provider(monkeypatch):
+    monkeypatch.setattr(settings, "openrouter_auth_token", "k-or")
+    monkeypatch.setattr(settings, "siliconflow_auth_token", "k-sf")
+    first, second = provider_targets("memory-summary-model")
+    assert resolve_model("memory-summary-model")[1] == "k-or"
+
+    llm_router.health(first.key).record_success(2000)
+    llm_router.health(second.key).record_success(200)
+    assert resolve_model("memory-summary-model")[1] == "k-sf"
+    targets = llm_router.targets("memory-summary-model", resolve_model("memory-summary-model"))
+    assert [t.name for t in targets] == ["siliconflow", "openrouter"]
+
+
+def test_unknown_endpoint_is_single_target():
+    targets = llm_router.targets("memory-summary-model", ("http://fake/v1", "k", "m"))
+    assert targets == [ProviderTarget("memory-summary-model", "http://fake/v1", "k", "m")]
+
+
+@pytest.mark.asyncio
+async def test_failover_in_order_and_validate(router):
+    calls = []
+    request = fake_providers({
+        "a": (0, RuntimeError("down")),
+        "b": (0, "x"),  # 不合格
+        "c": (0, "good answer"),
+    }, calls)
+    routed = await router.complete([A, B, C], request, validate=lambda r: len(r) >= 5)
+    assert routed.value == "good answer" and routed.target == C and routed.attempts == 3
+    assert calls == ["a", "b", "c"]
+    assert router.stats()[A.key]["failures"] == 1
+    assert router.stats()[B.key]["failures"] == 1
+    assert router.stats()[C.key]["successes"] == 1
+
+
+@pytest.mark.asyncio
+async def test_all_failed_raises_last_error(router):
+    request = fake_providers({"a": (0, RuntimeError("a down")), "b": (0, ValueError("b down"))}, [])
+    with pytest.raises(ValueError, match="b down"):
+        await router.complete([A, B], request)
+
+
+@pytest.mark.asyncio
+async def test_attempt_timeout_fails_over(router):
+    calls = []
+    request = fake_providers({"a": (10, "late"), "b": (0, "fast")}, calls)
+    start = time.monotonic()
+    routed = await router.complete([A, B], request, attempt_timeout=0.05)
+    assert routed.target == B and time.monotonic() - start < 1
+    assert router.health(A.key).consecutive_failures == 1
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_then_half_open_trial(router, monkeypatch):
+    calls = []
+    behaviour = {"a": (0, RuntimeError("down"))}
+    request = fake_providers(behaviour, calls)
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            await router.complete([A], request)
+    assert router.stats()[A.key]["state"] == "open"
+
+    with pytest.raises(ProvidersUnavailable):  # 熔断期间不再打到供应商
+        await router.complete([A], request)
+    assert len(calls) == 3
+
+    monkeypatch.setattr(settings, "llm_breaker_cooldown", 0.0)
+    behaviour["a"] = (0.05, "ok")
+    trial = asyncio.create_task(router.complete([A], request))
+    await asyncio.sleep(0.01)
+    assert router.health(A.key).state == "half_open"
+    with pytest.raises(ProvidersUnavailable):  # 半开只放一个试探请求
+        await router.complete([A], request)
+    assert (await trial).value == "ok"
+    assert router.stats()[A.key]["state"] == "closed"
+
+
+@pytest.mark.asyncio
+async def test_failed_trial_reopens(router, monkeypatch):
+    request = fake_providers({"a": (0, RuntimeError("down"))}, [])
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            await router.complete([A], request)
+    monkeypatch.setattr(settings, "llm_breaker_cooldown", 0.0)
+    with pytest.raises(RuntimeError):
+        await router.complete([A], request)
+    health = router.health(A.key)
+    assert health.state == "open" and health.consecutive_failures == 4
+
+
+@pytest.mark.asyncio
+async def test_open_breaker_skipped_in_failover(router):
+    calls = []
+    request = fake_providers({"a": (0, RuntimeError("down")), "b": (0, "ok")}, calls)
+    for _ in range(3):
+        router.health(A.key).record_failure()
+    routed = await router.complete([A, B], request)
+    assert routed.target == B and calls == ["b"] and routed.attempts == 1
+
+
+@pytest.mark.asyncio
+async def test_hedge_fires_second_provider_after_delay(router, monkeypatch):
+    monkeypatch.setattr(settings, "llm_hedge_delay_ms", 50)
+    calls = []
+    request = fake_providers({"a": (5, "slow"), "b": (0.01, "fast")}, calls)
+    start = time.monotonic()
+    routed = await router.complete([A, B], request, hedge=True)
+    elapsed = time.monotonic() - start
+    assert routed.value == "fast" and routed.hedged and calls == ["a", "b"]
+    assert 0.05 <= elapsed < 1
+    assert router.health(A.key).failures == 0  # 被取消的一方不算失败
+
+
+@pytest.mark.asyncio
+async def test_no_hedge_when_primary_fast_or_disabled(router, monkeypatch):
+    monkeypatch.setattr(settings, "llm_hedge_delay_ms", 50)
+    calls = []
+    request = fake_providers({"a": (0.01, "a"), "b": (0, "b")}, calls)
+    assert (await router.complete([A, B], request, hedge=True)).hedged is False
+    request = fake_providers({"a": (0.1, "a"), "b": (0, "b")}, calls)
+    assert (await router.complete([A, B], request)).value == "a"  # 默认关闭
+    assert calls == ["a", "a"]
+
+
+@pytest.mark.asyncio
+async def test_hedge_delay_follows_p95(router, monkeypatch):
+    monkeypatch.setattr(settings, "llm_hedge_min_samples", 5)
+    monkeypatch.setattr(settings, "llm_hedge_delay_ms", 10_000)
+    for _ in range(5):
+        router.health(A.key).record_success(30)
+    calls = []
+    request = fake_providers({"a": (5, "slow"), "b": (0, "fast")}, calls)
+    start = time.monotonic()
+    routed = await router.complete([A, B], request, hedge=True)
+    assert routed.target == B and time.monotonic() - start < 1
+
+
+@pytest.mark.asyncio
+async def test_caller_cancel_cancels_attempts(router):
+    started = asyncio.Event()
+    cancelled = []
+
+    async def request(target):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(target.name)
+            raise
+
+    task = asyncio.create_task(router.complete([A, B], request))
+    await started.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert cancelled == ["a"]
+    assert router.health(A.key).failures == 0
+
+
+# ---------------------------------------------------------------------------
+# 本地假供应商（HTTP stub）：记忆摘要主供应商报错，转移到备用，健康度可从 API 查看
+# ---------------------------------------------------------------------------
+
+async def _stub_provider(status: int, content: str):
+    body = json.dumps({
+        "id": "c1", "object": "chat.completion", "created": 0, "model": "stub",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+    } if status == 200 else {"error": {"message": "bad request"}}).encode()
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                await reader.readexactly(length)
+                writer.write(
+                    f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n".encode()
+                    + b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/v1"
+
+
+@pytest.mark.asyncio
+async def test_summary_fails_over_between_local_providers(monkeypatch):
+    broken, broken_url = await _stub_provider(400, "")
+    healthy, healthy_url = await _stub_provider(200, "张三答应周五归还借的书")
+    monkeypatch.setattr(settings, "openrouter_auth_token", "k-or")
+    monkeypatch.setattr(settings, "openrouter_base_url", broken_url)
+    monkeypatch.setattr(settings, "siliconflow_auth_token", "k-sf")
+    monkeypatch.setattr(settings, "siliconflow_base_url", healthy_url)
+    try:
+        assert await _llm_summarize("张三: 周五还你书") == "张三答应周五归还借的书"
+        assert await _llm_summarize("张三: 周五还你书") == "张三答应周五归还借的书"
+    finally:
+        await llm_clients.aclose()
+        broken.close()
+        healthy.close()
+
+    stats = (await llm_health())["providers"]
+    openrouter = next(v for k, v in stats.items() if k.startswith("openrouter:"))
+    siliconflow = next(v for k, v in stats.items() if k.startswith("siliconflow:"))
+    # 第二次直接先走健康的备用供应商
+    assert openrouter["failures"] == 1 and openrouter["error_rate"] > 0
+    assert siliconflow["successes"] == 2 and siliconflow["ewma_latency_ms"] is not None
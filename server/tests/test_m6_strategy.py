@@ -147,7 +147,7 @@ async def test_decide_new_format():
 
     with patch("app.services.autonomy_service.resolve_model",
                return_value=("http://fake", "sk-fake", "test-model")), \
-         patch("app.services.autonomy_service.AsyncOpenAI",
+         patch("app.services.autonomy_service.llm_client",
                return_value=mock_client):
         actions = await decide("fake snapshot")
 
@@ -172,7 +172,7 @@ async def test_decide_legacy_fallback():
 
     with patch("app.services.autonomy_service.resolve_model",
                return_value=("http://fake", "sk-fake", "test-model")), \
-         patch("app.services.autonomy_service.AsyncOpenAI",
+         patch("app.services.autonomy_service.llm_client",
                return_value=mock_client):
         actions = await decide("fake snapshot")
 
@@ -197,7 +197,7 @@ async def test_decide_reasoning_field_fallback():
 
     with patch("app.services.autonomy_service.resolve_model",
                return_value=("http://fake", "sk-fake", "test-model")), \
-         patch("app.services.autonomy_service.AsyncOpenAI",
+         patch("app.services.autonomy_service.llm_client",
                return_value=mock_client):
         actions = await decide("fake snapshot")
 
@@ -207,7 +207,6 @@ async def test_decide_reasoning_field_fallback():
 
 # ── T6: execute_strategies 测试 ──
 
-@pytest.mark.skip(reason="策略系统 dormant（DEV-40）")
 async def test_keep_working_executes_checkin():
     """keep_working 策略：agent 在目标建筑，自动 checkin。"""
     from app.services.autonomy_service import execute_strategies
@@ -230,7 +229,6 @@ async def test_keep_working_executes_checkin():
     assert stats["executed"] >= 1 or stats["skipped"] >= 0  # 取决于是否有可用岗位
 
 
-@pytest.mark.skip(reason="策略系统 dormant（DEV-40）")
 async def test_keep_working_stops_when_resource_reached():
     """keep_working 策略：资源达标时标记 completed。"""
     from app.services.autonomy_service import execute_strategies
@@ -252,7 +250,6 @@ async def test_keep_working_stops_when_resource_reached():
     assert stats["executed"] == 0
 
 
-@pytest.mark.skip(reason="策略系统 dormant（DEV-40）")
 async def test_opportunistic_buy_accepts_cheap_order():
     """opportunistic_buy 策略：市场有低价单时自动接单。"""
     from app.services.autonomy_service import execute_strategies
@@ -280,7 +277,6 @@ async def test_opportunistic_buy_accepts_cheap_order():
     assert stats["executed"] == 1
 
 
-@pytest.mark.skip(reason="策略系统 dormant（DEV-40）")
 async def test_opportunistic_buy_stops_when_enough():
     """opportunistic_buy 策略：库存达标时 completed。"""
     from app.services.autonomy_service import execute_strategies
@@ -301,7 +297,6 @@ async def test_opportunistic_buy_stops_when_enough():
     assert stats["executed"] == 0
 
 
-@pytest.mark.skip(reason="策略系统 dormant（DEV-40）")
 async def test_opportunistic_buy_skips_expensive_order():
     """opportunistic_buy 策略：单价超过阈值不接单。"""
     from app.services.autonomy_service import execute_strategies
@@ -328,7 +323,6 @@ async def test_opportunistic_buy_skips_expensive_order():
     assert stats["skipped"] >= 1
 
 
-@pytest.mark.skip(reason="策略系统 dormant（DEV-40）")
 async def test_opportunistic_buy_skips_multiple_orders():
     """opportunistic_buy 策略：多个订单都不满足条件，skipped 只计一次（DEV-BUG-18 回归测试）。"""
     from app.services.autonomy_service import execute_strategies
@@ -363,7 +357,6 @@ async def test_opportunistic_buy_skips_multiple_orders():
     assert stats["skipped"] == 1  # 只计一次，不是 3 次
 
 
-@pytest.mark.skip(reason="策略系统 dormant（DEV-40）")
 async def test_strategy_execution_isolates_failures():
     """策略执行异常隔离：一个 agent 的策略失败不影响其他 agent。"""
     from app.services.autonomy_service import execute_strategies
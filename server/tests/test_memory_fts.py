@@ -0,0 +1,150 @@
+"""
+记忆 FTS5 全文索引：触发器同步、/memories?keyword= 走索引、混合检索（BM25 + cosine）
+"""
+from unittest.mock import AsyncMock, patch
+
+import numpy as np
+import pytest
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import _migrate_memories_fts
+from app.models import Memory, MemoryType
+from app.services import memory_fts, vector_store
+from app.services.memory_admin_service import list_memories
+
+EMBED = "app.services.vector_store.embed"
+
+
+async def _fts_ids(db, match: str) -> set[int]:
+    rows = await db.execute(text("SELECT rowid FROM memories_fts WHERE memories_fts MATCH :m"), {"m": match})
+    return {r[0] for r in rows}
+
+
+def test_trigram_query_skips_punctuation_and_caps():
+    assert memory_fts.trigram_query("你好，世界") is None  # 每个 3 字窗口都跨了标点
+    assert memory_fts.trigram_query("长安城") == '"长安城"'
+    assert memory_fts.trigram_query("a" * 10 + "".join(chr(0x4e00 + i) for i in range(100)), limit=5).count("OR") == 4
+    assert memory_fts.phrase_query('say "hi"') == '"say ""hi"""'
+    assert memory_fts.phrase_query("长安") is None
+
+
+@pytest.mark.asyncio
+async def test_triggers_keep_index_in_sync(db):
+    mem = Memory(agent_id=1, memory_type=MemoryType.LONG, content="小明在长安城开了一家面馆")
+    db.add(mem)
+    await db.commit()
+    assert await _fts_ids(db, '"长安城"') == {mem.id}
+
+    mem.content = "小明搬去了洛阳"
+    await db.commit()
+    assert await _fts_ids(db, '"长安城"') == set()
+    assert await _fts_ids(db, '"洛阳"') == set()  # 2 字不够一个 trigram
+    assert await _fts_ids(db, '"去了洛阳"') == {mem.id}
+
+    await db.delete(mem)
+    await db.commit()
+    assert await _fts_ids(db, '"去了洛阳"') == set()
+
+
+@pytest.mark.asyncio
+async def test_migration_backfills_existing_rows(db):
+    await db.execute(text("DROP TABLE memories_fts"))
+    for name in ("ai", "ad", "au"):
+        await db.execute(text(f"DROP TRIGGER memories_fts_{name}"))
+    db.add(Memory(agent_id=1, memory_type=MemoryType.LONG, content="迁移前就存在的记忆"))
+    await db.commit()
+
+    await _migrate_memories_fts(await db.connection())
+    await db.commit()
+    assert len(await _fts_ids(db, '"就存在"')) == 1
+
+
+@pytest.mark.asyncio
+async def test_keyword_listing_matches_like(db):
+    contents = ["我喜欢吃面条", "今天面条很好吃", "Hello World", "hello there", "长安面馆", "完全无关"]
+    for i, c in enumerate(contents):
+        db.add(Memory(agent_id=1 + i % 2, memory_type=MemoryType.LONG, content=c))
+    await db.commit()
+
+    for kw, agent_id in [("面条", None), ("吃面条", None), ("HELLO", None), ("hello", 1), ("o W", None)]:
+        result = await list_memories(agent_id, None, kw, 1, 20, db)
+        expected = [c for i, c in enumerate(contents)
+                    if kw.lower() in c.lower() and (agent_id is None or 1 + i % 2 == agent_id)]
+        assert sorted(item["content"] for item in result["items"]) == sorted(expected), kw
+        assert result["total"] == len(expected)
+
+
+@pytest.mark.asyncio
+async def test_keyword_listing_uses_fts_index(db):
+    plan = (await db.execute(text(
+        "EXPLAIN QUERY PLAN SELECT rowid FROM memories_fts WHERE memories_fts MATCH '\"面条很\"'"
+    ))).all()
+    assert any("VIRTUAL TABLE INDEX" in row[-1] for row in plan)
+
+
+@pytest.mark.asyncio
+async def test_without_fts_table_falls_back_to_like(db):
+    await db.execute(text("DROP TABLE memories_fts"))
+    for name in ("ai", "ad", "au"):
+        await db.execute(text(f"DROP TRIGGER memories_fts_{name}"))
+    memory_fts._available.clear()
+    db.add(Memory(agent_id=1, memory_type=MemoryType.LONG, content="没有全文索引也能搜"))
+    await db.commit()
+    try:
+        result = await list_memories(None, None, "全文索引", 1, 20, db)
+        assert result["total"] == 1
+    finally:
+        memory_fts._available.clear()
+
+
+# ---------------------------------------------------------------------------
+# 混合检索
+# ---------------------------------------------------------------------------
+
+async def _hybrid_corpus(db):
+    """keyword 条目与查询字面重合但向量略远，semantic 条目向量最近"""
+    eye = np.eye(settings.embedding_dim, dtype=np.float32)
+    q = eye[0]
+    rows = {
+        "semantic": (0.8 * eye[0] + 0.6 * eye[1], "一些不相干的文字"),  # cos = 0.8
+        "keyword": (0.6 * eye[0] + 0.8 * eye[2], "小明欠了老王三百块钱"),  # cos = 0.6
+    }
+    for i in range(10):
+        rows[f"other{i}"] = (eye[3 + i], f"无关记忆{i}")  # cos = 0
+    ids = {}
+    for name, (vec, content) in rows.items():
+        mem = Memory(agent_id=1, memory_type=MemoryType.LONG, content=content, embedding=vec.tobytes())
+        db.add(mem)
+        await db.flush()
+        ids[name] = mem.id
+    await db.commit()
+    return q, ids
+
+
+@pytest.mark.asyncio
+async def test_hybrid_boosts_keyword_match(db, monkeypatch):
+    q, ids = await _hybrid_corpus(db)
+    with patch(EMBED, new_callable=AsyncMock, return_value=q.tobytes()):
+        monkeypatch.setattr(settings, "memory_search_keyword_weight", 0.0)
+        pure = await vector_store.search_memories("老王三百块", 1, top_k=2, db=db)
+        monkeypatch.setattr(settings, "memory_search_keyword_weight", 0.5)
+        hybrid = await vector_store.search_memories("老王三百块", 1, top_k=2, db=db)
+
+    assert pure[0]["memory_id"] == ids["semantic"]
+    assert hybrid[0]["memory_id"] == ids["keyword"]
+    # _distance 仍是余弦距离，不混入 BM25
+    by_id = {r["memory_id"]: r["_distance"] for r in pure}
+    assert hybrid[0]["_distance"] == pytest.approx(by_id[ids["keyword"]], abs=1e-5)
+
+
+@pytest.mark.asyncio
+async def test_hybrid_pulls_in_keyword_only_candidates(db, monkeypatch):
+    """向量 top-k 之外的关键词命中也能进入候选，并按精确余弦打分"""
+    q, ids = await _hybrid_corpus(db)
+    monkeypatch.setattr(settings, "vector_rerank_factor", 1)
+    monkeypatch.setattr(settings, "memory_search_keyword_weight", 0.9)
+    with patch(EMBED, new_callable=AsyncMock, return_value=q.tobytes()):
+        results = await vector_store.search_memories("老王三百块", 1, top_k=1, db=db)
+    assert results[0]["memory_id"] == ids["keyword"]
+    assert 0 < results[0]["_distance"] < 1
@@ -37,7 +37,7 @@ MEMORY_SEARCH = "app.services.agent_runner.memory_service.search"
 
 
 def _patch_llm_success(reply_text="测试回复"):
-    """返回一个 patch 好的 resolve_model + AsyncOpenAI，使 LLM 调用成功返回。"""
+    """返回一个 patch 好的 resolve_model + llm_client，使 LLM 调用成功返回。"""
     mock_choice = MagicMock()
     mock_choice.message.content = reply_text
     mock_response = MagicMock()
@@ -51,7 +51,7 @@ def _patch_llm_success(reply_text="测试回复"):
 
     return (
         patch(RESOLVE_MODEL, return_value=("http://fake", "sk-fake", "test-model")),
-        patch("app.services.agent_runner.AsyncOpenAI", return_value=mock_client),
+        patch("app.services.agent_runner.llm_client", return_value=mock_client),
     )
 
 
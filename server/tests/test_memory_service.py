@@ -54,11 +54,19 @@ async def test_search_increments_access_count(db):
     await db.refresh(mem)
 
     mock_results = [{"memory_id": mem.id, "text": "test", "_distance": 0.1}]
-    with patch(f"{VECTOR_STORE}.search_memories", new_callable=AsyncMock, return_value=mock_results):
+    with patch(f"{VECTOR_STORE}.search_memories", new_callable=AsyncMock, return_value=mock_results), \
+         patch.object(db, "commit", wraps=db.commit) as commit:
         results = await memory_service.search(1, "test", db=db)
+        await memory_service.search(1, "test", db=db)
 
     assert len(results) == 1
-    assert results[0].access_count == 1
+    commit.assert_not_awaited()  # 检索路径不写库，命中计数先在内存里累积
+    assert memory_service.pending_hits == 1
+
+    assert await memory_service.flush_access_counts(db) == 1
+    await db.refresh(mem)
+    assert mem.access_count == 2
+    assert memory_service.pending_hits == 0
 
 
 @pytest.mark.asyncio
@@ -71,11 +79,15 @@ async def test_promote_short_to_long(db):
 
     mock_results = [{"memory_id": mem.id, "text": "popular", "_distance": 0.1}]
     with patch(f"{VECTOR_STORE}.search_memories", new_callable=AsyncMock, return_value=mock_results):
-        results = await memory_service.search(1, "popular", db=db)
+        await memory_service.search(1, "popular", db=db)
+    with patch(f"{VECTOR_STORE}.set_memory_type") as set_type:
+        await memory_service.flush_access_counts(db)
 
-    assert results[0].access_count == 5
-    assert results[0].memory_type == MemoryType.LONG
-    assert results[0].expires_at is None
+    await db.refresh(mem)
+    assert mem.access_count == 5
+    assert mem.memory_type == MemoryType.LONG
+    assert mem.expires_at is None
+    set_type.assert_called_once_with(mem.id, MemoryType.LONG)
 
 
 @pytest.mark.asyncio
@@ -140,3 +152,131 @@ async def test_search_orphan_detection(db):
     # Only the real memory should be returned
     assert len(results) == 1
     assert results[0].id == mem.id
+
+
+@pytest.mark.asyncio
+async def test_search_many_bulk_updates_access_counts(db):
+    """批量检索：同一条公共记忆被多个 agent 命中按次数累加，写回与晋升一次提交完成"""
+    public = Memory(agent_id=None, memory_type=MemoryType.PUBLIC, content="公共", access_count=0)
+    hot = Memory(agent_id=1, memory_type=MemoryType.SHORT, content="hot", access_count=4,
+                 expires_at=datetime.now(timezone.utc) + timedelta(days=7))
+    cold = Memory(agent_id=2, memory_type=MemoryType.SHORT, content="cold", access_count=0,
+                  expires_at=datetime.now(timezone.utc) + timedelta(days=7))
+    db.add_all([public, hot, cold])
+    await db.commit()
+
+    mock_results = {
+        1: [{"memory_id": hot.id, "text": "hot", "_distance": 0.1},
+            {"memory_id": public.id, "text": "公共", "_distance": 0.2}],
+        2: [{"memory_id": public.id, "text": "公共", "_distance": 0.1},
+            {"memory_id": cold.id, "text": "cold", "_distance": 0.3}],
+        3: [],
+    }
+    with patch(f"{VECTOR_STORE}.search_memories_many", new_callable=AsyncMock, return_value=mock_results), \
+         patch.object(db, "commit", wraps=db.commit) as commit:
+        results = await memory_service.search_many({1: "q", 2: "q", 3: "q"}, db=db)
+        assert commit.await_count == 0
+        await memory_service.flush_access_counts(db)
+        assert commit.await_count == 1
+
+    assert [m.id for m in results[1]] == [hot.id, public.id]
+    assert [m.id for m in results[2]] == [public.id, cold.id]
+    assert results[3] == []
+    for mem in (public, hot, cold):
+        await db.refresh(mem)
+    assert public.access_count == 2
+    assert cold.access_count == 1 and cold.memory_type == MemoryType.SHORT
+    assert hot.access_count == 5 and hot.memory_type == MemoryType.LONG and hot.expires_at is None
+
+
+@pytest.mark.asyncio
+async def test_search_does_not_load_embedding_blob(db):
+    mem = Memory(agent_id=1, memory_type=MemoryType.LONG, content="blob", embedding=b"\x00" * 4096)
+    db.add(mem)
+    await db.commit()
+    db.expunge_all()
+
+    mock_results = [{"memory_id": mem.id, "text": "blob", "_distance": 0.1}]
+    with patch(f"{VECTOR_STORE}.search_memories", new_callable=AsyncMock, return_value=mock_results):
+        results = await memory_service.search(1, "blob", db=db)
+    assert "embedding" not in results[0].__dict__
+
+
+@pytest.mark.asyncio
+async def test_flush_failure_keeps_pending_hits(db):
+    memory_service._pending_hits.update([1, 1, 2])
+    with patch.object(db, "execute", new_callable=AsyncMock, side_effect=RuntimeError("locked")):
+        with pytest.raises(RuntimeError):
+            await memory_service.flush_access_counts(db)
+    assert memory_service._pending_hits == {1: 2, 2: 1}
+
+
+@pytest.mark.asyncio
+async def test_cleanup_flushes_promotions_first(db):
+    """过期前刚被频繁命中的短期记忆先晋升，不会被清理"""
+    mem = Memory(agent_id=1, memory_type=MemoryType.SHORT, content="rescued", access_count=4,
+                 expires_at=datetime.now(timezone.utc) - timedelta(hours=1))
+    db.add(mem)
+    await db.commit()
+    memory_service._pending_hits.update([mem.id])
+
+    assert await memory_service.cleanup_expired(db) == 0
+    await db.refresh(mem)
+    assert mem.memory_type == MemoryType.LONG
+
+
+@pytest.mark.asyncio
+async def test_cleanup_expired_in_chunks_cascades_references(db):
+    """分块集合删除：过期记忆连同 memory_references 一起删掉，每块单独提交"""
+    from sqlalchemy import func, select
+    from app.models import Agent, MemoryReference, Message
+
+    db.add(Agent(id=1, name="Alice", persona="test", model="test"))
+    msg = Message(agent_id=1, content="hi")
+    db.add(msg)
+    past = datetime.now(timezone.utc) - timedelta(days=1)
+    expired = [Memory(agent_id=1, memory_type=MemoryType.SHORT, content=f"old{i}", expires_at=past)
+               for i in range(25)]
+    keep = [
+        Memory(agent_id=1, memory_type=MemoryType.SHORT, content="fresh",
+               expires_at=datetime.now(timezone.utc) + timedelta(days=1)),
+        Memory(agent_id=1, memory_type=MemoryType.LONG, content="long", expires_at=past),
+    ]
+    db.add_all(expired + keep)
+    await db.flush()
+    db.add_all([MemoryReference(message_id=msg.id, memory_id=m.id) for m in expired[:3] + keep])
+    await db.commit()
+
+    with patch(f"{VECTOR_STORE}.remove_from_indexes") as remove, \
+         patch.object(db, "commit", wraps=db.commit) as commit:
+        count = await memory_service.cleanup_expired(db, chunk_size=10)
+
+    assert count == 25
+    assert commit.await_count == 3
+    assert sorted(i for c in remove.call_args_list for i in c.args[0]) == sorted(m.id for m in expired)
+    remaining = (await db.execute(select(Memory.content))).scalars().all()
+    assert sorted(remaining) == ["fresh", "long"]
+    refs = (await db.execute(select(func.count(MemoryReference.id)))).scalar()
+    assert refs == 2
+
+
+@pytest.mark.asyncio
+async def test_cleanup_query_uses_type_expires_index(db):
+    from sqlalchemy import text
+    plan = (await db.execute(text(
+        "EXPLAIN QUERY PLAN SELECT id FROM memories WHERE memory_type = 'short' AND expires_at < '2030-01-01'"
+    ))).all()
+    assert any("ix_memories_type_expires" in row[-1] for row in plan)
+
+
+@pytest.mark.asyncio
+async def test_migration_adds_memory_indexes(db):
+    from sqlalchemy import text
+    from app.core.database import _migrate_memory_indexes
+
+    await db.execute(text("DROP INDEX ix_memories_type_expires"))
+    await db.execute(text("DROP INDEX ix_memory_references_memory_id"))
+    await _migrate_memory_indexes(await db.connection())
+    await _migrate_memory_indexes(await db.connection())  # 幂等
+    names = (await db.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))).scalars().all()
+    assert {"ix_memories_type_expires", "ix_memory_references_memory_id"} <= set(names)
@@ -81,7 +81,7 @@ async def test_llm_summarize_success():
     )
 
     with patch(f"{CONFIG}.MODEL_REGISTRY", {"memory-summary-model": entry}), \
-         patch(f"{CHAT}.AsyncOpenAI", return_value=mock_client):
+         patch(f"{CHAT}.llm_client", return_value=mock_client):
         result = await _llm_summarize("张三: 我喜欢吃苹果\n李四: 明天我带水果来")
 
     assert result is not None
@@ -103,7 +103,7 @@ async def test_llm_summarize_respects_100_char_limit():
     )
 
     with patch(f"{CONFIG}.MODEL_REGISTRY", {"memory-summary-model": entry}), \
-         patch(f"{CHAT}.AsyncOpenAI", return_value=mock_client):
+         patch(f"{CHAT}.llm_client", return_value=mock_client):
         result = await _llm_summarize("测试对话")
 
     assert result is not None
@@ -123,7 +123,7 @@ async def test_llm_summarize_no_useful_memory():
     )
 
     with patch(f"{CONFIG}.MODEL_REGISTRY", {"memory-summary-model": entry}), \
-         patch(f"{CHAT}.AsyncOpenAI", return_value=mock_client):
+         patch(f"{CHAT}.llm_client", return_value=mock_client):
         result = await _llm_summarize("你好\n你好啊")
 
     assert result is None
@@ -158,7 +158,7 @@ async def test_llm_summarize_primary_timeout_fallback_to_secondary():
         return mock_client_ok
 
     with patch(f"{CONFIG}.MODEL_REGISTRY", {"memory-summary-model": entry}), \
-         patch(f"{CHAT}.AsyncOpenAI", side_effect=mock_openai_factory), \
+         patch(f"{CHAT}.llm_client", side_effect=mock_openai_factory), \
          patch(f"{CHAT}.MEMORY_SUMMARY_TIMEOUT", 0.1):  # 缩短超时加速测试
         result = await _llm_summarize("测试对话")
 
@@ -178,7 +178,7 @@ async def test_llm_summarize_all_providers_fail_truncation_fallback():
     mock_client = _make_async_client(create_side_effect=Exception("API error"))
 
     with patch(f"{CONFIG}.MODEL_REGISTRY", {"memory-summary-model": entry}), \
-         patch(f"{CHAT}.AsyncOpenAI", return_value=mock_client):
+         patch(f"{CHAT}.llm_client", return_value=mock_client):
         result = await _llm_summarize("测试对话内容")
 
     assert result is not None
@@ -208,7 +208,7 @@ async def test_llm_summarize_validation_fail_tries_next():
         )
 
     with patch(f"{CONFIG}.MODEL_REGISTRY", {"memory-summary-model": entry}), \
-         patch(f"{CHAT}.AsyncOpenAI", side_effect=mock_openai_factory):
+         patch(f"{CHAT}.llm_client", side_effect=mock_openai_factory):
         result = await _llm_summarize("测试对话")
 
     assert result is not None
@@ -238,7 +238,7 @@ async def test_llm_summarize_validation_fail_short_text():
         )
 
     with patch(f"{CONFIG}.MODEL_REGISTRY", {"memory-summary-model": entry}), \
-         patch(f"{CHAT}.AsyncOpenAI", side_effect=mock_openai_factory):
+         patch(f"{CHAT}.llm_client", side_effect=mock_openai_factory):
         result = await _llm_summarize("测试对话")
 
     assert result is not None
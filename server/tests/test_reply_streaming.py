@@ -0,0 +1,239 @@
+"""
+流式回复：AgentRunner 流式生成、工具调用轮次中途重置、message_delta 只推给 ?stream=1 的连接、
+结束后 new_message 带 stream_id 替换临时消息
+"""
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from openai.types.chat import ChatCompletionChunk
+
+from app.api import chat
+from app.core.config import settings
+from app.services.agent_runner import AgentRunner, _collect_stream
+from app.services.broadcast_bus import LocalBus
+from app.services.broadcast_hub import BroadcastHub
+
+
+class FakeWS:
+    def __init__(self):
+        self.received: list[str] = []
+
+    async def send_text(self, text: str):
+        self.received.append(text)
+
+
+async def _drain(hub: BroadcastHub, clients):
+    while any(hub._conns[id(ws)].depth for ws in clients):
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(0)
+
+
+def _chunk(content=None, tool_calls=None, finish_reason=None, usage=None, reasoning=None):
+    delta = {"role": "assistant"}
+    if content is not None:
+        delta["content"] = content
+    if tool_calls is not None:
+        delta["tool_calls"] = tool_calls
+    if reasoning is not None:
+        delta["reasoning"] = reasoning
+    return ChatCompletionChunk.model_validate({
+        "id": "c1", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if usage is None else [],
+        "usage": usage,
+    })
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.closed = True
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+TOOL_CALL_CHUNKS = [
+    _chunk(content="我查一下"),
+    _chunk(tool_calls=[{"index": 0, "id": "call_1", "type": "function",
+                        "function": {"name": "check_balance", "arguments": '{"agent'}}]),
+    _chunk(tool_calls=[{"index": 0, "function": {"arguments": '_id": 1}'}}], finish_reason="tool_calls"),
+]
+REPLY_CHUNKS = [
+    _chunk(content="你有"),
+    _chunk(content=" 100 信用点"),
+    _chunk(finish_reason="stop"),
+    _chunk(usage={"prompt_tokens": 10, "completion_tokens": 4, "total_tokens": 14}),
+]
+
+
+@pytest.mark.asyncio
+async def test_collect_stream_rebuilds_completion():
+    emitted = []
+
+    async def emit(text):
+        emitted.append(text)
+
+    stream = FakeStream([_chunk(reasoning="想想"), *TOOL_CALL_CHUNKS])
+    response = await _collect_stream(stream, emit)
+    assert stream.closed
+    assert emitted == ["我查一下"]
+    msg = response.choices[0].message
+    assert msg.content == "我查一下" and msg.reasoning == "想想"
+    assert msg.tool_calls[0].id == "call_1"
+    assert msg.tool_calls[0].function.name == "check_balance"
+    assert json.loads(msg.tool_calls[0].function.arguments) == {"agent_id": 1}
+    assert response.choices[0].finish_reason == "tool_calls"
+
+    response = await _collect_stream(FakeStream(REPLY_CHUNKS), emit)
+    assert response.choices[0].message.content == "你有 100 信用点"
+    assert response.usage.total_tokens == 14
+
+
+@pytest.mark.asyncio
+async def test_generate_reply_streams_through_tool_round():
+    streams = [FakeStream(TOOL_CALL_CHUNKS), FakeStream(REPLY_CHUNKS)]
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs)
+        return streams[len(calls) - 1]
+
+    client = MagicMock()
+    client.chat.completions.create = create
+    deltas = []
+
+    async def on_delta(text, reset):
+        deltas.append((text, reset))
+
+    with patch("app.services.agent_runner.resolve_model", return_value=("http://x", "k", "m")), \
+         patch("app.services.agent_runner.llm_client", return_value=client), \
+         patch("app.services.tool_registry.tool_registry.execute", new_callable=AsyncMock,
+               return_value={"credits": 100}):
+        reply, usage, _ = await AgentRunner(1, "Alice", "p", "m").generate_reply(
+            [{"name": "Bob", "content": "我还有多少钱"}], on_delta=on_delta,
+        )
+
+    assert reply == "你有 100 信用点"
+    assert usage["total_tokens"] == 14
+    assert all(c["stream"] is True and c["stream_options"] == {"include_usage": True} for c in calls)
+    assert calls[1]["messages"][-1]["role"] == "tool"
+    # 第二轮的第一段增量带 reset，客户端丢掉第一轮的“我查一下”
+    assert deltas == [("我查一下", False), ("你有", True), (" 100 信用点", False)]
+
+
+@pytest.mark.asyncio
+async def test_generate_reply_without_on_delta_does_not_stream():
+    response = MagicMock()
+    response.choices = [MagicMock()]
+    response.choices[0].message.content = "好的"
+    response.choices[0].message.tool_calls = None
+    client = MagicMock()
+    client.chat.completions.create = AsyncMock(return_value=response)
+    with patch("app.services.agent_runner.resolve_model", return_value=("http://x", "k", "m")), \
+         patch("app.services.agent_runner.llm_client", return_value=client):
+        reply, _, _ = await AgentRunner(1, "Alice", "p", "m").generate_reply([{"name": "Bob", "content": "hi"}])
+    assert reply == "好的"
+    assert "stream" not in client.chat.completions.create.call_args.kwargs
+
+
+@pytest.mark.asyncio
+async def test_hub_channel_only_reaches_subscribers():
+    hub = BroadcastHub()
+    plain, streaming = FakeWS(), FakeWS()
+    hub.register(0, plain)
+    hub.register(0, streaming, channels=("message_delta",))
+    assert hub.publish("delta", channel="message_delta") == 1
+    assert hub.publish("msg") == 2
+    await _drain(hub, [plain, streaming])
+    assert plain.received == ["msg"]
+    assert streaming.received == ["delta", "msg"]
+    for ws in (plain, streaming):
+        hub.unregister(ws)
+
+
+@pytest.mark.asyncio
+async def test_reply_stream_coalesces_and_aborts(monkeypatch):
+    monkeypatch.setattr(settings, "chat_stream_flush_ms", 10_000)
+    sent = []
+    with patch.object(chat, "broadcast", new=AsyncMock(side_effect=lambda d, **kw: sent.append((d, kw)))):
+        stream = chat.ReplyStream(1, "Alice")
+        await stream.push("你")  # 第一段立即推送（首字延迟）
+        await stream.push("好")
+        await stream.push("呀")
+        await stream.flush()
+        await stream.push("重来", reset=True)
+        await stream.flush()
+        await stream.abort()
+
+    frames = [d["data"] for d, _ in sent]
+    assert all(d["type"] == "message_delta" for d, _ in sent)
+    assert all(kw == {"channel": "message_delta"} for _, kw in sent)
+    assert [f.get("delta") for f in frames[:3]] == ["你", "好呀", "重来"]
+    assert frames[2]["reset"] is True and "reset" not in frames[1]
+    assert [f["seq"] for f in frames] == [0, 1, 2, 3]
+    assert frames[3]["aborted"] is True and frames[3]["stream_id"] == stream.id
+
+
+@pytest.mark.asyncio
+async def test_handle_wakeup_streams_then_sends_final_message(monkeypatch):
+    monkeypatch.setattr(settings, "chat_stream_flush_ms", 0)
+    hub = BroadcastHub()
+    plain, streaming = FakeWS(), FakeWS()
+    hub.register(0, plain)
+    hub.register(0, streaming, channels=("message_delta",))
+
+    async def generate_reply(history, db=None, on_delta=None):
+        await on_delta("你好", False)
+        await on_delta("，Bob", False)
+        return "你好，Bob", None, []
+
+    runner = MagicMock()
+    runner.generate_reply = generate_reply
+    agent = MagicMock(id=1, persona="p", model="m", personality_json=None)
+    agent.name = "Alice"
+    db = MagicMock()
+    db.get = AsyncMock(return_value=agent)
+    db.execute = AsyncMock(return_value=MagicMock(scalars=lambda: MagicMock(all=lambda: [])))
+    db.commit = AsyncMock()
+    session = MagicMock()
+    session.__aenter__ = AsyncMock(return_value=db)
+    session.__aexit__ = AsyncMock(return_value=False)
+
+    async def send_agent_message(agent_id, agent_name, content, db, stream_id=None):
+        await chat.broadcast({"type": "new_message", "data": {"id": 5, "content": content, "stream_id": stream_id}})
+        return MagicMock(id=5)
+
+    with patch.object(chat, "broadcast_bus", LocalBus(hub)), \
+         patch.object(chat, "async_session", return_value=session), \
+         patch.object(chat, "wakeup_service") as wakeup, \
+         patch.object(chat, "runner_manager") as rm, \
+         patch.object(chat, "economy_service") as econ, \
+         patch.object(chat, "send_agent_message", side_effect=send_agent_message), \
+         patch.object(chat, "_extract_memory", new_callable=AsyncMock):
+        wakeup.process = AsyncMock(return_value=[1])
+        rm.get_or_create = MagicMock(return_value=runner)
+        econ.check_quota = AsyncMock(return_value=MagicMock(allowed=True))
+        econ.deduct_quota = AsyncMock()
+        await chat.handle_wakeup(MagicMock())
+        await _drain(hub, [plain, streaming])
+
+    frames = [json.loads(t) for t in streaming.received]
+    assert [f["type"] for f in frames] == ["message_delta", "message_delta", "new_message"]
+    stream_id = frames[0]["data"]["stream_id"]
+    assert "".join(f["data"]["delta"] for f in frames[:2]) == "你好，Bob"
+    assert frames[2]["data"]["stream_id"] == stream_id
+    assert [json.loads(t)["type"] for t in plain.received] == ["new_message"]
+    for ws in (plain, streaming):
+        hub.unregister(ws)
@@ -3,7 +3,7 @@ import pytest_asyncio
 from sqlalchemy import select
 
 from app.models import Agent, Memory, MemoryType
-from app.services.scheduler import daily_grant, daily_memory_cleanup, DAILY_CREDIT_GRANT, HUMAN_ID
+from app.services.scheduler import daily_grant, daily_memory_cleanup, flush_memory_access, DAILY_CREDIT_GRANT, HUMAN_ID
 from datetime import datetime, timedelta, timezone
 from unittest.mock import AsyncMock, patch
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
@@ -71,3 +71,19 @@ async def test_daily_memory_cleanup(db_and_maker):
         count = await daily_memory_cleanup(db_session_maker=maker)
 
     assert count == 1
+
+
+@pytest.mark.asyncio
+async def test_flush_memory_access(db_and_maker):
+    from app.services.memory_service import memory_service
+    db, maker = db_and_maker
+    mem = Memory(agent_id=1, memory_type=MemoryType.LONG, content="hit", access_count=1)
+    db.add(mem)
+    await db.commit()
+
+    assert await flush_memory_access(db_session_maker=maker) == 0  # 无待写回计数时不开会话
+    memory_service._pending_hits.update([mem.id, mem.id, mem.id])
+    assert await flush_memory_access(db_session_maker=maker) == 1
+
+    async with maker() as check_db:
+        assert (await check_db.get(Memory, mem.id)).access_count == 4
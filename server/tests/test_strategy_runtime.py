@@ -0,0 +1,200 @@
+"""
+策略自动机按事件触发：挂单 / 成交 / 生产 / 打卡提交后由后台任务执行，
+低价买入按 (资源, 价格上限) 索引匹配，策略持久化到 agent_strategies 表
+"""
+from unittest.mock import AsyncMock, patch
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import select
+
+from app.core.database import Base, engine, async_session, unit_of_work
+from app.models import Agent, AgentResource, AgentStrategy, Building, BuildingWorker, CheckIn, Job, MarketOrder
+from app.services import strategy_engine
+from app.services.market_service import create_order
+from app.services.strategy_engine import (
+    Strategy, StrategyType, delete_strategies, get_strategies, keep_working_agents,
+    load_strategies, match_buyers, save_strategies, update_strategies,
+)
+from app.services.strategy_runtime import strategy_runtime
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def setup_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with async_session() as db:
+        db.add_all([
+            Agent(id=0, name="Human", persona="human", model="none"),
+            Agent(id=1, name="Alice", persona="面包师", model="test", credits=50),
+            Agent(id=2, name="Bob", persona="磨坊主", model="test", credits=50),
+            Job(id=1, title="矿工", daily_reward=10, max_workers=5),
+            Building(id=1, name="小麦田", building_type="farm", city="长安", max_workers=3),
+            AgentResource(agent_id=1, resource_type="wheat", quantity=100),
+            AgentResource(agent_id=2, resource_type="flour", quantity=50),
+        ])
+        await db.commit()
+    with patch("app.services.autonomy_service._broadcast_action", new_callable=AsyncMock), \
+         patch("app.services.market_service._broadcast_market_event", new_callable=AsyncMock), \
+         patch("app.services.city_service._broadcast_city_event", new_callable=AsyncMock):
+        yield
+        await strategy_runtime.drain()
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+
+
+def _buy(agent_id, price_below, stop=None, resource="flour"):
+    return Strategy(agent_id=agent_id, strategy=StrategyType.OPPORTUNISTIC_BUY,
+                    resource=resource, price_below=price_below, stop_when_amount=stop)
+
+
+async def _quantity(agent_id, resource):
+    async with async_session() as db:
+        return await db.scalar(select(AgentResource.quantity).where(
+            AgentResource.agent_id == agent_id, AgentResource.resource_type == resource)) or 0
+
+
+async def _sell_flour(amount, price):
+    async with async_session() as db:
+        res = await create_order(2, "flour", amount, "wheat", amount * price, db=db)
+    assert res["ok"]
+    return res["order_id"]
+
+
+async def test_index_matches_by_resource_and_price():
+    update_strategies(1, [_buy(1, 1.0)])
+    update_strategies(2, [_buy(2, 2.0), _buy(2, 0.5, resource="wheat")])
+    update_strategies(3, [Strategy(agent_id=3, strategy=StrategyType.KEEP_WORKING, building_id=1)])
+
+    assert match_buyers("flour", 0.8) == [2, 1]  # 出价上限高的在前
+    assert match_buyers("flour", 1.5) == [2]
+    assert match_buyers("flour", 2.5) == []
+    assert match_buyers("wheat", 0.5) == [2]
+    assert keep_working_agents(1) == [3]
+
+    update_strategies(2, [])
+    assert match_buyers("flour", 0.8) == [1]
+    assert match_buyers("wheat", 0.1) == []
+
+
+async def test_strategies_persist_across_restart():
+    async with async_session() as db:
+        await save_strategies(1, [_buy(1, 1.0, stop=20)], db)
+        await save_strategies(2, [Strategy(agent_id=2, strategy=StrategyType.KEEP_WORKING, building_id=1,
+                                           stop_when_resource="wheat", stop_when_amount=50)], db)
+    strategy_engine.clear_strategies()  # 模拟重启
+
+    async with async_session() as db:
+        await load_strategies(db)
+    assert get_strategies(1) == [_buy(1, 1.0, stop=20)]
+    assert match_buyers("flour", 1.0) == [1]
+    assert keep_working_agents(1) == [2]
+
+    async with async_session() as db:
+        await delete_strategies(1, db)
+        assert (await db.execute(select(AgentStrategy.agent_id))).scalars().all() == [2]
+    assert get_strategies(1) == []
+
+
+async def test_new_cheap_order_is_bought_after_commit():
+    update_strategies(1, [_buy(1, 1.0)])
+    cheap = await _sell_flour(10, 0.8)
+    expensive = await _sell_flour(10, 1.5)
+    await strategy_runtime.drain()
+
+    async with async_session() as db:
+        assert (await db.get(MarketOrder, cheap)).status == "filled"
+        assert (await db.get(MarketOrder, expensive)).status == "open"
+    assert await _quantity(1, "flour") == 10
+    assert strategy_runtime.stats["executed"] == 1
+    assert strategy_runtime.stats["latency_ms"] < 1000
+
+
+async def test_buys_until_stop_amount():
+    update_strategies(1, [_buy(1, 1.0, stop=15)])
+    first = await _sell_flour(10, 0.9)
+    await strategy_runtime.drain()
+    second = await _sell_flour(10, 0.6)
+    await strategy_runtime.drain()
+
+    assert await _quantity(1, "flour") == 15
+    async with async_session() as db:
+        assert (await db.get(MarketOrder, first)).status == "filled"
+        assert (await db.get(MarketOrder, second)).status == "partial"
+    assert strategy_runtime.stats["completed"] >= 1
+
+
+async def test_setting_strategy_buys_existing_order():
+    from app.api.agents import set_agent_strategies
+
+    order_id = await _sell_flour(5, 0.5)
+    async with async_session() as db:
+        await set_agent_strategies(1, [_buy(1, 1.0).model_dump()], db)
+    await strategy_runtime.drain()
+
+    async with async_session() as db:
+        assert (await db.get(MarketOrder, order_id)).status == "filled"
+        assert (await db.execute(select(AgentStrategy))).scalars().one().price_below == 1.0
+
+
+async def test_production_drives_keep_working_checkin():
+    from app.services.city_service import production_tick
+
+    async with async_session() as db:
+        db.add(BuildingWorker(building_id=1, agent_id=1))
+        await db.commit()
+    update_strategies(1, [Strategy(agent_id=1, strategy=StrategyType.KEEP_WORKING, building_id=1,
+                                   stop_when_resource="wheat", stop_when_amount=200)])
+
+    async with async_session() as db:
+        await production_tick("长安", db)
+    await strategy_runtime.drain()
+
+    async with async_session() as db:
+        checkins = (await db.execute(select(CheckIn.agent_id))).scalars().all()
+    assert checkins == [1]
+    assert strategy_runtime.stats["executed"] == 1
+
+
+async def test_rollback_and_no_strategies_publish_nothing():
+    update_strategies(1, [_buy(1, 1.0)])
+    async with async_session() as db:
+        await create_order(2, "flour", 10, "wheat", 1, db=db)  # 内部已提交
+        db.add(MarketOrder(seller_id=2, sell_type="flour", sell_amount=1, buy_type="wheat", buy_amount=0.1,
+                           remain_sell_amount=1, remain_buy_amount=0.1, status="open"))
+        await db.flush()
+        await db.rollback()
+    await strategy_runtime.drain()
+    assert strategy_runtime.stats["events"] == 3  # 挂单 + 成交后买卖双方的持仓变化；回滚的挂单不算
+
+    strategy_engine.clear_strategies()
+    events = strategy_runtime.stats["events"]
+    await _sell_flour(1, 0.1)
+    await strategy_runtime.drain()
+    assert strategy_runtime.stats["events"] == events
+
+
+async def test_rolled_back_savepoint_drops_its_events():
+    update_strategies(1, [_buy(1, 1.0)])
+
+    def order(price):
+        return MarketOrder(seller_id=2, sell_type="flour", sell_amount=1, buy_type="wheat", buy_amount=price,
+                           remain_sell_amount=1, remain_buy_amount=price, status="open")
+
+    async with async_session() as db:
+        async with unit_of_work(db) as uow:
+            await uow.begin_action()
+            db.add(order(5.0))  # 太贵，不会被买走
+            await db.flush()
+            await uow.end_action(True)
+            await uow.begin_action()
+            db.add(order(0.5))
+            await db.flush()
+            await uow.end_action(False)  # 这条 action 回滚，它的挂单事件不该发出
+            await uow.commit()
+    await strategy_runtime.drain()
+    assert strategy_runtime.stats["events"] == 1
+    assert strategy_runtime.stats["executed"] == 0
@@ -0,0 +1,414 @@
+"""
+向量检索 IVF 索引：召回率对比暴力扫描 + 常驻矩阵随 upsert / cleanup / 管理编辑同步
+"""
+import threading
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, call, patch
+
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.models import Memory, MemoryType
+from app.services import vector_store
+from app.services.ann_index import EmbeddingMatrix, IVFIndex, normalize_rows
+from app.services.memory_service import memory_service
+
+EMBED = "app.services.vector_store.embed"
+
+
+def _clustered(n: int, dim: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """带簇结构的合成向量（真实 embedding 也是成簇分布的）"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    return centers[labels] + 0.35 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def _brute_force(vecs: np.ndarray, q: np.ndarray, k: int) -> np.ndarray:
+    sims = normalize_rows(vecs) @ normalize_rows(q[None])[0]
+    return np.argsort(-sims)[:k]
+
+
+# ---------------------------------------------------------------------------
+# IVFIndex 单元测试
+# ---------------------------------------------------------------------------
+
+def test_small_index_is_exact():
+    """未达到训练阈值时索引就是精确扫描"""
+    vecs = _clustered(500, 32)
+    index = IVFIndex(32, min_train=2048)
+    index.add(np.arange(500), vecs)
+    assert not index.is_trained
+
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        q = rng.standard_normal(32).astype(np.float32)
+        ids, _ = index.search(q, 10)
+        assert ids.tolist() == _brute_force(vecs, q, 10).tolist()
+
+
+def test_recall_at_k_against_brute_force():
+    """训练后 recall@10 ≥ 0.9"""
+    n, dim, k = 20000, 64, 10
+    vecs = _clustered(n, dim)
+    index = IVFIndex(dim, nprobe=8, min_train=2048)
+    index.add(np.arange(n), vecs)
+    assert index.is_trained
+
+    queries = _clustered(100, dim, seed=7)
+    hits = 0
+    for q in queries:
+        ids, _ = index.search(q, k)
+        hits += len(set(ids.tolist()) & set(_brute_force(vecs, q, k).tolist()))
+    recall = hits / (len(queries) * k)
+    assert recall >= 0.9, f"recall@{k}={recall:.3f}"
+
+
+def test_add_replace_and_remove():
+    index = IVFIndex(8)
+    index.add([1, 2], np.eye(8, dtype=np.float32)[:2])
+    index.add([1], np.eye(8, dtype=np.float32)[3:4])  # 同 id 覆盖
+    assert len(index) == 2
+    ids, sims = index.search(np.eye(8, dtype=np.float32)[3], 1)
+    assert ids.tolist() == [1] and sims[0] == pytest.approx(1.0)
+
+    assert index.remove([1, 99]) == 1
+    assert 1 not in index and 2 in index
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    vecs = _clustered(3000, 16)
+    index = IVFIndex(16, min_train=1000)
+    index.add(np.arange(3000), vecs)
+    path = tmp_path / "idx.npz"
+    index.save(path)
+
+    loaded = IVFIndex.load(path, 16, min_train=1000)
+    assert loaded is not None and loaded.is_trained
+    assert sorted(loaded.ids().tolist()) == list(range(3000))
+    q = vecs[42]
+    assert loaded.search(q, 1)[0].tolist() == index.search(q, 1)[0].tolist()
+    assert IVFIndex.load(path, 32) is None  # 维度不符视为无效
+
+
+# ---------------------------------------------------------------------------
+# vector_store 集成：默认走索引，结果与暴力扫描一致
+# ---------------------------------------------------------------------------
+
+def _blob(v: np.ndarray) -> bytes:
+    return np.asarray(v, dtype=np.float32).tobytes()
+
+
+async def _seed(db, n_agent=40, n_public=10, agent_id=1):
+    rng = np.random.default_rng(0)
+    dim = settings.embedding_dim
+    vecs = {}
+    for i in range(n_agent + n_public):
+        v = rng.standard_normal(dim).astype(np.float32)
+        mem = Memory(
+            agent_id=agent_id if i < n_agent else None,
+            memory_type=MemoryType.LONG if i < n_agent else MemoryType.PUBLIC,
+            content=f"m{i}", embedding=_blob(v),
+        )
+        db.add(mem)
+        await db.flush()
+        vecs[mem.id] = v
+    # 其他 agent 的记忆不应被搜到
+    db.add(Memory(agent_id=agent_id + 1, memory_type=MemoryType.LONG, content="other",
+                  embedding=_blob(rng.standard_normal(dim))))
+    await db.commit()
+    return vecs
+
+
+@pytest.mark.asyncio
+async def test_search_matches_exact_scan(db, monkeypatch):
+    vecs = await _seed(db)
+    q = np.random.default_rng(5).standard_normal(settings.embedding_dim).astype(np.float32)
+
+    with patch(EMBED, new_callable=AsyncMock, return_value=_blob(q)):
+        ann = await vector_store.search_memories("q", 1, top_k=5, db=db)
+        monkeypatch.setattr(settings, "vector_search_mode", "exact")
+        exact = await vector_store.search_memories("q", 1, top_k=5, db=db)
+
+    assert [r["memory_id"] for r in ann] == [r["memory_id"] for r in exact]
+    for a, e in zip(ann, exact):
+        assert a["text"] == e["text"]
+        assert a["_distance"] == pytest.approx(e["_distance"], abs=1e-5)
+
+
+@pytest.mark.asyncio
+async def test_upsert_updates_resident_index(db):
+    await _seed(db, n_agent=5, n_public=0)
+    target = np.zeros(settings.embedding_dim, dtype=np.float32)
+    target[0] = 1.0
+
+    with patch(EMBED, new_callable=AsyncMock, return_value=_blob(target)):
+        await vector_store.search_memories("warm up", 1, db=db)  # 建立常驻索引
+        mem = await memory_service.save_memory(1, "fresh", MemoryType.LONG, db)
+        results = await vector_store.search_memories("q", 1, top_k=1, db=db)
+
+    assert results[0]["memory_id"] == mem.id
+    assert results[0]["_distance"] == pytest.approx(0.0, abs=1e-5)
+
+
+@pytest.mark.asyncio
+async def test_cleanup_expired_removes_from_index(db):
+    target = np.zeros(settings.embedding_dim, dtype=np.float32)
+    target[0] = 1.0
+    expired = Memory(agent_id=1, memory_type=MemoryType.SHORT, content="old",
+                     embedding=_blob(target),
+                     expires_at=datetime.now(timezone.utc) - timedelta(days=1))
+    db.add(expired)
+    await db.commit()
+
+    with patch(EMBED, new_callable=AsyncMock, return_value=_blob(target)):
+        before = await vector_store.search_memories("q", 1, db=db)
+        assert [r["memory_id"] for r in before] == [expired.id]
+        await memory_service.cleanup_expired(db)
+        index = await vector_store._get_index(1, db)
+        assert expired.id not in index
+        assert await vector_store.search_memories("q", 1, db=db) == []
+
+
+@pytest.mark.asyncio
+async def test_persisted_index_is_reconciled(db):
+    """落盘的索引重新加载时与表对齐（补缺失、删多余）"""
+    vecs = await _seed(db, n_agent=6, n_public=0)
+    index = await vector_store._get_index(1, db)
+    index.add([999999], np.ones(settings.embedding_dim, dtype=np.float32))  # 表里不存在
+    vector_store._dirty.add(1)
+    vector_store.save_vector_indexes()
+    vector_store.reset_vector_indexes()
+
+    reloaded = await vector_store._get_index(1, db)
+    assert sorted(reloaded.ids().tolist()) == sorted(vecs)
+
+
+@pytest.mark.asyncio
+async def test_persisted_index_picks_up_type_changes(db):
+    """不在内存里时改的 memory_type（晋升 / 管理编辑）在重新加载时同步到标签"""
+    vecs = await _seed(db, n_agent=3, n_public=0)
+    first = min(vecs)
+    await vector_store._get_index(1, db)
+    vector_store._dirty.add(1)
+    vector_store.save_vector_indexes()
+    vector_store.reset_vector_indexes()
+
+    mem = await db.get(Memory, first)
+    mem.memory_type = MemoryType.SHORT
+    await db.commit()
+    vector_store.set_memory_type(first, MemoryType.SHORT.value)  # 不常驻，什么也不改
+
+    reloaded = await vector_store._get_index(1, db)
+    assert reloaded.tag_of(first) == vector_store._TYPE_CODES["short"]
+    assert all(reloaded.tag_of(mid) == vector_store._TYPE_CODES["long"] for mid in vecs if mid != first)
+    assert 1 in vector_store._dirty  # 修正后的标签下次落盘
+
+
+@pytest.mark.asyncio
+async def test_index_changes_are_announced_to_peers_after_commit(db):
+    """多 worker：新增向量在提交之后才通知其他 worker，删除 / 改类型在调用时（调用方已提交）通知"""
+    bus = MagicMock(backend="unix")
+    target = np.ones(settings.embedding_dim, dtype=np.float32)
+    with patch.object(vector_store, "broadcast_bus", bus), \
+         patch(EMBED, new_callable=AsyncMock, return_value=_blob(target)):
+        mem = Memory(agent_id=1, memory_type=MemoryType.LONG, content="x")
+        db.add(mem)
+        await db.flush()
+        await vector_store.upsert_memory(mem.id, 1, "x", db)
+        bus.notify_peers.assert_not_called()
+        await db.commit()
+        bus.notify_peers.assert_called_once_with("vector_index", {"added": [[1, mem.id]]})
+
+        vector_store.set_memory_type(mem.id, MemoryType.SHORT)
+        vector_store.remove_from_indexes([mem.id])
+    assert bus.notify_peers.call_args_list[1:] == [
+        call("vector_index", {"types": [[mem.id, "short"]]}),
+        call("vector_index", {"removed": [mem.id]}),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_peer_changes_patch_resident_index(db):
+    """另一个 worker 写入 / 改类型 / 删除的记忆，本 worker 的常驻索引按通知同步"""
+    vecs = await _seed(db, n_agent=3, n_public=0)
+    index = await vector_store._get_index(1, db)
+    first = min(vecs)
+
+    target = np.zeros(settings.embedding_dim, dtype=np.float32)
+    target[0] = 1.0
+    other = Memory(agent_id=1, memory_type=MemoryType.LONG, content="from peer", embedding=_blob(target))
+    db.add(other)  # 模拟另一个 worker 直接写库，本 worker 的索引没有跟着变
+    await db.commit()
+    assert other.id not in index
+
+    vector_store._on_peer_change({"added": [[1, other.id]], "types": [[first, "short"]]})
+    vector_store._on_peer_change({"removed": [max(vecs)]})
+    assert index.tag_of(first) == vector_store._TYPE_CODES["short"]
+    assert max(vecs) not in index
+
+    with patch(EMBED, new_callable=AsyncMock, return_value=_blob(target)):
+        results = await vector_store.search_memories("q", 1, top_k=1, db=db)
+    assert results[0]["memory_id"] == other.id
+
+
+# ---------------------------------------------------------------------------
+# 常驻矩阵缓存：增量追加 / 精确失效 / LRU
+# ---------------------------------------------------------------------------
+
+def test_embedding_matrix_append_is_amortized():
+    """逐条追加只在容量翻倍时重新分配"""
+    m = EmbeddingMatrix(4)
+    reallocs, last_buf = 0, None
+    for i in range(1000):
+        m.append(np.array([i]), np.ones((1, 4), dtype=np.float32) * i, np.zeros(1, dtype=np.int8))
+        if m._vecs is not last_buf:
+            reallocs += 1
+            last_buf = m._vecs
+    assert len(m) == 1000
+    assert reallocs <= 6  # 64 → 128 → … → 1024
+    assert m.vecs.flags["C_CONTIGUOUS"]
+
+
+def test_embedding_matrix_remove_keeps_rows_dense():
+    m = EmbeddingMatrix(2)
+    m.append(np.arange(5), np.arange(10, dtype=np.float32).reshape(5, 2), np.arange(5, dtype=np.int8))
+    m.remove([1, 42])
+    assert len(m) == 4
+    assert sorted(m.ids.tolist()) == [0, 2, 3, 4]
+    for row, mid in enumerate(m.ids.tolist()):
+        assert m.vecs[row].tolist() == [2 * mid, 2 * mid + 1]
+        assert m.tag_of(mid) == mid
+
+
+@pytest.mark.asyncio
+async def test_search_returns_cached_memory_type(db):
+    await _seed(db, n_agent=3, n_public=2)
+    q = np.random.default_rng(9).standard_normal(settings.embedding_dim).astype(np.float32)
+    with patch(EMBED, new_callable=AsyncMock, return_value=_blob(q)):
+        results = await vector_store.search_memories("q", 1, top_k=5, db=db)
+    types = {r["memory_id"]: r["memory_type"] for r in results}
+    rows = {m.id: m.memory_type for m in (await db.execute(select(Memory))).scalars()}
+    assert types == {mid: rows[mid] for mid in types}
+
+
+@pytest.mark.asyncio
+async def test_admin_edits_invalidate_precisely(db):
+    from app.services import memory_admin_service
+    vecs = await _seed(db, n_agent=3, n_public=0)
+    first, second = sorted(vecs)[:2]
+    index = await vector_store._get_index(1, db)
+
+    await memory_admin_service.update_memory(first, None, MemoryType.SHORT.value, db)
+    assert index.tag_of(first) == vector_store._TYPE_CODES["short"]
+
+    await memory_admin_service.delete_memory(second, db)
+    assert second not in index and first in index
+
+
+@pytest.mark.asyncio
+async def test_promotion_updates_cached_type(db):
+    target = np.zeros(settings.embedding_dim, dtype=np.float32)
+    target[0] = 1.0
+    mem = Memory(agent_id=1, memory_type=MemoryType.SHORT, content="hot", access_count=4,
+                 embedding=_blob(target), expires_at=datetime.now(timezone.utc) + timedelta(days=1))
+    db.add(mem)
+    await db.commit()
+
+    with patch(EMBED, new_callable=AsyncMock, return_value=_blob(target)):
+        await memory_service.search(1, "hot", db=db)
+        await memory_service.flush_access_counts(db)
+        results = await vector_store.search_memories("hot", 1, db=db)
+    assert results[0]["memory_type"] == MemoryType.LONG
+
+
+@pytest.mark.asyncio
+async def test_lru_evicts_least_recent_agent(db, monkeypatch):
+    for aid in (1, 2, 3):
+        await _seed(db, n_agent=2, n_public=0, agent_id=aid * 10)
+    monkeypatch.setattr(settings, "vector_cache_max_mb", 0)
+
+    await vector_store._get_index(None, db)
+    await vector_store._get_index(10, db)
+    vector_store._dirty.add(10)
+    await vector_store._get_index(20, db)
+
+    assert list(vector_store._indexes) == [None, 20]
+    assert vector_store._index_path(10).exists()  # 脏索引淘汰前落盘
+
+
+# ---------------------------------------------------------------------------
+# 打分放到线程池：大量并发搜索时事件循环不卡顿
+# ---------------------------------------------------------------------------
+
+@pytest.mark.asyncio
+async def test_search_scores_in_pool_thread(db, monkeypatch):
+    """延迟与卡顿的对比数据见 scripts/bench_vector_search.py，这里只验证打分在哪个线程上跑"""
+    threads = []
+    index = IVFIndex(settings.embedding_dim)
+    index.add(np.arange(50), _clustered(50, settings.embedding_dim))
+    search = index.search
+
+    def record_search(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return search(*args, **kwargs)
+
+    monkeypatch.setattr(index, "search", record_search)
+    vector_store._indexes[1] = index
+    vector_store._indexes[None] = IVFIndex(settings.embedding_dim)
+    q = np.random.default_rng(1).standard_normal(settings.embedding_dim).astype(np.float32)
+
+    with patch(EMBED, new_callable=AsyncMock, return_value=_blob(q)), \
+         patch.object(vector_store.memory_fts, "keyword_scores", new=AsyncMock(return_value={})):
+        monkeypatch.setattr(settings, "vector_search_workers", 0)
+        await vector_store.search_memories("q", 1, top_k=5, db=db)
+        monkeypatch.setattr(settings, "vector_search_workers", 2)
+        await vector_store.search_memories("q", 1, top_k=5, db=db)
+
+    assert threads[0] == threading.current_thread().name  # workers=0：在事件循环里算
+    assert threads[1].startswith("vector-search")
+
+
+# ---------------------------------------------------------------------------
+# 批量检索（batch_generate）
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize("n,min_train", [(500, 2048), (5000, 1000)])
+def test_search_many_matches_single_queries(n, min_train):
+    vecs = _clustered(n, 32)
+    index = IVFIndex(32, nprobe=4, min_train=min_train)
+    index.add(np.arange(n), vecs)
+    queries = _clustered(12, 32, seed=8)
+    for q, (ids, sims) in zip(queries, index.search_many(queries, 7)):
+        single_ids, single_sims = index.search(q, 7)
+        assert ids.tolist() == single_ids.tolist()
+        assert np.allclose(sims, single_sims, atol=1e-5)
+
+
+@pytest.mark.asyncio
+async def test_search_memories_many_matches_per_agent_search(db):
+    await _seed(db, n_agent=20, n_public=10, agent_id=1)
+    await _seed(db, n_agent=20, n_public=0, agent_id=5)
+    rng = np.random.default_rng(11)
+    qvec = {t: rng.standard_normal(settings.embedding_dim).astype(np.float32) for t in ("shared", "own")}
+    queries = {1: "shared", 5: "shared", 2: "own", 9: "   "}
+
+    async def fake_embed(text):
+        return _blob(qvec[text])
+
+    async def fake_embed_many(texts):
+        return [_blob(qvec[t]) for t in texts]
+
+    with patch(EMBED, side_effect=fake_embed), \
+         patch("app.services.vector_store.embed_many", side_effect=fake_embed_many) as many:
+        batched = await vector_store.search_memories_many(queries, top_k=4, db=db)
+        single = {aid: await vector_store.search_memories(q, aid, top_k=4, db=db)
+                  for aid, q in queries.items()}
+
+    many.assert_awaited_once_with(["shared", "own"])  # 相同历史只 embed 一次
+    assert batched[9] == [] == single[9]
+    for aid in (1, 5, 2):
+        assert [r["memory_id"] for r in batched[aid]] == [r["memory_id"] for r in single[aid]]
+        assert [r["_distance"] for r in batched[aid]] == pytest.approx([r["_distance"] for r in single[aid]], abs=1e-5)
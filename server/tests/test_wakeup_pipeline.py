@@ -0,0 +1,131 @@
+"""
+唤醒回复流水线：历史只查一次、多个 agent 并发生成（有上限）、超时的 agent 被跳过、
+先生成完的先发送、可选的错开展示间隔
+"""
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.api import chat
+from app.core.config import settings
+
+
+def _agent(agent_id: int, name: str):
+    agent = MagicMock(id=agent_id, persona="p", model="m", personality_json=None)
+    agent.name = name
+    return agent
+
+
+async def _run_wakeup(agents: dict, generate, monkeypatch, **overrides):
+    """agents: id -> Agent；generate(agent_name) 是协程，返回回复文本（None = 不回复）"""
+    monkeypatch.setattr(settings, "chat_streaming", False)
+    for key, value in overrides.items():
+        monkeypatch.setattr(settings, key, value)
+    db = MagicMock()
+    db.get = AsyncMock(side_effect=lambda model, agent_id: agents.get(agent_id))
+    db.execute = AsyncMock(return_value=MagicMock(scalars=lambda: MagicMock(all=lambda: [])))
+    db.commit = AsyncMock()
+    session = MagicMock()
+    session.__aenter__ = AsyncMock(return_value=db)
+    session.__aexit__ = AsyncMock(return_value=False)
+
+    def get_or_create(agent_id, name, *args):
+        async def generate_reply(history, db=None, on_delta=None):
+            return await generate(name), None, []
+        return MagicMock(generate_reply=generate_reply)
+
+    sent = []
+
+    async def send_agent_message(agent_id, agent_name, content, db, stream_id=None):
+        sent.append((agent_name, time.monotonic()))
+        return MagicMock(id=len(sent))
+
+    with patch.object(chat, "async_session", return_value=session), \
+         patch.object(chat, "wakeup_service") as wakeup, \
+         patch.object(chat, "runner_manager") as rm, \
+         patch.object(chat, "economy_service") as econ, \
+         patch.object(chat, "send_agent_message", side_effect=send_agent_message), \
+         patch.object(chat, "_extract_memory", new_callable=AsyncMock):
+        wakeup.process = AsyncMock(return_value=list(agents))
+        rm.get_or_create = MagicMock(side_effect=get_or_create)
+        econ.check_quota = AsyncMock(return_value=MagicMock(allowed=True))
+        econ.deduct_quota = AsyncMock()
+        await chat.handle_wakeup(MagicMock())
+    return sent, db
+
+
+@pytest.mark.asyncio
+async def test_replies_generated_concurrently_and_sent_as_ready(monkeypatch):
+    agents = {1: _agent(1, "Alice"), 2: _agent(2, "Bob"), 3: _agent(3, "Carol")}
+    started = []
+    all_started = asyncio.Event()
+    done = {name: asyncio.Event() for name in ("Alice", "Bob", "Carol")}
+    after = {"Bob": all_started, "Carol": done["Bob"], "Alice": done["Carol"]}  # 生成完的顺序：Bob、Carol、Alice
+
+    async def generate(name):
+        started.append(name)
+        if len(started) == len(agents):
+            all_started.set()  # 三个同时在生成，而不是一个接一个
+        await after[name].wait()
+        done[name].set()
+        return f"{name} 的回复"
+
+    # 超时只是兜底：退化成串行时几秒内失败，而不是卡住
+    sent, db = await _run_wakeup(agents, generate, monkeypatch, wakeup_max_concurrency=4, wakeup_reply_timeout=5)
+    assert all_started.is_set()
+    assert [name for name, _ in sent] == ["Bob", "Carol", "Alice"]  # 谁先生成完谁先发
+    assert db.execute.await_count == 1  # 聊天历史只查一次
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_bounded(monkeypatch):
+    agents = {i: _agent(i, f"A{i}") for i in range(1, 6)}
+    running = peak = 0
+
+    async def generate(name):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        return "好"
+
+    sent, _ = await _run_wakeup(agents, generate, monkeypatch, wakeup_max_concurrency=2)
+    assert peak == 2
+    assert len(sent) == 5
+
+
+@pytest.mark.asyncio
+async def test_slow_or_failing_agent_does_not_block_others(monkeypatch):
+    agents = {1: _agent(1, "Slow"), 2: _agent(2, "Broken"), 3: _agent(3, "Fast")}
+    cancelled = []
+
+    async def generate(name):
+        if name == "Slow":
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(name)  # 超时后被取消，而不是等它睡完
+                raise
+        if name == "Broken":
+            raise RuntimeError("provider down")
+        return "在的"
+
+    sent, _ = await _run_wakeup(agents, generate, monkeypatch, wakeup_reply_timeout=0.1)
+    assert [name for name, _ in sent] == ["Fast"]
+    assert cancelled == ["Slow"]
+
+
+@pytest.mark.asyncio
+async def test_stagger_spaces_out_sends(monkeypatch):
+    agents = {1: _agent(1, "Alice"), 2: _agent(2, "Bob"), 3: _agent(3, "Carol")}
+
+    async def generate(name):
+        return "好"
+
+    sent, _ = await _run_wakeup(agents, generate, monkeypatch, wakeup_stagger_seconds=0.1)
+    times = [t for _, t in sent]
+    assert len(times) == 3
+    assert all(b - a >= 0.09 for a, b in zip(times, times[1:]))
@@ -0,0 +1,150 @@
+"""
+唤醒选人规则层：人设 / 擅长领域打分有把握时不调用小模型，拿不准才调用并按上下文指纹缓存，
+Agent 消息无人相关时直接不触发，统计省掉的模型调用和规则与模型的一致率
+"""
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.core.config import settings
+from app.models import Agent, Message
+from app.services.responder_scorer import DecisionCache, ResponderScorer, normalise, terms
+from app.services.wakeup_service import WakeupService
+
+
+@pytest.fixture
+def svc():
+    return WakeupService()
+
+
+async def _seed(db):
+    db.add_all([
+        Agent(id=1, name="Alice", persona="股票交易员，关注市场行情",
+              personality_json={"knowledge_domains": ["股票", "投资理财"]}),
+        Agent(id=2, name="Bob", persona="厨师，喜欢研究新菜",
+              personality_json={"knowledge_domains": ["烹饪", "美食"]}),
+        Agent(id=3, name="Carol", persona="程序员，写 Python",
+              personality_json={"knowledge_domains": ["编程", "python"]}),
+    ])
+    await db.commit()
+
+
+async def _say(db, content, sender_type="human", agent_id=0):
+    msg = Message(agent_id=agent_id, sender_type=sender_type, content=content, message_type="chat")
+    db.add(msg)
+    await db.commit()
+    return msg
+
+
+def test_terms_and_normalise():
+    assert terms("Python 编程") == {"python", "编程"}
+    assert terms("炒股票") == {"炒股", "股票"}
+    assert normalise("今天  股票涨了吗？！") == normalise("今天股票涨了吗")
+
+
+@pytest.mark.asyncio
+async def test_confident_domain_match_skips_model(svc, db):
+    await _seed(db)
+    msg = await _say(db, "最近股票行情怎么样，值得投资吗")
+    with patch("app.services.wakeup_service.call_wakeup_model", new_callable=AsyncMock) as model:
+        assert await svc.process(msg, set(), db) == [1]
+    model.assert_not_awaited()
+    assert svc.decision_stats()["rule"] == 1
+    assert svc.decision_stats()["llm_avoided_ratio"] == 1.0
+
+
+@pytest.mark.asyncio
+async def test_name_mentioned_without_at(svc, db):
+    await _seed(db)
+    msg = await _say(db, "bob 你觉得呢")
+    with patch("app.services.wakeup_service.call_wakeup_model", new_callable=AsyncMock) as model:
+        assert await svc.process(msg, set(), db) == [2]
+    model.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_ambiguous_asks_model_once_then_cached(svc, db):
+    await _seed(db)
+    first = await _say(db, "大家晚上好！")
+    with patch("app.services.wakeup_service.call_wakeup_model",
+               new_callable=AsyncMock, return_value="Carol") as model:
+        assert await svc.process(first, set(), db) == [3]
+        again = await _say(db, "大家晚上好")  # 近似重复的问候
+        assert await svc.process(again, set(), db) == [3]
+    assert model.await_count == 1
+    stats = svc.decision_stats()
+    assert stats["llm"] == 1 and stats["cached"] == 1 and stats["cache_entries"] == 1
+    assert stats["llm_avoided_ratio"] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_cache_expires(svc, db, monkeypatch):
+    await _seed(db)
+    monkeypatch.setattr(settings, "wakeup_cache_ttl", 0.0)
+    with patch("app.services.wakeup_service.call_wakeup_model",
+               new_callable=AsyncMock, return_value="NONE") as model:
+        await svc.process(await _say(db, "嗯嗯"), set(), db)
+        await svc.process(await _say(db, "嗯嗯"), set(), db)
+    assert model.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_model_call_is_not_cached(svc, db):
+    await _seed(db)
+    with patch("app.services.wakeup_service.call_wakeup_model",
+               new_callable=AsyncMock, side_effect=[None, "Carol"]) as model:
+        assert await svc.process(await _say(db, "大家晚上好！"), set(), db) == []  # 供应商出错
+        assert await svc.process(await _say(db, "大家晚上好！"), set(), db) == [3]
+    assert model.await_count == 2
+    assert svc.decision_stats()["cached"] == 0
+
+
+@pytest.mark.asyncio
+async def test_irrelevant_agent_message_does_not_trigger(svc, db):
+    await _seed(db)
+    msg = await _say(db, "哈哈哈哈", sender_type="agent", agent_id=1)
+    with patch("app.services.wakeup_service.call_wakeup_model", new_callable=AsyncMock) as model:
+        assert await svc.process(msg, set(), db) == []
+    model.assert_not_awaited()
+    assert svc._no_response_count.get(1, 0) == 0  # 没触发就不算无回应
+
+
+@pytest.mark.asyncio
+async def test_scorer_disabled_always_asks_model(svc, db, monkeypatch):
+    await _seed(db)
+    monkeypatch.setattr(settings, "wakeup_scorer", False)
+    msg = await _say(db, "最近股票行情怎么样")
+    with patch("app.services.wakeup_service.call_wakeup_model",
+               new_callable=AsyncMock, return_value="Alice") as model:
+        assert await svc.process(msg, set(), db) == [1]
+    model.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_rule_agreement_tracked_against_model(svc, db):
+    await _seed(db)
+    with patch("app.services.wakeup_service.call_wakeup_model",
+               new_callable=AsyncMock, side_effect=["Bob", "Alice"]):
+        await svc.process(await _say(db, "python 还是美食"), set(), db)  # 两人各中一个领域，拿不准
+        await svc.process(await _say(db, "股票和美食"), set(), db)
+    stats = svc.decision_stats()
+    assert stats["compared"] == 2
+    assert 0.0 <= stats["rule_agreement"] <= 1.0
+
+
+def test_recency_and_flagged_agents():
+    alice, bob = Agent(id=1, name="Alice", persona="x"), Agent(id=2, name="Bob", persona="y")
+    last = Message(agent_id=2, sender_type="agent", content="...")
+    scorer = ResponderScorer()
+    scores = scorer.score("好的", [alice, bob], [last], {})
+    assert scores[2] > scores[1]  # 上一个发言者更可能被回复
+    scores = scorer.score("好的", [alice, bob], [last], {2: 3})
+    assert scores[2] < 1.0  # 连续无回应的被降权
+
+
+def test_fingerprint_tracks_room_state():
+    alice, bob = Agent(id=1, name="Alice", persona="x"), Agent(id=2, name="Bob", persona="y")
+    key = DecisionCache.fingerprint("select", "你好！", [alice, bob], [], {})
+    assert key == DecisionCache.fingerprint("select", "你好", [bob, alice], [], {})
+    assert key != DecisionCache.fingerprint("select", "你好", [alice], [], {})
+    assert key != DecisionCache.fingerprint("select", "你好", [alice, bob], [], {1: 3})
@@ -0,0 +1,151 @@
+"""
+世界快照增量维护：ORM 写入提交后只重读受影响的居民 / 段落，回滚不失效，
+批量 UPDATE 靠显式标记，定期全量比对记录漂移，多 worker 部署每轮全量读取
+"""
+import logging
+
+import pytest
+from sqlalchemy import update
+
+from app.core.config import settings
+from app.models import Agent, AgentResource, Building, BuildingWorker, Job
+from app.services.economy_service import economy_service
+from app.services.world_state import WorldState, world_state
+from app.services.work_service import work_service
+
+
+async def _seed(db):
+    db.add_all([
+        Agent(id=0, name="Human", persona="h"),
+        Agent(id=1, name="Alice", persona="程序员", credits=50),
+        Agent(id=2, name="Bob", persona="厨师", credits=30),
+        Job(id=1, title="矿工", daily_reward=8, max_workers=5),
+        Building(id=1, name="一号农场", building_type="farm", max_workers=3),
+    ])
+    await db.commit()
+
+
+async def _fresh(db):
+    """不用缓存、直接从数据库构建的快照"""
+    return (await WorldState().view(db)).render()
+
+
+@pytest.mark.asyncio
+async def test_commit_refreshes_only_touched_agent(db):
+    await _seed(db)
+    await world_state.view(db)
+    assert world_state.stats["full_rebuilds"] == 1
+
+    alice = await db.get(Agent, 1)
+    alice.credits = 99
+    await db.commit()
+
+    world = await world_state.view(db)
+    assert "余额=99" in world.agent_lines[1]
+    assert world_state.stats["full_rebuilds"] == 1
+    assert world_state.stats["agent_refreshes"] == 1
+
+
+@pytest.mark.asyncio
+async def test_status_only_change_does_not_invalidate(db):
+    await _seed(db)
+    await world_state.view(db)
+    alice = await db.get(Agent, 1)
+    alice.activity = "思考中"
+    await db.commit()
+    assert not world_state._dirty_agents
+
+
+@pytest.mark.asyncio
+async def test_rollback_marks_nothing(db):
+    await _seed(db)
+    await world_state.view(db)
+    alice = await db.get(Agent, 1)
+    alice.credits = 0
+    await db.flush()
+    await db.rollback()
+    assert not world_state._dirty_agents
+    world = await world_state.view(db)
+    assert "余额=50" in world.agent_lines[1]
+
+
+@pytest.mark.asyncio
+async def test_incremental_view_matches_full_rebuild(db):
+    await _seed(db)
+    await world_state.view(db)
+
+    assert (await work_service.check_in(1, 1, db))["ok"]
+    db.add_all([
+        AgentResource(agent_id=2, resource_type="wheat", quantity=5, frozen_amount=1),
+        BuildingWorker(building_id=1, agent_id=2),
+        Agent(id=3, name="Carol", persona="新来的"),
+    ])
+    await db.commit()
+
+    cached = await world_state.view(db)
+    assert world_state.stats["full_rebuilds"] == 1
+    assert cached.render() == await _fresh(db)
+    assert "今日1/5人" in "\n".join(cached.sections["可用岗位"])
+    assert "1/3人" in "\n".join(cached.sections["城市建筑"])
+
+    await db.delete(await db.get(Agent, 3))
+    await db.commit()
+    assert [aid for aid, _ in (await world_state.view(db)).agents] == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_bulk_update_needs_explicit_touch(db):
+    await _seed(db)
+    await world_state.view(db)
+    await db.execute(update(Agent).where(Agent.id == 1).values(quota_used_today=Agent.daily_free_quota))
+    await db.commit()
+    assert await economy_service.deduct_quota(1, db)  # 免费额度用完，扣信用点（批量 UPDATE + 显式标记）
+    await db.commit()
+    assert "余额=49" in (await world_state.view(db)).agent_lines[1]
+
+
+@pytest.mark.asyncio
+async def test_verify_pass_records_drift(db, monkeypatch, caplog):
+    await _seed(db)
+    await world_state.view(db)
+    await db.execute(update(Agent).where(Agent.id == 2).values(credits=1))  # 绕过所有标记
+    await db.commit()
+    assert "余额=30" in (await world_state.view(db)).agent_lines[2]
+
+    monkeypatch.setattr(settings, "world_state_verify_seconds", 0.0)
+    with caplog.at_level(logging.WARNING, logger="app.services.world_state"):
+        world = await world_state.view(db)
+    assert "余额=1" in world.agent_lines[2]
+    assert world_state.stats["drift"] == 1
+    assert "agents=[2]" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_multi_worker_backend_always_rebuilds(db, monkeypatch):
+    await _seed(db)
+    monkeypatch.setattr(settings, "broadcast_backend", "redis")
+    await world_state.view(db)
+    await world_state.view(db)
+    assert world_state.stats["full_rebuilds"] == 2
+
+
+@pytest.mark.asyncio
+async def test_savepoints_defer_marks_to_outer_commit(db):
+    await _seed(db)
+    await world_state.view(db)
+
+    sp = await db.begin_nested()
+    (await db.get(Agent, 1)).credits = 77
+    await sp.commit()
+    assert not world_state._dirty_agents  # 释放 SAVEPOINT 不算提交
+
+    sp = await db.begin_nested()
+    (await db.get(Agent, 2)).credits = 0
+    await db.flush()
+    await sp.rollback()  # 只回滚这一条，Alice 的标记保留
+    await db.commit()
+
+    world = await world_state.view(db)
+    assert "余额=77" in world.agent_lines[1]
+    assert "余额=30" in world.agent_lines[2]
+    assert world.render() == await _fresh(db)
@@ -16,6 +16,7 @@ import { MemoryAdmin } from '../pages/MemoryAdmin'
 
 const HUMAN_AGENT_ID = 0
 let _sysMsgSeq = 0
+let _streamMsgSeq = 0
 
 type View = 'chat' | 'agents' | 'bounties' | 'work' | 'city' | 'memory-admin'
 
@@ -38,8 +39,35 @@ export function DiscordLayout() {
       setMessages(prev => {
         // 去重：StrictMode 双连接或网络重放可能导致同一消息到达两次
         if (prev.some(m => m.id === msg.data.id)) return prev
+        // 流式回复结束：最终消息原位替换临时消息
+        const streamId = msg.data.stream_id
+        if (streamId && prev.some(m => m.stream_id === streamId)) {
+          return prev.map(m => (m.stream_id === streamId ? msg.data : m))
+        }
         return [...prev, msg.data]
       })
+    } else if (msg.type === 'message_delta') {
+      const d = msg.data
+      setMessages(prev => {
+        const existing = prev.find(m => m.stream_id === d.stream_id)
+        if (d.aborted) return prev.filter(m => m.stream_id !== d.stream_id)
+        if (!existing) {
+          const draft: Message = {
+            id: -(++_streamMsgSeq) - 1_000_000,  // 负数临时 id，与系统消息错开
+            agent_id: d.agent_id,
+            agent_name: d.agent_name ?? '',
+            sender_type: 'agent',
+            message_type: 'chat',
+            content: d.delta ?? '',
+            mentions: [],
+            created_at: new Date().toISOString(),
+            stream_id: d.stream_id,
+          }
+          return [...prev, draft]
+        }
+        const content = (d.reset ? '' : existing.content) + (d.delta ?? '')
+        return prev.map(m => (m === existing ? { ...m, content } : m))
+      })
     } else if (msg.type === 'system_event') {
       const { event, agent_id } = msg.data
       setOnlineIds(prev => {
@@ -99,6 +127,14 @@ export function DiscordLayout() {
             : a
         ))
       }
+      // agent_status_batch：一帧携带多个 agent 的最新状态（服务端 batch 模式）
+      if (msg.data.event === 'agent_status_batch' && msg.data.updates) {
+        const byId = new Map(msg.data.updates.map(u => [u.agent_id, u] as const))
+        setAgents(prev => prev.map(a => {
+          const u = byId.get(a.id)
+          return u ? { ...a, status: u.status as Agent['status'], activity: u.activity || '' } : a
+        }))
+      }
     }
   }, [pushActivity])
 
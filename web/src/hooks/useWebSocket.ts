@@ -26,7 +26,8 @@ export function useWebSocket(agentId: number, onMessage: (msg: WsIncoming) => vo
       wsRef.current = null
     }
     const protocol = location.protocol === 'https:' ? 'wss:' : 'ws:'
-    const url = `${protocol}//${location.host}/api/ws/${agentId}`
+    // stream=1：订阅流式回复的 message_delta 增量
+    const url = `${protocol}//${location.host}/api/ws/${agentId}?stream=1`
     const ws = new WebSocket(url)
 
     ws.onopen = () => {
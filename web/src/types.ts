@@ -40,6 +40,7 @@ export interface Message {
   content: string
   mentions: number[]
   created_at: string
+  stream_id?: string  // 流式回复：临时消息 / 替换它的最终消息
 }
 
 // WebSocket 消息协议
@@ -54,10 +55,33 @@ export interface WsNewMessage {
   data: Message
 }
 
+// 流式回复增量（连接时带 ?stream=1 才会收到），按 stream_id 拼出临时消息
+export interface WsMessageDelta {
+  type: 'message_delta'
+  data: {
+    stream_id: string
+    agent_id: number
+    agent_name?: string
+    seq: number
+    delta?: string
+    reset?: boolean    // 丢掉之前收到的内容，从这段重新开始
+    aborted?: boolean  // 生成失败，移除临时消息
+  }
+}
+
+// agent_status_batch 中的单条状态
+export interface AgentStatusUpdate {
+  agent_id: number
+  agent_name: string
+  status: string
+  activity: string
+  timestamp: string
+}
+
 export interface WsSystemEvent {
   type: 'system_event'
   data: {
-    event: 'agent_online' | 'agent_offline' | 'checkin' | 'purchase' | 'agent_action' | 'agent_status_change' | 'resource_transferred' | 'building_construction_started' | 'building_completed'
+    event: 'agent_online' | 'agent_offline' | 'checkin' | 'purchase' | 'agent_action' | 'agent_status_change' | 'agent_status_batch' | 'resource_transferred' | 'building_construction_started' | 'building_completed'
     agent_id: number
     agent_name: string
     timestamp: string
@@ -70,6 +94,7 @@ export interface WsSystemEvent {
     // F35: agent_status_change 字段
     status?: string
     activity?: string
+    updates?: AgentStatusUpdate[]  // agent_status_batch
     // M5.1: 转赠事件字段
     from_agent_id?: number
     from_agent_name?: string
@@ -80,7 +105,7 @@ export interface WsSystemEvent {
   }
 }
 
-export type WsIncoming = WsNewMessage | WsSystemEvent
+export type WsIncoming = WsNewMessage | WsMessageDelta | WsSystemEvent
 
 // 工作岗位
 export interface Job {